@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Canonical Audio Format
+Every voice segment and music bed is converted exactly once, at ingest, to the
+configured render format. Inside the renderer audio is a numpy array shaped
+(frames, channels) holding samples in [-1.0, 1.0], so mixing never has to
+reconcile sample rates or channel counts again.
+"""
+
+import math
+import struct
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+
+# sample_type: 'float32' (default) or 'int16' storage for ingested audio
+RenderFormat = namedtuple('RenderFormat', ['sample_rate', 'channels', 'sample_type'])
+
+DEFAULT_RENDER_FORMAT = RenderFormat(44100, 2, 'float32')
+
+_render_format = DEFAULT_RENDER_FORMAT
+
+# Windowed-sinc resampler settings
+RESAMPLE_ZERO_CROSSINGS = 24   # filter half-width in input samples (at unity ratio)
+RESAMPLE_KAISER_BETA = 8.6     # ~ -85 dB stop band
+RESAMPLE_ROLLOFF = 0.945       # cutoff as a fraction of the lower Nyquist
+
+# G.711 mu-law companding
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+WAVE_FORMAT_MULAW = 7
+
+
+def render_format():
+    """Return the configured canonical render format"""
+    return _render_format
+
+
+def set_render_format(fmt):
+    """Configure the canonical render format used for all ingest"""
+    global _render_format
+    if fmt.sample_type not in ('float32', 'int16'):
+        raise ValueError(f"Unsupported sample type: {fmt.sample_type}")
+    if fmt.channels not in (1, 2):
+        raise ValueError(f"Unsupported channel count: {fmt.channels}")
+    _render_format = RenderFormat(int(fmt.sample_rate), int(fmt.channels), fmt.sample_type)
+    return _render_format
+
+
+def as_float(samples):
+    """View canonical samples as float32 in [-1.0, 1.0]"""
+    if samples.dtype == np.int16:
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32, copy=False)
+
+
+def store_as(samples, sample_type):
+    """Convert float samples to the storage sample type"""
+    if sample_type == 'int16':
+        return np.clip(np.round(samples * 32767.0), -32768, 32767).astype(np.int16)
+    return samples.astype(np.float32, copy=False)
+
+
+def pcm_to_float(raw_data, sample_width, channels):
+    """Decode interleaved little-endian PCM bytes into a float32 (frames, channels) array"""
+    if sample_width == 1:
+        samples = (np.frombuffer(raw_data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(raw_data, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        b = np.frombuffer(raw_data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608.0
+    elif sample_width == 4:
+        samples = (np.frombuffer(raw_data, dtype='<i4').astype(np.float64) / 2147483648.0).astype(np.float32)
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels)
+
+
+def float_to_pcm16(samples):
+    """Encode float samples as interleaved 16-bit PCM bytes"""
+    return np.clip(np.round(as_float(samples) * 32767.0), -32768, 32767).astype('<i2').tobytes()
+
+
+def float_to_mulaw(samples):
+    """Encode float samples as interleaved G.711 mu-law bytes (8 bits per sample)"""
+    pcm = np.clip(np.round(as_float(samples).ravel() * 32767.0), -32768, 32767).astype(np.int32)
+    sign = np.where(pcm < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(pcm), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.frexp(magnitude)[1] - 8  # position of the highest set bit above bit 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+
+def mulaw_to_float(raw_data, channels):
+    """Decode interleaved G.711 mu-law bytes into a float32 (frames, channels) array"""
+    codes = ~np.frombuffer(raw_data, dtype=np.uint8).astype(np.int32) & 0xFF
+    magnitude = (((codes & 0x0F) << 3) + MULAW_BIAS) << ((codes >> 4) & 0x07)
+    samples = (np.where(codes & 0x80, MULAW_BIAS - magnitude, magnitude - MULAW_BIAS) / 32768.0).astype(np.float32)
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels)
+
+
+def convert_channels(samples, channels):
+    """Up/down-mix a (frames, n) array to the requested channel count"""
+    current = samples.shape[1]
+    if current == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True, dtype=np.float32)
+    if current == 1:
+        return np.repeat(samples, channels, axis=1)
+    # More source channels than wanted (e.g. 5.1 -> stereo): keep the front pair
+    return np.ascontiguousarray(samples[:, :channels])
+
+
+def _kaiser_sinc(x, cutoff, half_width):
+    """Kaiser-windowed sinc evaluated at offsets x (in input samples)"""
+    inside = np.abs(x) < half_width
+    ratio = np.where(inside, x / half_width, 0.0)
+    taper = np.i0(RESAMPLE_KAISER_BETA * np.sqrt(1.0 - ratio * ratio)) / np.i0(RESAMPLE_KAISER_BETA)
+    return np.where(inside, cutoff * np.sinc(cutoff * x) * taper, 0.0)
+
+
+class Resampler:
+    """Polyphase windowed-sinc resampler for a fixed src_rate -> dst_rate ratio
+
+    Any range of output frames can be computed from the matching span of input
+    frames, so long files can be converted chunk by chunk with results that are
+    identical to converting the whole file at once.
+    """
+
+    def __init__(self, src_rate, dst_rate, zero_crossings=RESAMPLE_ZERO_CROSSINGS):
+        self.src_rate = int(src_rate)
+        self.dst_rate = int(dst_rate)
+        g = math.gcd(self.src_rate, self.dst_rate)
+        self.up = self.dst_rate // g      # polyphase branches
+        self.down = self.src_rate // g    # input step (in branches) per output sample
+
+        ratio = min(1.0, self.dst_rate / self.src_rate)
+        cutoff = RESAMPLE_ROLLOFF * ratio
+        half_width = zero_crossings / ratio
+        self.taps = 2 * int(math.ceil(half_width)) + 1
+        self.offset = self.taps // 2
+
+        # Filter bank: phase p holds the filter for fractional position p/up
+        phases = np.arange(self.up, dtype=np.float64)[:, None] / self.up
+        positions = np.arange(self.taps, dtype=np.float64)[None, :] - self.offset
+        self.bank = _kaiser_sinc(positions - phases, cutoff, half_width).astype(np.float32)
+
+    def output_frames(self, input_frames):
+        """Number of output frames produced for input_frames of input"""
+        return int(math.ceil(input_frames * self.up / self.down))
+
+    def input_span(self, out_start, out_count):
+        """Input frame range [first, end) needed to compute the given output frames"""
+        first = (out_start * self.down) // self.up - self.offset
+        last = ((out_start + out_count - 1) * self.down) // self.up - self.offset
+        return first, last + self.taps
+
+    def process(self, window, window_start, out_start, out_count):
+        """Compute output frames from a window of input starting at input frame window_start
+
+        The window must cover input_span(out_start, out_count); frames outside
+        the source signal must already be zero.
+        """
+        windows = np.lib.stride_tricks.sliding_window_view(window, self.taps, axis=0)  # (n, channels, taps)
+        output = np.empty((out_count, window.shape[1]), dtype=np.float32)
+
+        # Output n uses the input window at n*down//up with phase n*down%up; the
+        # outputs n, n+up, n+2*up, ... share a phase and step through the input
+        # by `down`, so each residue is one strided dot product over a view.
+        for j in range(min(self.up, out_count)):
+            base, phase = divmod((out_start + j) * self.down, self.up)
+            local = base - self.offset - window_start
+            count = len(range(j, out_count, self.up))
+            output[j::self.up] = windows[local:local + count * self.down:self.down] @ self.bank[phase]
+        return output
+
+    def resample(self, samples):
+        """Resample a whole (frames, channels) array"""
+        out_count = self.output_frames(len(samples))
+        first, end = self.input_span(0, out_count)
+        window = np.zeros((end - first, samples.shape[1]), dtype=np.float32)
+        window[-first:-first + len(samples)] = samples
+        return self.process(window, first, 0, out_count)
+
+
+def resample(samples, src_rate, dst_rate):
+    """Band-limited windowed-sinc resampling of a (frames, channels) float array"""
+    samples = as_float(samples)
+    if int(src_rate) == int(dst_rate) or len(samples) == 0:
+        return samples
+    return Resampler(src_rate, dst_rate).resample(samples)
+
+
+def to_canonical(samples, src_rate, fmt=None):
+    """Convert a (frames, channels) array at src_rate to the render format, once"""
+    fmt = fmt or render_format()
+    samples = as_float(samples)
+    # Resample after down-mixing (less work) but before up-mixing
+    if fmt.channels < samples.shape[1]:
+        samples = convert_channels(samples, fmt.channels)
+    samples = resample(samples, src_rate, fmt.sample_rate)
+    samples = convert_channels(samples, fmt.channels)
+    return store_as(samples, fmt.sample_type)
+
+
+def audio_segment_to_array(audio):
+    """Turn a pydub AudioSegment into (float32 (frames, channels), sample_rate)"""
+    samples = pcm_to_float(audio.raw_data, audio.sample_width, audio.channels)
+    return samples, audio.frame_rate
+
+
+def read_wav(filename):
+    """Read a PCM WAV file into (float32 (frames, channels), sample_rate)"""
+    with wave.open(filename, 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        raw_data = wav_file.readframes(wav_file.getnframes())
+    return pcm_to_float(raw_data, sample_width, channels), sample_rate
+
+
+def decode_file(filename):
+    """Decode any supported audio file into (float32 (frames, channels), sample_rate)"""
+    if filename.lower().endswith('.wav'):
+        try:
+            return read_wav(filename)
+        except (wave.Error, EOFError, ValueError):
+            pass  # e.g. float or extensible WAV, let the decode service handle it
+    import decode_service
+    return decode_service.decode_one(filename)
+
+
+def load_audio(filename, fmt=None):
+    """Decode a file and convert it to the canonical render format"""
+    samples, sample_rate = decode_file(filename)
+    return to_canonical(samples, sample_rate, fmt)
+
+
+def silence(seconds, fmt=None):
+    """Canonical silence of the given duration"""
+    fmt = fmt or render_format()
+    frames = int(round(seconds * fmt.sample_rate))
+    dtype = np.int16 if fmt.sample_type == 'int16' else np.float32
+    return np.zeros((frames, fmt.channels), dtype=dtype)
+
+
+def write_wav(filename, samples, fmt=None):
+    """Write canonical samples as a 16-bit PCM WAV in the render format"""
+    fmt = fmt or render_format()
+    with wave.open(filename, 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(fmt.sample_rate)
+        wav_file.writeframes(float_to_pcm16(samples))
+
+
+def pcm16_wav_header(frames, channels, sample_rate):
+    """The 44-byte header of a 16-bit PCM WAV holding frames, for files whose data is written separately"""
+    data_bytes = frames * channels * 2
+    return (b'RIFF' + struct.pack('<I', 36 + data_bytes) + b'WAVE' +
+            b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, sample_rate * channels * 2,
+                                  channels * 2, 16) +
+            b'data' + struct.pack('<I', data_bytes))
+
+
+def write_mulaw_wav(filename, samples, fmt=None):
+    """Write canonical samples as a mu-law WAV: half the size of 16-bit PCM, playable everywhere
+
+    The wave module only writes PCM, so the header is built here.
+    """
+    fmt = fmt or render_format()
+    channels = samples.shape[1]
+    data = float_to_mulaw(samples)
+    with open(filename, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 4 + 26 + 12 + 8 + len(data) + len(data) % 2) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHHH', 18, WAVE_FORMAT_MULAW, channels, fmt.sample_rate,
+                                      fmt.sample_rate * channels, channels, 8, 0))
+        f.write(b'fact' + struct.pack('<II', 4, len(samples)))
+        f.write(b'data' + struct.pack('<I', len(data)) + data + b'\0' * (len(data) % 2))
+
+
+def duration_seconds(samples, fmt=None):
+    """Duration of a canonical array in seconds"""
+    fmt = fmt or render_format()
+    return len(samples) / float(fmt.sample_rate)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Audio Metadata Probing
+Reads duration, sample rate and channel count from file headers without
+decoding any audio: WAV chunks, FLAC STREAMINFO, Ogg Vorbis/Opus headers plus
+the last page's granule position, and MP3 frame headers with Xing/Info/VBRI
+tags. Probing a multi-hour file costs a few kilobytes of I/O.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+
+# format: 'wav', 'flac', 'ogg', 'opus' or 'mp3'; frames: samples per channel
+AudioInfo = namedtuple('AudioInfo', ['format', 'duration', 'sample_rate', 'channels', 'frames'])
+
+
+class ProbeError(Exception):
+    """Raised when a file's headers cannot be parsed"""
+
+
+def probe_audio(filename):
+    """Return AudioInfo for an audio file by reading only its headers"""
+    with open(filename, 'rb') as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[:4] in (b'RIFF', b'RF64') and head[8:12] == b'WAVE':
+            return _probe_wav(f)
+        if head[:4] == b'fLaC':
+            return _probe_flac(f)
+        if head[:4] == b'OggS':
+            return _probe_ogg(f, os.path.getsize(filename))
+        return _probe_mp3(f, os.path.getsize(filename))
+
+
+def probe_duration(filename):
+    """Duration in seconds from headers, or None if the file cannot be probed"""
+    try:
+        return probe_audio(filename).duration
+    except (OSError, ProbeError, struct.error):
+        return None
+
+
+# --- WAV -------------------------------------------------------------------
+
+def _probe_wav(f):
+    riff = f.read(12)
+    file_size = os.fstat(f.fileno()).st_size
+    channels = sample_rate = block_align = None
+    data_size = None
+    ds64_data_size = None
+
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'ds64':
+            body = f.read(chunk_size)
+            ds64_data_size = struct.unpack('<Q', body[8:16])[0]
+            f.seek(chunk_size % 2, 1)
+            continue
+        if chunk_id == b'fmt ':
+            body = f.read(chunk_size)
+            _, channels, sample_rate, _, block_align = struct.unpack('<HHIIH', body[:14])
+            f.seek(chunk_size % 2, 1)
+            continue
+        if chunk_id == b'data':
+            if riff[:4] == b'RF64' and ds64_data_size is not None:
+                chunk_size = ds64_data_size
+            # Streamed writers may leave a placeholder size; trust the file length
+            data_size = min(chunk_size, file_size - f.tell())
+            break
+        f.seek(chunk_size + chunk_size % 2, 1)
+
+    if not channels or not sample_rate or not block_align or data_size is None:
+        raise ProbeError("Incomplete WAV header")
+    frames = data_size // block_align
+    return AudioInfo('wav', frames / float(sample_rate), sample_rate, channels, frames)
+
+
+# --- FLAC ------------------------------------------------------------------
+
+def _probe_flac(f):
+    f.seek(4)
+    block_header = f.read(4)
+    if len(block_header) < 4 or (block_header[0] & 0x7F) != 0:
+        raise ProbeError("FLAC file does not start with STREAMINFO")
+    info = f.read(34)
+    if len(info) < 34:
+        raise ProbeError("Truncated FLAC STREAMINFO")
+    # Bytes 10-17: 20 bits sample rate, 3 bits channels-1, 5 bits bps-1, 36 bits total samples
+    packed = int.from_bytes(info[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    frames = packed & 0xFFFFFFFFF
+    if not sample_rate:
+        raise ProbeError("Invalid FLAC sample rate")
+    return AudioInfo('flac', frames / float(sample_rate), sample_rate, channels, frames)
+
+
+# --- Ogg (Vorbis / Opus) ---------------------------------------------------
+
+def _last_granule(f, file_size):
+    """Granule position of the last Ogg page, scanning backwards from the end"""
+    span = 65536
+    while True:
+        start = max(0, file_size - span)
+        f.seek(start)
+        tail = f.read(file_size - start)
+        index = tail.rfind(b'OggS')
+        while index >= 0:
+            if index + 14 <= len(tail) and tail[index + 4] == 0:
+                granule = struct.unpack('<q', tail[index + 6:index + 14])[0]
+                if granule >= 0:
+                    return granule
+            index = tail.rfind(b'OggS', 0, index)
+        if start == 0:
+            raise ProbeError("No Ogg page with a granule position")
+        span *= 4
+
+
+def _probe_ogg(f, file_size):
+    page = f.read(27)
+    segment_count = page[26]
+    f.read(segment_count)
+    packet = f.read(64)
+
+    if packet.startswith(b'\x01vorbis'):
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        frames = _last_granule(f, file_size)
+        return AudioInfo('ogg', frames / float(sample_rate), sample_rate, channels, frames)
+
+    if packet.startswith(b'OpusHead'):
+        channels = packet[9]
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        input_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+        # Opus granule positions always count 48 kHz samples
+        frames48 = max(0, _last_granule(f, file_size) - pre_skip)
+        duration = frames48 / 48000.0
+        return AudioInfo('opus', duration, input_rate, channels, int(round(duration * input_rate)))
+
+    raise ProbeError("Unsupported Ogg codec")
+
+
+# --- MP3 -------------------------------------------------------------------
+
+_MP3_BITRATES = {
+    # (version is MPEG1, layer) -> kbps by index
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+Mp3Frame = namedtuple('Mp3Frame', ['mpeg1', 'layer', 'bitrate', 'sample_rate', 'channels',
+                                   'samples_per_frame', 'frame_size'])
+
+
+def parse_mp3_frame_header(header):
+    """Parse a 4-byte MPEG audio frame header, or return None if it is not one"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    padding = (header[2] >> 1) & 0x1
+    channel_mode = header[3] >> 6
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][rate_index]
+    if layer == 1:
+        samples_per_frame = 384
+        frame_size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if (mpeg1 or layer == 2) else 576
+        frame_size = samples_per_frame // 8 * bitrate // sample_rate + padding
+    channels = 1 if channel_mode == 3 else 2
+    return Mp3Frame(mpeg1, layer, bitrate, sample_rate, channels, samples_per_frame, frame_size)
+
+
+def _skip_id3v2(f):
+    """Return the offset just past any ID3v2 tags at the start of the file"""
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            return offset
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        footer = 10 if header[5] & 0x10 else 0
+        offset += 10 + size + footer
+
+
+def _find_first_frame(f, start, file_size):
+    """Find the first frame header that is followed by a second valid frame"""
+    f.seek(start)
+    data = f.read(min(file_size - start, 256 * 1024))
+    index = data.find(b'\xFF')
+    while 0 <= index < len(data) - 4:
+        frame = parse_mp3_frame_header(data[index:index + 4])
+        if frame and frame.frame_size > 4:
+            following = data[index + frame.frame_size:index + frame.frame_size + 4]
+            if len(following) < 4 or parse_mp3_frame_header(following):
+                return start + index, frame
+        index = data.find(b'\xFF', index + 1)
+    raise ProbeError("No MPEG audio frame found")
+
+
+def _probe_mp3(f, file_size):
+    audio_start = _skip_id3v2(f)
+    frame_offset, frame = _find_first_frame(f, audio_start, file_size)
+    f.seek(frame_offset)
+    first_frame = f.read(max(frame.frame_size, 200))
+
+    # Xing/Info tag sits after the side information of the first frame
+    if frame.mpeg1:
+        side_info = 17 if frame.channels == 1 else 32
+    else:
+        side_info = 9 if frame.channels == 1 else 17
+    xing_offset = 4 + side_info
+    tag = first_frame[xing_offset:xing_offset + 4]
+
+    frame_count = None
+    encoder_delay = encoder_padding = 0
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', first_frame[xing_offset + 4:xing_offset + 8])[0]
+        position = xing_offset + 8
+        if flags & 0x1:
+            frame_count = struct.unpack('>I', first_frame[position:position + 4])[0]
+            position += 4
+        if flags & 0x2:
+            position += 4
+        if flags & 0x4:
+            position += 100
+        if flags & 0x8:
+            position += 4
+        # LAME extension: 9-byte encoder string, then delay/padding 12 bits each at +21
+        if first_frame[position:position + 4] in (b'LAME', b'Lavf', b'Lavc') and len(first_frame) >= position + 24:
+            packed = int.from_bytes(first_frame[position + 21:position + 24], 'big')
+            encoder_delay = packed >> 12
+            encoder_padding = packed & 0xFFF
+    elif first_frame[36:40] == b'VBRI':
+        frame_count = struct.unpack('>I', first_frame[50:54])[0]
+
+    if frame_count is not None:
+        frames = max(0, frame_count * frame.samples_per_frame - encoder_delay - encoder_padding)
+    else:
+        # Constant bitrate: count frames from the audio payload size
+        audio_end = file_size
+        f.seek(max(0, file_size - 128))
+        if f.read(3) == b'TAG':
+            audio_end -= 128
+        payload = audio_end - frame_offset
+        duration = payload * 8.0 / frame.bitrate
+        frames = int(round(duration * frame.sample_rate))
+
+    return AudioInfo('mp3', frames / float(frame.sample_rate), frame.sample_rate, frame.channels, frames)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Audio Sources
+Lazily read audio in the canonical render format. A source has a `frames`
+length and a `read(start, count)` method returning a float32 (count, channels)
+array; reads outside the source return silence. Sources let the renderers pull
+just the part of a clip or music bed they are mixing instead of materializing
+whole tracks.
+"""
+
+import math
+import wave
+
+import numpy as np
+
+import audio_format
+
+
+class ArraySource:
+    """Audio source backed by an in-memory canonical array"""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.frames = len(samples)
+
+    def read(self, start, count):
+        """Return count frames starting at start as float32, zero outside the array"""
+        first = max(start, 0)
+        stop = min(start + count, self.frames)
+        if first == start and stop - first == count:
+            return audio_format.as_float(self.samples[first:stop])
+        chunk = np.zeros((count, self.samples.shape[1]), dtype=np.float32)
+        if stop > first:
+            chunk[first - start:stop - start] = audio_format.as_float(self.samples[first:stop])
+        return chunk
+
+
+class WavSource:
+    """Audio source that reads a PCM WAV lazily and converts it to the render format per read"""
+
+    def __init__(self, filename, fmt=None):
+        self.filename = filename
+        self.fmt = fmt or audio_format.render_format()
+        with wave.open(filename, 'rb') as wav_file:
+            self.source_channels = wav_file.getnchannels()
+            self.sample_width = wav_file.getsampwidth()
+            self.source_rate = wav_file.getframerate()
+            self.source_frames = wav_file.getnframes()
+
+        self.resampler = None
+        if self.source_rate != self.fmt.sample_rate:
+            self.resampler = audio_format.Resampler(self.source_rate, self.fmt.sample_rate)
+            self.frames = self.resampler.output_frames(self.source_frames)
+        else:
+            self.frames = self.source_frames
+
+    def _read_source(self, first, end):
+        """Read source frames [first, end) as float32, zero outside the file"""
+        window = np.zeros((end - first, self.source_channels), dtype=np.float32)
+        start = max(first, 0)
+        stop = min(end, self.source_frames)
+        if stop > start:
+            with wave.open(self.filename, 'rb') as wav_file:
+                wav_file.setpos(start)
+                raw_data = wav_file.readframes(stop - start)
+            samples = audio_format.pcm_to_float(raw_data, self.sample_width, self.source_channels)
+            window[start - first:start - first + len(samples)] = samples
+        return window
+
+    def read(self, start, count):
+        """Return count canonical frames starting at start, zero-padded past the end"""
+        if self.resampler is None:
+            samples = self._read_source(start, start + count)
+        else:
+            first, end = self.resampler.input_span(start, count)
+            samples = self.resampler.process(self._read_source(first, end), first, start, count)
+        # Zero frames past the converted length (the filter tail can ring there)
+        if start + count > self.frames:
+            samples[max(self.frames - start, 0):] = 0.0
+        return audio_format.convert_channels(samples, self.fmt.channels)
+
+
+class CrossfadeLoopSource:
+    """Loop a source between loop points with an equal-power crossfade at the seam
+
+    Plays source[0:loop_out) once and then repeats [loop_in, loop_out). The
+    `crossfade` frames before loop_out are blended with the frames before
+    loop_in, so every pass joins the next without a click. Positions are
+    mapped per read; nothing longer than the requested range is built.
+    """
+
+    def __init__(self, source, loop_in, loop_out, crossfade):
+        loop_out = min(int(loop_out), source.frames)
+        crossfade = max(0, min(int(crossfade), int(loop_in), (loop_out - int(loop_in)) // 2))
+        self.source = source
+        self.loop_in = int(loop_in)
+        self.loop_out = loop_out
+        self.crossfade = crossfade
+        self.period = loop_out - self.loop_in
+        # Timeline frame where the first crossfade starts
+        self.first_seam = loop_out - crossfade
+        if self.period <= 0:
+            raise ValueError("Loop out point must come after the loop in point")
+
+    @classmethod
+    def from_loop_points(cls, source, loop_points, sample_rate):
+        """Build from LoopPoints given in seconds"""
+        return cls(source,
+                   int(round(loop_points.loop_in * sample_rate)),
+                   int(round(loop_points.loop_out * sample_rate)),
+                   int(round(loop_points.crossfade * sample_rate)))
+
+    def _fade(self, phase_start, count):
+        """Equal-power fade-in/fade-out gains for crossfade phases"""
+        position = (np.arange(phase_start, phase_start + count, dtype=np.float32) + 0.5) / self.crossfade
+        angle = np.float32(math.pi / 2) * position
+        return np.sin(angle)[:, None], np.cos(angle)[:, None]
+
+    def read(self, start, count):
+        """Return count frames of the looped timeline starting at start"""
+        parts = []
+        position = start
+        end = start + count
+        if position < self.first_seam:
+            take = min(end, self.first_seam) - position
+            parts.append(self.source.read(position, take))
+            position += take
+
+        while position < end:
+            phase = (position - self.first_seam) % self.period
+            # phase counts from the start of a crossfade; source position is loop_in - crossfade + phase
+            if phase < self.crossfade:
+                take = min(end - position, self.crossfade - phase)
+                source_position = self.loop_in - self.crossfade + phase
+                fade_in, fade_out = self._fade(phase, take)
+                parts.append(self.source.read(source_position, take) * fade_in +
+                             self.source.read(source_position + self.period, take) * fade_out)
+            else:
+                take = min(end - position, self.period - phase)
+                parts.append(self.source.read(self.loop_in - self.crossfade + phase, take))
+            position += take
+
+        if not parts:
+            return self.source.read(start, 0)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class MixSource:
+    """Voice clips placed on a timeline over an optional background, mixed per read
+
+    clips are (start frame, source) pairs in timeline order that do not
+    overlap. The clips sounding in a read are found by binary search, so any
+    position can be read at the same cost and nothing but the requested range
+    is held in memory.
+    """
+
+    def __init__(self, clips, frames, channels, background=None, background_gain=1.0, voice_gain=1.0):
+        self.clips = list(clips)
+        self.frames = int(frames)
+        self.channels = channels
+        self.background = background
+        self.background_gain = np.float32(background_gain)
+        self.voice_gain = np.float32(voice_gain)
+        self.starts = np.array([start for start, _ in self.clips], dtype=np.int64)
+        self.ends = self.starts + np.array([source.frames for _, source in self.clips], dtype=np.int64)
+
+    def read(self, start, count):
+        """Return count mixed frames starting at start, silent outside the session"""
+        first = max(start, 0)
+        stop = min(start + count, self.frames)
+        if stop <= first:
+            return np.zeros((count, self.channels), dtype=np.float32)
+        if self.background is not None:
+            mix = self.background.read(first, stop - first) * self.background_gain
+        else:
+            mix = np.zeros((stop - first, self.channels), dtype=np.float32)
+
+        begin = int(np.searchsorted(self.ends, first, side='right'))
+        end = int(np.searchsorted(self.starts, stop, side='left'))
+        for index in range(begin, end):
+            clip_start, source = self.clips[index]
+            offset = max(first - clip_start, 0)
+            position = max(clip_start - first, 0)
+            take = min(source.frames - offset, stop - first - position)
+            if self.voice_gain == 1.0:
+                mix[position:position + take] += source.read(offset, take)
+            else:
+                mix[position:position + take] += source.read(offset, take) * self.voice_gain
+
+        if first == start and stop - first == count:
+            return mix
+        chunk = np.zeros((count, self.channels), dtype=np.float32)
+        chunk[first - start:stop - start] = mix
+        return chunk
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Render Checkpoints
+Makes segment synthesis crash-safe and resumable. Each render job gets a
+directory under output/.jobs/ named after a hash of the job (script and
+settings). Finished segments are moved into it with an atomic rename and
+recorded, keyed by a hash of everything that determines the segment's audio,
+by appending one line to a journal. Every COMPACT_EVERY entries the journal
+is folded into a manifest that is replaced atomically, so recording a
+segment costs the same however long the job is. If the app is closed or
+killed, the next render of the same job reuses every recorded segment and
+only synthesizes the rest; the directory is removed once the final file is
+written.
+
+Renders that keep speech in memory checkpoint under SCRATCH_DIR in the
+system temp directory instead, so their segments never touch the output
+volume.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import audio_format
+import metrics
+
+
+JOBS_DIRNAME = ".jobs"
+SCRATCH_DIR = os.path.join(tempfile.gettempdir(), "guided_meditation")
+MANIFEST_FILENAME = "manifest.json"
+JOURNAL_FILENAME = "journal.jsonl"
+MANIFEST_VERSION = 1
+COMPACT_EVERY = 64  # journal entries folded into the manifest at a time
+
+
+def settings_hash(*parts):
+    """Stable hash of the values that determine a job or segment"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _write_atomic(filename, data):
+    """Write bytes so readers see either the old or the new file, never a torn one"""
+    temp_file = f"{filename}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, filename)
+
+
+class RenderCheckpoint:
+    """Manifest of completed segments for one render job"""
+
+    def __init__(self, job_dir):
+        self.job_dir = Path(job_dir)
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.job_dir / MANIFEST_FILENAME
+        self.journal_file = self.job_dir / JOURNAL_FILENAME
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._journaled = 0
+        self._load()
+
+    @classmethod
+    def for_job(cls, output_dir, *job_identity):
+        """Checkpoint for the job identified by job_identity (script, settings, format...)"""
+        job_id = settings_hash(*job_identity)[:16]
+        return cls(Path(output_dir) / JOBS_DIRNAME / job_id)
+
+    def _load(self):
+        """Read the manifest and replay the journal, keeping only entries whose file is intact"""
+        entries = {}
+        try:
+            data = json.loads(self.manifest_file.read_text())
+            if data.get('version') == MANIFEST_VERSION:
+                entries.update(data.get('segments', {}))
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            lines = self.journal_file.read_text().splitlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+                entries[record.pop('segment')] = record
+            except (ValueError, KeyError, TypeError, AttributeError):
+                break  # a torn last line from a crash mid-append
+            self._journaled += 1
+        for segment_hash, entry in entries.items():
+            try:
+                if os.path.getsize(self.job_dir / entry['file']) == entry['bytes']:
+                    self._segments[segment_hash] = entry
+            except (OSError, KeyError, TypeError):
+                continue
+        if self._segments:
+            print(f"♻️ Resuming render: {len(self._segments)} segment(s) already done in {self.job_dir}")
+
+    def _save(self):
+        data = {'version': MANIFEST_VERSION, 'segments': self._segments}
+        _write_atomic(str(self.manifest_file), json.dumps(data, indent=1, sort_keys=True).encode('utf-8'))
+
+    def _append(self, segment_hash, entry):
+        """Journal one entry, compacting the journal into the manifest every COMPACT_EVERY entries"""
+        with open(self.journal_file, 'ab') as f:
+            f.write(json.dumps(dict(entry, segment=segment_hash), sort_keys=True).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journaled += 1
+        if self._journaled >= COMPACT_EVERY:
+            # The manifest holds every entry before the journal is emptied, so a
+            # crash in between only replays entries the manifest already has
+            self._save()
+            os.truncate(self.journal_file, 0)
+            self._journaled = 0
+
+    def __len__(self):
+        return len(self._segments)
+
+    def segment_file(self, *segment_key):
+        """Final path of the segment identified by segment_key"""
+        return str(self.job_dir / f"segment_{settings_hash(*segment_key)[:16]}.wav")
+
+    def partial_file(self, *segment_key):
+        """Scratch path to synthesize into before the segment is committed"""
+        return str(self.job_dir / f"partial_{settings_hash(*segment_key)[:16]}.wav")
+
+    def completed(self, *segment_key):
+        """Path of the committed segment, or None if it still has to be made"""
+        entry = self._segments.get(settings_hash(*segment_key))
+        return str(self.job_dir / entry['file']) if entry else None
+
+    def lookup(self, *segment_key):
+        """completed(), counted as a checkpoint hit or miss; call it once per segment a render needs"""
+        path = self.completed(*segment_key)
+        metrics.record_cache('checkpoint', path is not None)
+        return path
+
+    def commit(self, partial_file, *segment_key):
+        """Atomically move a finished partial file into place and record it"""
+        segment_file = self.segment_file(*segment_key)
+        os.replace(partial_file, segment_file)
+        entry = {'file': os.path.basename(segment_file), 'bytes': os.path.getsize(segment_file)}
+        segment_hash = settings_hash(*segment_key)
+        with self._lock:
+            self._segments[segment_hash] = entry
+            self._append(segment_hash, entry)
+        return segment_file
+
+    def commit_samples(self, samples, *segment_key, fmt=None):
+        """Write canonical samples as the segment's WAV and record it"""
+        partial_file = self.partial_file(*segment_key)
+        audio_format.write_wav(partial_file, samples, fmt)
+        return self.commit(partial_file, *segment_key)
+
+    def discard(self):
+        """Remove the job directory once the final output exists"""
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+        try:
+            self.job_dir.parent.rmdir()  # drop output/.jobs when it is empty
+        except OSError:
+            pass
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Bounded-Memory Rendering
+Renders very long sessions chunk by chunk under a process memory (RSS) budget.
+Voice segments and music are read lazily from disk in the render format; only
+one chunk of the timeline is ever held in memory. Music that cannot be read
+incrementally (MP3, OGG, float WAV...) is decoded once into a temporary WAV
+spill file and streamed from there.
+"""
+
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+import audio_format
+import metrics
+import mixer
+from audio_sources import ArraySource, WavSource, CrossfadeLoopSource, MixSource
+from encoder_tee import EncoderTee
+from loop_points import find_loop_points_for_source
+from loudness import (AnalysisCache, LoudnessMeter, duck_under_speech, normalization_gains,
+                      report as loudness_report)
+from render_cache import music_identity
+from soundscape import is_soundscape, open_soundscape
+
+
+# loudness: LoudnessReport of the output when rendered with a LoudnessTarget
+# exports: {extension: filename} of the compressed copies encoded alongside the WAV
+RenderReport = namedtuple('RenderReport', ['filename', 'duration', 'peak_rss', 'spilled_bytes', 'chunks', 'loudness',
+                                           'exports'])
+RenderReport.__new__.__defaults__ = (None, None)
+
+DEFAULT_CHUNK_SECONDS = 10.0
+MIN_CHUNK_SECONDS = 1.0
+# Rough multiple of one chunk buffer needed while mixing it (reads, resampler
+# windows, mix sum, PCM encode)
+CHUNK_WORKING_SET = 12
+
+
+def _psutil():
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        return None
+
+
+def _windows_memory_counters():
+    """PROCESS_MEMORY_COUNTERS of this process on Windows, or None elsewhere"""
+    if sys.platform != 'win32':
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    try:
+        kernel32, psapi = ctypes.WinDLL('kernel32'), ctypes.WinDLL('psapi')
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters
+    except (OSError, AttributeError):
+        pass
+    return None
+
+
+def _getrusage_peak():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where it cannot be measured"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    psutil = _psutil()
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    counters = _windows_memory_counters()
+    if counters is not None:
+        return counters.WorkingSetSize
+    return _getrusage_peak()  # the peak overstates current use, which keeps the budget safe
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it cannot be measured"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    counters = _windows_memory_counters()
+    if counters is not None:
+        return counters.PeakWorkingSetSize
+    peak = _getrusage_peak()
+    return peak if peak is not None else current_rss()
+
+
+def format_rss(size):
+    """size in MB for messages, 'unknown' if RSS could not be measured"""
+    return f"{size / 2**20:.0f} MB" if size is not None else "unknown"
+
+
+Clip = namedtuple('Clip', ['start', 'source'])
+
+
+class BoundedRenderer:
+    """Render a voice timeline over background music within a memory budget"""
+
+    def __init__(self, memory_budget_bytes, fmt=None, chunk_seconds=DEFAULT_CHUNK_SECONDS, spill_dir=None,
+                 analysis_cache_dir=None):
+        self.memory_budget = int(memory_budget_bytes)
+        self.fmt = fmt or audio_format.render_format()
+        self.chunk_seconds = chunk_seconds
+        self.spill_dir = spill_dir
+        self.analysis_cache_dir = analysis_cache_dir
+        self.spilled_bytes = 0
+
+    def open_source(self, filename, work_dir):
+        """Open an audio file as a lazily read source, spilling a decoded copy if needed"""
+        try:
+            return WavSource(filename, self.fmt)
+        except (wave.Error, EOFError, ValueError):
+            pass  # not a plain PCM WAV
+
+        spill_file = os.path.join(work_dir, f"spill_{len(os.listdir(work_dir)):04d}.wav")
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg:
+            # Let ffmpeg stream the decode straight to disk; nothing is held in memory
+            result = subprocess.run(
+                [ffmpeg, '-v', 'error', '-y', '-i', filename, '-vn', '-acodec', 'pcm_s16le', spill_file],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            if result.returncode == 0:
+                self.spilled_bytes += os.path.getsize(spill_file)
+                print(f"💽 Spilled decoded audio to disk: {spill_file}")
+                return WavSource(spill_file, self.fmt)
+            print(f"⚠️ ffmpeg decode failed: {result.stderr.decode(errors='replace').strip()}")
+
+        # Last resort: full in-memory decode, spilled to disk if it would eat the headroom
+        samples = audio_format.load_audio(filename, self.fmt)
+        if samples.nbytes > self._headroom() // 4:
+            audio_format.write_wav(spill_file, samples, self.fmt)
+            del samples
+            gc.collect()
+            self.spilled_bytes += os.path.getsize(spill_file)
+            print(f"💽 Spilled decoded audio to disk: {spill_file}")
+            return WavSource(spill_file, self.fmt)
+        return self._array_source(samples)
+
+    def _array_source(self, samples):
+        """Source for audio decoded into memory"""
+        return ArraySource(samples)
+
+    def _headroom(self):
+        """Bytes still available under the budget; all of it where RSS cannot be measured"""
+        rss = current_rss()
+        return self.memory_budget if rss is None else self.memory_budget - rss
+
+    def _place_clips(self, audio_segments, work_dir):
+        """Open voice segments lazily and compute their start frames"""
+        clips = []
+        position = 0
+        for segment_type, content in audio_segments:
+            if segment_type == 'audio':
+                if os.path.exists(content):
+                    source = self.open_source(content, work_dir)
+                    clips.append(Clip(position, source))
+                    position += source.frames
+                else:
+                    print(f"  ⚠️ Missing audio file: {content}")
+                    position += int(round(2.0 * self.fmt.sample_rate))  # 2 seconds of silence
+            elif segment_type == 'samples':
+                source = self._array_source(content)
+                clips.append(Clip(position, source))
+                position += source.frames
+            elif segment_type == 'pause':
+                position += int(round(content * self.fmt.sample_rate))
+        return clips, position
+
+    def open_session(self, audio_segments, music_file, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+                     loop_points=None, work_dir=None, loudness=None):
+        """The whole session as a MixSource that reads voice and music lazily
+
+        Spill files go to work_dir, which must outlive the returned source.
+        music_file may be a soundscape (see soundscape.py), whose layers carry
+        their own gains, so music_gain_db does not apply to it. With a
+        LoudnessTarget the voice is normalized to it, music sits music_gain_db
+        below the voice and the background ducks under speech.
+        """
+        clips, total_frames = self._place_clips(audio_segments, work_dir)
+        music = background = None
+        background_gain = 10 ** (music_gain_db / 20.0)
+        if is_soundscape(music_file):
+            background = open_soundscape(music_file, total_frames, self.fmt)
+            background_gain = 1.0
+        elif music_file:
+            music = self.open_source(music_file, work_dir)
+            if 0 < music.frames < total_frames:
+                if loop_points is None:
+                    loop_points = find_loop_points_for_source(music, self.fmt.sample_rate)
+                print(f"🔄 Looping background music seamlessly (loop {loop_points.loop_in:.1f}s-"
+                      f"{loop_points.loop_out:.1f}s)")
+                background = CrossfadeLoopSource.from_loop_points(music, loop_points, self.fmt.sample_rate)
+            elif music.frames > 0:
+                background = music
+
+        voice_gain = 1.0
+        if loudness is not None:
+            voice_gain, background, background_gain = self._apply_loudness(
+                clips, music_file, music, background, background_gain, music_gain_db, loudness)
+        return MixSource(clips, total_frames, self.fmt.channels, background, background_gain, voice_gain)
+
+    def _apply_loudness(self, clips, music_file, music, background, background_gain, music_gain_db, target):
+        """Voice gain, (ducked) background and background gain for a LoudnessTarget"""
+        cache = AnalysisCache(self.analysis_cache_dir)
+        analyses = [cache.analyze(source, self.fmt) for _, source in clips]
+        track = None
+        if music is not None:
+            track = cache.analyze(music, self.fmt, key=repr(('track', music_identity(music_file), tuple(self.fmt))))
+        voice_lufs, voice_gain, music_gain = normalization_gains(analyses, track, target, music_gain_db)
+        if music_gain is not None:
+            background_gain = music_gain
+        background = duck_under_speech(background, clips, analyses, voice_lufs, target, self.fmt.sample_rate)
+        return voice_gain, background, background_gain
+
+    def render(self, audio_segments, music_file, filename, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+               loop_points=None, start_seconds=0.0, end_seconds=None, loudness=None, exports=()):
+        """Render to filename chunk by chunk and return a RenderReport
+
+        loop_points (seconds) are used when the music has to loop; if omitted
+        they are found from the head and tail of the music. start_seconds and
+        end_seconds limit the output to that excerpt of the session, with the
+        music at the same position it has in the full render. With a
+        LoudnessTarget the gains are set from cached analyses before mixing
+        and the output is measured while it is written. exports are
+        compressed formats (see encoder_tee.py) encoded from the same chunks
+        alongside the WAV; the report maps each one written to its file.
+        """
+        if self._headroom() <= 0:
+            raise MemoryError(
+                f"Memory budget {self.memory_budget / 2**20:.0f} MB is below current usage "
+                f"{format_rss(current_rss())}"
+            )
+        if current_rss() is None:
+            print("⚠️ Memory use cannot be measured here - rendering without the budget check")
+
+        bytes_per_frame = self.fmt.channels * 4
+        chunk_frames = max(1, int(self.chunk_seconds * self.fmt.sample_rate))
+        min_chunk_frames = min(chunk_frames, int(MIN_CHUNK_SECONDS * self.fmt.sample_rate))
+        chunk_frames = min(chunk_frames, self._headroom() // (bytes_per_frame * CHUNK_WORKING_SET))
+        chunk_frames = max(chunk_frames, min_chunk_frames)
+
+        print(f"🧩 Bounded render: budget {self.memory_budget / 2**20:.0f} MB, "
+              f"chunks of {chunk_frames / self.fmt.sample_rate:.1f}s")
+
+        work_dir = tempfile.mkdtemp(prefix="render_spill_", dir=self.spill_dir)
+        started = time.perf_counter()
+        peak = current_rss()
+        chunks = 0
+        try:
+            session = self.open_session(audio_segments, music_file, music_gain_db, loop_points, work_dir, loudness)
+            meter = LoudnessMeter(self.fmt.sample_rate, self.fmt.channels) if loudness is not None else None
+            total_frames = session.frames
+            first_frame = min(total_frames, max(0, int(round(start_seconds * self.fmt.sample_rate))))
+            last_frame = total_frames
+            if end_seconds is not None:
+                last_frame = min(total_frames, max(first_frame, int(round(end_seconds * self.fmt.sample_rate))))
+
+            with wave.open(filename, 'wb') as wav_file, EncoderTee(filename, exports, self.fmt) as tee:
+                wav_file.setnchannels(self.fmt.channels)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(self.fmt.sample_rate)
+
+                start = first_frame
+                while start < last_frame:
+                    count = min(chunk_frames, last_frame - start)
+                    end = start + count
+                    chunk = session.read(start, count)
+                    pcm = audio_format.float_to_pcm16(chunk)
+                    wav_file.writeframes(pcm)
+                    tee.write(pcm)
+                    if meter is not None:
+                        meter.add(chunk)
+                    del chunk
+                    start = end
+                    chunks += 1
+
+                    rss = current_rss()
+                    if rss is None:
+                        continue
+                    peak = max(peak, rss)
+                    if rss > self.memory_budget:
+                        gc.collect()
+                        if chunk_frames > min_chunk_frames:
+                            chunk_frames = max(min_chunk_frames, chunk_frames // 2)
+                            print(f"⚠️ Over memory budget, shrinking chunks to {chunk_frames / self.fmt.sample_rate:.1f}s")
+                        elif current_rss() > self.memory_budget:
+                            raise MemoryError(
+                                f"Render exceeded memory budget: {rss / 2**20:.0f} MB > "
+                                f"{self.memory_budget / 2**20:.0f} MB"
+                            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        duration = (last_frame - first_frame) / float(self.fmt.sample_rate)
+        # Chunked renders mix and export in one pass
+        metrics.record_stage('chunked_render', duration, time.perf_counter() - started)
+        print(f"✅ Bounded render complete: {duration / 60:.1f} minutes in {chunks} chunks, "
+              f"peak RSS {format_rss(peak)}, spilled {self.spilled_bytes / 2**20:.0f} MB")
+        output_loudness = None
+        if meter is not None:
+            output_loudness = loudness_report(meter.result())
+            print(f"📏 Output: {output_loudness.integrated_lufs:.1f} LUFS, "
+                  f"true peak {output_loudness.true_peak_db:.1f} dBTP")
+            if output_loudness.true_peak_db > loudness.true_peak_db:
+                print(f"⚠️ Output peaks above the {loudness.true_peak_db:.1f} dBTP ceiling")
+        for extension, export in tee.outputs.items():
+            print(f"💾 {extension.upper()}: {export}")
+        return RenderReport(filename, duration, peak, self.spilled_bytes, chunks, output_loudness, tee.outputs)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Batched Audio Decoding
+Decodes many compressed blobs or files (gTTS MP3 segments, background music)
+without spawning one decoder process per item. Backends, in order:
+
+1. an in-process decoder (soundfile/libsndfile 1.1+, which reads MP3) when it
+   is installed;
+2. one ffmpeg process per batch, every input fed over its own pipe and every
+   output read back over another, so nothing is written to disk;
+3. pydub, one ffmpeg run per item (the old behaviour, and the Windows path,
+   where extra pipe descriptors cannot be passed to a child process).
+
+Plain PCM WAV data never leaves the process. Results are (float32 (frames,
+channels), sample_rate) like audio_format.decode_file; load_many converts them
+to the canonical render format.
+"""
+
+import io
+import os
+import shutil
+import struct
+import subprocess
+import threading
+
+import numpy as np
+
+import audio_format
+
+
+MAX_BATCH = 16                  # inputs per ffmpeg process (two pipes each)
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class DecodeError(Exception):
+    """Raised when an item cannot be decoded by any backend"""
+
+
+def _soundfile():
+    try:
+        import soundfile
+        return soundfile
+    except (ImportError, OSError):
+        return None
+
+
+def parse_wav_stream(data):
+    """Decode WAV bytes whose size fields may be placeholders (streamed output)
+
+    Everything after the data chunk header is taken as audio, which is what a
+    writer that could not seek back to fix the header intended.
+    """
+    if data[:4] not in (b'RIFF', b'RF64') or data[8:12] != b'WAVE':
+        raise DecodeError("Not a WAV stream")
+    position = 12
+    fmt_chunk = None
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack('<4sI', data[position:position + 8])
+        position += 8
+        if chunk_id == b'fmt ':
+            fmt_chunk = data[position:position + chunk_size]
+        elif chunk_id == b'data':
+            if fmt_chunk is None:
+                break
+            format_tag, channels, sample_rate = struct.unpack('<HHI', fmt_chunk[:8])
+            bits = struct.unpack('<H', fmt_chunk[14:16])[0]
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 26:
+                format_tag = struct.unpack('<H', fmt_chunk[24:26])[0]
+            payload = data[position:]
+            if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+                samples = np.frombuffer(payload[:len(payload) // 4 * 4], dtype='<f4')
+                frames = len(samples) // channels
+                return samples[:frames * channels].reshape(frames, channels).astype(np.float32), sample_rate
+            if format_tag == WAVE_FORMAT_PCM:
+                return audio_format.pcm_to_float(payload, bits // 8, channels), sample_rate
+            if format_tag == audio_format.WAVE_FORMAT_MULAW:
+                return audio_format.mulaw_to_float(payload, channels), sample_rate
+            raise DecodeError(f"Unsupported WAV format tag {format_tag}")
+        position += chunk_size + chunk_size % 2
+    raise DecodeError("WAV stream has no audio data")
+
+
+def _decode_in_process(item, soundfile):
+    """Decode with soundfile; returns None if it cannot read the item"""
+    try:
+        source = io.BytesIO(item) if isinstance(item, bytes) else item
+        samples, sample_rate = soundfile.read(source, dtype='float32', always_2d=True)
+        return samples, sample_rate
+    except Exception:
+        return None
+
+
+def _pump_in(fd, data):
+    try:
+        with os.fdopen(fd, 'wb') as pipe:
+            pipe.write(data)
+    except BrokenPipeError:
+        pass  # ffmpeg gave up on this input; its error is reported on stderr
+
+
+def _pump_out(fd, buffers, index):
+    with os.fdopen(fd, 'rb') as pipe:
+        buffers[index] = pipe.read()
+
+
+def _ffmpeg_batch(ffmpeg, items):
+    """Decode items in one ffmpeg process; returns (results, stderr)
+
+    Each bytes item is read from its own pipe (pipe:N); each output is written
+    as float WAV to its own pipe. Threads keep every pipe moving so ffmpeg can
+    interleave inputs and outputs in any order.
+    """
+    command = [ffmpeg, '-v', 'error', '-nostdin']
+    child_fds = []
+    feeders = []
+    for item in items:
+        if isinstance(item, bytes):
+            read_fd, write_fd = os.pipe()
+            child_fds.append(read_fd)
+            feeders.append((write_fd, item))
+            command += ['-i', f'pipe:{read_fd}']
+        else:
+            command += ['-i', item]
+    readers = []
+    for index in range(len(items)):
+        read_fd, write_fd = os.pipe()
+        child_fds.append(write_fd)
+        readers.append(read_fd)
+        command += ['-map', f'{index}:a:0', '-acodec', 'pcm_f32le', '-f', 'wav', f'pipe:{write_fd}']
+
+    try:
+        process = subprocess.Popen(command, pass_fds=child_fds, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        for fd in child_fds + readers + [fd for fd, _ in feeders]:
+            os.close(fd)
+        raise
+    for fd in child_fds:
+        os.close(fd)  # the child holds its own copies
+
+    buffers = [b''] * len(items)
+    threads = [threading.Thread(target=_pump_in, args=feeder) for feeder in feeders]
+    threads += [threading.Thread(target=_pump_out, args=(fd, buffers, index)) for index, fd in enumerate(readers)]
+    for thread in threads:
+        thread.start()
+    stderr = process.stderr.read().decode(errors='replace').strip()
+    process.wait()
+    for thread in threads:
+        thread.join()
+
+    if process.returncode != 0:
+        return None, stderr
+    return [parse_wav_stream(buffer) for buffer in buffers], stderr
+
+
+def _decode_with_pydub(item):
+    from pydub import AudioSegment
+    source = io.BytesIO(item) if isinstance(item, bytes) else item
+    return audio_format.audio_segment_to_array(AudioSegment.from_file(source))
+
+
+def decode_many(items):
+    """Decode a list of audio blobs (bytes) and/or filenames
+
+    Returns a list of (samples, sample_rate) in item order; items that no
+    backend could decode are None.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        data = item if isinstance(item, bytes) else None
+        if data is not None and data[:4] in (b'RIFF', b'RF64'):
+            try:
+                results[index] = parse_wav_stream(data)
+                continue
+            except DecodeError:
+                pass
+        pending.append(index)
+
+    soundfile = _soundfile() if pending else None
+    if soundfile is not None:
+        for index in list(pending):
+            results[index] = _decode_in_process(items[index], soundfile)
+        pending = [index for index in pending if results[index] is None]
+
+    ffmpeg = shutil.which('ffmpeg')
+    if pending and ffmpeg and os.name == 'posix':
+        print(f"🎛️ Decoding {len(pending)} item(s) in {-(-len(pending) // MAX_BATCH)} ffmpeg process(es)")
+        for batch_start in range(0, len(pending), MAX_BATCH):
+            batch = pending[batch_start:batch_start + MAX_BATCH]
+            try:
+                decoded, stderr = _ffmpeg_batch(ffmpeg, [items[index] for index in batch])
+            except (OSError, DecodeError) as e:
+                decoded, stderr = None, str(e)
+            if decoded is None:
+                # One bad input fails the whole run; the rest are retried one by one below
+                print(f"⚠️ Batched decode failed, retrying items individually: {stderr}")
+                continue
+            for index, result in zip(batch, decoded):
+                results[index] = result
+        pending = [index for index in pending if results[index] is None]
+
+    for index in pending:
+        try:
+            results[index] = _decode_with_pydub(items[index])
+        except Exception as e:
+            print(f"❌ Could not decode audio item {index + 1}: {e}")
+    return results
+
+
+def decode_one(item):
+    """Decode a single blob or filename, raising DecodeError on failure"""
+    result = decode_many([item])[0]
+    if result is None:
+        raise DecodeError("Audio could not be decoded (is ffmpeg installed?)")
+    return result
+
+
+def load_many(items, fmt=None):
+    """decode_many, converted to the canonical render format (None for failures)"""
+    return [None if result is None else audio_format.to_canonical(result[0], result[1], fmt)
+            for result in decode_many(items)]
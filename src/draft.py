@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Draft Renders
+A fast, low-fidelity preview for iterating on a script. Compared with a final
+render a draft:
+
+- speaks with the selected engine and voice only, taking each phrase from
+  the speech cache the final render reads (and filling it in turn), so a
+  draft never mixes voices and leaves the final render warm. Google TTS
+  misses are fetched in coalesced requests; local engine misses are all
+  rendered by one engine process;
+- works in DRAFT_FORMAT (16 kHz mono) from decode to export;
+- skips the rate time-stretch and volume processing, so phrases play at the
+  engine's natural pace;
+- exports a small compressed preview (MP3 through ffmpeg, mu-law WAV without it).
+
+    python src/draft.py scripts/body_scan.txt --music background_music/rain.wav
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import subprocess
+import time
+from collections import namedtuple
+
+import audio_format
+import metrics
+import mixer
+import speech
+from audio_format import RenderFormat
+from meditation_script import parse_meditation_text
+from soundscape import is_soundscape
+
+
+DRAFT_FORMAT = RenderFormat(16000, 1, 'float32')
+PREVIEW_BITRATE = '32k'
+
+DraftReport = namedtuple('DraftReport', ['filename', 'duration', 'seconds'])
+
+
+def draft_speech(texts, settings, fmt=DRAFT_FORMAT):
+    """{text: samples} in fmt without rate or volume processing, from the selected engine and its cache"""
+    texts = list(dict.fromkeys(texts))
+    samples = {}
+    if settings.engine == "gtts":
+        # The final render's request parameters, so drafts warm its cache and vice versa
+        lang, tld, slow = speech.gtts_voice_params(settings.voice, settings.rate)
+        for text, ((decoded, sample_rate), seconds) in speech.fetch_gtts_samples(
+                texts, lang, tld, slow, coalesce=True).items():
+            samples[text] = audio_format.to_canonical(decoded, sample_rate, fmt)
+            if seconds is not None:
+                metrics.record_segment('gtts', seconds)
+    missing = [text for text in texts if text not in samples]
+    if missing:
+        if settings.engine == "gtts":
+            print("🔄 Falling back to local TTS...")
+            metrics.GTTS_FALLBACKS.inc(len(missing))
+        samples.update(speech.local_speech_many(missing, settings, fmt))
+    return samples
+
+
+def export_preview(samples, filename, fmt=DRAFT_FORMAT):
+    """Write a compressed preview next to filename's stem; returns the file written"""
+    stem = os.path.splitext(filename)[0]
+    start = time.perf_counter()
+    ffmpeg = shutil.which('ffmpeg')
+    written = None
+    if ffmpeg:
+        result = subprocess.run(
+            [ffmpeg, '-v', 'error', '-y', '-f', 's16le', '-ar', str(fmt.sample_rate),
+             '-ac', str(samples.shape[1]), '-i', 'pipe:0', '-b:a', PREVIEW_BITRATE, f"{stem}.mp3"],
+            input=audio_format.float_to_pcm16(samples), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        if result.returncode == 0:
+            written = f"{stem}.mp3"
+        else:
+            print(f"⚠️ MP3 preview failed, writing mu-law WAV: {result.stderr.decode(errors='replace').strip()}")
+    if written is None:
+        written = f"{stem}.wav"
+        audio_format.write_mulaw_wav(written, samples, fmt)
+    metrics.record_stage('draft_export', audio_format.duration_seconds(samples, fmt), time.perf_counter() - start)
+    return written
+
+
+def render_draft(meditation_text, settings, output_dir="output", music_file=None,
+                 music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB, loop_points=None):
+    """Render a quick preview of a script; returns a DraftReport"""
+    started = time.perf_counter()
+    segments = parse_meditation_text(meditation_text)
+    speech_samples = draft_speech([content for kind, content in segments if kind == 'text'], settings)
+    audio_segments = [('samples', speech_samples[content]) if kind == 'text' else ('pause', content)
+                      for kind, content in segments]
+    mix = mixer.build_voice_track(audio_segments, DRAFT_FORMAT)
+    if is_soundscape(music_file):
+        mix = mixer.mix_voice_with_soundscape(mix, music_file, DRAFT_FORMAT)
+    elif music_file:
+        background = mixer.load_background_music(music_file, DRAFT_FORMAT)
+        mix = mixer.mix_voice_with_background(mix, background, music_gain_db, DRAFT_FORMAT, loop_points)
+
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = export_preview(mix, os.path.join(output_dir, f"draft_meditation_{timestamp}"))
+    seconds = time.perf_counter() - started
+    duration = audio_format.duration_seconds(mix, DRAFT_FORMAT)
+    print(f"📝 Draft ready in {seconds:.1f}s: {filename} ({duration / 60:.1f} minutes, "
+          f"{os.path.getsize(filename):,} bytes)")
+    return DraftReport(filename, duration, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a fast low-fidelity draft of a meditation script")
+    parser.add_argument('script', help="meditation script text file")
+    parser.add_argument('--output', default="output", help="output folder")
+    parser.add_argument('--music', help="background music file")
+    parser.add_argument('--music-gain-db', type=float, default=mixer.DEFAULT_MUSIC_GAIN_DB)
+    parser.add_argument('--engine', default="gtts", choices=["gtts", "pyttsx3"])
+    parser.add_argument('--voice', default="English (US)")
+    parser.add_argument('--rate', type=int, default=speech.DEFAULT_RATE)
+    parser.add_argument('--volume', type=float, default=speech.DEFAULT_VOLUME)
+    args = parser.parse_args()
+
+    speech.set_speech_cache_dir(speech.DEFAULT_SPEECH_CACHE_DIR)
+    with open(args.script, encoding='utf-8') as f:
+        meditation_text = f.read()
+    settings = speech.VoiceSettings(args.engine, args.voice, args.rate, args.volume, None)
+    render_draft(meditation_text, settings, args.output, args.music, args.music_gain_db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Multi-Format Export
+Encodes compressed copies of a mix while it is being written. The renderer
+writes the WAV master as usual and hands the same 16-bit PCM to an
+EncoderTee, which fans it out to one ffmpeg process per format (128 kbps MP3
+and Opus for mobile by default). The encoders run concurrently with the mix
+and with each other, each fed from its own small queue by a thread, so a slow
+encoder never holds up the mixer for longer than its queue takes to fill,
+and nothing is decoded or mixed twice.
+
+    with EncoderTee("output/session.wav", ('mp3', 'opus'), fmt) as tee:
+        tee.write(pcm_bytes)
+    tee.outputs    # {'mp3': 'output/session.mp3', 'opus': 'output/session.opus'}
+
+The 'hls' format writes a segmented HLS stream next to the master instead
+of a single file (see hls_output.py). Without ffmpeg only the master is
+written.
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import audio_format
+import hls_output
+
+
+# Encoder arguments per output extension
+EXPORT_FORMATS = {
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '64k', '-ar', '48000'],  # Opus runs at 48 kHz
+    'hls': hls_output.ENCODER_ARGS,
+}
+DEFAULT_EXPORTS = ('mp3', 'opus')
+QUEUE_CHUNKS = 4                # PCM chunks buffered per encoder before the writer waits
+READ_BYTES = 64 * 1024
+STDERR_TAIL_BYTES = 4096        # end of an encoder's diagnostics kept for the failure report
+
+
+def export_paths(master_filename, formats):
+    """{format: path} of the copies an EncoderTee for master_filename writes"""
+    stem = os.path.splitext(master_filename)[0]
+    return {extension: hls_output.playlist_path(stem) if extension == 'hls' else f"{stem}.{extension}"
+            for extension in dict.fromkeys(formats) if extension != 'wav'}
+
+
+class _Encoder:
+    """One ffmpeg process encoding PCM from stdin, fed by a thread
+
+    Its stderr is drained by a second thread while it runs: read only after
+    stdin closes, an encoder that filled the pipe with diagnostics would
+    block on it while the feeder blocks on stdin.
+    """
+
+    output = None               # ffmpeg output target; the file by default
+    stdout = subprocess.DEVNULL
+
+    def __init__(self, ffmpeg, extension, filename, fmt):
+        self.extension = extension
+        self.filename = filename
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.failed = False
+        self.stderr = ''
+        self.process = subprocess.Popen(
+            [ffmpeg, '-v', 'error', '-nostdin', '-y', '-f', 's16le', '-ar', str(fmt.sample_rate),
+             '-ac', str(fmt.channels), '-i', 'pipe:0'] + EXPORT_FORMATS[extension] + [self.output or filename],
+            stdin=subprocess.PIPE, stdout=self.stdout, stderr=subprocess.PIPE
+        )
+        self.errors = threading.Thread(target=self._drain_errors, daemon=True)
+        self.errors.start()
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _drain_errors(self):
+        tail = b''
+        for data in iter(lambda: self.process.stderr.read1(READ_BYTES), b''):
+            tail = (tail + data)[-STDERR_TAIL_BYTES:]
+        self.stderr = tail.decode(errors='replace').strip()
+
+    def _feed(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.failed:
+                continue  # keep draining so the writer never blocks on a dead encoder
+            try:
+                self.process.stdin.write(data)
+            except (BrokenPipeError, OSError):
+                self.failed = True
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            self.failed = True
+        self.process.wait()
+        self.errors.join()
+
+    def finish(self):
+        """Wait for the encoder; True if it wrote its file"""
+        self.queue.put(None)
+        self.thread.join()
+        return not self.failed and self.process.returncode == 0
+
+    def kill(self):
+        self.process.kill()
+        self.queue.put(None)
+        self.thread.join()
+
+    def discard(self):
+        """Remove what a failed encoder wrote"""
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+class _HlsEncoder(_Encoder):
+    """Encoder whose MP3 stream is cut into HLS segments as it is produced"""
+
+    output = 'pipe:1'
+    stdout = subprocess.PIPE
+
+    def __init__(self, ffmpeg, extension, filename, fmt):
+        self.segmenter = hls_output.HlsSegmenter(os.path.dirname(filename))
+        super().__init__(ffmpeg, extension, filename, fmt)
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        try:
+            for data in iter(lambda: self.process.stdout.read1(READ_BYTES), b''):
+                self.segmenter.feed(data)
+        except OSError:
+            self.failed = True
+            self.process.kill()
+
+    def finish(self):
+        done = super().finish()
+        self.reader.join()
+        if done:
+            self.segmenter.finish()
+        return done
+
+    def kill(self):
+        super().kill()
+        self.reader.join()
+
+    def discard(self):
+        shutil.rmtree(os.path.dirname(self.filename), ignore_errors=True)
+
+
+class EncoderTee:
+    """Compressed copies of one PCM stream, written next to the master as the stream is written
+
+    formats are keys of EXPORT_FORMATS; after close() (or the with block)
+    outputs maps each format that was encoded to its file. Encoders that fail
+    are reported and their partial files removed; the master is unaffected.
+    """
+
+    def __init__(self, master_filename, formats, fmt=None):
+        self.fmt = fmt or audio_format.render_format()
+        self.outputs = {}
+        self.encoders = []
+        formats = [extension for extension in dict.fromkeys(formats) if extension != 'wav']
+        unknown = [extension for extension in formats if extension not in EXPORT_FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown export format(s) {', '.join(unknown)} "
+                             f"(choose from {', '.join(EXPORT_FORMATS)})")
+        if not formats:
+            return
+        ffmpeg = shutil.which('ffmpeg')
+        if not ffmpeg:
+            print(f"⚠️ ffmpeg not found - skipping {', '.join(formats)} export")
+            return
+        try:
+            for extension, filename in export_paths(master_filename, formats).items():
+                encoder = _HlsEncoder if extension == 'hls' else _Encoder
+                self.encoders.append(encoder(ffmpeg, extension, filename, self.fmt))
+        except OSError as e:
+            self.abort()
+            print(f"⚠️ Could not start the encoders - skipping {', '.join(formats)} export: {e}")
+
+    @property
+    def encoding(self):
+        """True while any encoder is running"""
+        return bool(self.encoders)
+
+    def write(self, pcm):
+        """Queue 16-bit PCM bytes (interleaved, in the tee's format) for every encoder"""
+        for encoder in self.encoders:
+            encoder.queue.put(pcm)
+
+    def close(self):
+        """Finish every encoder; returns outputs"""
+        for encoder in self.encoders:
+            if encoder.finish():
+                self.outputs[encoder.extension] = encoder.filename
+            else:
+                print(f"⚠️ {encoder.extension.upper()} export failed (ffmpeg exit code "
+                      f"{encoder.process.returncode}): {encoder.stderr}")
+                encoder.discard()
+        self.encoders = []
+        return self.outputs
+
+    def abort(self):
+        """Stop every encoder and remove their partial files"""
+        for encoder in self.encoders:
+            encoder.kill()
+            encoder.discard()
+        self.encoders = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
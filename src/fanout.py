@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Fan-out Rendering
+Renders one meditation script against a matrix of (voice, rate, music, music
+gain) variants. Work that the variants have in common is done once: the script
+is parsed once, each distinct gTTS request is fetched once, each distinct
+(voice settings, text) segment is synthesized once, each voice track is built
+once and each background file is decoded once. Only the final mixes are done
+per variant, and they run in parallel. Synthesized segments are checkpointed
+(see checkpoint.py), so an interrupted batch resumes without redoing them.
+"""
+
+import os
+import datetime
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import audio_format
+import decode_service
+import metrics
+import speech
+import mixer
+from loop_points import find_loop_points
+from meditation_script import parse_meditation_text
+from checkpoint import RenderCheckpoint
+from soundscape import is_soundscape
+
+
+RenderVariant = namedtuple('RenderVariant', ['settings', 'music_file', 'music_gain_db', 'label'])
+RenderVariant.__new__.__defaults__ = (mixer.DEFAULT_MUSIC_GAIN_DB, None)
+
+
+def _digest(*parts):
+    """Short stable hash used for work file names"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class FanOutRenderer:
+    """Render one script into many variants, sharing parse, synthesis and decode work"""
+
+    def __init__(self, output_dir="output", max_workers=4):
+        self.output_dir = Path(output_dir)
+        self.max_workers = max_workers
+
+    def render(self, meditation_text, variants):
+        """Render every variant and return the output filenames in variant order"""
+        variants = list(variants)
+        self.output_dir.mkdir(exist_ok=True)
+        segments = parse_meditation_text(meditation_text)
+        texts = [content for segment_type, content in segments if segment_type == 'text']
+
+        voice_settings = list(dict.fromkeys(v.settings for v in variants))
+        music_files = list(dict.fromkeys(v.music_file for v in variants if v.music_file))
+        mix_keys = list(dict.fromkeys((v.settings, v.music_file, v.music_gain_db) for v in variants))
+        segment_keys = list(dict.fromkeys((s, t) for s in voice_settings for t in texts))
+
+        print(f"🧮 Fan-out: {len(variants)} variants, {len(voice_settings)} voice setting(s), "
+              f"{len(segment_keys)} unique segment(s), {len(music_files)} music file(s), "
+              f"{len(mix_keys)} unique mix(es)")
+
+        # Synthesized segments are checkpointed, so a crashed batch resumes where it stopped
+        fmt = audio_format.render_format()
+        checkpoint = RenderCheckpoint.for_job(self.output_dir, meditation_text, tuple(voice_settings), fmt)
+        segment_files = {key: checkpoint.lookup(*key, fmt) for key in segment_keys}
+        pending_keys = [key for key in segment_keys if not segment_files[key]]
+        work_dir = str(checkpoint.job_dir)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            raw_mp3s = self._fetch_gtts_requests(pool, pending_keys, work_dir)
+            segment_files.update(self._synthesize_segments(pool, pending_keys, raw_mp3s, checkpoint, fmt))
+
+            # Decode music while the voice tracks are assembled
+            music_futures = {f: pool.submit(self._load_music, f) for f in music_files}
+            voice_futures = {
+                s: pool.submit(mixer.build_voice_track, self._audio_segments(segments, s, segment_files))
+                for s in voice_settings
+            }
+            voice_tracks = {s: f.result() for s, f in voice_futures.items()}
+            backgrounds = {}
+            for music_file, future in music_futures.items():
+                try:
+                    backgrounds[music_file] = future.result()
+                except Exception as e:
+                    print(f"❌ Failed to load background music {music_file}: {e}")
+
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            mix_filenames = {}
+            mix_futures = {}
+            for index, variant in enumerate(variants):
+                key = (variant.settings, variant.music_file, variant.music_gain_db)
+                if key in mix_futures:
+                    continue
+                label = variant.label or f"v{index + 1:02d}"
+                filename = str(self.output_dir / f"complete_meditation_{timestamp}_{label}.wav")
+                background, loop_points = backgrounds.get(variant.music_file, (None, None))
+                mix_futures[key] = pool.submit(
+                    self._mix_variant, voice_tracks[variant.settings],
+                    background, loop_points, variant.music_gain_db, filename
+                )
+            for key, future in mix_futures.items():
+                try:
+                    mix_filenames[key] = future.result()
+                except Exception as e:
+                    print(f"❌ Variant mix failed: {e}")
+                    mix_filenames[key] = None
+
+        results = [mix_filenames[(v.settings, v.music_file, v.music_gain_db)] for v in variants]
+        if all(results):
+            checkpoint.discard()
+        print(f"🎉 Fan-out complete: {sum(1 for r in results if r)}/{len(results)} variants rendered")
+        return results
+
+    def _fetch_gtts_requests(self, pool, segment_keys, work_dir):
+        """Fetch each distinct raw gTTS request once; returns {request_key: mp3 path or None}"""
+        requests = {}
+        for settings, text in segment_keys:
+            if settings.engine == "gtts":
+                lang, tld, slow = speech.gtts_voice_params(settings.voice, settings.rate)
+                requests.setdefault(speech.gtts_request_key(text, lang, tld, slow), text)
+
+        def fetch(request_key):
+            _, text, lang, tld, slow = request_key
+            mp3_filename = os.path.join(work_dir, f"raw_{_digest(request_key)}.mp3")
+            try:
+                speech.fetch_gtts_mp3(text, lang, tld, slow, mp3_filename)
+                return mp3_filename
+            except Exception as e:
+                print(f"❌ Google TTS failed: {e}")
+                return None
+
+        futures = {key: pool.submit(fetch, key) for key in requests}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _synthesize_segments(self, pool, segment_keys, raw_mp3s, checkpoint, fmt):
+        """Produce and checkpoint one WAV per distinct (settings, text); returns {key: path}"""
+        # Every raw MP3 is decoded in one batch rather than one decoder run each
+        raw_paths = [path for path in raw_mp3s.values() if path]
+        decoded = dict(zip(raw_paths, decode_service.decode_many(raw_paths)))
+
+        def synthesize(settings, text):
+            filename = checkpoint.partial_file(settings, text, fmt)
+            try:
+                if settings.engine == "gtts":
+                    lang, tld, slow = speech.gtts_voice_params(settings.voice, settings.rate)
+                    raw_mp3 = raw_mp3s.get(speech.gtts_request_key(text, lang, tld, slow))
+                    if raw_mp3 and decoded.get(raw_mp3) is not None:
+                        samples, sample_rate = decoded[raw_mp3]
+                        audio_format.write_wav(filename, speech.apply_voice_adjustments(
+                            samples, sample_rate, settings.rate, settings.volume))
+                    elif raw_mp3:
+                        speech.convert_gtts_mp3(raw_mp3, filename, settings)
+                    else:
+                        print("🔄 Falling back to local TTS...")
+                        metrics.GTTS_FALLBACKS.inc()
+                        speech.create_speech_pyttsx3(text, filename, settings)
+                else:
+                    speech.create_speech_pyttsx3(text, filename, settings)
+            except Exception as e:
+                print(f"❌ Error processing segment: {e}")
+                # Silence is not checkpointed, so a resumed run tries this segment again
+                speech.create_silent_audio(filename, duration=len(text.split()) * 0.5)
+                return filename
+            return checkpoint.commit(filename, settings, text, fmt)
+
+        futures = {key: pool.submit(synthesize, *key) for key in segment_keys}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _audio_segments(self, segments, settings, segment_files):
+        """Map parsed segments to the ('audio', path)/('pause', n) list for one voice"""
+        audio_segments = []
+        for segment_type, content in segments:
+            if segment_type == 'text':
+                audio_segments.append(('audio', segment_files[(settings, content)]))
+            else:
+                audio_segments.append(('pause', content))
+        return audio_segments
+
+    def _load_music(self, music_file):
+        """Decode a music file and find its loop points, once for all variants"""
+        if is_soundscape(music_file):
+            return music_file, None  # layers are read lazily per variant from the PCM cache
+        background = mixer.load_background_music(music_file)
+        return background, find_loop_points(background, audio_format.render_format().sample_rate)
+
+    def _mix_variant(self, voice_track, background, loop_points, music_gain_db, filename):
+        """Mix and export one variant (voice-only when there is no usable music)"""
+        if background is None:
+            filename = filename.replace("complete_meditation_", "voice_only_meditation_")
+            return mixer.export_mix(voice_track, filename)
+        if is_soundscape(background):
+            mix = mixer.mix_voice_with_soundscape(voice_track, background, music_gain_db=music_gain_db)
+            return mixer.export_mix(mix, filename)
+        mix = mixer.mix_voice_with_background(voice_track, background, music_gain_db, loop_points=loop_points)
+        return mixer.export_mix(mix, filename)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+HLS Output
+Serves a session over HTTP as it renders. One encoder process turns the
+mixer's PCM into a single MP3 stream (so there are no encoder gaps between
+segments), and HlsSegmenter cuts that stream on MP3 frame boundaries into
+fixed-duration packed-audio segments. Each segment is published the moment
+it is complete, followed by the EVENT playlist listing it, so a client can
+start playing after the first segment while the rest is still rendering.
+Segments and playlist are written to a temporary file and renamed, so a web
+server never serves a partial file.
+
+Each segment starts with the ID3 timestamp tag HLS requires for packed
+audio. validate_playlist() re-reads a playlist and its segments and checks
+the declared durations against the MP3 frames actually in each segment:
+
+    python src/hls_output.py output/complete_meditation_20250101_120000_hls/playlist.m3u8
+
+DASH is not written: DASH players expect fragmented MP4 segments rather
+than packed audio.
+"""
+
+import argparse
+import math
+import os
+import struct
+import sys
+import tempfile
+from collections import namedtuple
+
+from audio_probe import parse_mp3_frame_header
+
+
+SEGMENT_SECONDS = 6.0
+PLAYLIST_NAME = "playlist.m3u8"
+# A bare MP3 stream: no Xing frame or ID3 tag, which would be cut into the first segment
+ENCODER_ARGS = ['-c:a', 'libmp3lame', '-b:a', '128k', '-write_xing', '0', '-id3v2_version', '0', '-f', 'mp3']
+TIMESTAMP_OWNER = b'com.apple.streaming.transportStreamTimestamp'
+TIMESTAMP_CLOCK = 90000         # MPEG-2 timestamps count a 90 kHz clock
+
+Segment = namedtuple('Segment', ['uri', 'duration'])
+Playlist = namedtuple('Playlist', ['target_duration', 'segments', 'ended'])
+
+
+class PlaylistError(Exception):
+    """Raised when a playlist or one of its segments is malformed"""
+
+
+def playlist_path(stem):
+    """Where the HLS output of a render whose master is stem + '.wav' goes"""
+    return os.path.join(f"{stem}_hls", PLAYLIST_NAME)
+
+
+def _syncsafe(value):
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def timestamp_tag(samples, sample_rate):
+    """ID3v2.4 tag holding the 90 kHz timestamp of a packed audio segment starting at samples"""
+    timestamp = (samples * TIMESTAMP_CLOCK // sample_rate) & (2**33 - 1)
+    payload = TIMESTAMP_OWNER + b'\x00' + struct.pack('>Q', timestamp)
+    frame = b'PRIV' + _syncsafe(len(payload)) + b'\x00\x00' + payload
+    return b'ID3\x04\x00\x00' + _syncsafe(len(frame)) + frame
+
+
+def _write_atomic(filename, data):
+    directory = os.path.dirname(filename)
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, filename)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+class HlsSegmenter:
+    """Cuts an MP3 stream fed in arbitrary pieces into segments, publishing each as it completes"""
+
+    def __init__(self, directory, segment_seconds=SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.target_duration = max(1, math.ceil(segment_seconds))
+        self.segments = []
+        self.buffer = b''
+        self.frames = []              # MP3 frames of the segment being collected
+        self.frame_samples = 0
+        self.segment_start = 0        # samples before the segment being collected
+        self.sample_rate = None
+        os.makedirs(directory, exist_ok=True)
+
+    def feed(self, data):
+        """Take the next bytes of the MP3 stream"""
+        buffer = self.buffer + data
+        position = 0
+        while len(buffer) - position >= 4:
+            frame = parse_mp3_frame_header(buffer[position:position + 4])
+            if frame is None or frame.frame_size <= 4:
+                position += 1           # resynchronize on the next frame header
+                continue
+            if len(buffer) - position < frame.frame_size:
+                break
+            if self.sample_rate is None:
+                self.sample_rate = frame.sample_rate
+            self.frames.append(buffer[position:position + frame.frame_size])
+            self.frame_samples += frame.samples_per_frame
+            position += frame.frame_size
+            if self.frame_samples >= self.segment_seconds * self.sample_rate:
+                self._publish()
+        self.buffer = buffer[position:]
+
+    def finish(self):
+        """Publish the last partial segment and end the playlist; returns its path"""
+        if self.frames:
+            self._publish()
+        self._write_playlist(ended=True)
+        return os.path.join(self.directory, PLAYLIST_NAME)
+
+    def _publish(self):
+        uri = f"segment_{len(self.segments):05d}.mp3"
+        _write_atomic(os.path.join(self.directory, uri),
+                      timestamp_tag(self.segment_start, self.sample_rate) + b''.join(self.frames))
+        self.segments.append(Segment(uri, self.frame_samples / float(self.sample_rate)))
+        self.segment_start += self.frame_samples
+        self.frames = []
+        self.frame_samples = 0
+        self._write_playlist(ended=False)
+
+    def _write_playlist(self, ended):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{self.target_duration}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}"]
+        for segment in self.segments:
+            lines += [f"#EXTINF:{segment.duration:.6f},", segment.uri]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        _write_atomic(os.path.join(self.directory, PLAYLIST_NAME), ("\n".join(lines) + "\n").encode())
+
+
+def segment_duration(filename):
+    """Duration in seconds of the MP3 frames in a packed audio segment"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    position = 0
+    if data[:3] == b'ID3':
+        position = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+    samples = 0
+    sample_rate = None
+    while position < len(data):
+        frame = parse_mp3_frame_header(data[position:position + 4])
+        if frame is None or position + frame.frame_size > len(data):
+            raise PlaylistError(f"{filename}: broken MP3 frame at byte {position}")
+        sample_rate = sample_rate or frame.sample_rate
+        samples += frame.samples_per_frame
+        position += frame.frame_size
+    if sample_rate is None:
+        raise PlaylistError(f"{filename}: no audio")
+    return samples / float(sample_rate)
+
+
+def validate_playlist(filename):
+    """Parse an HLS media playlist and check it against its segments; returns a Playlist"""
+    with open(filename) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise PlaylistError(f"{filename}: not an M3U8 playlist")
+    target_duration = None
+    segments = []
+    duration = None
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = int(line.split(':', 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0])
+        elif not line.startswith('#'):
+            if duration is None:
+                raise PlaylistError(f"{filename}: segment {line} has no #EXTINF")
+            segments.append(Segment(line, duration))
+            duration = None
+    if target_duration is None:
+        raise PlaylistError(f"{filename}: no #EXT-X-TARGETDURATION")
+
+    directory = os.path.dirname(filename)
+    for segment in segments:
+        if round(segment.duration) > target_duration:
+            raise PlaylistError(f"{segment.uri}: {segment.duration:.3f}s is over the "
+                                f"{target_duration}s target duration")
+        actual = segment_duration(os.path.join(directory, segment.uri))
+        if abs(actual - segment.duration) > 1e-3:
+            raise PlaylistError(f"{segment.uri}: declared {segment.duration:.3f}s, holds {actual:.3f}s")
+    return Playlist(target_duration, segments, "#EXT-X-ENDLIST" in lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate an HLS playlist and its segment durations")
+    parser.add_argument('playlist')
+    args = parser.parse_args(argv)
+    try:
+        playlist = validate_playlist(args.playlist)
+    except (OSError, PlaylistError) as e:
+        print(f"❌ {e}")
+        return 1
+    total = sum(segment.duration for segment in playlist.segments)
+    print(f"✅ {len(playlist.segments)} segments, {total / 60:.1f} minutes, "
+          f"target {playlist.target_duration}s, {'complete' if playlist.ended else 'still rendering'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Seamless Loop Points
+Finds loop-in/loop-out points in a music track so it can be repeated without
+an audible seam. The audio just before each candidate loop-out is matched
+against every position near the start of the track with an FFT-based
+normalized cross-correlation (waveform match) plus an RMS energy penalty; the
+best pair is where the crossfade will be least noticeable.
+
+The points are computed once per track and cached in the music library index
+(see music_library.py); CrossfadeLoopSource in audio_sources.py plays them.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+# All times in seconds. The loop plays [0, loop_out) once, then repeats
+# [loop_in, loop_out); the `crossfade` seconds before loop_out are blended with
+# the `crossfade` seconds before loop_in using an equal-power curve.
+LoopPoints = namedtuple('LoopPoints', ['loop_in', 'loop_out', 'crossfade', 'score'])
+
+DEFAULT_CROSSFADE = 0.5      # seconds
+SEARCH_SECONDS = 30.0        # how far into the head/tail to search
+OUT_CANDIDATES = 8           # loop-out positions tried in the tail region
+ENERGY_WEIGHT = 0.5          # penalty per decade of RMS mismatch
+MIN_LOOP_SECONDS = 1.0
+
+
+def whole_track_loop(duration, crossfade=DEFAULT_CROSSFADE):
+    """Loop points that simply repeat the whole track (used when analysis is impossible)"""
+    crossfade = min(crossfade, duration / 4.0)
+    return LoopPoints(crossfade, float(duration), crossfade, 0.0)
+
+
+def _to_mono(samples):
+    samples = np.asarray(samples, dtype=np.float64)
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def _sliding_energy(signal, window):
+    """Sum of squares of every length-`window` slice of signal"""
+    cumulative = np.concatenate([[0.0], np.cumsum(signal * signal)])
+    return cumulative[window:] - cumulative[:-window]
+
+
+def find_loop_points_in_regions(head, head_offset, tail, tail_offset, sample_rate,
+                                crossfade=DEFAULT_CROSSFADE, duration=None):
+    """Find loop points given only the head and tail regions of a track
+
+    head/tail are sample arrays starting at frames head_offset/tail_offset of
+    the track; this lets long files be analyzed without decoding the middle.
+    """
+    head = _to_mono(head)
+    tail = _to_mono(tail)
+    window = max(2, int(round(crossfade * sample_rate)))
+    if duration is None:
+        duration = (tail_offset + len(tail)) / float(sample_rate)
+
+    if len(head) < 2 * window or len(tail) < window:
+        return whole_track_loop(duration, crossfade)
+
+    # Candidate loop-outs evenly spread over the tail region
+    first_out = tail_offset + window
+    last_out = tail_offset + len(tail)
+    outs = np.unique(np.linspace(first_out, last_out, OUT_CANDIDATES).astype(np.int64))
+
+    head_energy = _sliding_energy(head, window)
+    # loop_in = head_offset + k + window must leave a loop of useful length
+    loop_ins = head_offset + np.arange(len(head_energy)) + window
+    min_loop = max(2 * window, int(MIN_LOOP_SECONDS * sample_rate))
+    # Near-silent windows correlate meaninglessly; require some signal
+    has_signal = head_energy > 1e-9 * window
+
+    # Correlate each template against every head window with one FFT product;
+    # the head spectrum is shared and only one score row is alive at a time
+    size = 1 << int(math.ceil(math.log2(len(head) + window)))
+    head_spectrum = np.fft.rfft(head, size)
+    best_score, best = -np.inf, None
+    for out in outs:
+        template = tail[out - tail_offset - window:out - tail_offset]
+        correlation = np.fft.irfft(head_spectrum * np.fft.rfft(template[::-1], size), size)
+        # correlation[k + window - 1] = dot(template, head[k:k + window])
+        dots = correlation[window - 1:len(head)]
+        template_energy = float(np.dot(template, template))
+        ncc = dots / np.sqrt(np.maximum(head_energy * template_energy, 1e-20))
+        # Penalize level jumps: compare RMS of the two windows (in decades)
+        ratio = np.sqrt((head_energy + 1e-12) / (template_energy + 1e-12))
+        score = ncc - ENERGY_WEIGHT * np.abs(np.log10(ratio))
+        score[(out - loop_ins < min_loop) | ~has_signal] = -np.inf
+        k = int(np.argmax(score))
+        if score[k] > best_score:
+            best_score, best = float(score[k]), (out, k)
+
+    if best is None or not np.isfinite(best_score):
+        return whole_track_loop(duration, crossfade)
+
+    loop_in = loop_ins[best[1]] / float(sample_rate)
+    loop_out = best[0] / float(sample_rate)
+    return LoopPoints(float(loop_in), float(loop_out), window / float(sample_rate), best_score)
+
+
+def find_loop_points(samples, sample_rate, start=0.0, end=None, crossfade=DEFAULT_CROSSFADE,
+                     search_seconds=SEARCH_SECONDS):
+    """Find loop points for a decoded track, searching near its start and end
+
+    start/end bound the audible part of the track (e.g. with silent lead-in
+    and tail trimmed off).
+    """
+    total = len(samples)
+    duration = total / float(sample_rate)
+    start_frame = int(start * sample_rate)
+    end_frame = total if end is None else min(total, int(end * sample_rate))
+    audible = end_frame - start_frame
+    search = min(int(search_seconds * sample_rate), audible // 3)
+    if search <= 0:
+        return whole_track_loop(duration, crossfade)
+    return find_loop_points_in_regions(
+        samples[start_frame:start_frame + search], start_frame,
+        samples[end_frame - search:end_frame], end_frame - search,
+        sample_rate, crossfade, duration
+    )
+
+
+def find_loop_points_for_source(source, sample_rate, crossfade=DEFAULT_CROSSFADE,
+                                search_seconds=SEARCH_SECONDS):
+    """Find loop points for a lazily read source, reading only its head and tail"""
+    total = source.frames
+    search = min(int(search_seconds * sample_rate), total // 3)
+    if search <= 0:
+        return whole_track_loop(total / float(sample_rate), crossfade)
+    return find_loop_points_in_regions(
+        source.read(0, search), 0, source.read(total - search, search), total - search,
+        sample_rate, crossfade, total / float(sample_rate)
+    )
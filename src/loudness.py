@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Loudness
+Streaming loudness measurement (ITU-R BS.1770 integrated LUFS and true peak),
+voice normalization and ducking of the background under speech.
+
+The meter runs the BS.1770 K-weighting (a high-shelf pre-filter and the RLB
+high pass, two biquads) continuously over the signal, carrying the filter
+state from chunk to chunk, and keeps the K-weighted mean square of each of the
+100 ms sub-blocks BS.1770 gates with, so a measurement is just a short array
+of sub-block powers. The biquads are run a block at a time without a
+per-sample loop (see Biquad), which keeps metering cheap next to mixing. Those
+arrays are
+cached per voice segment and per music track (AnalysisCache), which is all a
+render needs to set its gains before the first chunk is mixed: the voice
+track's loudness is the gated loudness of its segments' sub-blocks, and the
+music is then placed music_gain_db below it. The output is measured in the
+same chunked pass that writes it.
+
+Ducking is keyed from the same cached analyses: the sub-blocks where a segment
+is speaking are known before mixing, so the background can start to dip just
+ahead of each phrase and recover after it, at any read position.
+"""
+
+import hashlib
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import audio_format
+
+
+DEFAULT_ANALYSIS_CACHE_DIR = os.path.join("output", ".loudness_cache")
+
+SUB_BLOCK_SECONDS = 0.1         # gating blocks are 4 sub-blocks (400 ms) with 75% overlap
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+TRUE_PEAK_OVERSAMPLING = 4
+TRUE_PEAK_ZERO_CROSSINGS = 8
+TRUE_PEAK_BLOCK_FRAMES = 2**15  # oversampled in pieces to bound the working set
+SPEECH_ACTIVITY_LU = -20.0      # sub-blocks within this of the voice loudness count as speech
+ANALYSIS_CHUNK_SECONDS = 10.0
+ANALYSIS_VERSION = 2            # cached analyses of other versions are measured again
+BIQUAD_BLOCK_FRAMES = 4096      # biquads filter blocks of this many frames (FFTs of twice that)
+K_WEIGHTING_SETTLE_SECONDS = 0.25  # the filters' memory of earlier input is below float precision after this
+
+# voice_lufs: integrated loudness of the voice track; true_peak_db: ceiling for
+# the voice peaks; duck_db: background level change under speech (0 disables);
+# attack/release: seconds the background takes to dip before and recover after speech
+LoudnessTarget = namedtuple('LoudnessTarget', ['voice_lufs', 'true_peak_db', 'duck_db', 'attack', 'release'])
+LoudnessTarget.__new__.__defaults__ = (-18.0, -1.0, -6.0, 0.3, 0.8)
+
+# block_powers: K-weighted mean square of each 100 ms sub-block, summed over
+# channels; true_peak: linear; frames: length analyzed
+Analysis = namedtuple('Analysis', ['block_powers', 'true_peak', 'frames'])
+
+LoudnessReport = namedtuple('LoudnessReport', ['integrated_lufs', 'true_peak_db'])
+
+
+def to_db(value):
+    return 20 * math.log10(value) if value > 0 else float('-inf')
+
+
+def _biquad_power(b, a, frequencies, sample_rate):
+    """|H|^2 of a biquad at the given frequencies"""
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    return np.abs(np.polyval(b[::-1], z)) ** 2 / np.abs(np.polyval(a[::-1], z)) ** 2
+
+
+def k_weighting_filters(sample_rate):
+    """(b, a) of the BS.1770 K-weighting stages at sample_rate: the pre-filter (high shelf), then the RLB high pass
+
+    BS.1770 publishes the coefficients for 48 kHz; they are the bilinear
+    transform of these analog prototypes, which gives the same filters at
+    any other rate.
+    """
+    # Pre-filter: +4 dB shelf above ~1.7 kHz (head effects)
+    k = math.tan(math.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    high = 10 ** (3.999843853973347 / 20)
+    band = high ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (np.array([high + band * k / q + k * k, 2 * (k * k - high), high - band * k / q + k * k]) / a0,
+             np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+    # RLB weighting: high pass at ~38 Hz
+    k = math.tan(math.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = (np.array([1.0, -2.0, 1.0]), np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+    return [shelf, high_pass]
+
+
+def k_weighting_power(frequencies, sample_rate):
+    """Power response of the BS.1770 K-weighting at any sample rate"""
+    power = np.ones(len(frequencies))
+    for b, a in k_weighting_filters(sample_rate):
+        power = power * _biquad_power(b, a, frequencies, sample_rate)
+    return power
+
+
+class Biquad:
+    """A biquad filtering a signal fed chunk by chunk, its state carried from chunk to chunk
+
+    Blocks of up to block_frames are filtered exactly without a per-sample
+    loop: the numerator is a 3-tap FIR, and the recursion is that FIR's
+    output convolved (by FFT) with the impulse response of 1 / A(z), which
+    within a block needs only as many taps as the block is long, plus the
+    decay of the two outputs before the block.
+    """
+
+    def __init__(self, b, a, channels, block_frames=BIQUAD_BLOCK_FRAMES):
+        b, a = np.asarray(b, dtype=np.float64), np.asarray(a, dtype=np.float64)
+        self.b = b / a[0]
+        self.a1, self.a2 = a[1] / a[0], a[2] / a[0]
+        self.block_frames = block_frames
+        # Impulse response of 1 / A(z), after a leading zero so response[n + 1] is tap n
+        self.response = np.zeros(block_frames + 1)
+        self.response[1] = 1.0
+        for n in range(2, block_frames + 1):
+            self.response[n] = -self.a1 * self.response[n - 1] - self.a2 * self.response[n - 2]
+        self.spectrum = np.fft.rfft(self.response[1:], 2 * block_frames)[:, None]
+        self.inputs = np.zeros((2, channels))   # the last two input frames
+        self.outputs = np.zeros((2, channels))  # the last two output frames
+
+    def process(self, samples):
+        """The next len(samples) frames of the filtered signal (float64)"""
+        samples = np.asarray(samples, dtype=np.float64)
+        filtered = np.empty_like(samples)
+        size = 2 * self.block_frames
+        for start in range(0, len(samples), self.block_frames):
+            frames = samples[start:start + self.block_frames]
+            count = len(frames)
+            padded = np.concatenate([self.inputs, frames])
+            fir = self.b[0] * padded[2:] + self.b[1] * padded[1:-1] + self.b[2] * padded[:-2]
+            block = np.fft.irfft(np.fft.rfft(fir, size, axis=0) * self.spectrum, size, axis=0)[:count]
+            # The previous outputs y[-2], y[-1] continue as -(a1 y[-1] + a2 y[-2]) h[n] - a2 y[-1] h[n - 1]
+            before, last = self.outputs
+            block += np.outer(self.response[1:count + 1], -(self.a1 * last + self.a2 * before))
+            block += np.outer(self.response[:count], -self.a2 * last)
+            self.inputs = padded[-2:]
+            self.outputs = np.concatenate([self.outputs, block])[-2:]
+            filtered[start:start + count] = block
+        return filtered
+
+
+def integrated_loudness(block_powers):
+    """Gated integrated loudness (LUFS) from 100 ms sub-block powers"""
+    block_powers = np.asarray(block_powers, dtype=np.float64)
+    if len(block_powers) < 4:
+        return float('-inf')
+    blocks = np.convolve(block_powers, np.full(4, 0.25), mode='valid')
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > ABSOLUTE_GATE_LUFS]
+    if len(gated) == 0:
+        return float('-inf')
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = blocks[(loudness > ABSOLUTE_GATE_LUFS) & (loudness > relative_gate)]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+class TruePeakMeter:
+    """Peak of the signal oversampled 4x, fed chunk by chunk
+
+    Oversampled frames are computed as soon as the input they need has
+    arrived, so the meter lags the input by a few frames and finish()
+    completes it with the silence after the end. To meter one range of a
+    longer signal exactly, pass the history_frames before it as history and
+    the following_frames after it to finish().
+    """
+
+    def __init__(self, sample_rate, channels, history=None):
+        self.resampler = audio_format.Resampler(sample_rate, sample_rate * TRUE_PEAK_OVERSAMPLING,
+                                                TRUE_PEAK_ZERO_CROSSINGS)
+        offset = self.resampler.offset
+        self.history_frames = offset
+        self.following_frames = self.resampler.taps
+        if history is None:
+            history = np.zeros((offset, channels), dtype=np.float32)  # silence before the start
+        self.buffer = audio_format.as_float(history)
+        self.buffer_start = -offset
+        self.frames = 0
+        self.done = 0
+        self.peak = 0.0
+
+    def _measure(self, ready):
+        resampler = self.resampler
+        while self.done < ready:
+            count = min(ready - self.done, TRUE_PEAK_BLOCK_FRAMES)
+            first, _ = resampler.input_span(self.done, count)
+            window = self.buffer[first - self.buffer_start:]
+            self.peak = max(self.peak, float(np.abs(resampler.process(window, first, self.done, count)).max()))
+            self.done += count
+        first, _ = resampler.input_span(self.done, 1)
+        self.buffer = self.buffer[first - self.buffer_start:]
+        self.buffer_start = first
+
+    def add(self, samples):
+        if len(samples) == 0:
+            return
+        self.peak = max(self.peak, float(np.abs(samples).max()))
+        self.buffer = np.concatenate([self.buffer, audio_format.as_float(samples)])
+        self.frames += len(samples)
+        # Output n needs input up to n // up - offset + taps - 1
+        available = self.buffer_start + len(self.buffer)
+        resampler = self.resampler
+        self._measure(resampler.up * (available - resampler.taps + resampler.offset + 1))
+
+    def finish(self, following=None):
+        """Measure the last frames (against silence after the end) and return the linear peak"""
+        if following is None:
+            following = np.zeros((self.following_frames, self.buffer.shape[1]), dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, audio_format.as_float(following)])
+        self._measure(self.resampler.output_frames(self.frames))
+        return self.peak
+
+
+class LoudnessMeter:
+    """Integrated loudness and true peak of a signal fed chunk by chunk"""
+
+    def __init__(self, sample_rate, channels):
+        self.sub_frames = int(round(SUB_BLOCK_SECONDS * sample_rate))
+        self.filters = [Biquad(b, a, channels) for b, a in k_weighting_filters(sample_rate)]
+        self.settle_frames = int(round(K_WEIGHTING_SETTLE_SECONDS * sample_rate))
+        self.pending = np.zeros(0)  # K-weighted power of the frames of an unfinished sub-block
+        self.block_powers = []
+        self.true_peak = TruePeakMeter(sample_rate, channels)
+        self.frames = 0
+
+    @classmethod
+    def for_range(cls, source, first, sample_rate, channels, start=0):
+        """Meter for the frames of source from first on, in a signal that begins at start
+
+        Finish with range_result(); the results of adjacent ranges combine()
+        to the measurement of the whole signal.
+        """
+        meter = cls(sample_rate, channels)
+        frames = max(meter.true_peak.history_frames, meter.settle_frames)
+        history = source.read(first - frames, frames)
+        history[:max(0, start - (first - frames))] = 0.0
+        meter._weight(history[frames - meter.settle_frames:])  # bring the filters to their state at first
+        meter.true_peak = TruePeakMeter(sample_rate, channels, history[frames - meter.true_peak.history_frames:])
+        return meter
+
+    def _weight(self, samples):
+        for biquad in self.filters:
+            samples = biquad.process(samples)
+        return samples
+
+    def add(self, samples):
+        samples = audio_format.as_float(samples)
+        self.true_peak.add(samples)
+        self.frames += len(samples)
+        weighted = self._weight(samples)
+        power = np.concatenate([self.pending, np.einsum('fc,fc->f', weighted, weighted)])
+        whole = len(power) // self.sub_frames
+        if whole:
+            self.block_powers.append(power[:whole * self.sub_frames].reshape(whole, self.sub_frames).mean(axis=1))
+        self.pending = power[whole * self.sub_frames:]
+
+    def result(self, following=None):
+        """Analysis of everything added; a trailing partial sub-block is not gated, as in BS.1770"""
+        powers = np.concatenate(self.block_powers) if self.block_powers else np.zeros(0)
+        return Analysis(powers, self.true_peak.finish(following), self.frames)
+
+    def range_result(self, source, stop, end=None):
+        """Analysis of a range metered with for_range() that ends at stop, in a signal that ends at end"""
+        following = source.read(stop, self.true_peak.following_frames)
+        if end is not None:
+            following[max(0, end - stop):] = 0.0
+        return self.result(following)
+
+
+def combine(analyses):
+    """Analysis of consecutive ranges metered separately, each but the last a whole number of sub-blocks"""
+    analyses = list(analyses)
+    powers = np.concatenate([analysis.block_powers for analysis in analyses] or [np.zeros(0)])
+    return Analysis(powers, max([analysis.true_peak for analysis in analyses] or [0.0]),
+                    sum(analysis.frames for analysis in analyses))
+
+
+def report(analysis):
+    """LoudnessReport of an Analysis"""
+    return LoudnessReport(integrated_loudness(analysis.block_powers), to_db(analysis.true_peak))
+
+
+def analyze_source(source, sample_rate, channels):
+    """Analysis of a whole audio source, read in bounded chunks"""
+    meter = LoudnessMeter(sample_rate, channels)
+    chunk = int(ANALYSIS_CHUNK_SECONDS * sample_rate)
+    for start in range(0, source.frames, chunk):
+        meter.add(source.read(start, min(chunk, source.frames - start)))
+    return meter.result()
+
+
+def source_key(source, fmt):
+    """Cache key for a source's content, or None if it cannot be identified cheaply"""
+    if hasattr(source, 'samples'):
+        digest = hashlib.sha256(np.ascontiguousarray(source.samples).tobytes()).hexdigest()
+        return repr(('samples', digest, tuple(fmt)))
+    if hasattr(source, 'filename'):
+        stat = os.stat(source.filename)
+        return repr(('file', os.path.abspath(source.filename), stat.st_size, stat.st_mtime_ns, tuple(fmt)))
+    return None
+
+
+class AnalysisCache:
+    """Analyses of segments and tracks by content, in memory and on disk (<digest>.npz)"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_ANALYSIS_CACHE_DIR
+        self._memory = {}
+
+    def _file(self, key):
+        digest = hashlib.sha256(f"{ANALYSIS_VERSION}:{key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.npz')
+
+    def analyze(self, source, fmt, key=None):
+        """Analysis of a source, measured once per content"""
+        key = key or source_key(source, fmt)
+        if key is None:
+            return analyze_source(source, fmt.sample_rate, fmt.channels)
+        if key in self._memory:
+            return self._memory[key]
+        filename = self._file(key)
+        try:
+            with np.load(filename) as data:
+                analysis = Analysis(data['block_powers'], float(data['true_peak']), int(data['frames']))
+        except (OSError, ValueError, KeyError):
+            analysis = analyze_source(source, fmt.sample_rate, fmt.channels)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temp_file = f"{filename}.tmp{os.getpid()}.npz"
+            np.savez(temp_file, block_powers=analysis.block_powers, true_peak=analysis.true_peak,
+                     frames=analysis.frames)
+            os.replace(temp_file, filename)
+        self._memory[key] = analysis
+        return analysis
+
+
+def speech_intervals(clips, analyses, voice_lufs, sample_rate):
+    """Merged (starts, ends) frame arrays where the voice clips are speaking"""
+    sub_frames = int(round(SUB_BLOCK_SECONDS * sample_rate))
+    threshold = 10 ** ((voice_lufs + SPEECH_ACTIVITY_LU + 0.691) / 10)
+    starts, ends = [], []
+    for (clip_start, source), analysis in zip(clips, analyses):
+        active = np.flatnonzero(analysis.block_powers > threshold)
+        if len(active) == 0:
+            continue
+        # Runs of consecutive active sub-blocks
+        breaks = np.flatnonzero(np.diff(active) > 1)
+        for first, last in zip(np.r_[active[0], active[breaks + 1]], np.r_[active[breaks], active[-1]]):
+            start = clip_start + int(first) * sub_frames
+            end = min(clip_start + (int(last) + 1) * sub_frames, clip_start + source.frames)
+            if starts and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def normalization_gains(voice_analyses, music_analysis, target, music_gain_db):
+    """(voice LUFS, voice gain, music gain) for a LoudnessTarget
+
+    The voice is brought to target.voice_lufs (or to its true-peak ceiling)
+    and the music placed music_gain_db below it. A silent voice keeps gain
+    1.0; the music gain is None, keeping the plain music_gain_db, when there
+    is no music analysis or the music is silent.
+    """
+    voice_lufs = integrated_loudness(np.concatenate(
+        [analysis.block_powers for analysis in voice_analyses] or [np.zeros(0)]))
+    if math.isinf(voice_lufs):
+        return voice_lufs, 1.0, None
+    voice_peak = max(analysis.true_peak for analysis in voice_analyses)
+    voice_db = min(target.voice_lufs - voice_lufs, target.true_peak_db - to_db(voice_peak))
+    print(f"📏 Voice {voice_lufs:.1f} LUFS -> {voice_lufs + voice_db:.1f} LUFS ({voice_db:+.1f} dB)")
+
+    music_gain = None
+    if music_analysis is not None:
+        music_lufs = integrated_loudness(music_analysis.block_powers)
+        if not math.isinf(music_lufs):
+            music_db = voice_lufs + voice_db + music_gain_db - music_lufs
+            music_gain = 10 ** (music_db / 20.0)
+            print(f"📏 Music {music_lufs:.1f} LUFS -> {music_lufs + music_db:.1f} LUFS ({music_db:+.1f} dB)")
+    return voice_lufs, 10 ** (voice_db / 20.0), music_gain
+
+
+def duck_under_speech(background, clips, analyses, voice_lufs, target, sample_rate):
+    """background ducked where the (start, source) clips speak, or background itself if target does not duck"""
+    if background is None or not target.duck_db or math.isinf(voice_lufs):
+        return background
+    starts, ends = speech_intervals(clips, analyses, voice_lufs, sample_rate)
+    return DuckingSource(background, starts, ends, 10 ** (target.duck_db / 20.0),
+                         target.attack * sample_rate, target.release * sample_rate)
+
+
+class DuckingSource:
+    """A background lowered by duck_gain wherever speech is, with lookahead attack and a release
+
+    The gain ramps down linearly over the attack frames before each speech
+    interval and back up over the release frames after it; reads find the
+    intervals they touch by binary search, so any position reads alike.
+    """
+
+    def __init__(self, source, starts, ends, duck_gain, attack, release):
+        self.source = source
+        self.frames = getattr(source, 'frames', None)  # looped music has no end
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.duck_gain = float(duck_gain)
+        self.attack = max(1, int(attack))
+        self.release = max(1, int(release))
+
+    def read(self, start, count):
+        samples = self.source.read(start, count)
+        stop = start + count
+        begin = int(np.searchsorted(self.ends + self.release, start, side='right'))
+        end = int(np.searchsorted(self.starts - self.attack, stop, side='left'))
+        if begin >= end:
+            return samples
+        depth = np.zeros(count)
+        for index in range(begin, end):
+            first = max(start, int(self.starts[index]) - self.attack)
+            last = min(stop, int(self.ends[index]) + self.release)
+            positions = np.arange(first, last, dtype=np.float64)
+            down = (positions - (self.starts[index] - self.attack)) / self.attack
+            up = ((self.ends[index] + self.release) - positions) / self.release
+            ramp = np.clip(np.minimum(down, up), 0.0, 1.0)
+            depth[first - start:last - start] = np.maximum(depth[first - start:last - start], ramp)
+        gain = 1.0 - (1.0 - self.duck_gain) * depth
+        return samples * gain.astype(np.float32)[:, None]
@@ -16,8 +16,40 @@ from pathlib import Path
 import tempfile
 import wave
 
+import audio_format
+import metrics
+import speech
+import mixer
+from meditation_script import parse_meditation_text, estimate_meditation_duration
+from fanout import FanOutRenderer
+from chunked_render import BoundedRenderer
+from sharded_render import ShardedRenderer
+from audio_probe import probe_audio, probe_duration
+from music_library import MusicLibrary
+from checkpoint import RenderCheckpoint, SCRATCH_DIR
+from draft import render_draft
+from player import Player, PygameSink
+from render_cache import RenderCache, RetentionPolicy, render_fingerprint
+from soundscape import is_soundscape, load_soundscape
+from loudness import LoudnessTarget
+from encoder_tee import DEFAULT_EXPORTS, export_paths
+from prewarm import AUDITION_TEXT, AuditionClips
+
 
 class MeditationGenerator:
+    # Sessions estimated longer than this are rendered in bounded-memory chunks, one shard per core
+    LONG_SESSION_SECONDS = 20 * 60
+    MEMORY_BUDGET_BYTES = 1024 * 2**20  # 1 GB
+    # Delivered next to the WAV master, encoded from the same mix in one pass
+    EXPORT_FORMATS = DEFAULT_EXPORTS
+    # In-memory synthesis is checkpointed after every batch of this many segments
+    CHECKPOINT_BATCH = 8
+    # False keeps in-memory speech off disk entirely: no segment WAVs, so a
+    # cancelled render resumes from the speech cache instead of the checkpoint
+    CHECKPOINT_IN_MEMORY_SEGMENTS = True
+    # Finished renders kept for identical requests
+    RENDER_CACHE_RETENTION = RetentionPolicy(max_entries=50, max_age_seconds=14 * 24 * 3600, max_bytes=5 * 2**30)
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Guided Meditation Generator")
@@ -35,8 +67,9 @@ class MeditationGenerator:
             self.tts_engine = None
             self.tts_working = False
         
-        # Initialize pygame mixer for audio
-        pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
+        # Initialize pygame mixer for audio in the canonical render format
+        fmt = audio_format.render_format()
+        pygame.mixer.init(frequency=fmt.sample_rate, size=-16, channels=fmt.channels, buffer=512)
         
         # Variables
         self.background_music_file = tk.StringVar()
@@ -45,6 +78,8 @@ class MeditationGenerator:
         self.is_paused = False
         self.background_music = None
         self.generated_audio_files = []
+        self.player = None
+        self.auditions = AuditionClips(fmt)
         
         self.setup_ui()
         self.create_background_music_folder()
@@ -142,15 +177,7 @@ class MeditationGenerator:
         
         if selected_engine == "gtts":
             # Google TTS options - 7 different accents
-            voice_options = [
-                "🌸 English (US Female, Slow) - BEST for Meditation",
-                "🗣️ English (US Standard Speed)",
-                "🇬🇧 British English (Slow) - Elegant",
-                "🇦🇺 Australian English (Slow) - Warm",
-                "🇮🇳 Indian English (Slow) - Clear",
-                "🇨🇦 Canadian English (Slow) - Neutral",
-                "🇿🇦 South African English (Slow) - Distinctive"
-            ]
+            voice_options = list(speech.GTTS_VOICES)
             self.voice_combo['values'] = voice_options
             self.voice_combo.current(0)  # Default to best for meditation
             
@@ -201,74 +228,30 @@ class MeditationGenerator:
         else:
             self.test_local_voice()
     
+    def prerender_auditions(self):
+        """Render the test clip of every listed voice in the background, so voice tests play at once"""
+        rate, volume = self.rate_var.get(), self.volume_var.get()
+        voices = [speech.VoiceSettings("gtts", label, rate, volume, None) for label in speech.GTTS_VOICES]
+        if self.tts_working and self.tts_engine:
+            voices += [speech.VoiceSettings("pyttsx3", voice.name, rate, volume, voice.id)
+                       for voice in self.tts_engine.getProperty('voices')]
+        self.auditions.start(voices)
+    
+    def play_audition(self, samples):
+        """Play a test clip on the mixer without waiting for it"""
+        pygame.mixer.Sound(buffer=audio_format.float_to_pcm16(samples)).play()
+    
     def test_google_voice(self):
         """Test Google TTS voice"""
         try:
-            from gtts import gTTS
-            import tempfile
-            import os
-            
-            selected_voice = self.voice_var.get()
-            test_text = "Welcome to this guided meditation. Take a deep breath and feel yourself relaxing."
-            
-            print(f"🎤 Testing Google TTS voice: {selected_voice}")
-            
-            # Determine settings based on voice selection
-            if "British" in selected_voice:
-                lang = 'en'
-                tld = 'co.uk'
-            elif "Australian" in selected_voice:
-                lang = 'en'
-                tld = 'com.au'
-            elif "Indian" in selected_voice:
-                lang = 'en'
-                tld = 'co.in'
-            elif "Canadian" in selected_voice:
-                lang = 'en'
-                tld = 'ca'
-            elif "South African" in selected_voice:
-                lang = 'en'
-                tld = 'co.za'
-            else:
-                lang = 'en'
-                tld = 'com'
-            
-            slow = "Slow" in selected_voice or "Female" in selected_voice
-            
-            print(f"🌐 Google TTS settings: lang={lang}, tld={tld}, slow={slow}")
-            
-            # Create TTS
-            tts = gTTS(text=test_text, lang=lang, slow=slow, tld=tld)
-            
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_filename = temp_file.name
-            
-            tts.save(temp_filename)
-            
-            # Try to play the file
-            try:
-                import pygame
-                pygame.mixer.init()
-                pygame.mixer.music.load(temp_filename)
-                pygame.mixer.music.play()
-                
-                # Wait for playback to finish
-                while pygame.mixer.music.get_busy():
-                    pygame.time.wait(100)
-                
-                pygame.mixer.quit()
-                
-            except Exception as play_error:
-                print(f"⚠️ Could not play audio: {play_error}")
-                print(f"✅ Audio file created: {temp_filename}")
-                print("🎧 You can play this file manually to hear the voice")
-            
-            # Clean up
-            try:
-                os.unlink(temp_filename)
-            except:
-                pass
+            settings = self.current_voice_settings()
+            print(f"🎤 Testing Google TTS voice: {settings.voice}")
+            
+            samples = self.auditions.get(settings)
+            if samples is None:
+                # Not prerendered (yet): fetch it now, which also caches it for the next test
+                samples = speech.texts_to_speech_samples([AUDITION_TEXT], settings)[0]
+            self.play_audition(samples)
                 
         except Exception as e:
             messagebox.showerror("Google TTS Test Error", f"Error testing Google TTS voice: {str(e)}")
@@ -286,17 +269,20 @@ class MeditationGenerator:
             if 0 <= selected_index < len(voices):
                 selected_voice = voices[selected_index]
                 
+                print(f"🎤 Testing local voice: {selected_voice.name}")
+                print(f"   Rate: {self.rate_var.get()} WPM, Volume: {self.volume_var.get():.1f}")
+                
+                samples = self.auditions.get(self.current_voice_settings())
+                if samples is not None:
+                    self.play_audition(samples)
+                    return
+                
                 # Apply current settings
                 self.tts_engine.setProperty('voice', selected_voice.id)
                 self.tts_engine.setProperty('rate', self.rate_var.get())
                 self.tts_engine.setProperty('volume', self.volume_var.get())
                 
-                test_text = "Welcome to this guided meditation. Take a deep breath and feel yourself relaxing."
-                
-                print(f"🎤 Testing local voice: {selected_voice.name}")
-                print(f"   Rate: {self.rate_var.get()} WPM, Volume: {self.volume_var.get():.1f}")
-                
-                self.tts_engine.say(test_text)
+                self.tts_engine.say(AUDITION_TEXT)
                 self.tts_engine.runAndWait()
                 
             else:
@@ -587,6 +573,19 @@ Your meditation is complete.
             self.volume_display.config(text=f"{val}%")
         volume_scale.configure(command=update_volume_display)
         
+        # In-memory pipeline: speech goes from the TTS engine to the mixer without segment files
+        self.in_memory_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(voice_frame, text="Keep speech in memory (no segment files in output/)",
+                        variable=self.in_memory_var).pack(anchor='w', pady=(10, 0))
+        
+        # Google TTS request coalescing: short phrases share one request (in-memory pipeline only)
+        self.coalesce_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(voice_frame, text="Batch short phrases into fewer Google TTS requests",
+                        variable=self.coalesce_var).pack(anchor='w')
+        self.normalize_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(voice_frame, text="Normalize loudness and lower the music under speech",
+                        variable=self.normalize_var).pack(anchor='w')
+        
         # Control buttons
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill='x', pady=(0, 10))
@@ -594,9 +593,24 @@ Your meditation is complete.
         self.generate_btn = ttk.Button(button_frame, text="Create Meditation File", command=self.generate_meditation, style='Custom.TButton')
         self.generate_btn.pack(side='left', padx=(0, 10))
         
+        # Fast low-fidelity preview for iterating on the script
+        self.draft_btn = ttk.Button(button_frame, text="Quick Draft", command=self.generate_draft, style='Custom.TButton')
+        self.draft_btn.pack(side='left', padx=(0, 10))
+        
         self.stop_btn = ttk.Button(button_frame, text="Cancel", command=self.stop_meditation, style='Custom.TButton', state='disabled')
         self.stop_btn.pack(side='left', padx=(0, 10))
         
+        # In-app player: streams the session from its segments, no exported file needed
+        self.play_btn = ttk.Button(button_frame, text="▶ Play", command=self.toggle_playback, style='Custom.TButton')
+        self.play_btn.pack(side='left', padx=(0, 10))
+        
+        self.seek_var = tk.DoubleVar(value=0.0)
+        self.seeking = False
+        self.seek_scale = ttk.Scale(main_frame, from_=0.0, to=1.0, variable=self.seek_var, orient='horizontal')
+        self.seek_scale.pack(fill='x', pady=(10, 0))
+        self.seek_scale.bind('<ButtonPress-1>', lambda event: setattr(self, 'seeking', True))
+        self.seek_scale.bind('<ButtonRelease-1>', self.on_seek)
+        
         # Progress bar
         self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
         self.progress.pack(fill='x', pady=(10, 0))
@@ -609,6 +623,7 @@ Your meditation is complete.
         """Browse for background music file"""
         file_types = [
             ("Audio files", "*.mp3 *.wav *.ogg *.m4a"),
+            ("Soundscapes", "*.json"),
             ("MP3 files", "*.mp3"),
             ("WAV files", "*.wav"),
             ("All files", "*.*")
@@ -622,70 +637,61 @@ Your meditation is complete.
         
         if filename:
             self.background_music_file.set(filename)
+            
+            if is_soundscape(filename):
+                try:
+                    layers = load_soundscape(filename)
+                    self.status_label.config(text=f"🌧️ {Path(filename).name}: soundscape of {len(layers)} layers")
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ Could not read soundscape: {e}")
+                    self.status_label.config(text=f"⚠️ {Path(filename).name} is not a valid soundscape")
+                return
+
+            # Validate the selection from its headers without decoding it
+            try:
+                info = probe_audio(filename)
+                channel_name = "stereo" if info.channels == 2 else f"{info.channels}ch"
+                self.status_label.config(
+                    text=f"🎼 {Path(filename).name}: {int(info.duration // 60)}:{int(info.duration % 60):02d}, "
+                         f"{info.sample_rate / 1000:g} kHz {channel_name}"
+                )
+            except Exception as e:
+                print(f"⚠️ Could not read music header: {e}")
+                self.status_label.config(text=f"🎼 {Path(filename).name} selected (length unknown)")
     
     def parse_meditation_text(self, text):
         """Parse meditation text and extract pauses"""
-        segments = []
-        current_pos = 0
-        
-        # Find all pause markers (case-insensitive, flexible spacing)
-        pause_pattern = r'\[pause\s*:\s*(\d+)\s*\]'
-        matches = list(re.finditer(pause_pattern, text, re.IGNORECASE))
-        
-        for match in matches:
-            # Add text before pause
-            if match.start() > current_pos:
-                text_segment = text[current_pos:match.start()].strip()
-                if text_segment:
-                    segments.append(('text', text_segment))
-            
-            # Add pause
-            pause_duration = int(match.group(1))
-            segments.append(('pause', pause_duration))
-            current_pos = match.end()
-        
-        # Add remaining text
-        if current_pos < len(text):
-            remaining_text = text[current_pos:].strip()
-            if remaining_text:
-                segments.append(('text', remaining_text))
-        
-        return segments
+        return parse_meditation_text(text)
     
     def estimate_meditation_duration(self, segments):
         """Estimate total duration of meditation in seconds"""
-        total_duration = 0
-        speech_rate = self.rate_var.get()  # words per minute
-        
-        for segment_type, content in segments:
-            if segment_type == 'text':
-                # Estimate speech duration based on word count and speech rate
-                word_count = len(content.split())
-                speech_duration = (word_count / speech_rate) * 60  # convert to seconds
-                total_duration += speech_duration
-            elif segment_type == 'pause':
-                total_duration += content
-        
-        return total_duration
+        return estimate_meditation_duration(segments, self.rate_var.get())
     
     def get_audio_duration(self, audio_file):
-        """Get duration of audio file in seconds"""
-        try:
-            # Load the audio file to get its length
-            sound = pygame.mixer.Sound(audio_file)
-            duration = sound.get_length()
+        """Get duration of audio file in seconds (None if it cannot be read)"""
+        # Header-only probe: instant even for multi-hour files
+        duration = probe_duration(audio_file)
+        if duration is not None:
             return duration
-        except:
-            # If we can't get duration, return a default that will trigger looping
-            return 60  # 1 minute default
+        
+        # Unknown container (e.g. m4a): fall back to a full decode
+        try:
+            samples, sample_rate = audio_format.decode_file(audio_file)
+            return len(samples) / float(sample_rate)
+        except Exception as e:
+            print(f"⚠️ Could not read duration of {audio_file}: {e}")
+            return None
     
     def manage_background_music(self, meditation_duration):
         """Display information about background music (no longer used for playback)"""
-        if not self.background_music_file.get():
+        if not self.background_music_file.get() or is_soundscape(self.background_music_file.get()):
             return
         
         try:
             music_duration = self.get_audio_duration(self.background_music_file.get())
+            if music_duration is None:
+                print("⚠️ Background music length unknown - it will be checked when mixing")
+                return
             
             # Just display information, no actual playback
             minutes = int(meditation_duration // 60)
@@ -693,257 +699,53 @@ Your meditation is complete.
             music_mins = int(music_duration // 60)
             music_secs = int(music_duration % 60)
             
-            if music_duration < meditation_duration:
-                print(f"🔄 Background music will loop (Meditation: {minutes}:{seconds:02d}, Music: {music_mins}:{music_secs:02d})")
+            loops_needed = mixer.plan_loops(music_duration, meditation_duration)
+            if loops_needed > 1:
+                print(f"🔄 Background music will loop {loops_needed} times (Meditation: {minutes}:{seconds:02d}, Music: {music_mins}:{music_secs:02d})")
             else:
                 print(f"🎼 Background music covers full meditation (Meditation: {minutes}:{seconds:02d}, Music: {music_mins}:{music_secs:02d})")
                 
         except Exception as e:
             print(f"Warning: Could not analyze background music: {e}")
     
+    def current_voice_settings(self):
+        """Snapshot the engine, voice and slider settings from the UI"""
+        return speech.VoiceSettings(
+            engine=self.get_selected_engine(),
+            voice=self.voice_var.get(),
+            rate=self.rate_var.get(),
+            volume=self.volume_var.get(),
+            voice_id=self.get_selected_voice_id()
+        )
+    
     def text_to_speech_file(self, text, filename):
         """Convert text to speech and save as file with selected engine"""
-        print(f"🎤 Starting TTS for: {text[:50]}...")
-        
-        selected_engine = self.get_selected_engine()
-        
-        if selected_engine == "gtts":
-            return self.create_speech_gtts(text, filename)
-        else:
-            return self.create_speech_pyttsx3(text, filename)
+        return speech.text_to_speech_file(text, filename, self.current_voice_settings())
     
     def create_speech_gtts(self, text, filename):
         """Create speech using Google TTS"""
-        try:
-            from gtts import gTTS
-            import os
-            
-            # Get voice settings from selection
-            selected_voice = self.voice_var.get()
-            
-            # Get rate and volume from sliders
-            rate_setting = self.rate_var.get()
-            volume_setting = self.volume_var.get()
-            
-            print(f"🎛️ TTS Settings from sliders: Rate={rate_setting} WPM, Volume={volume_setting:.1f}")
-            
-            # Determine language and slow setting based on voice selection
-            if "British" in selected_voice:
-                lang = 'en'
-                tld = 'co.uk'
-            elif "Australian" in selected_voice:
-                lang = 'en'
-                tld = 'com.au'
-            elif "Indian" in selected_voice:
-                lang = 'en'
-                tld = 'co.in'
-            elif "Canadian" in selected_voice:
-                lang = 'en'
-                tld = 'ca'
-            elif "South African" in selected_voice:
-                lang = 'en'
-                tld = 'co.za'
-            else:
-                lang = 'en'
-                tld = 'com'  # Default to US English
-            
-            # Determine slow setting based on both voice selection AND rate slider
-            # If rate is below 150 WPM, use slow speech
-            slow = ("Slow" in selected_voice or "Female" in selected_voice) or (rate_setting < 150)
-            
-            print(f"🌐 Using Google TTS: lang={lang}, tld={tld}, slow={slow} (based on rate={rate_setting})")
-            
-            # Create TTS
-            tts = gTTS(text=text, lang=lang, slow=slow, tld=tld)
-            
-            # Save as MP3 first, then convert to WAV if needed
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_mp3 = temp_file.name
-            
-            tts.save(temp_mp3)
-            
-            # Convert MP3 to WAV and adjust volume using pydub if available
-            try:
-                from pydub import AudioSegment
-                audio = AudioSegment.from_mp3(temp_mp3)
-                
-                # Adjust speed based on rate slider setting
-                # Convert rate (80-200 WPM) to speed multiplier
-                # 120 WPM (default) = 1.0x speed, lower = slower, higher = faster
-                default_rate = 120  # Default meditation rate
-                if rate_setting != default_rate:
-                    # Calculate speed multiplier (0.5x to 1.8x)
-                    speed_multiplier = rate_setting / default_rate
-                    # Clamp to reasonable range
-                    speed_multiplier = max(0.5, min(speed_multiplier, 1.8))
-                    
-                    print(f"💪 Adjusting speech speed: {rate_setting} WPM -> {speed_multiplier:.2f}x speed")
-                    
-                    # Change speed by adjusting frame rate
-                    # Higher frame rate = faster playback
-                    original_frame_rate = audio.frame_rate
-                    new_frame_rate = int(original_frame_rate * speed_multiplier)
-                    audio = audio._spawn(audio.raw_data, overrides={'frame_rate': new_frame_rate})
-                    # Convert back to original sample rate to maintain pitch
-                    audio = audio.set_frame_rate(original_frame_rate)
-                    
-                    print(f"✅ Speed adjusted: {original_frame_rate}Hz -> {new_frame_rate}Hz -> {original_frame_rate}Hz")
-                
-                # Adjust volume based on slider setting
-                # Convert volume (0.1-1.0) to decibels
-                # 0.85 (default) = 0dB, lower values = negative dB, higher = positive dB
-                if volume_setting != 0.85:  # Only adjust if different from default
-                    volume_db = 20 * (volume_setting - 0.85) / 0.75  # Scale to reasonable dB range
-                    audio = audio + volume_db
-                    print(f"🔊 Volume adjusted by {volume_db:.1f}dB (slider: {volume_setting:.2f})")
-                
-                audio.export(filename, format="wav")
-                os.unlink(temp_mp3)  # Remove temporary MP3
-                print(f"✅ Google TTS created: {filename}")
-            except Exception as e:
-                # If pydub fails, just rename MP3 to WAV (will work for final mixing)
-                import shutil
-                shutil.move(temp_mp3, filename)
-                print(f"✅ Google TTS created: {filename} (as MP3, pydub failed: {e})")
-                print(f"⚠️ Speed and volume adjustments not applied due to pydub failure")
-            
-            return True
-            
-        except Exception as e:
-            print(f"❌ Google TTS failed: {e}")
-            print("🔄 Falling back to local TTS...")
-            return self.create_speech_pyttsx3(text, filename)
+        return speech.create_speech_gtts(text, filename, self.current_voice_settings())
     
     def create_speech_pyttsx3(self, text, filename):
         """Create speech using local pyttsx3 engine"""
-        rate_setting = self.rate_var.get()
-        volume_setting = self.volume_var.get()
-        
-        print(f"🎤 Using local TTS engine...")
-        print(f"🎛️ TTS Settings from sliders: Rate={rate_setting} WPM, Volume={volume_setting:.2f}")
-        
-        # Create a fresh TTS engine for each segment to avoid conflicts
-        try:
-            import pyttsx3
-            fresh_engine = pyttsx3.init()
-            fresh_engine.setProperty('rate', rate_setting)
-            fresh_engine.setProperty('volume', volume_setting)
-            
-            print(f"✅ Fresh TTS engine created with Rate={rate_setting}, Volume={volume_setting:.2f}")
-            
-        except Exception as e:
-            print(f"❌ Failed to create fresh TTS engine: {e}")
-            print("🔇 Creating silent audio as fallback")
-            self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
-            return
-            
-        # Use a simple subprocess approach for maximum reliability
-        try:
-            import subprocess
-            import sys
-            import os
-            
-            # Create a simple TTS script that runs in isolation
-            # Escape text properly for the script
-            escaped_text = text.replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-            # Convert Windows path to forward slashes (Python handles this fine)
-            normalized_filename = filename.replace('\\', '/')
-            
-            # Get selected voice ID
-            selected_voice_id = self.get_selected_voice_id()
-            voice_setup = ""
-            if selected_voice_id:
-                # Escape voice ID for script
-                escaped_voice_id = selected_voice_id.replace('\\', '\\\\').replace('"', '\\"')
-                voice_setup = f'    engine.setProperty("voice", "{escaped_voice_id}")'
-            
-            tts_script = f'''
-import pyttsx3
-import sys
-import os
-
-try:
-    engine = pyttsx3.init()
-{voice_setup}
-    engine.setProperty('rate', {rate_setting})
-    engine.setProperty('volume', {volume_setting})
-    print(f"TTS Script: Rate={{rate_setting}}, Volume={{volume_setting}}")
-    engine.save_to_file("""{escaped_text}""", "{normalized_filename}")
-    engine.runAndWait()
-    print("TTS_SUCCESS")
-except Exception as e:
-    print(f"TTS_ERROR: {{e}}")
-    sys.exit(1)
-'''
-            
-            # Write script to temporary file
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as script_file:
-                script_file.write(tts_script)
-                script_filename = script_file.name
-            
-            try:
-                # Run the TTS script with timeout
-                print(f"🚀 Running isolated TTS process...")
-                result = subprocess.run(
-                    [sys.executable, script_filename],
-                    capture_output=True,
-                    text=True,
-                    timeout=20  # 20 second timeout
-                )
-                
-                if result.returncode == 0 and "TTS_SUCCESS" in result.stdout:
-                    print("✅ TTS generation completed successfully")
-                    # Verify file was created
-                    if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                        print(f"✅ Audio file created: {os.path.getsize(filename)} bytes")
-                    else:
-                        print("❌ Audio file not created, using fallback")
-                        self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
-                else:
-                    print(f"❌ TTS process failed: {result.stderr}")
-                    self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
-                    
-            except subprocess.TimeoutExpired:
-                print("⏰ TTS process timeout - creating silent audio")
-                self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
-            except Exception as e:
-                print(f"❌ TTS subprocess error: {e}")
-                self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
-            finally:
-                # Clean up script file
-                try:
-                    os.unlink(script_filename)
-                except:
-                    pass
-                    
-        except Exception as e:
-            print(f"❌ TTS generation failed completely: {e}")
-            # Final fallback - create silent audio
-            self._create_silent_audio(filename, duration=len(text.split()) * 0.5)
+        return speech.create_speech_pyttsx3(text, filename, self.current_voice_settings())
     
     def _create_silent_audio(self, filename, duration=1.0):
         """Create a silent audio file as fallback"""
-        import wave
-        import struct
-        
-        sample_rate = 22050
-        frames = int(duration * sample_rate)
-        
-        with wave.open(filename, 'w') as wav_file:
-            wav_file.setnchannels(1)  # Mono
-            wav_file.setsampwidth(2)  # 2 bytes per sample
-            wav_file.setframerate(sample_rate)
-            
-            # Write silent frames
-            for _ in range(frames):
-                wav_file.writeframes(struct.pack('<h', 0))
+        speech.create_silent_audio(filename, duration)
     
+    def loudness_target(self):
+        """LoudnessTarget for final renders and playback, or None when normalization is off
+
+        The volume slider trims the normalized voice level.
+        """
+        if not self.normalize_var.get():
+            return None
+        return LoudnessTarget(voice_lufs=LoudnessTarget().voice_lufs + speech.volume_offset_db(self.volume_var.get()))
+
     def create_final_meditation_file(self, audio_segments, estimated_duration):
         """Create a final meditation file combining voice and background music"""
         try:
-            from pydub import AudioSegment
             import datetime
             
             print("🎵 Creating final meditation file with background music...")
@@ -956,22 +758,26 @@ except Exception as e:
             if not self.background_music_file.get():
                 print("❌ No background music selected")
                 return None
-                
-            print(f"🎼 Loading background music: {self.background_music_file.get()}")
             
-            # Try different methods to load background music
-            background = None
-            music_file = self.background_music_file.get()
+            loudness = self.loudness_target()
+            long_session = estimated_duration >= self.LONG_SESSION_SECONDS
+            if is_soundscape(self.background_music_file.get()):
+                # Layers are streamed from the decoded PCM cache whatever the session length
+                renderer = (ShardedRenderer if long_session else BoundedRenderer)(self.MEMORY_BUDGET_BYTES)
+                return renderer.render(audio_segments, self.background_music_file.get(), final_filename,
+                                       loudness=loudness, exports=self.EXPORT_FORMATS).filename
+
+            # Seamless loop points are cached in the library index for tracks in background_music/
+            loop_points = MusicLibrary("background_music").loop_points(self.background_music_file.get())
+
+            if long_session:
+                print(f"🧩 Long session ({estimated_duration / 60:.0f} min) - rendering in parallel shards")
+                return ShardedRenderer(self.MEMORY_BUDGET_BYTES).render(
+                    audio_segments, self.background_music_file.get(), final_filename, loop_points=loop_points,
+                    loudness=loudness, exports=self.EXPORT_FORMATS).filename
             
             try:
-                # First try: Direct loading (works for WAV without ffmpeg)
-                if music_file.lower().endswith('.wav'):
-                    background = AudioSegment.from_wav(music_file)
-                    print("✅ Loaded WAV background music successfully")
-                else:
-                    # For MP3/other formats, try with ffmpeg
-                    background = AudioSegment.from_file(music_file)
-                    print("✅ Loaded background music with ffmpeg")
+                background = mixer.load_background_music(self.background_music_file.get())
             except Exception as e:
                 print(f"❌ Failed to load background music: {e}")
                 print("[EMOJI] Try converting your background music to WAV format")
@@ -979,60 +785,12 @@ except Exception as e:
                 return self.create_voice_only_file(audio_segments, final_filename)
             
             # Create the voice track by combining all segments
-            print("🎤 Combining voice segments...")
-            voice_track = AudioSegment.empty()
-            
-            for segment_type, content in audio_segments:
-                if segment_type == 'audio':
-                    if os.path.exists(content):
-                        print(f"  Adding audio: {content}")
-                        audio_segment = AudioSegment.from_wav(content)
-                        voice_track += audio_segment
-                    else:
-                        print(f"  ⚠️ Missing audio file: {content}")
-                        # Add silence instead
-                        silence_duration = 2000  # 2 seconds
-                        voice_track += AudioSegment.silent(duration=silence_duration)
-                        
-                elif segment_type == 'pause':
-                    print(f"  Adding {content}s pause")
-                    pause_duration = int(content * 1000)  # Convert to milliseconds
-                    voice_track += AudioSegment.silent(duration=pause_duration)
-            
-            # Ensure background music is long enough
-            voice_duration = len(voice_track)
-            print(f"📊 Voice track duration: {voice_duration/1000:.1f}s")
-            print(f"📊 Background music duration: {len(background)/1000:.1f}s")
-            
-            if len(background) < voice_duration:
-                # Loop background music to cover the entire meditation
-                loops_needed = (voice_duration // len(background)) + 1
-                print(f"🔄 Looping background music {loops_needed} times")
-                background = background * loops_needed
-            
-            # Trim background to match voice duration exactly
-            background = background[:voice_duration]
-            
-            # Reduce background volume and mix with voice
-            background = background - 12  # Reduce volume by 12dB (about 25% volume)
-            
-            print("🎚️ Mixing voice and background music...")
-            # Overlay voice on background music
-            final_mix = background.overlay(voice_track)
+            voice_track = mixer.build_voice_track(audio_segments)
+            final_mix = mixer.mix_voice_with_background(voice_track, background, loop_points=loop_points,
+                                                        loudness=loudness)
             
             # Export final file
-            print(f"💾 Exporting final meditation: {final_filename}")
-            final_mix.export(final_filename, format="wav")
-            
-            file_size = os.path.getsize(final_filename)
-            duration_minutes = len(final_mix) / 60000
-            
-            print(f"✅ Final meditation created successfully!")
-            print(f"📁 File: {final_filename}")
-            print(f"📊 Size: {file_size:,} bytes")
-            print(f"⏱️ Duration: {duration_minutes:.1f} minutes")
-            
-            return final_filename
+            return mixer.export_mix(final_mix, final_filename, exports=self.EXPORT_FORMATS)
             
         except ImportError:
             print("❌ pydub library required for creating final meditation file")
@@ -1045,42 +803,14 @@ except Exception as e:
     def create_voice_only_file(self, audio_segments, filename):
         """Create a voice-only meditation file as fallback"""
         try:
-            from pydub import AudioSegment
-            
             print("🎤 Creating voice-only meditation file...")
             
             # Create the voice track by combining all segments
-            voice_track = AudioSegment.empty()
-            
-            for segment_type, content in audio_segments:
-                if segment_type == 'audio':
-                    if os.path.exists(content):
-                        print(f"  Adding audio: {content}")
-                        audio_segment = AudioSegment.from_wav(content)
-                        voice_track += audio_segment
-                    else:
-                        print(f"  ⚠️ Missing audio file: {content}")
-                        # Add silence instead
-                        silence_duration = 2000  # 2 seconds
-                        voice_track += AudioSegment.silent(duration=silence_duration)
-                        
-                elif segment_type == 'pause':
-                    print(f"  Adding {content}s pause")
-                    pause_duration = int(content * 1000)  # Convert to milliseconds
-                    voice_track += AudioSegment.silent(duration=pause_duration)
+            voice_track = mixer.build_voice_track(audio_segments)
             
             # Export voice-only file
             voice_filename = filename.replace("complete_meditation_", "voice_only_meditation_")
-            print(f"💾 Exporting voice-only meditation: {voice_filename}")
-            voice_track.export(voice_filename, format="wav")
-            
-            file_size = os.path.getsize(voice_filename)
-            duration_minutes = len(voice_track) / 60000
-            
-            print(f"✅ Voice-only meditation created successfully!")
-            print(f"📁 File: {voice_filename}")
-            print(f"📊 Size: {file_size:,} bytes")
-            print(f"⏱️ Duration: {duration_minutes:.1f} minutes")
+            mixer.export_mix(voice_track, voice_filename)
             print("[EMOJI] To add background music, convert your music file to WAV format or install ffmpeg")
             
             return voice_filename
@@ -1109,6 +839,34 @@ except Exception as e:
         # Clear the list since files are deleted
         self.generated_audio_files.clear()
     
+    def checkpoint_dir(self):
+        """Where renders checkpoint their segments: off the output volume when speech stays in memory"""
+        return Path(SCRATCH_DIR) if self.in_memory_var.get() else Path("output")
+    
+    def generate_draft(self):
+        """Render a fast low-fidelity preview of the script (see draft.py)"""
+        meditation_text = self.text_area.get('1.0', tk.END).strip()
+        if not meditation_text:
+            messagebox.showwarning("No Text", "Please enter meditation text.")
+            return
+        
+        music_file = self.background_music_file.get() or None
+        loop_points = None
+        if music_file and not is_soundscape(music_file):
+            loop_points = MusicLibrary("background_music").loop_points(music_file)
+        self.draft_btn.config(state='disabled')
+        self.status_label.config(text="Rendering draft...")
+        self.root.update()
+        try:
+            report = render_draft(meditation_text, self.current_voice_settings(), "output", music_file,
+                                  loop_points=loop_points)
+            self.status_label.config(text=f"Draft ready in {report.seconds:.1f}s: {os.path.basename(report.filename)}")
+        except Exception as e:
+            print(f"❌ Draft failed: {e}")
+            self.status_label.config(text=f"Draft failed: {e}")
+        finally:
+            self.draft_btn.config(state='normal')
+    
     def generate_meditation(self):
         """Generate and play the guided meditation"""
         if not self.background_music_file.get():
@@ -1120,6 +878,9 @@ except Exception as e:
             messagebox.showwarning("No Text", "Please enter meditation text.")
             return
         
+        # The render discards the checkpoint segments the player streams from
+        self.stop_playback()
+        
         # Disable generate button and enable cancel button
         self.generate_btn.config(state='disabled')
         self.stop_btn.config(state='normal')
@@ -1150,11 +911,28 @@ except Exception as e:
             output_dir.mkdir(exist_ok=True)
             print(f"📁 Output directory ready: {output_dir}")
             
+            # Identical requests are answered from the render cache without any synthesis
+            settings = self.current_voice_settings()
+            render_fmt = audio_format.render_format()
+            render_cache = RenderCache(retention=self.RENDER_CACHE_RETENTION)
+            fingerprint = render_fingerprint(meditation_text, settings, self.background_music_file.get(),
+                                             mixer.DEFAULT_MUSIC_GAIN_DB, render_fmt,
+                                             loudness=self.loudness_target(), coalesce=self.coalesce_var.get(),
+                                             in_memory=self.in_memory_var.get(),
+                                             exports=tuple(self.EXPORT_FORMATS))
+            cached = render_cache.lookup(fingerprint)
+            if cached:
+                self.stop_meditation()
+                files = ", ".join([cached.filename] + list(cached.exports.values()))
+                self.status_label.config(text=f"Final meditation file (from cache)! 🎵 {files}")
+                return
+            
             # Parse meditation text
             segments = self.parse_meditation_text(meditation_text)
             
             # Estimate total meditation duration
             estimated_duration = self.estimate_meditation_duration(segments)
+            self.manage_background_music(estimated_duration)
             
             # Update status
             self.status_label.config(text="Creating audio segments...")
@@ -1165,6 +943,31 @@ except Exception as e:
             text_segment_count = len(text_segments)
             current_text_segment = 0
             
+            # Completed segments are checkpointed so a crashed or cancelled render resumes here
+            in_memory = self.in_memory_var.get()
+            checkpoint = RenderCheckpoint.for_job(self.checkpoint_dir(), meditation_text, settings, render_fmt)
+            restored = {text: checkpoint.lookup(settings, text, render_fmt)
+                        for text in dict.fromkeys(content for _, content in text_segments)}
+            
+            speech_samples = {}
+            if in_memory:
+                # Fetch segments in small batches: each batch is decoded together and
+                # checkpointed before the next one starts
+                pending = [text for text, path in restored.items() if not path]
+                for batch_start in range(0, len(pending), self.CHECKPOINT_BATCH):
+                    if not self.is_playing:
+                        print(f"🛑 Generation stopped by user, {len(checkpoint)} segment(s) kept for resume")
+                        return
+                    batch = pending[batch_start:batch_start + self.CHECKPOINT_BATCH]
+                    self.status_label.config(
+                        text=f"Creating audio segments {batch_start + 1}-{batch_start + len(batch)}/{len(pending)}...")
+                    self.root.update()  # Force UI update
+                    for text, samples in zip(batch, speech.texts_to_speech_samples(
+                            batch, settings, coalesce=self.coalesce_var.get())):
+                        if self.CHECKPOINT_IN_MEMORY_SEGMENTS:
+                            checkpoint.commit_samples(samples, settings, text, render_fmt)
+                        speech_samples[text] = samples
+            
             for i, (segment_type, content) in enumerate(segments):
                 if not self.is_playing:  # Check if stopped
                     print(f"🛑 Generation stopped by user, is_playing: {self.is_playing}")
@@ -1172,6 +975,7 @@ except Exception as e:
                 
                 if segment_type == 'text':
                     current_text_segment += 1
+                    metrics.QUEUE_DEPTH.set(text_segment_count - current_text_segment, queue='segments')
                     # Update progress status
                     progress_msg = f"Creating audio segment {current_text_segment}/{text_segment_count}..."
                     self.status_label.config(text=progress_msg)
@@ -1180,30 +984,39 @@ except Exception as e:
                     print(f"\n[TEXT] Processing segment {current_text_segment}/{text_segment_count}")
                     print(f"Text: {content[:60]}...")
                     
-                    # Create audio file in current directory
-                    audio_filename = f"output/meditation_segment_{current_text_segment:02d}.wav"
+                    if content in speech_samples:
+                        audio_files.append(('samples', speech_samples[content]))
+                        print(f"✅ Segment {current_text_segment} completed in memory")
+                        continue
+                    
+                    audio_filename = checkpoint.completed(settings, content, render_fmt)
+                    if audio_filename:
+                        print(f"♻️ Segment {current_text_segment} restored from checkpoint")
+                        audio_files.append(('audio', audio_filename))
+                        continue
+                    
+                    # Synthesize into a scratch file; it only becomes a segment once complete
+                    partial_filename = checkpoint.partial_file(settings, content, render_fmt)
                     
                     try:
-                        self.text_to_speech_file(content, audio_filename)
+                        self.text_to_speech_file(content, partial_filename)
                         
                         # Verify the file was created successfully
-                        if os.path.exists(audio_filename) and os.path.getsize(audio_filename) > 0:
+                        if os.path.exists(partial_filename) and os.path.getsize(partial_filename) > 0:
+                            audio_filename = checkpoint.commit(partial_filename, settings, content, render_fmt)
                             print(f"✅ Segment {current_text_segment} completed successfully")
                             print(f"📁 Saved as: {audio_filename}")
-                            audio_files.append(('audio', audio_filename))
-                            self.generated_audio_files.append(audio_filename)
                         else:
                             print(f"❌ Segment {current_text_segment} failed - file not created")
                             # Still add it to the list so the meditation continues
-                            audio_files.append(('audio', audio_filename))
-                            self.generated_audio_files.append(audio_filename)
+                            audio_filename = partial_filename
                             
                     except Exception as e:
                         print(f"❌ Error processing segment {current_text_segment}: {e}")
-                        # Create silent audio as fallback
-                        self._create_silent_audio(audio_filename, duration=len(content.split()) * 0.5)
-                        audio_files.append(('audio', audio_filename))
-                        self.generated_audio_files.append(audio_filename)
+                        # Create silent audio as fallback (not checkpointed, so a resume retries it)
+                        self._create_silent_audio(partial_filename, duration=len(content.split()) * 0.5)
+                        audio_filename = partial_filename
+                    audio_files.append(('audio', audio_filename))
                         
                 elif segment_type == 'pause':
                     print(f"⏸ Adding {content} second pause")
@@ -1215,13 +1028,20 @@ except Exception as e:
             self.root.update()
             
             if self.is_playing:
-                file_count = len([f for f in self.generated_audio_files if os.path.exists(f)])
+                file_count = len(checkpoint)
                 
                 try:
                     final_filename = self.create_final_meditation_file(audio_files, estimated_duration)
                     if final_filename:
                         # Clean up individual segment files after successful final file creation
                         self.cleanup_segment_files()
+                        checkpoint.discard()
+                        if os.path.basename(final_filename).startswith("complete_meditation_"):
+                            # not voice-only fallbacks; the compressed copies are cached with the master
+                            exports = {extension: path for extension, path
+                                       in export_paths(final_filename, self.EXPORT_FORMATS).items()
+                                       if os.path.exists(path)}
+                            render_cache.store(fingerprint, final_filename, exports)
                         self.status_label.config(text=f"Final meditation file created! 🎵 {final_filename}")
                         print(f"🎉 Meditation generation complete! Final file: {final_filename}")
                         print(f"🧹 Individual segments cleaned up - only final file remains")
@@ -1231,7 +1051,7 @@ except Exception as e:
                 except Exception as e:
                     print(f"❌ Failed to create final file: {e}")
                     self.status_label.config(text=f"Meditation segments created! 🧘 ({file_count} files)")
-                    print("💾 Individual segments kept since final file creation failed")
+                    print(f"💾 Segments kept in {checkpoint.job_dir} since final file creation failed")
                 
                 # Stop without playing
                 self.stop_meditation()
@@ -1240,11 +1060,95 @@ except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
             self.stop_meditation()
     
+    def render_variants(self, variants, max_workers=4):
+        """Render the current script for several voice/music variants in one pass"""
+        meditation_text = self.text_area.get('1.0', tk.END).strip()
+        return FanOutRenderer(max_workers=max_workers).render(meditation_text, variants)
+    
+    def toggle_playback(self):
+        """Play the session, or pause/resume it if it is already playing"""
+        if self.player and self.player.is_active():
+            if self.player.paused:
+                self.player.resume()
+                self.play_btn.config(text="⏸ Pause")
+            else:
+                self.player.pause()
+                self.play_btn.config(text="▶ Play")
+            return
+        self.start_playback()
+    
+    def start_playback(self):
+        """Stream the current script over the music without exporting it first"""
+        meditation_text = self.text_area.get('1.0', tk.END).strip()
+        if not meditation_text:
+            messagebox.showwarning("No Text", "Please enter meditation text.")
+            return
+        
+        settings = self.current_voice_settings()
+        fmt = audio_format.render_format()
+        segments = self.parse_meditation_text(meditation_text)
+        # Speech comes from (and goes into) the same checkpoint a render of this script uses
+        checkpoint = RenderCheckpoint.for_job(self.checkpoint_dir(), meditation_text, settings, fmt)
+        segment_files = {text: checkpoint.lookup(settings, text, fmt)
+                         for text in dict.fromkeys(content for kind, content in segments if kind == 'text')}
+        pending = [text for text, path in segment_files.items() if not path]
+        if pending:
+            self.status_label.config(text=f"Preparing {len(pending)} speech segment(s) for playback...")
+            self.root.update()
+            for text, samples in zip(pending, speech.texts_to_speech_samples(
+                    pending, settings, coalesce=self.coalesce_var.get())):
+                segment_files[text] = checkpoint.commit_samples(samples, settings, text, fmt)
+        audio_segments = [('audio', segment_files[content]) if kind == 'text'
+                          else ('pause', content) for kind, content in segments]
+        
+        music_file = self.background_music_file.get() or None
+        loop_points = None
+        if music_file and not is_soundscape(music_file):
+            loop_points = MusicLibrary("background_music").loop_points(music_file)
+        self.stop_playback()
+        try:
+            self.player = Player.for_session(audio_segments, music_file, loop_points=loop_points,
+                                             sink=PygameSink(fmt), fmt=fmt, loudness=self.loudness_target())
+        except Exception as e:
+            print(f"❌ Playback failed: {e}")
+            self.status_label.config(text=f"Playback failed: {e}")
+            return
+        self.seek_scale.config(to=max(self.player.duration, 1.0))
+        self.player.play()
+        self.play_btn.config(text="⏸ Pause")
+        self.status_label.config(text=f"Playing ({self.player.duration / 60:.1f} minutes)")
+        self.root.after(250, self.update_playback_position)
+    
+    def update_playback_position(self):
+        """Move the seek bar with playback"""
+        if not self.player:
+            return
+        if not self.player.is_active():
+            self.play_btn.config(text="▶ Play")
+            return
+        if not self.seeking:
+            self.seek_var.set(self.player.position)
+        self.root.after(250, self.update_playback_position)
+    
+    def on_seek(self, event=None):
+        """Jump to the position the seek bar was dragged to"""
+        self.seeking = False
+        if self.player and self.player.is_active():
+            self.player.seek(self.seek_var.get())
+    
+    def stop_playback(self):
+        """Stop the in-app player, if any"""
+        if self.player:
+            self.player.stop()
+            self.player = None
+            self.play_btn.config(text="▶ Play")
+    
     def stop_meditation(self):
         """Stop meditation playback"""
         print("🛑 stop_meditation() called")
         self.is_playing = False
         self.is_paused = False
+        self.stop_playback()
         
         # Stop all audio
         pygame.mixer.music.stop()
@@ -1282,6 +1186,15 @@ def main():
     
     app = MeditationGenerator(root)
     
+    # Drafts and final renders share fetched speech through this cache
+    speech.set_speech_cache_dir(speech.DEFAULT_SPEECH_CACHE_DIR)
+    app.prerender_auditions()
+    
+    # Optional Prometheus metrics endpoint for deployments; loopback only unless a host is given
+    if os.environ.get('MEDITATION_METRICS_PORT'):
+        metrics.serve(int(os.environ['MEDITATION_METRICS_PORT']),
+                      os.environ.get('MEDITATION_METRICS_HOST', metrics.DEFAULT_HOST))
+    
     # Handle window close
     def on_closing():
         app.stop_meditation()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Meditation Script Parsing
+Splits meditation text into spoken text and [PAUSE:X] segments.
+"""
+
+import re
+
+
+PAUSE_PATTERN = re.compile(r'\[pause\s*:\s*(\d+)\s*\]', re.IGNORECASE)
+
+
+def parse_meditation_text(text):
+    """Parse meditation text and extract pauses"""
+    segments = []
+    current_pos = 0
+
+    # Find all pause markers (case-insensitive, flexible spacing)
+    for match in PAUSE_PATTERN.finditer(text):
+        # Add text before pause
+        if match.start() > current_pos:
+            text_segment = text[current_pos:match.start()].strip()
+            if text_segment:
+                segments.append(('text', text_segment))
+
+        # Add pause
+        pause_duration = int(match.group(1))
+        segments.append(('pause', pause_duration))
+        current_pos = match.end()
+
+    # Add remaining text
+    if current_pos < len(text):
+        remaining_text = text[current_pos:].strip()
+        if remaining_text:
+            segments.append(('text', remaining_text))
+
+    return segments
+
+
+def estimate_meditation_duration(segments, speech_rate):
+    """Estimate total duration of meditation in seconds"""
+    total_duration = 0
+
+    for segment_type, content in segments:
+        if segment_type == 'text':
+            # Estimate speech duration based on word count and speech rate
+            word_count = len(content.split())
+            speech_duration = (word_count / speech_rate) * 60  # convert to seconds
+            total_duration += speech_duration
+        elif segment_type == 'pause':
+            total_duration += content
+
+    return total_duration
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Render Metrics
+Live counters, gauges and histograms for the render engine, exposed in the
+Prometheus text format (version 0.0.4) by a small built-in HTTP server, so no
+client library is needed:
+
+    import metrics
+    metrics.serve(9464)        # scrape http://127.0.0.1:9464/metrics
+
+The endpoint has no authentication, so it only listens on the loopback
+interface unless a host is passed explicitly (e.g. host='0.0.0.0' for a
+scraper on another machine).
+
+Instrumented code updates the module-level metrics below; ratios such as the
+cache hit ratio, segments per second and realtime factors are computed when
+scraped.
+"""
+
+import abc
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_HOST = '127.0.0.1'
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+RATE_WINDOW_SECONDS = 60.0
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self):
+        """[(suffix, label pairs, value)] for exposition"""
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [("", key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or computed by a function at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """Compute the value by calling function() on every scrape"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            function = self._functions.get(key)
+            value = self._values.get(key, 0)
+        return function() if function else value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                values[key] = math.nan
+        return [("", key, value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._series.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key + (('le', _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, cumulative))
+        return samples
+
+
+class _RateWindow:
+    """Events per second over the last RATE_WINDOW_SECONDS"""
+
+    def __init__(self):
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def add(self, count=1):
+        with self._lock:
+            self._events.append((time.monotonic(), count))
+
+    def rate(self):
+        cutoff = time.monotonic() - RATE_WINDOW_SECONDS
+        with self._lock:
+            while self._events and self._events[0][0] < cutoff:
+                self._events.popleft()
+            return sum(count for _, count in self._events) / RATE_WINDOW_SECONDS
+
+
+# --- Render engine metrics ---------------------------------------------------
+
+SYNTHESIS_SECONDS = Histogram(
+    'meditation_synthesis_seconds', "Wall time to synthesize one speech segment", ['engine'])
+SEGMENTS = Counter(
+    'meditation_segments_synthesized_total', "Speech segments synthesized", ['engine'])
+SEGMENTS_PER_SECOND = Gauge(
+    'meditation_segments_per_second', f"Segments synthesized per second over the last {RATE_WINDOW_SECONDS:.0f}s")
+GTTS_REQUESTS = Counter(
+    'meditation_gtts_requests_total', "Requests sent to Google TTS")
+GTTS_FALLBACKS = Counter(
+    'meditation_gtts_fallbacks_total', "Google TTS failures that fell back to local TTS")
+SILENT_FALLBACKS = Counter(
+    'meditation_silent_fallbacks_total', "Segments replaced by silence because no engine produced speech")
+CACHE_REQUESTS = Counter(
+    'meditation_cache_requests_total', "Segment/music cache lookups", ['cache', 'result'])
+CACHE_HIT_RATIO = Gauge(
+    'meditation_cache_hit_ratio', "Fraction of cache lookups that were hits", ['cache'])
+AUDIO_SECONDS = Counter(
+    'meditation_audio_seconds_total', "Seconds of audio produced by a render stage", ['stage'])
+WALL_SECONDS = Counter(
+    'meditation_stage_wall_seconds_total', "Wall time spent in a render stage", ['stage'])
+REALTIME_FACTOR = Gauge(
+    'meditation_stage_realtime_factor', "Audio seconds produced per wall second by a render stage", ['stage'])
+QUEUE_DEPTH = Gauge(
+    'meditation_queue_depth', "Work items waiting to be processed", ['queue'])
+
+_segment_rate = _RateWindow()
+SEGMENTS_PER_SECOND.set_function(_segment_rate.rate)
+
+
+def record_segment(engine, seconds):
+    """One segment synthesized by engine in seconds of wall time"""
+    SYNTHESIS_SECONDS.observe(seconds, engine=engine)
+    SEGMENTS.inc(engine=engine)
+    _segment_rate.add()
+
+
+@contextmanager
+def time_synthesis(engine):
+    """Time a synthesis call; only successful calls count as segments"""
+    start = time.perf_counter()
+    yield
+    record_segment(engine, time.perf_counter() - start)
+
+
+def record_cache(cache, hit):
+    """One lookup in the named cache"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+    CACHE_HIT_RATIO.set_function(lambda: _ratio(cache), cache=cache)
+
+
+def _ratio(cache):
+    hits = CACHE_REQUESTS.value(cache=cache, result='hit')
+    total = hits + CACHE_REQUESTS.value(cache=cache, result='miss')
+    return hits / total if total else 0.0
+
+
+def record_stage(stage, audio_seconds, wall_seconds):
+    """A render stage produced audio_seconds of audio in wall_seconds"""
+    AUDIO_SECONDS.inc(audio_seconds, stage=stage)
+    WALL_SECONDS.inc(wall_seconds, stage=stage)
+    REALTIME_FACTOR.set_function(lambda: _realtime_factor(stage), stage=stage)
+
+
+def _realtime_factor(stage):
+    wall = WALL_SECONDS.value(stage=stage)
+    return AUDIO_SECONDS.value(stage=stage) / wall if wall else 0.0
+
+
+def render_text():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+def serve(port=9464, host=DEFAULT_HOST):
+    """Serve /metrics from a daemon thread; returns the server (call shutdown() to stop)
+
+    Pass a wider host such as '0.0.0.0' to expose the unauthenticated
+    endpoint beyond this machine.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    print(f"📈 Metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Audio Mixing
+Builds the voice track from synthesized segments and mixes it over the
+background music. Everything is converted to the canonical render format
+(see audio_format.py) when it is loaded, so the mix itself is plain array math.
+"""
+
+import os
+import time
+import wave
+
+import numpy as np
+
+import audio_format
+import metrics
+from audio_sources import ArraySource, CrossfadeLoopSource
+from encoder_tee import EncoderTee
+from loop_points import find_loop_points
+from loudness import analyze_source, duck_under_speech, normalization_gains, report as loudness_report
+from soundscape import open_soundscape
+
+
+DEFAULT_MUSIC_GAIN_DB = -12  # Reduce background by 12dB (about 25% volume)
+
+
+def plan_loops(music_length, voice_length):
+    """Number of back-to-back music copies needed to cover the voice track
+
+    Lengths may be frames or seconds; callers can plan from a header probe
+    (see audio_probe.py) before anything is decoded.
+    """
+    if music_length <= 0 or music_length >= voice_length:
+        return 1
+    return int(voice_length // music_length) + 1
+
+
+def load_background_music(music_file, fmt=None):
+    """Decode background music once and convert it to the render format"""
+    print(f"🎼 Loading background music: {music_file}")
+    background = audio_format.load_audio(music_file, fmt)
+    print(f"✅ Loaded background music ({audio_format.duration_seconds(background, fmt):.1f}s)")
+    return background
+
+
+def build_voice_track(audio_segments, fmt=None):
+    """Combine ('audio', path), ('samples', array) and ('pause', seconds) segments into one track
+
+    'samples' segments are canonical arrays synthesized in memory.
+    """
+    print("🎤 Combining voice segments...")
+    parts = []
+
+    for segment_type, content in audio_segments:
+        if segment_type == 'audio':
+            if os.path.exists(content):
+                print(f"  Adding audio: {content}")
+                parts.append(audio_format.load_audio(content, fmt))
+            else:
+                print(f"  ⚠️ Missing audio file: {content}")
+                # Add silence instead
+                parts.append(audio_format.silence(2.0, fmt))  # 2 seconds
+
+        elif segment_type == 'samples':
+            print(f"  Adding audio: {audio_format.duration_seconds(content, fmt):.1f}s from memory")
+            parts.append(content)
+
+        elif segment_type == 'pause':
+            print(f"  Adding {content}s pause")
+            parts.append(audio_format.silence(content, fmt))
+
+    if not parts:
+        return audio_format.silence(0, fmt)
+    return np.concatenate(parts)
+
+
+def mix_voice_with_background(voice_track, background, music_gain_db=DEFAULT_MUSIC_GAIN_DB, fmt=None,
+                              loop_points=None, loudness=None):
+    """Loop/trim the background to the voice track length and overlay the voice
+
+    Short music is looped lazily between seamless loop points (found on the fly
+    unless cached loop_points are given) instead of being tiled end to end.
+    With a LoudnessTarget the voice is normalized, the music set music_gain_db
+    below it and ducked under speech, with the same gains a BoundedRenderer
+    would use.
+    """
+    fmt = fmt or audio_format.render_format()
+    start = time.perf_counter()
+    # Ensure background music is long enough
+    voice_frames = len(voice_track)
+    print(f"📊 Voice track duration: {audio_format.duration_seconds(voice_track, fmt):.1f}s")
+    print(f"📊 Background music duration: {audio_format.duration_seconds(background, fmt):.1f}s")
+
+    voice = audio_format.as_float(voice_track)
+    gain = np.float32(10 ** (music_gain_db / 20.0))
+    if loudness is not None:
+        voice_analysis = analyze_source(ArraySource(voice), fmt.sample_rate, fmt.channels)
+        music_analysis = analyze_source(ArraySource(background), fmt.sample_rate, fmt.channels) if len(background) else None
+        voice_lufs, voice_gain, music_gain = normalization_gains([voice_analysis], music_analysis, loudness,
+                                                                 music_gain_db)
+        voice = voice * np.float32(voice_gain)
+        if music_gain is not None:
+            gain = np.float32(music_gain)
+
+    if len(background) == 0:
+        return voice
+
+    source = ArraySource(background)
+    if plan_loops(len(background), voice_frames) > 1:
+        if loop_points is None:
+            loop_points = find_loop_points(background, fmt.sample_rate)
+        # Loop background music to cover the entire meditation
+        print(f"🔄 Looping background music seamlessly (loop {loop_points.loop_in:.1f}s-"
+              f"{loop_points.loop_out:.1f}s, {loop_points.crossfade:.2f}s crossfade)")
+        source = CrossfadeLoopSource.from_loop_points(source, loop_points, fmt.sample_rate)
+    if loudness is not None:
+        source = duck_under_speech(source, [(0, ArraySource(voice_track))], [voice_analysis], voice_lufs, loudness,
+                                   fmt.sample_rate)
+
+    print("🎚️ Mixing voice and background music...")
+    # Trim background to match voice duration exactly, reduce its volume and overlay the voice
+    mix = source.read(0, voice_frames) * gain + voice
+    metrics.record_stage('mix', audio_format.duration_seconds(mix, fmt), time.perf_counter() - start)
+    if loudness is not None:
+        output = loudness_report(analyze_source(ArraySource(mix), fmt.sample_rate, fmt.channels))
+        print(f"📏 Output: {output.integrated_lufs:.1f} LUFS, true peak {output.true_peak_db:.1f} dBTP")
+    return mix
+
+
+def mix_voice_with_soundscape(voice_track, soundscape_file, fmt=None, music_gain_db=DEFAULT_MUSIC_GAIN_DB):
+    """Overlay the voice on a layered soundscape (see soundscape.py) read to the voice track length
+
+    The layer gains stand in for the music gain, so music_gain_db moves the
+    whole soundscape by its difference from DEFAULT_MUSIC_GAIN_DB.
+    """
+    fmt = fmt or audio_format.render_format()
+    start = time.perf_counter()
+    voice_frames = len(voice_track)
+    print("🎚️ Mixing voice and soundscape...")
+    mix = open_soundscape(soundscape_file, voice_frames, fmt).read(0, voice_frames)
+    if music_gain_db != DEFAULT_MUSIC_GAIN_DB:
+        print(f"🔉 Soundscape offset by {music_gain_db - DEFAULT_MUSIC_GAIN_DB:+g}dB")
+        mix *= np.float32(10 ** ((music_gain_db - DEFAULT_MUSIC_GAIN_DB) / 20.0))
+    mix += audio_format.as_float(voice_track)
+    metrics.record_stage('mix', audio_format.duration_seconds(mix, fmt), time.perf_counter() - start)
+    return mix
+
+
+def export_mix(samples, filename, fmt=None, exports=()):
+    """Export a mixed track as WAV, plus compressed copies encoded from the same PCM, and print a summary"""
+    print(f"💾 Exporting final meditation: {filename}")
+    start = time.perf_counter()
+    fmt = fmt or audio_format.render_format()
+    pcm = audio_format.float_to_pcm16(samples)
+    with wave.open(filename, 'wb') as wav_file, EncoderTee(filename, exports, fmt) as tee:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(fmt.sample_rate)
+        tee.write(pcm)
+        wav_file.writeframes(pcm)
+    metrics.record_stage('export', audio_format.duration_seconds(samples, fmt), time.perf_counter() - start)
+
+    file_size = os.path.getsize(filename)
+    duration_minutes = audio_format.duration_seconds(samples, fmt) / 60
+
+    print(f"✅ Final meditation created successfully!")
+    print(f"📁 File: {filename}")
+    print(f"📊 Size: {file_size:,} bytes")
+    print(f"⏱️ Duration: {duration_minutes:.1f} minutes")
+    for extension, export in tee.outputs.items():
+        print(f"💾 {extension.upper()}: {export} ({os.path.getsize(export):,} bytes)")
+    return filename
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Background Music Library
+A persistent index of every track in background_music/: format, duration,
+sample rate, channels, loudness and seamless loop points. The index is rebuilt
+incrementally (only files whose size or mtime changed are analyzed again) by a
+parallel scanner, so batch jobs can pick and validate music without touching
+audio data on every run.
+"""
+
+import argparse
+import json
+import os
+import wave
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import audio_format
+from audio_probe import probe_audio, ProbeError
+from loop_points import LoopPoints, find_loop_points, find_loop_points_in_regions, SEARCH_SECONDS
+
+
+INDEX_FILENAME = ".library_index.json"
+INDEX_VERSION = 2
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.opus', '.flac', '.m4a')
+
+ANALYSIS_BLOCK_SECONDS = 0.4    # loudness/silence analysis block
+SILENCE_THRESHOLD_DB = -60.0    # blocks quieter than this are treated as silence
+WAV_READ_SECONDS = 30           # WAVs are analyzed in bounded reads of this size
+
+TrackInfo = namedtuple('TrackInfo', [
+    'path', 'size', 'mtime_ns', 'format', 'duration', 'sample_rate', 'channels',
+    'loudness_db', 'loop_start', 'loop_end', 'loop_crossfade', 'loop_score'
+])
+
+ScanResult = namedtuple('ScanResult', ['added', 'updated', 'removed', 'unchanged', 'failed'])
+
+
+def _block_energies(samples, block_frames):
+    """Mean square energy of consecutive blocks (mono-summed), vectorized"""
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    usable = len(mono) // block_frames * block_frames
+    if usable == 0:
+        return np.zeros(0)
+    return np.mean(mono[:usable].reshape(-1, block_frames).astype(np.float64) ** 2, axis=1)
+
+
+def _iter_blocks_energy(filename, sample_rate):
+    """Block energies of a file, reading WAVs in bounded pieces"""
+    block_frames = max(1, int(ANALYSIS_BLOCK_SECONDS * sample_rate))
+    try:
+        with wave.open(filename, 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            piece = block_frames * max(1, int(WAV_READ_SECONDS / ANALYSIS_BLOCK_SECONDS))
+            energies = []
+            while True:
+                raw_data = wav_file.readframes(piece)
+                if not raw_data:
+                    break
+                energies.append(_block_energies(audio_format.pcm_to_float(raw_data, sample_width, channels), block_frames))
+            return np.concatenate(energies) if energies else np.zeros(0), block_frames
+    except (wave.Error, EOFError):
+        pass
+    samples, _ = audio_format.decode_file(filename)
+    return _block_energies(samples, block_frames), block_frames
+
+
+def _find_track_loop_points(filename, audible_start, audible_end):
+    """Loop points of a file within its audible range, reading only head and tail of WAVs"""
+    try:
+        with wave.open(filename, 'rb') as wav_file:
+            sample_rate = wav_file.getframerate()
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            start = int(audible_start * sample_rate)
+            end = min(wav_file.getnframes(), int(audible_end * sample_rate))
+            search = min(int(SEARCH_SECONDS * sample_rate), (end - start) // 3)
+            regions = []
+            for offset in (start, end - search):
+                wav_file.setpos(max(0, offset))
+                regions.append(audio_format.pcm_to_float(wav_file.readframes(max(0, search)), sample_width, channels))
+            return find_loop_points_in_regions(regions[0], start, regions[1], end - search, sample_rate,
+                                               duration=wav_file.getnframes() / float(sample_rate))
+    except (wave.Error, EOFError):
+        pass
+    samples, sample_rate = audio_format.decode_file(filename)
+    return find_loop_points(samples, sample_rate, audible_start, audible_end)
+
+
+def analyze_track(filename):
+    """Analyze one file; returns a dict of TrackInfo fields (without 'path')"""
+    stat = os.stat(filename)
+    try:
+        info = probe_audio(filename)
+        fmt, duration, sample_rate, channels = info.format, info.duration, info.sample_rate, info.channels
+    except (ProbeError, ValueError):
+        samples, sample_rate = audio_format.decode_file(filename)
+        fmt = Path(filename).suffix.lower().lstrip('.')
+        duration = len(samples) / float(sample_rate)
+        channels = samples.shape[1]
+        del samples
+
+    energies, block_frames = _iter_blocks_energy(filename, sample_rate)
+    block_seconds = block_frames / float(sample_rate)
+    db = 10 * np.log10(np.maximum(energies, 1e-12))
+    audible = np.nonzero(db > SILENCE_THRESHOLD_DB)[0]
+
+    if len(audible):
+        # Gated loudness: average energy of the non-silent blocks
+        loudness_db = float(10 * np.log10(np.mean(energies[audible])))
+        # Search for loop points between the first and last audible blocks so
+        # silent lead-in/out is skipped
+        audible_start = float(audible[0] * block_seconds)
+        audible_end = float(min(duration, (audible[-1] + 1) * block_seconds))
+    else:
+        loudness_db = None
+        audible_start, audible_end = 0.0, float(duration)
+    loop = _find_track_loop_points(filename, audible_start, audible_end)
+
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'format': fmt,
+        'duration': float(duration),
+        'sample_rate': int(sample_rate),
+        'channels': int(channels),
+        'loudness_db': loudness_db,
+        'loop_start': loop.loop_in,
+        'loop_end': loop.loop_out,
+        'loop_crossfade': loop.crossfade,
+        'loop_score': loop.score,
+    }
+
+
+def track_loop_points(track):
+    """LoopPoints stored for an indexed track"""
+    return LoopPoints(track.loop_start, track.loop_end, track.loop_crossfade, track.loop_score)
+
+
+class MusicLibrary:
+    """Persistent, incrementally updated index of the background music folder"""
+
+    def __init__(self, folder="background_music", index_file=None):
+        self.folder = Path(folder)
+        self.index_file = Path(index_file) if index_file else self.folder / INDEX_FILENAME
+        self._tracks = {}
+        self._load()
+
+    def _load(self):
+        """Load the index from disk (an unreadable or outdated index is rebuilt)"""
+        try:
+            data = json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        for relpath, fields in data.get('tracks', {}).items():
+            try:
+                self._tracks[relpath] = TrackInfo(path=relpath, **fields)
+            except TypeError:
+                continue  # entry written by a different layout, rescan it
+
+    def save(self):
+        """Write the index atomically"""
+        tracks = {relpath: dict(track._asdict()) for relpath, track in sorted(self._tracks.items())}
+        for fields in tracks.values():
+            del fields['path']
+        temp_file = self.index_file.with_name(self.index_file.name + f".tmp{os.getpid()}")
+        temp_file.write_text(json.dumps({'version': INDEX_VERSION, 'tracks': tracks}, indent=1))
+        os.replace(temp_file, self.index_file)
+
+    def _audio_files(self):
+        """Relative paths of every audio file under the folder"""
+        files = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append(os.path.relpath(os.path.join(root, name), self.folder))
+        return sorted(files)
+
+    def scan(self, max_workers=None):
+        """Bring the index up to date, analyzing only new or changed files"""
+        present = self._audio_files()
+        pending = []
+        unchanged = 0
+        for relpath in present:
+            stat = os.stat(self.folder / relpath)
+            known = self._tracks.get(relpath)
+            if known and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+                unchanged += 1
+            else:
+                pending.append(relpath)
+
+        present_set = set(present)
+        removed = [relpath for relpath in self._tracks if relpath not in present_set]
+        for relpath in removed:
+            del self._tracks[relpath]
+
+        added = updated = failed = 0
+        if pending:
+            print(f"🔎 Scanning {len(pending)} music file(s)...")
+            paths = [str(self.folder / relpath) for relpath in pending]
+            if len(pending) == 1 or max_workers == 1:
+                results = [_analyze_safely(path) for path in paths]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    results = list(pool.map(_analyze_safely, paths))
+            for relpath, fields in zip(pending, results):
+                if fields is None:
+                    failed += 1
+                    self._tracks.pop(relpath, None)
+                    continue
+                if relpath in self._tracks:
+                    updated += 1
+                else:
+                    added += 1
+                self._tracks[relpath] = TrackInfo(path=relpath, **fields)
+
+        if pending or removed or not self.index_file.exists():
+            self.save()
+        result = ScanResult(added, updated, len(removed), unchanged, failed)
+        print(f"🎼 Music library: {len(self._tracks)} track(s) "
+              f"(+{added} new, {updated} updated, {len(removed)} removed, {failed} unreadable)")
+        return result
+
+    def tracks(self):
+        """All indexed tracks"""
+        return list(self._tracks.values())
+
+    def get(self, path):
+        """Indexed info for a file (relative to the folder or absolute), or None"""
+        path = Path(path)
+        relpath = os.path.relpath(path, self.folder) if path.is_absolute() else str(path)
+        return self._tracks.get(relpath)
+
+    def loop_points(self, path):
+        """Cached LoopPoints for a file in the folder, analyzing it first if it is new or changed
+
+        Returns None for files outside the folder or that cannot be analyzed.
+        """
+        path = Path(path).resolve()
+        try:
+            relpath = str(path.relative_to(self.folder.resolve()))
+            stat = os.stat(path)
+        except (ValueError, OSError):
+            return None
+        track = self._tracks.get(relpath)
+        if not track or track.size != stat.st_size or track.mtime_ns != stat.st_mtime_ns:
+            fields = _analyze_safely(str(path))
+            if fields is None:
+                return None
+            track = self._tracks[relpath] = TrackInfo(path=relpath, **fields)
+            try:
+                self.save()
+            except OSError as e:
+                print(f"⚠️ Could not save music library index: {e}")
+        return track_loop_points(track)
+
+    def full_path(self, track):
+        """Filesystem path of an indexed track"""
+        return str(self.folder / track.path)
+
+    def find(self, min_duration=None, max_duration=None, formats=None, channels=None):
+        """Tracks matching every given constraint, longest first"""
+        matches = []
+        for track in self._tracks.values():
+            if min_duration is not None and track.duration < min_duration:
+                continue
+            if max_duration is not None and track.duration > max_duration:
+                continue
+            if formats is not None and track.format not in formats:
+                continue
+            if channels is not None and track.channels != channels:
+                continue
+            matches.append(track)
+        return sorted(matches, key=lambda track: (-track.duration, track.path))
+
+    def closest_loudness(self, target_db, **constraints):
+        """Tracks sorted by distance of their loudness to target_db (unmeasured ones last)"""
+        candidates = [track for track in self.find(**constraints) if track.loudness_db is not None]
+        return sorted(candidates, key=lambda track: (abs(track.loudness_db - target_db), track.path))
+
+
+def _analyze_safely(path):
+    """analyze_track for the process pool: unreadable files yield None"""
+    try:
+        return analyze_track(path)
+    except Exception as e:
+        print(f"⚠️ Could not analyze {path}: {e}")
+        return None
+
+
+def main():
+    """Scan the music folder and optionally query it"""
+    parser = argparse.ArgumentParser(description="Index and query the background music library")
+    parser.add_argument('--folder', default="background_music")
+    parser.add_argument('--min-duration', type=float, help="minimum length in seconds")
+    parser.add_argument('--max-duration', type=float, help="maximum length in seconds")
+    parser.add_argument('--loudness', type=float, help="sort by closeness to this loudness (dB)")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    library = MusicLibrary(args.folder)
+    library.scan(max_workers=args.workers)
+
+    constraints = {'min_duration': args.min_duration, 'max_duration': args.max_duration}
+    if args.loudness is not None:
+        tracks = library.closest_loudness(args.loudness, **constraints)
+    else:
+        tracks = library.find(**constraints)
+    for track in tracks:
+        loudness = f"{track.loudness_db:.1f} dB" if track.loudness_db is not None else "silent"
+        print(f"  {track.path}: {track.duration / 60:.1f} min, {track.format}, "
+              f"{track.sample_rate} Hz x{track.channels}, {loudness}, "
+              f"loop {track.loop_start:.1f}-{track.loop_end:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Streaming Player
+Plays a session straight from its timeline. A background thread reads small
+buffers from a source (BoundedRenderer.open_session's MixSource: voice clips
+and music read lazily from disk) and hands them to a sink, so nothing is
+exported first and memory stays constant however long the session is. Seek,
+pause and resume take effect within a buffer or two.
+
+A sink has write(samples), which blocks while the device queue is full (that
+is what paces playback), pause(), resume(), flush() to drop queued audio and
+close():
+
+- PygameSink plays through a pygame.mixer channel;
+- PipeSink writes raw PCM to a command-line player (aplay, pacat, ffplay);
+- OfflineSink simulates a device clock and records every buffer, for tests.
+"""
+
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import audio_format
+import mixer
+from chunked_render import BoundedRenderer
+
+
+DEFAULT_BUFFER_SECONDS = 0.1
+QUEUE_POLL_SECONDS = 0.005
+# BoundedRenderer only needs a budget to size chunks; the player reads its own buffers
+PLAYER_MEMORY_BUDGET_BYTES = 256 * 2**20
+
+
+class PygameSink:
+    """Sink that queues buffers on one pygame.mixer channel (mixer format must match fmt)"""
+
+    def __init__(self, fmt=None):
+        import pygame
+        self.fmt = fmt or audio_format.render_format()
+        if not pygame.mixer.get_init():
+            pygame.mixer.init(frequency=self.fmt.sample_rate, size=-16, channels=self.fmt.channels, buffer=512)
+        self.mixer = pygame.mixer
+        self.channel = pygame.mixer.find_channel(True)
+
+    def write(self, samples):
+        sound = self.mixer.Sound(buffer=audio_format.float_to_pcm16(samples))
+        # One buffer plays while the next waits in the channel queue
+        while self.channel.get_queue() is not None:
+            time.sleep(QUEUE_POLL_SECONDS)
+        if self.channel.get_busy():
+            self.channel.queue(sound)
+        else:
+            self.channel.play(sound)
+
+    def pause(self):
+        self.channel.pause()
+
+    def resume(self):
+        self.channel.unpause()
+
+    def flush(self):
+        self.channel.stop()
+
+    def close(self):
+        self.channel.stop()
+
+
+def raw_player_command(fmt=None):
+    """Command that plays raw 16-bit PCM from stdin, or None if no player is installed"""
+    fmt = fmt or audio_format.render_format()
+    rate, channels = str(fmt.sample_rate), str(fmt.channels)
+    if shutil.which('aplay'):
+        return ['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-r', rate, '-c', channels]
+    if shutil.which('pacat'):
+        return ['pacat', '--playback', '--format=s16le', f'--rate={rate}', f'--channels={channels}']
+    if shutil.which('ffplay'):
+        return ['ffplay', '-v', 'error', '-nodisp', '-autoexit', '-f', 's16le', '-ar', rate,
+                '-ch_layout', 'stereo' if fmt.channels == 2 else 'mono', '-i', 'pipe:0']
+    return None
+
+
+class PipeSink:
+    """Sink that streams raw PCM to a player process; the pipe's backpressure paces playback
+
+    Audio already in the pipe cannot be recalled, so pause and seek lag by
+    the pipe buffer (a fraction of a second).
+    """
+
+    def __init__(self, command=None, fmt=None):
+        self.fmt = fmt or audio_format.render_format()
+        command = command or raw_player_command(self.fmt)
+        if command is None:
+            raise RuntimeError("No raw audio player found (install alsa-utils, pulseaudio-utils or ffmpeg)")
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(self, samples):
+        try:
+            self.process.stdin.write(audio_format.float_to_pcm16(samples))
+        except BrokenPipeError:
+            pass  # the player exited; the session plays on silently
+
+    def pause(self):
+        pass  # the player thread stops writing and the pipe drains
+
+    def resume(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+
+
+class OfflineSink:
+    """Simulated output device that consumes audio at the sample rate
+
+    With realtime=True writes block like a device holding queue_seconds of
+    audio, against the wall clock. Each write is logged as (device time,
+    frames); a write that arrives after the queued audio has run out is an
+    underrun, i.e. an audible gap on a real device. With realtime=False the
+    clock is virtual: writes never block and never underrun.
+    """
+
+    def __init__(self, fmt=None, queue_seconds=0.2, realtime=True, keep_audio=True):
+        self.fmt = fmt or audio_format.render_format()
+        self.queue_seconds = queue_seconds
+        self.realtime = realtime
+        self.keep_audio = keep_audio
+        self.writes = []
+        self.audio = []
+        self.underruns = 0
+        self.paused = False
+        self._started = None
+        self._paused_at = None
+        self._queued_until = 0.0
+        self._flushed = False  # the next write starts afresh after a seek, not after a gap
+        self._lock = threading.Lock()
+
+    def _now(self):
+        if not self.realtime:
+            return self._queued_until
+        return time.monotonic() - self._started
+
+    def write(self, samples):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            now = self._now()
+            if self.writes and now > self._queued_until and not self.paused and not self._flushed:
+                self.underruns += 1
+            self._flushed = False
+            start = max(now, self._queued_until)
+            self._queued_until = start + len(samples) / float(self.fmt.sample_rate)
+            self.writes.append((start, len(samples)))
+            if self.keep_audio:
+                self.audio.append(np.array(samples, dtype=np.float32))
+        if self.realtime:
+            while True:
+                with self._lock:
+                    wait = self._queued_until - self.queue_seconds - self._now()
+                    if self.paused:
+                        wait = QUEUE_POLL_SECONDS
+                if wait <= 0:
+                    break
+                time.sleep(min(wait, QUEUE_POLL_SECONDS * 4))
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+            self._paused_at = self._now() if self._started is not None else None
+
+    def resume(self):
+        with self._lock:
+            if self._paused_at is not None:
+                # The device held its queue while paused
+                self._queued_until += self._now() - self._paused_at
+            self.paused = False
+            self._paused_at = None
+
+    def flush(self):
+        with self._lock:
+            if self._started is not None:
+                self._queued_until = min(self._queued_until, self._now())
+            self._flushed = True
+
+    def close(self):
+        pass
+
+    def played(self):
+        """Everything written, concatenated"""
+        if not self.audio:
+            return np.zeros((0, self.fmt.channels), dtype=np.float32)
+        return np.concatenate(self.audio)
+
+
+class Player:
+    """Streams a source to a sink in small buffers on a background thread"""
+
+    def __init__(self, source, sink, fmt=None, buffer_seconds=DEFAULT_BUFFER_SECONDS, work_dir=None):
+        self.source = source
+        self.sink = sink
+        self.fmt = fmt or audio_format.render_format()
+        self.buffer_frames = max(1, int(buffer_seconds * self.fmt.sample_rate))
+        self.work_dir = work_dir  # spill files of the session, removed on stop()
+        self._position = 0
+        self._generation = 0
+        self._paused = False
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @classmethod
+    def for_session(cls, audio_segments, music_file=None, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+                    loop_points=None, sink=None, fmt=None, buffer_seconds=DEFAULT_BUFFER_SECONDS, loudness=None):
+        """Player for ('audio', path)/('samples', array)/('pause', seconds) segments over music
+
+        loudness is a LoudnessTarget, so playback matches a final render made with it.
+        """
+        fmt = fmt or audio_format.render_format()
+        work_dir = tempfile.mkdtemp(prefix="player_spill_")
+        try:
+            session = BoundedRenderer(PLAYER_MEMORY_BUDGET_BYTES, fmt).open_session(
+                audio_segments, music_file, music_gain_db, loop_points, work_dir, loudness)
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        return cls(session, sink or PygameSink(fmt), fmt, buffer_seconds, work_dir)
+
+    @property
+    def duration(self):
+        return self.source.frames / float(self.fmt.sample_rate)
+
+    @property
+    def position(self):
+        """Seconds into the session of the next buffer to be queued"""
+        return self._position / float(self.fmt.sample_rate)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def is_active(self):
+        """True while the session is still being streamed"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def play(self, start_seconds=0.0):
+        """Start streaming from start_seconds"""
+        self.seek(start_seconds)
+        self._thread = threading.Thread(target=self._run, name="player", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        with self._condition:
+            self._paused = True
+            self.sink.pause()
+
+    def resume(self):
+        with self._condition:
+            self._paused = False
+            self.sink.resume()
+            self._condition.notify_all()
+
+    def seek(self, seconds):
+        """Continue from seconds; audio already queued for the old position is dropped"""
+        frame = int(round(seconds * self.fmt.sample_rate))
+        with self._condition:
+            self._position = min(max(frame, 0), self.source.frames)
+            self._generation += 1
+            self.sink.flush()
+            self._condition.notify_all()
+
+    def stop(self):
+        """Stop streaming, release the sink and remove spill files"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.sink.flush()
+        if self._thread is not None:
+            self._thread.join()
+        self.sink.close()
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def wait(self, timeout=None):
+        """Block until the whole session has been streamed (or stop() is called)"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._paused and not self._stopped:
+                    self._condition.wait()
+                if self._stopped or self._position >= self.source.frames:
+                    return
+                start = self._position
+                generation = self._generation
+                count = min(self.buffer_frames, self.source.frames - start)
+                self._position = start + count
+            chunk = self.source.read(start, count)
+            with self._condition:
+                if generation != self._generation:
+                    continue  # seeked while reading
+            self.sink.write(chunk)
+            with self._condition:
+                if generation != self._generation:
+                    self.sink.flush()  # a seek landed while this buffer was being queued
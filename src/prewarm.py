@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Cache Prewarming
+Fills the speech cache ahead of time, so the first render of a standard
+script starts warm and a voice test plays at once. prewarm() takes a set of
+scripts (plain or {slot} templates, whose static text is what gets cached)
+and the voices and rates they will be rendered with. The cache holds the
+engine's output before rate and volume processing, so those combinations
+come down to one Google TTS request per distinct (phrase, accent, slow);
+phrases already cached are skipped, and the rest are fetched in parallel,
+spaced out to stay under a request rate so a large library does not get the
+client throttled.
+
+    python src/prewarm.py scripts/*.txt --voice British --voice Australian --rate 120 --rate 160
+
+AuditionClips renders the voice test sentence of every listed voice in a
+background thread at startup: Google voices into the speech cache, local
+voices at the default rate and volume into memory. The rate and volume
+sliders are applied when a clip is played, so moving them never makes a
+test miss its clip.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import audio_format
+import segment_cache
+import speech
+from meditation_script import parse_meditation_text
+from templates import SLOT_PATTERN, parse_template
+
+
+AUDITION_TEXT = "Welcome to this guided meditation. Take a deep breath and feel yourself relaxing."
+DEFAULT_WORKERS = 4
+REQUESTS_PER_SECOND = 2.0
+
+PrewarmReport = namedtuple('PrewarmReport', ['requests', 'cached', 'fetched', 'failed', 'seconds'])
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1 / per_second apart, across threads"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def script_phrases(text):
+    """Distinct phrases a render of a script synthesizes; the static text of a template"""
+    if SLOT_PATTERN.search(text):
+        phrases = [piece for kind, content in parse_template(text) if kind == 'text'
+                   for piece_type, piece in content if piece_type == 'static']
+    else:
+        phrases = [content for kind, content in parse_meditation_text(text) if kind == 'text']
+    return list(dict.fromkeys(phrases))
+
+
+def gtts_requests(scripts, voices):
+    """Distinct (text, lang, tld, slow) Google TTS requests of scripts in voices
+
+    voices are VoiceSettings; local voices are left out, their speech is not
+    cached.
+    """
+    phrases = list(dict.fromkeys(phrase for script in scripts for phrase in script_phrases(script)))
+    params = dict.fromkeys(speech.gtts_voice_params(settings.voice, settings.rate)
+                           for settings in voices if settings.engine == "gtts")
+    return [(text,) + voice for voice in params for text in phrases]
+
+
+def prewarm(scripts, voices, workers=DEFAULT_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+    """Synthesize every phrase of scripts in voices into the speech cache; returns a PrewarmReport"""
+    if not speech.speech_cache_enabled():
+        raise ValueError("Prewarming needs the speech cache (see speech.set_speech_cache_dir)")
+    started = time.perf_counter()
+    requests = gtts_requests(scripts, voices)
+    pending = [request for request in requests if not speech.gtts_cached(*request)]
+    print(f"🔥 Prewarming {len(requests)} phrase(s): {len(requests) - len(pending)} already cached, "
+          f"{len(pending)} to fetch")
+    limiter = RateLimiter(requests_per_second)
+
+    def fetch(request):
+        text, lang, tld, slow = request
+        limiter.wait()
+        return text in speech.fetch_gtts_samples([text], lang, tld, slow)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        fetched = sum(pool.map(fetch, pending))
+    return PrewarmReport(len(requests), len(requests) - len(pending), fetched, len(pending) - fetched,
+                         time.perf_counter() - started)
+
+
+class AuditionClips:
+    """The voice test sentence in every listed voice, rendered in the background"""
+
+    def __init__(self, fmt=None, text=AUDITION_TEXT):
+        self.fmt = fmt or audio_format.render_format()
+        self.text = text
+        self.thread = None
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _local_key(settings):
+        # The GUI labels local voices by display name, so they are keyed by id;
+        # rate and volume are applied at playback
+        return settings.voice_id
+
+    def start(self, voices, requests_per_second=REQUESTS_PER_SECOND):
+        """Render the clip of every VoiceSettings in voices in a daemon thread"""
+        self.thread = threading.Thread(target=self._render, args=(list(voices), requests_per_second), daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def _render(self, voices, requests_per_second):
+        try:
+            if speech.speech_cache_enabled():
+                prewarm([self.text], voices, requests_per_second=requests_per_second)
+            for settings in voices:
+                if settings.engine == "gtts" or self._local_key(settings) in self._local:
+                    continue
+                # At the default rate and volume, which apply_voice_adjustments takes as neutral
+                neutral = settings._replace(rate=speech.DEFAULT_RATE, volume=speech.DEFAULT_VOLUME)
+                clip = speech.fetch_pyttsx3_samples([self.text], neutral).get(self.text)
+                if clip is not None:
+                    with self._lock:
+                        self._local[self._local_key(settings)] = clip
+        except Exception as e:
+            print(f"⚠️ Voice audition prerender stopped: {e}")
+
+    def get(self, settings):
+        """Samples of the clip in settings, or None if it has not been rendered"""
+        if settings.engine != "gtts":
+            with self._lock:
+                clip = self._local.get(self._local_key(settings))
+            if clip is None:
+                return None
+            samples, sample_rate = clip
+        else:
+            lang, tld, slow = speech.gtts_voice_params(settings.voice, settings.rate)
+            if not speech.gtts_cached(self.text, lang, tld, slow):
+                return None
+            clip = speech.fetch_gtts_samples([self.text], lang, tld, slow).get(self.text)
+            if clip is None:
+                return None
+            (samples, sample_rate), _ = clip
+        return speech.apply_voice_adjustments(samples, sample_rate, settings.rate, settings.volume, self.fmt)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthesize script libraries into the speech cache ahead of time")
+    parser.add_argument('scripts', nargs='+', help="meditation scripts or templates")
+    parser.add_argument('--voice', action='append', help="Google TTS voice label, e.g. British (default: every voice)")
+    parser.add_argument('--rate', action='append', type=int, help=f"speech rate in WPM (default {speech.DEFAULT_RATE})")
+    parser.add_argument('--cache-dir', default=speech.DEFAULT_SPEECH_CACHE_DIR)
+    parser.add_argument('--codec', choices=sorted(segment_cache.CACHE_CODECS), default=segment_cache.DEFAULT_CODEC)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--requests-per-second', type=float, default=REQUESTS_PER_SECOND)
+    args = parser.parse_args(argv)
+
+    scripts = []
+    for filename in args.scripts:
+        with open(filename, encoding='utf-8') as f:
+            scripts.append(f.read())
+    voices = [speech.VoiceSettings("gtts", label, rate, speech.DEFAULT_VOLUME, None)
+              for label in args.voice or speech.GTTS_VOICES for rate in args.rate or [speech.DEFAULT_RATE]]
+    speech.set_speech_cache_dir(args.cache_dir, args.codec)
+    report = prewarm(scripts, voices, args.workers, args.requests_per_second)
+    print(f"✅ Fetched {report.fetched} phrase(s) in {report.seconds:.1f}s; "
+          f"{report.cached} were already cached")
+    if report.failed:
+        print(f"❌ {report.failed} phrase(s) failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
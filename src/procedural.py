@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Procedural Backgrounds
+Pure tones, binaural beats and white/pink/brown noise generated on demand, chunk
+by chunk, as audio sources (see audio_sources.py), so sessions built on them
+need no pre-rendered music file and no decode. Everything is computed from the
+absolute frame position, so any chunk can be generated on its own and the
+output is the same for a given seed however the session is chunked or seeked.
+
+Noise is a sum of octave rows of value noise: row k holds random values at
+every 2**k frames, linearly interpolated between them. The random values come
+from a counter-based hash of (seed, channel, row, knot), so no filter state
+has to be carried from one chunk to the next. Weighting the rows sets the
+spectral slope: equal row amplitudes give pink (1/f) noise, amplitudes growing
+by sqrt(2) per octave give brown (1/f^2) noise.
+
+Generators are used as soundscape layers (see soundscape.py):
+
+    {"layers": [
+        {"generator": {"type": "binaural", "frequency": 200, "beat": 6}, "gain_db": -18},
+        {"generator": {"type": "pink", "seed": 7, "modulation_rate": 0.1,
+                       "modulation_depth": 0.5}, "gain_db": -24, "fade_in": 10}
+    ]}
+"""
+
+import math
+
+import numpy as np
+
+import audio_format
+
+
+TONE_AMPLITUDE = 0.5
+NOISE_RMS = 0.25
+NOISE_OCTAVES = 16              # slowest row changes every 2**15 frames (~0.7 s at 44.1 kHz)
+NOISE_SLOPES = {'white': 0.0, 'pink': 1.0, 'brown': 2.0}
+GENERATOR_TYPES = ('sine', 'binaural') + tuple(NOISE_SLOPES)
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _mix64(value):
+    """splitmix64 finalizer of a Python int"""
+    value &= _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def hash_uniform(key, indices):
+    """Uniform values in [-1, 1) for int64 indices, a pure function of (key, index)"""
+    x = indices.astype(np.uint64) * np.uint64(_GOLDEN) + np.uint64(key)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) * (2.0 ** -52) - 1.0
+
+
+class ToneSource:
+    """A sine tone, or a binaural pair with the two tones beat Hz apart
+
+    In stereo the left ear gets frequency - beat/2 and the right ear
+    frequency + beat/2. A mono render gets both tones summed (a monaural beat).
+    """
+
+    def __init__(self, frames, frequency, beat=0.0, fmt=None, amplitude=TONE_AMPLITUDE):
+        self.frames = int(frames)
+        self.fmt = fmt or audio_format.render_format()
+        self.frequencies = (frequency - beat / 2.0, frequency + beat / 2.0) if beat else (frequency,)
+        self.amplitude = amplitude
+
+    def _tone(self, frequency, positions):
+        return np.sin((2 * math.pi * frequency / self.fmt.sample_rate) * positions)
+
+    def read(self, start, count):
+        """Return count frames starting at start, silent outside the source"""
+        positions = np.arange(start, start + count, dtype=np.float64)
+        tones = [self._tone(frequency, positions) for frequency in self.frequencies]
+        if self.fmt.channels == 2 and len(tones) == 2:
+            samples = np.stack(tones, axis=1) * self.amplitude
+        else:
+            samples = (sum(tones) * (self.amplitude / len(tones)))[:, None]
+            samples = np.repeat(samples, self.fmt.channels, axis=1)
+        samples = samples.astype(np.float32)
+        samples[:max(0, min(count, -start))] = 0.0
+        samples[max(0, self.frames - start):] = 0.0
+        return samples
+
+
+class NoiseSource:
+    """White, pink or brown noise; each channel is an independent stream of the seed"""
+
+    def __init__(self, frames, color='pink', seed=0, fmt=None, rms=NOISE_RMS, octaves=NOISE_OCTAVES):
+        if color not in NOISE_SLOPES:
+            raise ValueError(f"Unknown noise color {color!r} (choose from {', '.join(NOISE_SLOPES)})")
+        self.frames = int(frames)
+        self.fmt = fmt or audio_format.render_format()
+        self.color = color
+        self.seed = int(seed)
+        rows = 1 if color == 'white' else octaves
+        # Row k's power spreads over a band 2**-k wide, so a density of f**-slope
+        # needs amplitude**2 proportional to 2**(k * (slope - 1))
+        slope = NOISE_SLOPES[color]
+        self.row_gains = np.array([2.0 ** (k * (slope - 1) / 2.0) for k in range(rows)])
+        # Variance of a uniform row is 1/3; interpolating halves it on average to 2/9
+        variance = self.row_gains[0] ** 2 / 3.0 + np.sum(self.row_gains[1:] ** 2) * 2.0 / 9.0
+        self.row_gains *= rms / math.sqrt(variance)
+
+    def _key(self, channel, k):
+        return _mix64(self.seed * _GOLDEN + channel * 1009 + k + 1)
+
+    def _channel(self, channel, first, stop):
+        """Noise of one channel for frames [first, stop)
+
+        Row k's knots fall on row k-1's knots, and interpolating a piecewise
+        linear curve onto a finer grid reproduces it exactly, so the rows are
+        summed coarse to fine: each level interpolates the running sum onto its
+        own knots (twice as many) and adds its own values. The per-frame work
+        is then one interpolation and one row, however many octaves there are.
+        """
+        total = None
+        for k in range(len(self.row_gains) - 1, -1, -1):
+            low = first >> k
+            knots = np.arange(low, ((stop - 1) >> k) + 1 + (k > 0), dtype=np.int64)
+            level = self.row_gains[k] * hash_uniform(self._key(channel, k), knots)
+            if total is not None:
+                # Even knots sit on a coarse knot, odd ones halfway between two
+                level += 0.5 * (total[(knots >> 1) - coarse_low] + total[((knots + 1) >> 1) - coarse_low])
+            total, coarse_low = level, low
+        return total
+
+    def read(self, start, count):
+        """Return count frames starting at start, silent outside the source"""
+        samples = np.zeros((count, self.fmt.channels), dtype=np.float32)
+        first = max(start, 0)
+        stop = min(start + count, self.frames)
+        if stop <= first:
+            return samples
+        for channel in range(self.fmt.channels):
+            samples[first - start:stop - start, channel] = self._channel(channel, first, stop)
+        return samples
+
+
+class ModulatedSource:
+    """Slow amplitude modulation (tremolo) of another source
+
+    The gain swings between 1 - depth and 1 once per 1/rate_hz seconds,
+    starting at full level.
+    """
+
+    def __init__(self, source, rate_hz, depth, fmt=None):
+        if not 0.0 <= depth <= 1.0:
+            raise ValueError("Modulation depth must be between 0 and 1")
+        self.source = source
+        self.frames = source.frames
+        self.fmt = fmt or audio_format.render_format()
+        self.rate_hz = rate_hz
+        self.depth = depth
+
+    def read(self, start, count):
+        """Return count modulated frames starting at start"""
+        positions = np.arange(start, start + count, dtype=np.float64)
+        phase = (2 * math.pi * self.rate_hz / self.fmt.sample_rate) * positions
+        gain = 1.0 - self.depth * 0.5 * (1.0 - np.cos(phase))
+        return self.source.read(start, count) * gain.astype(np.float32)[:, None]
+
+
+def open_generator(spec, frames, fmt=None):
+    """Source for a generator spec such as {"type": "pink", "seed": 3, "modulation_rate": 0.1}"""
+    spec = dict(spec)
+    kind = spec.pop('type', None)
+    modulation_rate = spec.pop('modulation_rate', None)
+    modulation_depth = spec.pop('modulation_depth', 0.5)
+    try:
+        if kind in ('sine', 'binaural'):
+            source = ToneSource(frames, fmt=fmt, **spec)
+        elif kind in NOISE_SLOPES:
+            source = NoiseSource(frames, kind, fmt=fmt, **spec)
+        else:
+            raise ValueError(f"Unknown generator type {kind!r} (choose from {', '.join(GENERATOR_TYPES)})")
+    except TypeError as e:
+        raise ValueError(f"Bad {kind} generator: {e}") from None
+    if modulation_rate:
+        source = ModulatedSource(source, modulation_rate, modulation_depth, fmt)
+    return source
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Render Result Cache
+Memoizes whole renders. A render is fingerprinted by everything that
+determines its output (script text, voice settings, music file identity, mix
+gain, render format and any other option passed as extra); when the
+fingerprint matches a cached render, the existing artifact is returned
+immediately instead of redoing the pipeline.
+
+Each entry is a <fingerprint>.json record plus a hard link (or copy) of the
+output, <fingerprint>.wav, and of each compressed export written with it
+(<fingerprint>.mp3, or a <fingerprint>_hls/ folder), so retention can delete
+cached artifacts without touching the user's own output files and several
+processes can share the cache without a common index. Retention is configurable by entry count, time
+since last use and total size; the least recently used entries go first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import audio_format
+import hls_output
+import metrics
+from soundscape import is_soundscape, soundscape_identity
+
+
+DEFAULT_CACHE_DIR = os.path.join("output", ".render_cache")
+
+# filename: the artifact to use; from_cache: True when no rendering was done;
+# exports: {format: path} of the compressed copies that belong to it
+RenderResult = namedtuple('RenderResult', ['filename', 'from_cache', 'fingerprint', 'exports'])
+RenderResult.__new__.__defaults__ = ({},)
+
+RetentionPolicy = namedtuple('RetentionPolicy', ['max_entries', 'max_age_seconds', 'max_bytes'])
+RetentionPolicy.__new__.__defaults__ = (100, 30 * 24 * 3600, 10 * 2**30)
+
+
+def music_identity(music_file):
+    """Identity of a music file: path, size and modification time"""
+    if not music_file:
+        return None
+    if is_soundscape(music_file):
+        return soundscape_identity(music_file)
+    stat = os.stat(music_file)
+    return (os.path.abspath(music_file), stat.st_size, stat.st_mtime_ns)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _link_or_copy(source, target):
+    """Hard link source at target (free on the same filesystem), or copy it keeping its mtime"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _disk_size(path):
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+    return path.stat().st_size
+
+
+def render_fingerprint(meditation_text, settings, music_file=None, music_gain_db=None, fmt=None, **extra):
+    """Fingerprint of every input that determines a render's output"""
+    fmt = fmt or audio_format.render_format()
+    parts = (meditation_text, tuple(settings), music_identity(music_file), music_gain_db, tuple(fmt),
+             tuple(sorted(extra.items())))
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Fingerprint -> finished render artifact, with a retention policy"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, retention=None):
+        self.cache_dir = Path(cache_dir)
+        self.retention = retention or RetentionPolicy()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _record_file(self, fingerprint):
+        return self.cache_dir / f"{fingerprint}.json"
+
+    def _artifact_file(self, fingerprint, extension='wav'):
+        if extension == 'hls':
+            # The playlist and its segments, in a folder of their own
+            return self.cache_dir / f"{fingerprint}_hls" / hls_output.PLAYLIST_NAME
+        return self.cache_dir / f"{fingerprint}.{extension}"
+
+    def _artifacts(self, fingerprint):
+        """Every cached file and folder of an entry, except its record"""
+        return [path for path in self.cache_dir.glob(f"{fingerprint}[._]*") if path.suffix != '.json']
+
+    def lookup(self, fingerprint):
+        """RenderResult for a cached render, or None
+
+        The original output is returned while it is unchanged; if it was moved,
+        edited or deleted the cached copy is returned instead.
+        """
+        record_file = self._record_file(fingerprint)
+        artifact = self._artifact_file(fingerprint)
+        try:
+            record = json.loads(record_file.read_text())
+            artifact_stat = os.stat(artifact)
+        except (OSError, ValueError):
+            metrics.record_cache('render', False)
+            return None
+        signature = (record['bytes'], record['mtime_ns'])
+        expired = time.time() - os.path.getmtime(record_file) > self.retention.max_age_seconds
+        # A hard-linked artifact changes if the output is rewritten in place; never serve that
+        if (expired or (artifact_stat.st_size, artifact_stat.st_mtime_ns) != signature
+                or not all(self._artifact_file(fingerprint, extension).exists()
+                           for extension in record.get('exports', {}))):
+            self._remove(fingerprint)
+            metrics.record_cache('render', False)
+            return None
+
+        os.utime(record_file)  # record mtime tracks last use for LRU eviction
+        metrics.record_cache('render', True)
+        filename = str(artifact)
+        try:
+            output_stat = os.stat(record['output'])
+            if (output_stat.st_size, output_stat.st_mtime_ns) == signature:
+                filename = record['output']
+        except OSError:
+            pass
+        exports = {}
+        for extension, export in record.get('exports', {}).items():
+            # The user's copy while it is unchanged, like the master
+            try:
+                unchanged = list(_signature(export['output'])) == export['signature']
+            except OSError:
+                unchanged = False
+            exports[extension] = export['output'] if unchanged else str(self._artifact_file(fingerprint, extension))
+        print(f"⚡ Render served from cache: {filename}")
+        return RenderResult(filename, True, fingerprint, exports)
+
+    def _store_export(self, fingerprint, extension, export):
+        """Cache one export next to the master; its record entry"""
+        target = self._artifact_file(fingerprint, extension)
+        if extension == 'hls':
+            temp_dir = f"{target.parent}.tmp{os.getpid()}"
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            shutil.copytree(os.path.dirname(export), temp_dir, copy_function=_link_or_copy)
+            shutil.rmtree(target.parent, ignore_errors=True)
+            os.replace(temp_dir, target.parent)
+        else:
+            temp_file = f"{target}.tmp{os.getpid()}"
+            _link_or_copy(export, temp_file)
+            os.replace(temp_file, target)
+        return {'output': os.path.abspath(export), 'signature': list(_signature(export))}
+
+    def store(self, fingerprint, output_file, exports=None):
+        """Remember output_file, and the {format: path} exports written with it, as the result for fingerprint
+
+        Returns a RenderResult.
+        """
+        artifact = self._artifact_file(fingerprint)
+        temp_artifact = f"{artifact}.tmp{os.getpid()}"
+        stat = os.stat(output_file)
+        _link_or_copy(output_file, temp_artifact)
+        os.replace(temp_artifact, artifact)
+        exports = dict(exports or {})
+
+        record = {
+            'output': os.path.abspath(output_file),
+            'mtime_ns': stat.st_mtime_ns,
+            'bytes': stat.st_size,
+            'created': time.time(),
+            'exports': {extension: self._store_export(fingerprint, extension, export)
+                        for extension, export in exports.items()},
+        }
+        record_file = self._record_file(fingerprint)
+        temp_record = f"{record_file}.tmp{os.getpid()}"
+        with open(temp_record, 'w') as f:
+            json.dump(record, f)
+        os.replace(temp_record, record_file)
+        self.prune()
+        return RenderResult(output_file, False, fingerprint, exports)
+
+    def _remove(self, fingerprint):
+        for path in [self._record_file(fingerprint)] + self._artifacts(fingerprint):
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        """[(fingerprint, last_used, bytes)] of cached renders, most recently used first"""
+        entries = []
+        for record_file in self.cache_dir.glob("*.json"):
+            fingerprint = record_file.stem
+            if not self._artifact_file(fingerprint).exists():
+                continue
+            try:
+                last_used = os.path.getmtime(record_file)
+                size = sum(_disk_size(path) for path in self._artifacts(fingerprint))
+            except OSError:
+                continue
+            entries.append((fingerprint, last_used, size))
+        return sorted(entries, key=lambda entry: -entry[1])
+
+    def prune(self):
+        """Apply the retention policy; returns the number of renders evicted"""
+        policy = self.retention
+        now = time.time()
+        kept_bytes = 0
+        evicted = 0
+        for index, (fingerprint, last_used, size) in enumerate(self.entries()):
+            if (index >= policy.max_entries or now - last_used > policy.max_age_seconds
+                    or kept_bytes + size > policy.max_bytes):
+                self._remove(fingerprint)
+                evicted += 1
+            else:
+                kept_bytes += size
+        if evicted:
+            print(f"🧹 Render cache: evicted {evicted} render(s)")
+        return evicted
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Render Farm
+Distributes render jobs over a local process pool and any number of remote
+workers that share a job directory and a cache directory (e.g. over NFS).
+
+Job directory layout: a job is a JSON file that moves pending/ -> running/ ->
+done/ (or failed/). Workers claim a job by renaming it into running/; rename
+is atomic, so exactly one worker wins. The worker keeps touching the running
+file while it renders, so requeue_stale only moves jobs whose worker stopped.
+
+Cache layout: every entry is written to a temporary name and renamed into
+place, so a file that exists is complete and readers never lock. Synthesis of
+a segment is guarded by an O_EXCL lock file, so when several workers need the
+same phrase one synthesizes it and the others wait for the cached result. The
+holder refreshes its lock while it synthesizes; locks left by a crashed worker
+expire after LOCK_STALE_SECONDS and are broken by renaming them away, so only
+one waiter takes over, and a worker only removes a lock holding its own token.
+
+    python src/render_farm.py submit --jobs /shared/jobs script.txt --music rain.wav
+    python src/render_farm.py worker --jobs /shared/jobs --processes 8
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import audio_format
+import metrics
+import mixer
+import speech
+from checkpoint import settings_hash
+from meditation_script import parse_meditation_text
+from render_cache import RenderCache, RenderResult, render_fingerprint
+from soundscape import is_soundscape
+
+
+LOCK_STALE_SECONDS = 120.0
+LOCK_POLL_SECONDS = 0.2
+HEARTBEAT_SECONDS = 10.0        # how often locks and running jobs are touched; keep well below the stale ages
+JOB_STATES = ('pending', 'running', 'done', 'failed')
+
+
+def worker_name():
+    """Identifies this worker in lock files and job records"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _temp_name(path):
+    return f"{path}.tmp-{worker_name()}"
+
+
+def write_json_atomic(path, data):
+    """Write JSON so other hosts see the old file or the new one, never a partial one"""
+    temp_file = _temp_name(path)
+    with open(temp_file, 'w') as f:
+        json.dump(data, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+
+class _Heartbeat:
+    """Touches path every HEARTBEAT_SECONDS from a thread while the with block runs"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return  # taken over or requeued; nothing left to keep alive
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def _read_token(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class SharedCache:
+    """Content-addressed cache of canonical audio that tolerates concurrent writers"""
+
+    def __init__(self, cache_dir, fmt=None):
+        self.cache_dir = Path(cache_dir)
+        self.fmt = fmt or audio_format.render_format()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = self.misses = self.waits = 0
+
+    def path(self, namespace, *key):
+        digest = settings_hash(namespace, self.fmt, *key)
+        return self.cache_dir / namespace / digest[:2] / f"{digest}.wav"
+
+    def get(self, namespace, *key):
+        """Cached file path or None; no lock needed because entries appear by rename"""
+        path = self.path(namespace, *key)
+        return str(path) if path.exists() else None
+
+    def put(self, samples, namespace, *key):
+        """Store canonical samples under key with an atomic rename"""
+        path = self.path(namespace, *key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = _temp_name(path)
+        audio_format.write_wav(temp_file, samples, self.fmt)
+        os.replace(temp_file, path)
+        return str(path)
+
+    def _try_lock(self, lock_path):
+        """The token written into a new lock file, or None if the lock is held"""
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        token = f"{worker_name()}-{uuid.uuid4().hex}"
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        return token
+
+    def _break_stale(self, lock_path):
+        """Move a lock that stopped being refreshed out of the way; True if it is gone"""
+        token = _read_token(lock_path)
+        try:
+            if token is None or time.time() - os.path.getmtime(lock_path) <= LOCK_STALE_SECONDS:
+                return token is None
+            # Rename is atomic: of several waiters that saw the same stale lock, one moves it
+            broken = f"{lock_path}.stale-{uuid.uuid4().hex}"
+            os.rename(lock_path, broken)
+        except FileNotFoundError:
+            return True  # released, or broken by another waiter
+        if _read_token(broken) != token:
+            # Another waiter broke the stale lock and locked again in between: put its lock back
+            try:
+                os.link(broken, lock_path)
+            except FileExistsError:
+                pass
+            os.unlink(broken)
+            return False
+        print(f"⚠️ Breaking stale cache lock {lock_path}")
+        os.unlink(broken)
+        return True
+
+    def _release(self, lock_path, token):
+        """Remove the lock if it is still ours (it may have been broken and taken over)"""
+        if _read_token(lock_path) == token:
+            try:
+                os.unlink(lock_path)
+            except FileNotFoundError:
+                pass
+
+    def get_or_create(self, produce, namespace, *key):
+        """Cached path for key, calling produce() -> samples (or None) at most once across workers
+
+        While one worker produces an entry, others with the same key wait for it
+        instead of duplicating the work. None from produce() is not cached and
+        returns None, so the next request tries again.
+        """
+        path = self.path(namespace, *key)
+        if path.exists():
+            self.hits += 1
+            metrics.record_cache('shared', True)
+            return str(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = f"{path}.lock"
+        waited = False
+        while True:
+            token = self._try_lock(lock_path)
+            if token:
+                break
+            if path.exists():
+                self.hits += 1
+                self.waits += waited
+                metrics.record_cache('shared', True)
+                return str(path)
+            waited = True
+            if not self._break_stale(lock_path):
+                time.sleep(LOCK_POLL_SECONDS)
+
+        try:
+            if path.exists():  # finished by another worker just before we locked
+                self.hits += 1
+                metrics.record_cache('shared', True)
+                return str(path)
+            self.misses += 1
+            metrics.record_cache('shared', False)
+            with _Heartbeat(lock_path):
+                samples = produce()
+            return None if samples is None else self.put(samples, namespace, *key)
+        finally:
+            self._release(lock_path, token)
+
+
+def _synthesize(text, settings, fmt):
+    """Speech samples for text, or None if every engine failed (never cached silence)"""
+    if settings.engine == "gtts":
+        try:
+            return speech.synthesize_gtts(text, settings, fmt)
+        except Exception as e:
+            print(f"❌ Google TTS failed: {e}")
+            print("🔄 Falling back to local TTS...")
+            metrics.GTTS_FALLBACKS.inc()
+    try:
+        return speech.synthesize_pyttsx3(text, settings, fmt)
+    except Exception as e:
+        print(f"❌ Local TTS failed: {e}")
+        return None
+
+
+def _place_output(source, filename):
+    """Put a copy of source at filename atomically (a hard link when possible)"""
+    temp_file = _temp_name(filename)
+    try:
+        os.link(source, temp_file)
+    except OSError:
+        shutil.copyfile(source, temp_file)
+    os.replace(temp_file, filename)
+
+
+def render_job(job, cache, output_dir, render_cache=None):
+    """Render one job description to its output file; returns a RenderResult
+
+    With a render_cache, a job identical to an earlier one gets the earlier
+    output (from_cache=True) without any synthesis or mixing.
+    """
+    fmt = cache.fmt
+    settings = speech.VoiceSettings(**job['settings'])
+    filename = str(Path(output_dir) / job.get('output', f"{job['id']}.wav"))
+    fingerprint = render_fingerprint(job['text'], settings, job.get('music_file'),
+                                     job.get('music_gain_db', mixer.DEFAULT_MUSIC_GAIN_DB), fmt)
+    cached = render_cache.lookup(fingerprint) if render_cache else None
+    if cached:
+        if os.path.abspath(cached.filename) != os.path.abspath(filename):
+            _place_output(cached.filename, filename)
+        return RenderResult(filename, True, fingerprint)
+
+    audio_segments = []
+    for segment_type, content in parse_meditation_text(job['text']):
+        if segment_type == 'pause':
+            audio_segments.append(('pause', content))
+            continue
+        segment_file = cache.get_or_create(lambda: _synthesize(content, settings, fmt),
+                                           'segments', settings, content)
+        if segment_file:
+            audio_segments.append(('audio', segment_file))
+        else:
+            print("🔇 Using silence for a segment no engine could synthesize")
+            metrics.SILENT_FALLBACKS.inc()
+            audio_segments.append(('samples', audio_format.silence(len(content.split()) * 0.5, fmt)))
+
+    voice_track = mixer.build_voice_track(audio_segments, fmt)
+    mix = voice_track
+    if is_soundscape(job.get('music_file')):
+        mix = mixer.mix_voice_with_soundscape(voice_track, job['music_file'], fmt,
+                                              job.get('music_gain_db', mixer.DEFAULT_MUSIC_GAIN_DB))
+    elif job.get('music_file'):
+        music_file = os.path.abspath(job['music_file'])
+        stat = os.stat(music_file)
+        music_path = cache.get_or_create(lambda: mixer.load_background_music(music_file, fmt),
+                                         'music', music_file, stat.st_size, stat.st_mtime_ns)
+        background = audio_format.load_audio(music_path, fmt)
+        mix = mixer.mix_voice_with_background(
+            voice_track, background, job.get('music_gain_db', mixer.DEFAULT_MUSIC_GAIN_DB), fmt
+        )
+
+    temp_file = _temp_name(filename)
+    mixer.export_mix(mix, temp_file, fmt)
+    os.replace(temp_file, filename)  # readers of the output folder never see half a file
+    if render_cache:
+        return render_cache.store(fingerprint, filename)
+    return RenderResult(filename, False, fingerprint)
+
+
+class RenderFarm:
+    """A shared job directory plus the workers that drain it"""
+
+    def __init__(self, job_dir, cache_dir=None, output_dir="output", retention=None):
+        self.job_dir = Path(job_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else self.job_dir / 'cache'
+        self.output_dir = Path(output_dir)
+        # Finished renders for repeated identical jobs; None keeps the default policy
+        self.retention = retention
+        for state in JOB_STATES:
+            (self.job_dir / state).mkdir(parents=True, exist_ok=True)
+        metrics.QUEUE_DEPTH.set_function(lambda: self.status()['pending'], queue='farm')
+
+    def submit(self, meditation_text, settings, music_file=None, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+               output=None):
+        """Queue a job; returns its id"""
+        job_id = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_" \
+                 f"{settings_hash(meditation_text, settings, music_file, music_gain_db, time.time_ns())[:8]}"
+        job = {
+            'id': job_id,
+            'text': meditation_text,
+            'settings': settings._asdict(),
+            'music_file': os.path.abspath(music_file) if music_file else None,
+            'music_gain_db': music_gain_db,
+        }
+        if output:
+            job['output'] = output
+        write_json_atomic(self.job_dir / 'pending' / f"{job_id}.json", job)
+        return job_id
+
+    def claim(self):
+        """Atomically take the oldest pending job, or None when the queue is empty"""
+        for name in sorted(os.listdir(self.job_dir / 'pending')):
+            if not name.endswith('.json'):
+                continue
+            running = self.job_dir / 'running' / name
+            try:
+                os.rename(self.job_dir / 'pending' / name, running)
+            except FileNotFoundError:
+                continue  # another worker claimed it first
+            with open(running) as f:
+                job = json.load(f)
+            # The claim token tells this worker's running file from a later claim of a requeued job;
+            # rewriting it also resets the mtime requeue_stale goes by
+            job['claim'] = f"{worker_name()}-{uuid.uuid4().hex}"
+            write_json_atomic(running, job)
+            return job
+        return None
+
+    def requeue_stale(self, max_age_seconds):
+        """Move jobs whose worker has been silent too long back to pending/
+
+        Workers touch their running file every HEARTBEAT_SECONDS, so
+        max_age_seconds only has to be a few heartbeats, not the longest render.
+        """
+        requeued = 0
+        for name in os.listdir(self.job_dir / 'running'):
+            running = self.job_dir / 'running' / name
+            try:
+                if time.time() - os.path.getmtime(running) > max_age_seconds:
+                    os.rename(running, self.job_dir / 'pending' / name)
+                    requeued += 1
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def _finish(self, job, state, **fields):
+        """Record a job's outcome, also when it was requeued while this worker rendered it"""
+        name = f"{job['id']}.json"
+        job.update(fields, worker=worker_name())
+        if state == 'done' or not (self.job_dir / 'done' / name).exists():
+            write_json_atomic(self.job_dir / state / name, job)
+        if state == 'done':
+            try:
+                os.unlink(self.job_dir / 'pending' / name)  # a requeued copy needs no second render
+            except FileNotFoundError:
+                pass
+        running = self.job_dir / 'running' / name
+        try:
+            with open(running) as f:
+                claim = json.load(f).get('claim')
+        except (FileNotFoundError, ValueError):
+            return
+        if claim == job.get('claim'):  # not a later claim of the requeued job by another worker
+            try:
+                os.unlink(running)
+            except FileNotFoundError:
+                pass
+
+    def work(self, idle_timeout=0.0):
+        """Process jobs until none has been pending for idle_timeout seconds; returns jobs done"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        cache = SharedCache(self.cache_dir)
+        render_cache = RenderCache(self.cache_dir / 'renders', self.retention)
+        done = 0
+        idle_since = time.time()
+        while True:
+            job = self.claim()
+            if job is None:
+                if time.time() - idle_since >= idle_timeout:
+                    break
+                time.sleep(LOCK_POLL_SECONDS)
+                continue
+            print(f"🏭 {worker_name()} rendering job {job['id']}")
+            try:
+                with _Heartbeat(self.job_dir / 'running' / f"{job['id']}.json"):
+                    result = render_job(job, cache, self.output_dir, render_cache)
+                self._finish(job, 'done', output=result.filename, from_cache=result.from_cache)
+                done += 1
+            except Exception as e:
+                print(f"❌ Job {job['id']} failed: {e}")
+                self._finish(job, 'failed', error=str(e))
+            idle_since = time.time()
+        print(f"🏁 {worker_name()}: {done} job(s), cache {cache.hits} hit(s), {cache.misses} miss(es), "
+              f"{cache.waits} wait(s) for other workers")
+        return done
+
+    def run_local(self, processes=None, idle_timeout=0.0):
+        """Drain the queue with a pool of local worker processes; returns jobs done"""
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_work, str(self.job_dir), str(self.cache_dir), str(self.output_dir),
+                                   self.retention, idle_timeout)
+                       for _ in range(processes)]
+            return sum(future.result() for future in futures)
+
+    def status(self):
+        """Number of jobs in each state"""
+        return {state: sum(1 for name in os.listdir(self.job_dir / state) if name.endswith('.json'))
+                for state in JOB_STATES}
+
+
+def _work(job_dir, cache_dir, output_dir, retention, idle_timeout):
+    """Process pool entry point"""
+    return RenderFarm(job_dir, cache_dir, output_dir, retention).work(idle_timeout)
+
+
+def main():
+    """Submit jobs to, or run workers for, a shared job directory"""
+    parser = argparse.ArgumentParser(description="Distributed meditation rendering")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help="queue a script for rendering")
+    submit.add_argument('script', help="meditation text file")
+    submit.add_argument('--music', help="background music file")
+    submit.add_argument('--music-gain-db', type=float, default=mixer.DEFAULT_MUSIC_GAIN_DB)
+    submit.add_argument('--engine', default="gtts", choices=["gtts", "pyttsx3"])
+    submit.add_argument('--voice', default="English (US)")
+    submit.add_argument('--rate', type=int, default=speech.DEFAULT_RATE)
+    submit.add_argument('--volume', type=float, default=speech.DEFAULT_VOLUME)
+
+    worker = commands.add_parser('worker', help="render queued jobs")
+    worker.add_argument('--cache', help="shared cache directory (default: <jobs>/cache)")
+    worker.add_argument('--output', default="output")
+    worker.add_argument('--processes', type=int, default=None)
+    worker.add_argument('--idle-timeout', type=float, default=0.0,
+                        help="keep polling for new jobs this long before exiting")
+    worker.add_argument('--requeue-after', type=float, default=None,
+                        help="first requeue jobs running longer than this many seconds")
+    worker.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics of this worker on this port")
+    worker.add_argument('--metrics-host', default=metrics.DEFAULT_HOST,
+                        help="interface for the metrics endpoint; 0.0.0.0 exposes it to the network")
+
+    for command in (submit, worker):
+        command.add_argument('--jobs', required=True, help="shared job directory")
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        settings = speech.VoiceSettings(args.engine, args.voice, args.rate, args.volume, None)
+        farm = RenderFarm(args.jobs)
+        print(farm.submit(Path(args.script).read_text(), settings, args.music, args.music_gain_db))
+    else:
+        farm = RenderFarm(args.jobs, args.cache, args.output)
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port, args.metrics_host)
+        if args.requeue_after is not None:
+            print(f"🔁 Requeued {farm.requeue_stale(args.requeue_after)} stale job(s)")
+        farm.run_local(args.processes, args.idle_timeout)
+        print(farm.status())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Compressed Segment Cache
+Keeps decoded speech clips on disk in a compressed format, with an in-memory
+hot tier in front. Clips are stored as FLAC by default: lossless, and about
+half the size of 16-bit WAV for speech. They can also be stored as Opus or
+MP3 when disk matters more than bit-exactness; at the bitrates here that
+holds roughly ten to twenty times more phrases than WAV.
+The most recently used clips stay decoded in memory up to a byte budget, so
+a warm render decodes nothing, and clips that are not in memory are decoded
+together in one batch (see decode_service.py).
+
+FLAC is written in-process by soundfile when it is installed, otherwise by
+ffmpeg; the lossy codecs need ffmpeg. Without an encoder for the chosen codec
+clips are stored as WAV. Entries written with another codec (such as the WAVs
+of an older cache) are still read.
+
+Report the size and decode speed of a cache, or convert it to another codec:
+
+    python src/segment_cache.py output/.speech_cache
+    python src/segment_cache.py output/.speech_cache --recompress opus
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import wave
+from collections import OrderedDict, namedtuple
+
+import audio_format
+import decode_service
+import metrics
+
+
+# ffmpeg output arguments per codec; the key is also the file extension
+CACHE_CODECS = {
+    'wav': None,
+    'flac': ['-c:a', 'flac', '-f', 'flac'],
+    'opus': ['-c:a', 'libopus', '-b:a', '32k', '-f', 'opus'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3'],
+}
+DEFAULT_CODEC = 'flac'
+HOT_TIER_BYTES = 64 * 2**20
+
+CacheBenchmark = namedtuple('CacheBenchmark', ['clips', 'stored_bytes', 'pcm_bytes', 'audio_seconds',
+                                               'decode_seconds'])
+
+
+def _wav_bytes(samples, sample_rate):
+    buffer = io.BytesIO()
+    audio_format.write_wav(buffer, samples, audio_format.RenderFormat(sample_rate, samples.shape[1], 'float32'))
+    return buffer.getvalue()
+
+
+def encode_clip(samples, sample_rate, codec):
+    """samples as a file in codec, or None if no encoder for it is available"""
+    if codec == 'wav':
+        return _wav_bytes(samples, sample_rate)
+    soundfile = decode_service._soundfile()
+    if codec == 'flac' and soundfile is not None:
+        buffer = io.BytesIO()
+        soundfile.write(buffer, samples, sample_rate, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue()
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    result = subprocess.run(
+        [ffmpeg, '-v', 'error', '-nostdin', '-f', 's16le', '-ar', str(sample_rate), '-ac', str(samples.shape[1]),
+         '-i', 'pipe:0'] + CACHE_CODECS[codec] + ['pipe:1'],
+        input=audio_format.float_to_pcm16(samples), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        print(f"⚠️ {codec.upper()} encode failed: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+def _decode_files(filenames):
+    """Decode cache files in one batch; (samples, sample_rate) or None each"""
+    results = [None] * len(filenames)
+    compressed = []
+    for index, filename in enumerate(filenames):
+        if filename.endswith('.wav'):
+            try:
+                results[index] = audio_format.read_wav(filename)
+            except (OSError, EOFError, ValueError, wave.Error):
+                pass
+        else:
+            compressed.append(index)
+    if compressed:
+        decoded = decode_service.decode_many([filenames[index] for index in compressed])
+        for index, result in zip(compressed, decoded):
+            results[index] = result
+    return results
+
+
+class SegmentCache:
+    """Clips by key: an in-memory LRU tier over compressed files in cache_dir"""
+
+    def __init__(self, cache_dir, codec=DEFAULT_CODEC, hot_bytes=HOT_TIER_BYTES):
+        if codec not in CACHE_CODECS:
+            raise ValueError(f"Unknown cache codec {codec!r} (choose from {', '.join(CACHE_CODECS)})")
+        self.cache_dir = cache_dir
+        self.codec = codec
+        self.hot_bytes = hot_bytes
+        self._hot = OrderedDict()
+        self._hot_size = 0
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def _stem(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _stored_file(self, key):
+        """The file holding key, whichever codec wrote it, or None"""
+        stem = self._stem(key)
+        for codec in [self.codec] + [codec for codec in CACHE_CODECS if codec != self.codec]:
+            if os.path.exists(f"{stem}.{codec}"):
+                return f"{stem}.{codec}"
+        return None
+
+    def _remember(self, key, clip):
+        with self._lock:
+            if key in self._hot:
+                self._hot_size -= self._hot.pop(key)[0].nbytes
+            if clip[0].nbytes > self.hot_bytes:
+                return
+            self._hot[key] = clip
+            self._hot_size += clip[0].nbytes
+            while self._hot_size > self.hot_bytes:
+                _, (samples, _) = self._hot.popitem(last=False)
+                self._hot_size -= samples.nbytes
+
+    def get_many(self, keys):
+        """{key: (samples, sample_rate)} for the keys that are cached"""
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._hot:
+                    self._hot.move_to_end(key)
+                    results[key] = self._hot[key]
+        cold = [key for key in dict.fromkeys(keys) if key not in results]
+        for key in dict.fromkeys(keys):
+            metrics.record_cache('speech_hot', key in results)
+        files = {key: self._stored_file(key) for key in cold}
+        stored = [key for key in cold if files[key]]
+        for key, clip in zip(stored, _decode_files([files[key] for key in stored])):
+            if clip is not None:
+                results[key] = clip
+                self._remember(key, clip)
+        for key in dict.fromkeys(keys):
+            metrics.record_cache('speech', key in results)
+        return results
+
+    def __contains__(self, key):
+        """True if key is cached, without decoding it"""
+        with self._lock:
+            if key in self._hot:
+                return True
+        return self._stored_file(key) is not None
+
+    def get(self, key):
+        """(samples, sample_rate) of key, or None"""
+        return self.get_many([key]).get(key)
+
+    def put(self, key, samples, sample_rate):
+        """Store a clip in the hot tier and on disk"""
+        self._remember(key, (samples, sample_rate))
+        codec = self.codec
+        data = encode_clip(samples, sample_rate, codec)
+        if data is None:
+            if not self._warned:
+                print(f"⚠️ No {codec.upper()} encoder available - caching segments as WAV")
+                self._warned = True
+            codec, data = 'wav', _wav_bytes(samples, sample_rate)
+        stem = self._stem(key)
+        os.makedirs(os.path.dirname(stem), exist_ok=True)
+        temp_file = f"{stem}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, f"{stem}.{codec}")
+        for other in CACHE_CODECS:
+            if other != codec and os.path.exists(f"{stem}.{other}"):
+                os.remove(f"{stem}.{other}")
+
+
+def _cache_files(cache_dir):
+    for directory, _, names in os.walk(cache_dir):
+        for name in sorted(names):
+            if os.path.splitext(name)[1][1:] in CACHE_CODECS:
+                yield os.path.join(directory, name)
+
+
+def benchmark(cache_dir):
+    """Compression ratio and decode speed of every clip in cache_dir; returns a CacheBenchmark"""
+    files = list(_cache_files(cache_dir))
+    start = time.perf_counter()
+    decoded = _decode_files(files)
+    decode_seconds = time.perf_counter() - start
+    clips = [(filename, clip) for filename, clip in zip(files, decoded) if clip is not None]
+    return CacheBenchmark(
+        len(clips),
+        sum(os.path.getsize(filename) for filename, _ in clips),
+        sum(samples.shape[0] * samples.shape[1] * 2 + 44 for _, (samples, _) in clips),
+        sum(samples.shape[0] / float(rate) for _, (samples, rate) in clips),
+        decode_seconds,
+    )
+
+
+def recompress(cache_dir, codec):
+    """Rewrite every clip in cache_dir with codec; returns the number of clips converted"""
+    converted = 0
+    for filename in list(_cache_files(cache_dir)):
+        stem, extension = os.path.splitext(filename)
+        if extension[1:] == codec:
+            continue
+        clip = _decode_files([filename])[0]
+        data = clip and encode_clip(clip[0], clip[1], codec)
+        if data is None:
+            continue
+        temp_file = f"{stem}.tmp{os.getpid()}"
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, f"{stem}.{codec}")
+        os.remove(filename)
+        converted += 1
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report or convert a compressed segment cache")
+    parser.add_argument('cache_dir')
+    parser.add_argument('--recompress', choices=sorted(CACHE_CODECS), help="convert every clip to this codec")
+    args = parser.parse_args(argv)
+    if args.recompress:
+        print(f"🗜️ Converted {recompress(args.cache_dir, args.recompress)} clip(s) to {args.recompress.upper()}")
+    report = benchmark(args.cache_dir)
+    if not report.clips:
+        print("📭 No cached clips")
+        return 0
+    print(f"📊 {report.clips} clips, {report.audio_seconds / 60:.1f} minutes of speech")
+    print(f"🗜️ {report.stored_bytes / 2**20:.1f} MB on disk vs {report.pcm_bytes / 2**20:.1f} MB as 16-bit WAV "
+          f"(ratio {report.pcm_bytes / max(1, report.stored_bytes):.1f}x)")
+    print(f"⚡ Decoded in {report.decode_seconds:.2f}s: "
+          f"{report.audio_seconds / max(report.decode_seconds, 1e-9):.0f}x realtime, "
+          f"{report.pcm_bytes / 2**20 / max(report.decode_seconds, 1e-9):.0f} MB/s of PCM")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Sharded Rendering
+Mixes a long session on every core. The timeline is split into time ranges
+(shards) whose boundaries fall in the pauses between phrases where possible,
+and a process pool mixes the shards into their place in one preallocated WAV.
+
+Every source behind the session's MixSource (voice clips, crossfade-looped
+music, soundscape layers, generators, ducking) computes a frame from its
+absolute position, so a shard mixed on its own is sample-for-sample the same
+as that range of a sequential render: there is nothing to align or crossfade
+where shards meet. Audio decoded into memory (music that cannot be streamed
+from disk, voice synthesized in memory) is placed in shared memory once and
+attached by the workers instead of being copied to each of them.
+
+With a LoudnessTarget each shard is metered separately; the shards start on
+100 ms sub-block boundaries and bring their K-weighting filters and
+true-peak context up from their neighbours, so the combined measurement
+equals a sequential one.
+"""
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import audio_format
+import metrics
+import mixer
+from audio_sources import ArraySource, MixSource
+from loudness import (LoudnessMeter, K_WEIGHTING_SETTLE_SECONDS, SUB_BLOCK_SECONDS, combine as combine_analyses,
+                      report as loudness_report)
+from encoder_tee import EncoderTee
+from chunked_render import (BoundedRenderer, RenderReport, DEFAULT_CHUNK_SECONDS, MIN_CHUNK_SECONDS,
+                            CHUNK_WORKING_SET, current_rss, format_rss)
+
+
+MIN_SHARD_SECONDS = 60.0
+SHARDS_PER_WORKER = 2           # spare shards even out workers that draw busier stretches
+SHARE_MIN_BYTES = 1 * 2**20     # smaller arrays are cheaper to pickle than to share
+WAV_HEADER_BYTES = 44
+CONTEXT_FRAMES = 1024           # clips this close to a shard are kept for its true-peak context
+
+
+def _attach(name):
+    """Attach to a shared memory block without registering it with the resource tracker
+
+    The renderer that created the block tracks and unlinks it. Its workers
+    share its tracker, which keeps one entry per name: an attach that
+    registered would leave the block to be unlinked by whichever process
+    unregisters first, and unregistering after the attach would drop the
+    creator's entry.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedArraySource(ArraySource):
+    """ArraySource over a shared memory block; pickles by block name, so workers attach instead of copying"""
+
+    def __init__(self, name, shape, dtype):
+        self.name, self.shape, self.dtype = name, tuple(shape), dtype
+        self.block = _attach(name)
+        super().__init__(np.ndarray(self.shape, dtype=dtype, buffer=self.block.buf))
+
+    def __reduce__(self):
+        return SharedArraySource, (self.name, self.shape, self.dtype)
+
+
+def shard_boundaries(session, first_frame, last_frame, shards, align):
+    """Shard edges in [first_frame, last_frame], moved into the nearest pause and aligned to align frames"""
+    edges = [first_frame]
+    for index in range(1, shards):
+        ideal = first_frame + (last_frame - first_frame) * index // shards
+        clip = int(np.searchsorted(session.ends, ideal, side='right'))
+        if clip < len(session.starts) and session.starts[clip] < ideal:
+            # Inside a phrase: take the closer of the pauses before and after it
+            before, after = int(session.starts[clip]), int(session.ends[clip])
+            ideal = before if ideal - before <= after - ideal else after
+        edge = ideal - (ideal - first_frame) % align
+        if edges[-1] < edge < last_frame:
+            edges.append(edge)
+    return edges + [last_frame]
+
+
+def _excerpt(session, first, stop, settle_frames=0):
+    """The session with only the clips sounding in or next to [first, stop), or settle_frames before it"""
+    begin = int(np.searchsorted(session.ends, first - CONTEXT_FRAMES - settle_frames, side='right'))
+    end = int(np.searchsorted(session.starts, stop + CONTEXT_FRAMES, side='left'))
+    return MixSource(session.clips[begin:end], session.frames, session.channels, session.background,
+                     session.background_gain, session.voice_gain)
+
+
+def _stream_to(tee, master, first, stop, chunk_frames, channels):
+    """Feed frames [first, stop) of the master's data to tee, chunk by chunk"""
+    master.seek(WAV_HEADER_BYTES + first * channels * 2)
+    for start in range(first, stop, chunk_frames):
+        tee.write(master.read(min(chunk_frames, stop - start) * channels * 2))
+
+
+def _render_shard(session, filename, first, stop, span, chunk_frames, min_chunk_frames, budget, fmt, measure):
+    """Mix frames [first, stop) into filename, which holds the frames span = (start, end) of session
+
+    The worker may grow by budget bytes over its RSS when the shard starts;
+    past that chunks are halved down to min_chunk_frames, then MemoryError
+    is raised, as in BoundedRenderer.render. Returns (chunks, Analysis or
+    None, peak RSS).
+    """
+    base, end = span
+    meter = LoudnessMeter.for_range(session, first, fmt.sample_rate, fmt.channels, base) if measure else None
+    chunks = 0
+    baseline = peak = current_rss()
+    # Shards cover disjoint byte ranges of the preallocated file, so each worker seeks once and writes on
+    with open(filename, 'r+b') as output:
+        output.seek(WAV_HEADER_BYTES + (first - base) * fmt.channels * 2)
+        position = first
+        while position < stop:
+            count = min(chunk_frames, stop - position)
+            chunk = session.read(position, count)
+            output.write(audio_format.float_to_pcm16(chunk))
+            if meter is not None:
+                meter.add(chunk)
+            del chunk
+            position += count
+            chunks += 1
+
+            rss = current_rss()
+            if rss is None:
+                continue
+            peak = max(peak, rss)
+            if rss - baseline > budget:
+                gc.collect()
+                if chunk_frames > min_chunk_frames:
+                    chunk_frames = max(min_chunk_frames, chunk_frames // 2)
+                    print(f"⚠️ Shard over its memory budget, shrinking chunks to "
+                          f"{chunk_frames / fmt.sample_rate:.1f}s")
+                elif current_rss() - baseline > budget:
+                    raise MemoryError(
+                        f"Shard exceeded its memory budget: {(rss - baseline) / 2**20:.0f} MB > "
+                        f"{budget / 2**20:.0f} MB"
+                    )
+    return chunks, meter.range_result(session, stop, end) if meter is not None else None, peak
+
+
+class ShardedRenderer(BoundedRenderer):
+    """BoundedRenderer that mixes time shards in parallel processes
+
+    The memory budget is shared by all workers: each one gets an equal share
+    of the headroom left when the render starts, and holds its shards to it.
+    """
+
+    def __init__(self, memory_budget_bytes, fmt=None, workers=None, chunk_seconds=DEFAULT_CHUNK_SECONDS,
+                 spill_dir=None, analysis_cache_dir=None):
+        super().__init__(memory_budget_bytes, fmt, chunk_seconds, spill_dir, analysis_cache_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self._blocks = []
+
+    def _array_source(self, samples):
+        if self.workers == 1 or samples.nbytes < SHARE_MIN_BYTES:
+            return ArraySource(samples)
+        block = shared_memory.SharedMemory(create=True, size=samples.nbytes)
+        self._blocks.append(block)
+        np.ndarray(samples.shape, dtype=samples.dtype, buffer=block.buf)[:] = samples
+        return SharedArraySource(block.name, samples.shape, samples.dtype.str)
+
+    def _release_blocks(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def render(self, audio_segments, music_file, filename, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+               loop_points=None, start_seconds=0.0, end_seconds=None, loudness=None, exports=()):
+        """Render like BoundedRenderer.render, mixing shards on self.workers processes
+
+        Compressed exports are encoded in timeline order: each shard's PCM is
+        fed to the encoders from the master as soon as it and every shard
+        before it are written, while later shards are still being mixed.
+        """
+        if self.workers == 1:
+            return super().render(audio_segments, music_file, filename, music_gain_db, loop_points,
+                                  start_seconds, end_seconds, loudness, exports)
+        if self._headroom() <= 0:
+            raise MemoryError(
+                f"Memory budget {self.memory_budget / 2**20:.0f} MB is below current usage "
+                f"{format_rss(current_rss())}"
+            )
+
+        rate = self.fmt.sample_rate
+        work_dir = tempfile.mkdtemp(prefix="render_spill_", dir=self.spill_dir)
+        started = time.perf_counter()
+        try:
+            session = self.open_session(audio_segments, music_file, music_gain_db, loop_points, work_dir, loudness)
+            first_frame = min(session.frames, max(0, int(round(start_seconds * rate))))
+            last_frame = session.frames
+            if end_seconds is not None:
+                last_frame = min(session.frames, max(first_frame, int(round(end_seconds * rate))))
+
+            shards = max(1, min(self.workers * SHARDS_PER_WORKER,
+                                int((last_frame - first_frame) // (MIN_SHARD_SECONDS * rate))))
+            align = int(round(SUB_BLOCK_SECONDS * rate))
+            edges = shard_boundaries(session, first_frame, last_frame, shards, align)
+            workers = min(self.workers, len(edges) - 1)
+            # Each worker mixes its own chunks under its share of the budget
+            budget = self._headroom() // workers
+            chunk_frames = int(self.chunk_seconds * rate)
+            min_chunk_frames = min(chunk_frames, int(MIN_CHUNK_SECONDS * rate))
+            share = budget // (self.fmt.channels * 4 * CHUNK_WORKING_SET)
+            chunk_frames = max(min_chunk_frames, min(chunk_frames, share))
+            print(f"🧩 Sharded render: {len(edges) - 1} shards on {workers} processes, "
+                  f"chunks of {chunk_frames / rate:.1f}s")
+
+            frames = last_frame - first_frame
+            with open(filename, 'wb') as f:
+                f.write(audio_format.pcm16_wav_header(frames, self.fmt.channels, rate))
+                f.truncate(WAV_HEADER_BYTES + frames * self.fmt.channels * 2)
+            # A metered shard also keeps the clips its K-weighting filters settle on
+            settle_frames = int(round(K_WEIGHTING_SETTLE_SECONDS * rate)) if loudness is not None else 0
+            with EncoderTee(filename, exports, self.fmt) as tee, ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_render_shard, _excerpt(session, first, stop, settle_frames), filename,
+                                       first, stop, (first_frame, last_frame), chunk_frames, min_chunk_frames, budget,
+                                       self.fmt, loudness is not None)
+                           for first, stop in zip(edges, edges[1:])]
+                results = []
+                # Unbuffered: a read-ahead would keep zeros of shards that are still being written
+                with open(filename, 'rb', buffering=0) as master:
+                    for first, stop, future in zip(edges, edges[1:], futures):
+                        results.append(future.result())
+                        if tee.encoding:
+                            _stream_to(tee, master, first - first_frame, stop - first_frame, chunk_frames,
+                                       self.fmt.channels)
+        finally:
+            self._release_blocks()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        duration = (last_frame - first_frame) / float(rate)
+        chunks = sum(result[0] for result in results)
+        peaks = [result[2] for result in results if result[2] is not None]
+        peak = max(peaks) if peaks else None
+        metrics.record_stage('sharded_render', duration, time.perf_counter() - started)
+        print(f"✅ Sharded render complete: {duration / 60:.1f} minutes in {time.perf_counter() - started:.1f}s, "
+              f"peak worker RSS {format_rss(peak)}")
+        output_loudness = None
+        if loudness is not None:
+            output_loudness = loudness_report(combine_analyses(result[1] for result in results))
+            print(f"📏 Output: {output_loudness.integrated_lufs:.1f} LUFS, "
+                  f"true peak {output_loudness.true_peak_db:.1f} dBTP")
+        for extension, export in tee.outputs.items():
+            print(f"💾 {extension.upper()}: {export}")
+        return RenderReport(filename, duration, peak, self.spilled_bytes, chunks, output_loudness, tee.outputs)
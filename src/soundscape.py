@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Soundscapes
+A background built from several layers (rain, a drone, an occasional singing
+bowl...) instead of one music file. A soundscape is a JSON file listing its
+layers; each has its own file, gain, fade in/out, start offset and loop or
+one-shot mode. Instead of a file, a layer can be a procedural tone or noise
+generator (see procedural.py):
+
+    {"layers": [
+        {"file": "rain.mp3", "gain_db": -14, "fade_in": 5, "fade_out": 10},
+        {"file": "drone.wav", "gain_db": -22, "offset": 30},
+        {"file": "bowl.wav", "gain_db": -10, "offset": 600, "loop": false},
+        {"generator": {"type": "brown", "seed": 1}, "gain_db": -30}
+    ]}
+
+Layer files are relative to the soundscape file. Every file is pulled lazily,
+read by read, from decoded PCM cached on disk in the render format (a
+compressed file is decoded once, not on every render), so each layer costs a
+bounded read per chunk and no full-length buffer.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+import audio_format
+import procedural
+from audio_sources import WavSource, CrossfadeLoopSource
+from loop_points import LoopPoints, find_loop_points_for_source
+
+
+SOUNDSCAPE_EXTENSION = '.json'
+DEFAULT_PCM_CACHE_DIR = os.path.join("background_music", ".pcm_cache")
+DEFAULT_LAYER_GAIN_DB = -12.0
+
+# Seconds for fade_in/fade_out/offset; loop=False plays the file once. A layer
+# has either a file or a generator spec (see procedural.py), which never loops.
+Layer = namedtuple('Layer', ['file', 'gain_db', 'fade_in', 'fade_out', 'offset', 'loop', 'generator'])
+Layer.__new__.__defaults__ = (None, DEFAULT_LAYER_GAIN_DB, 0.0, 0.0, 0.0, True, None)
+
+
+def is_soundscape(filename):
+    """True if a background selection is a soundscape definition rather than an audio file"""
+    return isinstance(filename, (str, os.PathLike)) and str(filename).lower().endswith(SOUNDSCAPE_EXTENSION)
+
+
+def load_soundscape(filename):
+    """Layers of a soundscape file, with file paths resolved against its folder"""
+    with open(filename, encoding='utf-8') as f:
+        definition = json.load(f)
+    folder = os.path.dirname(os.path.abspath(filename))
+    layers = []
+    for index, fields in enumerate(definition.get('layers', [])):
+        try:
+            layer = Layer(**fields)
+        except TypeError as e:
+            raise ValueError(f"Bad layer {index} in {filename}: {e}") from None
+        if (layer.file is None) == (layer.generator is None):
+            raise ValueError(f"Layer {index} in {filename} needs either a file or a generator")
+        if layer.file is not None:
+            layer = layer._replace(file=os.path.join(folder, layer.file))
+        layers.append(layer)
+    if not layers:
+        raise ValueError(f"Soundscape {filename} has no layers")
+    return layers
+
+
+def soundscape_identity(filename):
+    """Identity of a soundscape: the definition and every layer file (path, size, mtime)"""
+    # Generator specs live in the definition itself
+    files = [filename] + [layer.file for layer in load_soundscape(filename) if layer.file]
+    identity = []
+    for name in files:
+        stat = os.stat(name)
+        identity.append((os.path.abspath(name), stat.st_size, stat.st_mtime_ns))
+    return tuple(identity)
+
+
+class DecodedPcmCache:
+    """Layer files decoded once to 16-bit WAVs in the render format, plus their loop points
+
+    A PCM WAV already in the render format is read in place. Anything else
+    is decoded (by ffmpeg when installed) into the cache, keyed by the
+    file's path, size, mtime and the format, and read lazily from there
+    without resampling.
+    """
+
+    def __init__(self, cache_dir=None, fmt=None):
+        self.cache_dir = cache_dir or DEFAULT_PCM_CACHE_DIR
+        self.fmt = fmt or audio_format.render_format()
+
+    def _cache_file(self, filename, extension):
+        stat = os.stat(filename)
+        key = repr((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns,
+                    self.fmt.sample_rate, self.fmt.channels))
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:24] + extension)
+
+    def _in_render_format(self, filename):
+        try:
+            with wave.open(filename, 'rb') as wav_file:
+                return (wav_file.getframerate() == self.fmt.sample_rate and
+                        wav_file.getnchannels() == self.fmt.channels)
+        except (wave.Error, EOFError, OSError):
+            return False
+
+    def _decode(self, filename, cached):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_file = f"{cached}.tmp{os.getpid()}.wav"
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg:
+            # ffmpeg streams the decode to disk; nothing is held in memory
+            result = subprocess.run(
+                [ffmpeg, '-v', 'error', '-y', '-i', filename, '-vn', '-ar', str(self.fmt.sample_rate),
+                 '-ac', str(self.fmt.channels), '-acodec', 'pcm_s16le', temp_file],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            if result.returncode != 0:
+                print(f"⚠️ ffmpeg decode failed: {result.stderr.decode(errors='replace').strip()}")
+                ffmpeg = None
+        if not ffmpeg:
+            audio_format.write_wav(temp_file, audio_format.load_audio(filename, self.fmt), self.fmt)
+        os.replace(temp_file, cached)
+        print(f"💽 Cached decoded layer: {os.path.basename(filename)}")
+
+    def open(self, filename):
+        """Lazily read source for a layer file, decoding it into the cache on first use"""
+        if self._in_render_format(filename):
+            return WavSource(filename, self.fmt)
+        cached = self._cache_file(filename, '.wav')
+        if not os.path.exists(cached):
+            self._decode(filename, cached)
+        return WavSource(cached, self.fmt)
+
+    def loop_points(self, filename, source):
+        """LoopPoints for a layer file, found from its head and tail once and cached"""
+        cached = self._cache_file(filename, '.loop.json')
+        try:
+            with open(cached) as f:
+                return LoopPoints(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            pass
+        loop_points = find_loop_points_for_source(source, self.fmt.sample_rate)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_file = f"{cached}.tmp{os.getpid()}"
+        with open(temp_file, 'w') as f:
+            json.dump({field: float(value) for field, value in loop_points._asdict().items()}, f)
+        os.replace(temp_file, cached)
+        return loop_points
+
+
+class LayerSource:
+    """One layer placed on the session timeline with its gain and fades
+
+    The layer sounds over frames [start, end); source is read from its
+    beginning at start. Fades are linear ramps over the first fade_in and
+    last fade_out frames of that span, computed only for reads that touch them.
+    """
+
+    def __init__(self, source, start, end, gain, fade_in=0, fade_out=0):
+        self.source = source
+        self.start = int(start)
+        self.end = int(end)
+        self.length = self.end - self.start
+        self.gain = np.float32(gain)
+        self.fade_in = int(fade_in)
+        self.fade_out = int(fade_out)
+
+    def _envelope(self, first, count):
+        """Gain for layer positions [first, first + count): a scalar outside the fades"""
+        if first >= self.fade_in and first + count <= self.length - self.fade_out:
+            return self.gain
+        position = np.arange(first, first + count, dtype=np.float64) + 0.5
+        envelope = np.full(count, self.gain, dtype=np.float64)
+        if self.fade_in:
+            envelope *= np.minimum(position / self.fade_in, 1.0)
+        if self.fade_out:
+            envelope *= np.clip((self.length - position) / self.fade_out, 0.0, 1.0)
+        return envelope.astype(np.float32)[:, None]
+
+    def add_into(self, mix, start):
+        """Add the layer's frames for mix's span (starting at timeline frame start) into mix"""
+        first = max(start, self.start)
+        stop = min(start + len(mix), self.end)
+        if stop > first:
+            samples = self.source.read(first - self.start, stop - first)
+            mix[first - start:stop - start] += samples * self._envelope(first - self.start, stop - first)
+
+
+class SoundscapeSource:
+    """Sum of layer sources, mixed per read; only layers sounding in the read are touched"""
+
+    def __init__(self, layers, frames, channels):
+        self.layers = list(layers)
+        self.frames = int(frames)
+        self.channels = channels
+
+    def read(self, start, count):
+        """Return count mixed frames starting at start"""
+        mix = np.zeros((count, self.channels), dtype=np.float32)
+        for layer in self.layers:
+            layer.add_into(mix, start)
+        return mix
+
+
+def open_soundscape(filename, frames, fmt=None, pcm_cache=None):
+    """A SoundscapeSource covering a session of frames, reading every layer lazily"""
+    fmt = fmt or audio_format.render_format()
+    pcm_cache = pcm_cache or DecodedPcmCache(fmt=fmt)
+    rate = fmt.sample_rate
+    layers = []
+    for layer in load_soundscape(filename):
+        start = int(round(layer.offset * rate))
+        if start >= frames:
+            continue
+        if layer.generator is not None:
+            source = procedural.open_generator(layer.generator, frames - start, fmt)
+        else:
+            source = pcm_cache.open(layer.file)
+        if source.frames == 0:
+            continue
+        if layer.loop and source.frames < frames - start:
+            loop_points = pcm_cache.loop_points(layer.file, source)
+            source = CrossfadeLoopSource.from_loop_points(source, loop_points, rate)
+            end = frames
+        else:
+            end = min(frames, start + source.frames)
+        layers.append(LayerSource(source, start, end, 10 ** (layer.gain_db / 20.0),
+                                  int(round(layer.fade_in * rate)), int(round(layer.fade_out * rate))))
+    print(f"🌧️ Soundscape: {len(layers)} layers from {os.path.basename(filename)}")
+    return SoundscapeSource(layers, frames, fmt.channels)
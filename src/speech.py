@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Speech Synthesis
+Text-to-speech helpers shared by the GUI and batch rendering. All settings are
+passed in explicitly so the same code can run without a Tk window.
+
+Speech can be produced as segment files (text_to_speech_file) or kept in
+memory as canonical sample arrays (text_to_speech_samples), which skips the
+MP3/WAV round trips through the output folder.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import namedtuple
+
+import numpy as np
+
+import audio_format
+import decode_service
+import metrics
+import segment_cache
+import speech_batching
+
+
+# engine: "gtts" or "pyttsx3"
+# voice: display label of the selected voice (drives gTTS accent selection)
+# rate: speech rate in WPM, volume: 0.1-1.0
+# voice_id: pyttsx3 voice id, or None for the system default
+VoiceSettings = namedtuple('VoiceSettings', ['engine', 'voice', 'rate', 'volume', 'voice_id'])
+
+DEFAULT_RATE = 120  # Default meditation rate
+DEFAULT_VOLUME = 0.85
+
+# Google TTS voices offered in the GUI; gtts_voice_params maps each to an accent
+GTTS_VOICES = [
+    "🌸 English (US Female, Slow) - BEST for Meditation",
+    "🗣️ English (US Standard Speed)",
+    "🇬🇧 British English (Slow) - Elegant",
+    "🇦🇺 Australian English (Slow) - Warm",
+    "🇮🇳 Indian English (Slow) - Clear",
+    "🇨🇦 Canadian English (Slow) - Neutral",
+    "🇿🇦 South African English (Slow) - Distinctive",
+]
+
+DEFAULT_SPEECH_CACHE_DIR = os.path.join("output", ".speech_cache")
+_speech_cache = None
+
+
+def gtts_voice_params(voice_label, rate_setting):
+    """Map a gTTS voice label and rate to (lang, tld, slow)"""
+    if "British" in voice_label:
+        lang, tld = 'en', 'co.uk'
+    elif "Australian" in voice_label:
+        lang, tld = 'en', 'com.au'
+    elif "Indian" in voice_label:
+        lang, tld = 'en', 'co.in'
+    elif "Canadian" in voice_label:
+        lang, tld = 'en', 'ca'
+    elif "South African" in voice_label:
+        lang, tld = 'en', 'co.za'
+    else:
+        lang, tld = 'en', 'com'  # Default to US English
+
+    # Determine slow setting based on both voice selection AND rate slider
+    # If rate is below 150 WPM, use slow speech
+    slow = ("Slow" in voice_label or "Female" in voice_label) or (rate_setting < 150)
+    return lang, tld, slow
+
+
+def gtts_request_key(text, lang, tld, slow):
+    """Key identifying a raw gTTS request (before speed/volume processing); the speech cache is keyed by it"""
+    return ('gtts', text, lang, tld, slow)
+
+
+def fetch_gtts_bytes(text, lang, tld, slow):
+    """Download raw gTTS speech for text and return the MP3 data"""
+    from gtts import gTTS
+
+    print(f"🌐 Using Google TTS: lang={lang}, tld={tld}, slow={slow}")
+    metrics.GTTS_REQUESTS.inc()
+    tts = gTTS(text=text, lang=lang, slow=slow, tld=tld)
+    buffer = io.BytesIO()
+    tts.write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+def fetch_gtts_mp3(text, lang, tld, slow, mp3_filename):
+    """Download raw gTTS speech for text into an MP3 file"""
+    data = fetch_gtts_bytes(text, lang, tld, slow)
+    with open(mp3_filename, 'wb') as mp3_file:
+        mp3_file.write(data)
+
+
+def volume_offset_db(volume_setting):
+    """Level change in dB for a volume slider setting (0.1-1.0) relative to the default"""
+    return 20 * (volume_setting - DEFAULT_VOLUME) / 0.75  # Scale to reasonable dB range
+
+
+def apply_voice_adjustments(samples, sample_rate, rate_setting, volume_setting, fmt=None):
+    """Apply the rate and volume sliders and convert to the canonical render format
+
+    Speed and format conversion share one resampling pass: the decoded audio is
+    treated as if it had been recorded at sample_rate * speed and resampled
+    straight to the render rate.
+    """
+    fmt = fmt or audio_format.render_format()
+
+    # Adjust speed based on rate slider setting
+    # Convert rate (80-200 WPM) to speed multiplier
+    # 120 WPM (default) = 1.0x speed, lower = slower, higher = faster
+    if rate_setting != DEFAULT_RATE:
+        # Calculate speed multiplier (0.5x to 1.8x)
+        speed_multiplier = rate_setting / DEFAULT_RATE
+        # Clamp to reasonable range
+        speed_multiplier = max(0.5, min(speed_multiplier, 1.8))
+
+        print(f"💪 Adjusting speech speed: {rate_setting} WPM -> {speed_multiplier:.2f}x speed")
+
+        # Higher source rate = faster playback once resampled to the render rate
+        original_frame_rate = sample_rate
+        sample_rate = int(original_frame_rate * speed_multiplier)
+
+        print(f"✅ Speed adjusted: {original_frame_rate}Hz -> {sample_rate}Hz -> {fmt.sample_rate}Hz")
+
+    samples = audio_format.as_float(audio_format.to_canonical(samples, sample_rate, fmt._replace(sample_type='float32')))
+
+    # Adjust volume based on slider setting
+    # Convert volume (0.1-1.0) to decibels
+    # 0.85 (default) = 0dB, lower values = negative dB, higher = positive dB
+    if volume_setting != DEFAULT_VOLUME:  # Only adjust if different from default
+        volume_db = volume_offset_db(volume_setting)
+        samples = samples * np.float32(10 ** (volume_db / 20))
+        print(f"🔊 Volume adjusted by {volume_db:.1f}dB (slider: {volume_setting:.2f})")
+
+    return audio_format.store_as(samples, fmt.sample_type)
+
+
+def convert_gtts_mp3(mp3_filename, filename, settings):
+    """Convert a raw gTTS MP3 to the final segment WAV, applying rate and volume"""
+    try:
+        samples, sample_rate = audio_format.decode_file(mp3_filename)
+        samples = apply_voice_adjustments(samples, sample_rate, settings.rate, settings.volume)
+        audio_format.write_wav(filename, samples)
+        print(f"✅ Google TTS created: {filename}")
+    except Exception as e:
+        # If decoding fails, just copy the MP3 to WAV (will work for final mixing)
+        shutil.copyfile(mp3_filename, filename)
+        print(f"✅ Google TTS created: {filename} (as MP3, decode failed: {e})")
+        print(f"⚠️ Speed and volume adjustments not applied due to decode failure")
+
+
+def create_speech_gtts(text, filename, settings):
+    """Create speech using Google TTS; True if speech was written, False if silence had to stand in"""
+    try:
+        print(f"🎛️ TTS Settings from sliders: Rate={settings.rate} WPM, Volume={settings.volume:.1f}")
+
+        lang, tld, slow = gtts_voice_params(settings.voice, settings.rate)
+
+        # Save as MP3 first, then convert to WAV
+        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
+            temp_mp3 = temp_file.name
+
+        try:
+            with metrics.time_synthesis('gtts'):
+                fetch_gtts_mp3(text, lang, tld, slow, temp_mp3)
+                convert_gtts_mp3(temp_mp3, filename, settings)
+        finally:
+            try:
+                os.unlink(temp_mp3)  # Remove temporary MP3
+            except OSError:
+                pass
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Google TTS failed: {e}")
+        print("🔄 Falling back to local TTS...")
+        metrics.GTTS_FALLBACKS.inc()
+        return create_speech_pyttsx3(text, filename, settings)
+
+
+# Runs in a child process so a wedged speech driver cannot hang the app; the
+# settings arrive as one JSON argument instead of being pasted into the source.
+# One engine renders every (text, filename) item of the job in turn.
+_PYTTSX3_SCRIPT = """
+import json
+import sys
+import pyttsx3
+
+try:
+    job = json.loads(sys.argv[1])
+    engine = pyttsx3.init()
+    if job['voice_id']:
+        engine.setProperty('voice', job['voice_id'])
+    engine.setProperty('rate', job['rate'])
+    engine.setProperty('volume', job['volume'])
+    print(f"TTS Script: Rate={job['rate']}, Volume={job['volume']}, {len(job['items'])} phrase(s)")
+    for text, filename in job['items']:
+        engine.save_to_file(text, filename)
+        engine.runAndWait()
+    print("TTS_SUCCESS")
+except Exception as e:
+    print(f"TTS_ERROR: {e}")
+    sys.exit(1)
+"""
+PYTTSX3_TIMEOUT_SECONDS = 20    # per phrase rendered by the isolated process
+
+
+def _run_pyttsx3_many(items, settings):
+    """Render (text, filename) items with pyttsx3 in one isolated process; returns the filenames written"""
+    rate_setting = settings.rate
+    volume_setting = settings.volume
+
+    print(f"🎤 Using local TTS engine...")
+    print(f"🎛️ TTS Settings from sliders: Rate={rate_setting} WPM, Volume={volume_setting:.2f}")
+
+    job = json.dumps({
+        'items': [list(item) for item in items],
+        'voice_id': settings.voice_id,
+        'rate': rate_setting,
+        'volume': volume_setting,
+    })
+    start = time.perf_counter()
+    try:
+        # Run the TTS script with timeout
+        print(f"🚀 Running isolated TTS process...")
+        result = subprocess.run(
+            [sys.executable, '-c', _PYTTSX3_SCRIPT, job],
+            capture_output=True,
+            text=True,
+            timeout=PYTTSX3_TIMEOUT_SECONDS * len(items)
+        )
+    except subprocess.TimeoutExpired:
+        print("⏰ TTS process timeout")
+        return []
+    except Exception as e:
+        print(f"❌ TTS subprocess error: {e}")
+        return []
+
+    if result.returncode != 0 or "TTS_SUCCESS" not in result.stdout:
+        print(f"❌ TTS process failed: {result.stderr}")
+        return []
+    print("✅ TTS generation completed successfully")
+    # Verify the files were created
+    written = [filename for _, filename in items if os.path.exists(filename) and os.path.getsize(filename) > 0]
+    if len(written) < len(items):
+        print(f"❌ {len(items) - len(written)} audio file(s) not created")
+    seconds = (time.perf_counter() - start) / max(1, len(written))
+    for filename in written:
+        print(f"✅ Audio file created: {os.path.getsize(filename)} bytes")
+        metrics.record_segment('pyttsx3', seconds)
+    return written
+
+
+def _run_pyttsx3(text, filename, settings):
+    """Render text to filename with pyttsx3 in an isolated process; returns True on success"""
+    return bool(_run_pyttsx3_many([(text, filename)], settings))
+
+
+def create_speech_pyttsx3(text, filename, settings):
+    """Create speech using local pyttsx3 engine; True if speech was written, False if silence had to stand in"""
+    if _run_pyttsx3(text, filename, settings):
+        return True
+    print("🔇 Creating silent audio as fallback")
+    create_silent_audio(filename, duration=len(text.split()) * 0.5)
+    return False
+
+
+def create_silent_audio(filename, duration=1.0):
+    """Create a silent audio file as fallback"""
+    metrics.SILENT_FALLBACKS.inc()
+    audio_format.write_wav(filename, audio_format.silence(duration))
+
+
+def text_to_speech_file(text, filename, settings):
+    """Convert text to speech and save as file with the engine in settings
+
+    Returns True if speech was written, False if silence had to stand in.
+    """
+    print(f"🎤 Starting TTS for: {text[:50]}...")
+
+    if settings.engine == "gtts":
+        return create_speech_gtts(text, filename, settings)
+    else:
+        return create_speech_pyttsx3(text, filename, settings)
+
+
+def synthesize_gtts(text, settings, fmt=None):
+    """Google TTS straight to canonical samples: download, decode and adjust in memory"""
+    print(f"🎛️ TTS Settings from sliders: Rate={settings.rate} WPM, Volume={settings.volume:.1f}")
+    lang, tld, slow = gtts_voice_params(settings.voice, settings.rate)
+    with metrics.time_synthesis('gtts'):
+        samples, sample_rate = decode_service.decode_one(fetch_gtts_bytes(text, lang, tld, slow))
+    print("✅ Google TTS decoded in memory")
+    return apply_voice_adjustments(samples, sample_rate, settings.rate, settings.volume, fmt)
+
+
+def local_request_key(text, settings):
+    """Speech cache key for text from the local engine (which applies rate and volume itself)"""
+    return ('pyttsx3', text, settings.voice_id, settings.rate, settings.volume)
+
+
+def fetch_pyttsx3_samples(texts, settings):
+    """Local TTS speech for distinct texts, from the speech cache or rendered in one engine process
+
+    Returns {text: (samples, sample_rate)}; texts the engine failed on are
+    missing. pyttsx3 can only write files, so misses are rendered into the
+    system temp directory (not the output folder) and read back and removed
+    at once.
+    """
+    results = {}
+    if _speech_cache:
+        cached = _speech_cache.get_many([local_request_key(text, settings) for text in texts])
+        for text in texts:
+            clip = cached.get(local_request_key(text, settings))
+            if clip is not None:
+                results[text] = clip
+        texts = [text for text in texts if text not in results]
+        if results:
+            print(f"♻️ {len(results)} phrase(s) from the speech cache")
+    if not texts:
+        return results
+    temp_dir = tempfile.mkdtemp(prefix='tts_')
+    try:
+        items = [(text, os.path.join(temp_dir, f"{index}.wav")) for index, text in enumerate(texts)]
+        written = set(_run_pyttsx3_many(items, settings))
+        for text, filename in items:
+            if filename not in written:
+                continue
+            samples, sample_rate = audio_format.decode_file(filename)
+            results[text] = (samples, sample_rate)
+            if _speech_cache:
+                _speech_cache.put(local_request_key(text, settings), samples, sample_rate)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return results
+
+
+def synthesize_pyttsx3(text, settings, fmt=None):
+    """Local TTS to canonical samples, or None if the engine failed"""
+    clip = fetch_pyttsx3_samples([text], settings).get(text)
+    if clip is None:
+        return None
+    return audio_format.to_canonical(clip[0], clip[1], fmt)
+
+
+def local_speech_many(texts, settings, fmt=None):
+    """{text: samples} from the local engine in one batch, with silence wherever it fails"""
+    try:
+        clips = fetch_pyttsx3_samples(texts, settings)
+    except Exception as e:
+        print(f"❌ TTS generation failed completely: {e}")
+        clips = {}
+    samples = {}
+    for text in texts:
+        if text in clips:
+            samples[text] = audio_format.to_canonical(clips[text][0], clips[text][1], fmt)
+        else:
+            print("🔇 Creating silent audio as fallback")
+            metrics.SILENT_FALLBACKS.inc()
+            samples[text] = audio_format.silence(len(text.split()) * 0.5, fmt)
+    return samples
+
+
+def local_speech_samples(text, settings, fmt=None):
+    """Local TTS samples, or silence if the local engine fails too"""
+    return local_speech_many([text], settings, fmt)[text]
+
+
+def text_to_speech_samples(text, settings, fmt=None):
+    """Convert text to canonical samples in memory with the engine in settings
+
+    Falls back from Google TTS to local TTS, and from local TTS to silence,
+    exactly like text_to_speech_file.
+    """
+    print(f"🎤 Starting TTS for: {text[:50]}...")
+
+    if settings.engine == "gtts":
+        try:
+            return synthesize_gtts(text, settings, fmt)
+        except Exception as e:
+            print(f"❌ Google TTS failed: {e}")
+            print("🔄 Falling back to local TTS...")
+            metrics.GTTS_FALLBACKS.inc()
+    return local_speech_samples(text, settings, fmt)
+
+
+def set_speech_cache_dir(cache_dir, codec=segment_cache.DEFAULT_CODEC):
+    """Keep decoded speech per phrase in cache_dir (None turns the cache off)
+
+    Entries hold the engine's output before any rate/volume processing, so
+    draft and final renders of the same voice share them. Google TTS and
+    local engine phrases are both kept, under gtts_request_key and
+    local_request_key. They are stored
+    compressed with codec, the most recent in memory (see segment_cache.py).
+    """
+    global _speech_cache
+    _speech_cache = segment_cache.SegmentCache(cache_dir, codec) if cache_dir else None
+
+
+def speech_cache_enabled():
+    """True if synthesized speech is being cached"""
+    return _speech_cache is not None
+
+
+def gtts_cached(text, lang, tld, slow):
+    """True if the speech cache holds text in this voice (nothing is decoded)"""
+    return _speech_cache is not None and gtts_request_key(text, lang, tld, slow) in _speech_cache
+
+
+def fetch_gtts_samples(texts, lang, tld, slow, coalesce=False, progress=None):
+    """Google TTS speech for distinct texts, from the speech cache or fetched and decoded
+
+    Returns {text: ((samples, sample_rate), seconds)} where seconds is the
+    fetch and decode time (None for cache hits); texts whose request failed
+    are missing. With coalesce, adjacent short texts share a request and
+    groups that cannot be split cleanly are fetched again one by one.
+    """
+    results = {}
+    if _speech_cache:
+        cached = _speech_cache.get_many([gtts_request_key(text, lang, tld, slow) for text in texts])
+        for text in texts:
+            clip = cached.get(gtts_request_key(text, lang, tld, slow))
+            if clip is not None:
+                results[text] = (clip, None)
+        texts = [text for text in texts if text not in results]
+        if results:
+            print(f"♻️ {len(results)} phrase(s) from the speech cache")
+    if texts:
+        fetched = _fetch_gtts_samples(texts, lang, tld, slow, coalesce, progress)
+        if _speech_cache:
+            for text, ((samples, sample_rate), _) in fetched.items():
+                _speech_cache.put(gtts_request_key(text, lang, tld, slow), samples, sample_rate)
+        results.update(fetched)
+    return results
+
+
+def _fetch_gtts_samples(texts, lang, tld, slow, coalesce=False, progress=None):
+    """Fetch and decode Google TTS speech for distinct texts; see fetch_gtts_samples"""
+    groups = speech_batching.coalesce_texts(texts) if coalesce else [[text] for text in texts]
+    if coalesce and len(groups) < len(texts):
+        print(f"🧩 Coalescing {len(texts)} phrases into {len(groups)} Google TTS request(s)")
+    blobs = {}
+    done = 0
+    for index, group in enumerate(groups):
+        if progress:
+            progress(done, len(texts))
+        done += len(group)
+        start = time.perf_counter()
+        try:
+            data = fetch_gtts_bytes(speech_batching.request_text(group) if len(group) > 1 else group[0],
+                                    lang, tld, slow)
+            blobs[index] = (data, time.perf_counter() - start)
+        except Exception as e:
+            print(f"❌ Google TTS failed: {e}")
+    start = time.perf_counter()
+    decoded = decode_service.decode_many([data for data, _ in blobs.values()])
+    # The batch decode is shared, so each request's latency gets an equal part of it
+    decode_share = (time.perf_counter() - start) / max(1, len(blobs))
+
+    results = {}
+    retry = []
+    for index, result in zip(blobs, decoded):
+        group = groups[index]
+        if result is None:
+            continue
+        clips = speech_batching.split_on_silence(result[0], result[1], group)
+        if clips is None:
+            print(f"⚠️ Could not split a request into {len(group)} phrases, fetching them one by one")
+            retry.extend(group)
+            continue
+        seconds = (blobs[index][1] + decode_share) / len(group)
+        for text, clip in zip(group, clips):
+            results[text] = ((clip, result[1]), seconds)
+    if retry:
+        results.update(_fetch_gtts_samples(retry, lang, tld, slow))
+    return results
+
+
+def texts_to_speech_samples(texts, settings, fmt=None, progress=None, coalesce=False):
+    """text_to_speech_samples for a whole script
+
+    Each distinct text is fetched once and all Google TTS MP3s are decoded
+    together by the decode service, instead of one decoder run per segment.
+    With coalesce, adjacent short texts are also fetched in shared requests
+    (see speech_batching). Phrases in the speech cache are not fetched at
+    all (see set_speech_cache_dir). progress(done, total) is called as segments are
+    fetched. Everything the local engine has to speak, whether selected or
+    standing in for Google TTS, is rendered by one engine process.
+    """
+    texts = list(texts)
+    samples = {}
+    if settings.engine == "gtts":
+        print(f"🎛️ TTS Settings from sliders: Rate={settings.rate} WPM, Volume={settings.volume:.1f}")
+        lang, tld, slow = gtts_voice_params(settings.voice, settings.rate)
+        fetched = fetch_gtts_samples(list(dict.fromkeys(texts)), lang, tld, slow, coalesce, progress)
+        for text, ((decoded, sample_rate), seconds) in fetched.items():
+            samples[text] = apply_voice_adjustments(decoded, sample_rate, settings.rate, settings.volume, fmt)
+            if seconds is not None:
+                metrics.record_segment('gtts', seconds)
+
+    missing = [text for text in dict.fromkeys(texts) if text not in samples]
+    if missing:
+        if settings.engine == "gtts":
+            print("🔄 Falling back to local TTS...")
+            metrics.GTTS_FALLBACKS.inc(len(missing))
+        samples.update(local_speech_many(missing, settings, fmt))
+    return [samples[text] for text in texts]
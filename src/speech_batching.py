@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Speech Request Coalescing
+Scripts with many short [PAUSE:X]-separated phrases turn into one Google TTS
+request per phrase, and request latency does not depend on the amount of text.
+Adjacent short phrases are therefore joined into a single request (each one
+ending in sentence punctuation, so the voice leaves a clear gap) and the
+returned speech is cut back into one clip per phrase at its longest silent
+gaps.
+
+A split is only accepted when it yields exactly one clip per phrase and the
+clip lengths are plausible for their texts; otherwise split_on_silence
+returns None and the caller requests the phrases one by one.
+"""
+
+import numpy as np
+
+
+# gTTS sends text up to this length as one request and splits longer text at
+# every punctuation mark, so a joined request must stay within it
+GTTS_MAX_CHARS = 100
+
+SENTENCE_ENDINGS = '.!?…'
+SILENCE_WINDOW_SECONDS = 0.01   # resolution of the energy envelope
+SILENCE_THRESHOLD_DB = -40.0    # below the loudest window counts as silence
+MIN_GAP_SECONDS = 0.15          # shorter silences are pauses within a phrase
+MAX_PACE_SPREAD = 3.0           # max ratio between the fastest and slowest clip's seconds per character
+
+
+def request_text(texts):
+    """Text for one request covering texts, each ending as a sentence"""
+    sentences = []
+    for text in texts:
+        text = text.strip()
+        sentences.append(text if text[-1:] in SENTENCE_ENDINGS else f"{text}.")
+    return " ".join(sentences)
+
+
+def coalesce_texts(texts, max_chars=GTTS_MAX_CHARS):
+    """Group adjacent texts so each group fits in one request; returns a list of lists
+
+    Texts that are too long to share a request stay in a group of their own.
+    """
+    groups = []
+    for text in texts:
+        if groups and len(request_text(groups[-1] + [text])) <= max_chars:
+            groups[-1].append(text)
+        else:
+            groups.append([text])
+    return groups
+
+
+def find_silent_gaps(samples, sample_rate, threshold_db=SILENCE_THRESHOLD_DB, min_gap=MIN_GAP_SECONDS):
+    """(starts, ends) frame arrays of the silences inside samples
+
+    Leading and trailing silence is not a gap between phrases and is left out.
+    """
+    mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+    window = max(1, int(sample_rate * SILENCE_WINDOW_SECONDS))
+    count = len(mono) // window
+    empty = np.zeros(0, dtype=np.int64)
+    if count == 0:
+        return empty, empty
+    energy = np.sqrt(np.mean(np.square(mono[:count * window].reshape(count, window), dtype=np.float64), axis=1))
+    peak = energy.max()
+    if peak <= 0:
+        return empty, empty
+
+    silent = (energy < peak * 10 ** (threshold_db / 20)).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], silent, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = (starts > 0) & (ends < count) & ((ends - starts) * window >= min_gap * sample_rate)
+    return starts[keep] * window, ends[keep] * window
+
+
+def split_on_silence(samples, sample_rate, texts):
+    """Cut the speech for request_text(texts) into one clip per text, or None
+
+    The cuts go in the middle of the len(texts) - 1 longest gaps. None means
+    the audio has too few gaps or the clips do not match their texts.
+    """
+    if len(texts) == 1:
+        return [samples]
+    starts, ends = find_silent_gaps(samples, sample_rate)
+    if len(starts) < len(texts) - 1:
+        return None
+    longest = np.sort(np.argsort(ends - starts, kind='stable')[::-1][:len(texts) - 1])
+    cuts = (starts[longest] + ends[longest]) // 2
+    clips = np.split(samples, cuts)
+
+    pace = np.array([len(clip) / max(1, len(text.strip())) for clip, text in zip(clips, texts)])
+    if pace.min() <= 0 or pace.max() / pace.min() > MAX_PACE_SPREAD:
+        return None
+    return clips
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Personalized Templates
+Renders one script for many listeners with their own details spoken in it.
+A template is a meditation script with {slot} placeholders:
+
+    Welcome, {name}. [PAUSE:3] Today we set the intention to {intention}.
+
+The static text around the slots is synthesized once per voice and kept in
+a clip store under output/.template_cache/, so later renders (and later
+runs) load it instead of synthesizing it again. A render then only
+synthesizes the slot values, which are usually a few words, and splices
+them between the static clips: the silence the engine leaves at each join
+is trimmed to a short margin and the clips overlap by a few milliseconds of
+crossfade, so the joins neither click nor leave gaps.
+
+    template = TemplateRenderer(open("scripts/welcome.txt").read(), settings)
+    for user in users:
+        template.render({'name': user.name, 'intention': user.intention}, f"output/{user.id}.wav")
+"""
+
+import os
+import re
+import time
+
+import numpy as np
+
+import audio_format
+import metrics
+import mixer
+import speech
+from checkpoint import RenderCheckpoint
+from chunked_render import BoundedRenderer
+from meditation_script import parse_meditation_text
+
+
+SLOT_PATTERN = re.compile(r'\{(\w+)\}')
+LEADING_PUNCTUATION = re.compile(r'^[.,;:!?…]+\s*')
+DEFAULT_TEMPLATE_CACHE_DIR = os.path.join("output", ".template_cache")
+TEMPLATE_MEMORY_BUDGET = 512 * 2**20
+SPLICE_CROSSFADE_SECONDS = 0.01
+SPLICE_MARGIN_SECONDS = 0.04    # silence kept on each side of a join
+SPLICE_WINDOW_SECONDS = 0.005   # resolution of the trim
+SPLICE_THRESHOLD_DB = -50.0     # quieter windows at a join are trimmed
+
+
+def parse_template(text):
+    """Parse a template into ('pause', seconds) and ('text', pieces) segments
+
+    pieces are ('static', text) and ('slot', name) in order. Static text
+    with nothing to pronounce (the period after a slot) is dropped, and so
+    is a text segment left empty by that.
+    """
+    segments = []
+    for segment_type, content in parse_meditation_text(text):
+        if segment_type != 'text':
+            segments.append((segment_type, content))
+            continue
+        pieces = []
+        for index, part in enumerate(SLOT_PATTERN.split(content)):
+            if index % 2:
+                pieces.append(('slot', part))
+            elif re.search(r'\w', part):
+                # Punctuation right after a slot ends the slot's phrase, not the next one
+                pieces.append(('static', LEADING_PUNCTUATION.sub('', part.strip())))
+        if pieces:
+            segments.append(('text', pieces))
+    return segments
+
+
+def _edges(samples, sample_rate):
+    """First and last frame of samples above SPLICE_THRESHOLD_DB, to window resolution"""
+    mono = np.abs(samples).max(axis=1)
+    window = max(1, int(sample_rate * SPLICE_WINDOW_SECONDS))
+    count = -(-len(mono) // window)
+    padded = np.zeros(count * window, dtype=mono.dtype)
+    padded[:len(mono)] = mono
+    loud = np.flatnonzero(padded.reshape(count, window).max(axis=1) >= 10 ** (SPLICE_THRESHOLD_DB / 20))
+    if len(loud) == 0:
+        return None
+    return loud[0] * window, min(len(mono), (loud[-1] + 1) * window)
+
+
+def _fade_in(frames):
+    """Raised-cosine fade in; reversed it is the complementary fade out (the two sum to one)"""
+    return (0.5 - 0.5 * np.cos(np.pi * (np.arange(frames) + 0.5) / max(1, frames))).astype(np.float32)[:, None]
+
+
+def splice(clips, sample_rate):
+    """Join speech clips, trimming the silence at each join and crossfading across it"""
+    margin = int(sample_rate * SPLICE_MARGIN_SECONDS)
+    fade = int(sample_rate * SPLICE_CROSSFADE_SECONDS)
+    trimmed = []
+    for index, clip in enumerate(clips):
+        edges = _edges(clip, sample_rate)
+        if edges is None:
+            continue
+        first = 0 if index == 0 else max(0, edges[0] - margin)
+        last = len(clip) if index == len(clips) - 1 else min(len(clip), edges[1] + margin)
+        trimmed.append(clip[first:last])
+    if not trimmed:
+        return audio_format.as_float(clips[0])
+
+    # A join fades over at most the clips on either side of it, and over at most
+    # half of a clip that has joins on both sides, so a very short slot value
+    # never overlaps more than one neighbour
+    def room(index):
+        return len(trimmed[index]) // (1 if index in (0, len(trimmed) - 1) else 2)
+
+    fades = [min(fade, room(index), room(index + 1)) for index in range(len(trimmed) - 1)] + [0]
+    output = np.zeros((sum(len(clip) for clip in trimmed) - sum(fades), trimmed[0].shape[1]), dtype=np.float32)
+    position = 0
+    for index, clip in enumerate(trimmed):
+        clip = np.array(clip, dtype=np.float32)
+        if index > 0:
+            clip[:fades[index - 1]] *= _fade_in(fades[index - 1])
+        clip[len(clip) - fades[index]:] *= _fade_in(fades[index])[::-1]
+        output[position:position + len(clip)] += clip
+        position += len(clip) - fades[index]
+    return output
+
+
+class TemplateRenderer:
+    """Render a template for many sets of slot values, synthesizing its static text once"""
+
+    def __init__(self, template_text, settings, fmt=None, cache_dir=None):
+        self.segments = parse_template(template_text)
+        self.settings = settings
+        self.fmt = fmt or audio_format.render_format()
+        self.store = RenderCheckpoint(cache_dir or DEFAULT_TEMPLATE_CACHE_DIR)
+        self._static = {}
+
+    @property
+    def slots(self):
+        """Names of the template's slots, in order of first use"""
+        return list(dict.fromkeys(name for kind, content in self.segments if kind == 'text'
+                                  for piece, name in content if piece == 'slot'))
+
+    def _static_clips(self):
+        """{text: samples} of every static piece, from memory, the clip store or synthesized"""
+        texts = [text for kind, content in self.segments if kind == 'text'
+                 for piece, text in content if piece == 'static' and text not in self._static]
+        missing = []
+        for text in dict.fromkeys(texts):
+            stored = self.store.lookup(self.settings, text, self.fmt)
+            if stored:
+                self._static[text] = audio_format.load_audio(stored, self.fmt)
+            else:
+                missing.append(text)
+        if missing:
+            print(f"🎤 Synthesizing {len(missing)} static template phrase(s) once")
+            for text, samples in zip(missing, speech.texts_to_speech_samples(missing, self.settings, self.fmt,
+                                                                             coalesce=True)):
+                self._static[text] = samples
+                self.store.commit_samples(samples, self.settings, text, self.fmt, fmt=self.fmt)
+        return self._static
+
+    def audio_segments(self, values):
+        """('samples', ...)/('pause', ...) segments of the template with values filled in"""
+        missing = [name for name in self.slots if not str(values.get(name, '')).strip()]
+        if missing:
+            raise ValueError(f"No value for template slot(s): {', '.join(missing)}")
+        static = self._static_clips()
+        texts = list(dict.fromkeys(str(values[name]).strip() for name in self.slots))
+        spoken = dict(zip(texts, speech.texts_to_speech_samples(texts, self.settings, self.fmt, coalesce=True)))
+        audio_segments = []
+        for kind, content in self.segments:
+            if kind != 'text':
+                audio_segments.append((kind, content))
+                continue
+            clips = [static[text] if piece == 'static' else spoken[str(values[text]).strip()]
+                     for piece, text in content]
+            audio_segments.append(('samples', splice(clips, self.fmt.sample_rate)))
+        return audio_segments
+
+    def render(self, values, filename, music_file=None, music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB,
+               loudness=None, exports=(), renderer=None):
+        """Render the template with values to filename; returns the RenderReport"""
+        started = time.perf_counter()
+        audio_segments = self.audio_segments(values)
+        renderer = renderer or BoundedRenderer(TEMPLATE_MEMORY_BUDGET, self.fmt)
+        report = renderer.render(audio_segments, music_file, filename, music_gain_db,
+                                 loudness=loudness, exports=exports)
+        metrics.record_stage('template_render', report.duration, time.perf_counter() - started)
+        return report
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Session Timeline
+Start offset and length of every segment of a parsed meditation script, kept
+in parallel numpy arrays so looking up the segment playing at any time is a
+binary search. Speech lengths are estimated from the word count until the
+segment has been synthesized (or found in a checkpoint), then they are exact.
+
+render_range renders any excerpt (e.g. minute 12 to 14) by synthesizing only
+the speech segments that overlap it and mixing that window over the music at
+the same position it has in the full session:
+
+    python src/timeline.py scripts/body_scan.txt --start 12:00 --end 14:00
+"""
+
+import argparse
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import audio_format
+import mixer
+import speech
+from audio_sources import WavSource
+from chunked_render import BoundedRenderer
+from meditation_script import parse_meditation_text
+
+
+PAUSE = 0
+SPEECH = 1
+
+DEFAULT_MEMORY_BUDGET_BYTES = 512 * 2**20
+
+RangeReport = namedtuple('RangeReport', ['filename', 'start', 'duration', 'synthesized', 'exact_offsets'])
+
+
+def estimate_speech_frames(text, rate, fmt=None):
+    """Frames of speech expected for text at rate words per minute"""
+    fmt = fmt or audio_format.render_format()
+    return int(round(len(text.split()) / rate * 60 * fmt.sample_rate))
+
+
+class Timeline:
+    """Segment offsets and lengths in frames, with binary-search lookup by time"""
+
+    def __init__(self, kinds, lengths, contents, exact, fmt=None):
+        self.fmt = fmt or audio_format.render_format()
+        self.kinds = np.asarray(kinds, dtype=np.int8)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.exact = np.asarray(exact, dtype=bool)
+        self.contents = list(contents)  # spoken text, or pause seconds
+        self.starts = np.zeros(len(self.lengths), dtype=np.int64)
+        self._update_starts(0)
+
+    @classmethod
+    def from_segments(cls, segments, rate=speech.DEFAULT_RATE, fmt=None):
+        """Timeline of parsed ('text', str)/('pause', seconds) segments with estimated speech lengths"""
+        fmt = fmt or audio_format.render_format()
+        kinds, lengths, contents, exact = [], [], [], []
+        for segment_type, content in segments:
+            if segment_type == 'text':
+                kinds.append(SPEECH)
+                lengths.append(estimate_speech_frames(content, rate, fmt))
+                exact.append(False)
+            else:
+                kinds.append(PAUSE)
+                lengths.append(int(round(content * fmt.sample_rate)))
+                exact.append(True)
+            contents.append(content)
+        return cls(kinds, lengths, contents, exact, fmt)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _update_starts(self, index):
+        """Recompute the offsets of segments after index"""
+        if index + 1 < len(self.starts):
+            self.starts[index + 1:] = self.starts[index] + np.cumsum(self.lengths[index:-1])
+
+    @property
+    def total_frames(self):
+        return int(self.starts[-1] + self.lengths[-1]) if len(self) else 0
+
+    @property
+    def duration(self):
+        return self.total_frames / float(self.fmt.sample_rate)
+
+    def set_length(self, index, frames):
+        """Record the real length of a segment; later segments move accordingly"""
+        self.lengths[index] = frames
+        self.exact[index] = True
+        self._update_starts(index)
+
+    def index_at(self, seconds):
+        """Index of the segment playing at seconds, or None past the end"""
+        frame = int(round(seconds * self.fmt.sample_rate))
+        if frame < 0 or frame >= self.total_frames:
+            return None
+        return int(np.searchsorted(self.starts, frame, side='right')) - 1
+
+    def overlapping(self, start_seconds, end_seconds):
+        """Indices of the segments that sound in [start_seconds, end_seconds)"""
+        first = int(round(start_seconds * self.fmt.sample_rate))
+        last = int(round(end_seconds * self.fmt.sample_rate))
+        begin = int(np.searchsorted(self.starts + self.lengths, first, side='right'))
+        end = int(np.searchsorted(self.starts, last, side='left'))
+        return range(begin, max(begin, end))
+
+    def offsets_exact(self, end_seconds):
+        """True when every segment starting before end_seconds has its real length"""
+        end = int(np.searchsorted(self.starts, int(round(end_seconds * self.fmt.sample_rate)), side='left'))
+        return bool(self.exact[:end].all())
+
+    def audio_segments(self, speech_clips):
+        """Segment list for the mixers; speech not in speech_clips becomes silence of its length"""
+        audio_segments = []
+        for index, kind in enumerate(self.kinds):
+            if kind == SPEECH and index in speech_clips:
+                audio_segments.append(speech_clips[index])
+            else:
+                audio_segments.append(('pause', self.lengths[index] / float(self.fmt.sample_rate)))
+        return audio_segments
+
+
+def _exact_length(audio_segment, fmt):
+    segment_type, content = audio_segment
+    if segment_type == 'samples':
+        return len(content)
+    return WavSource(content, fmt).frames
+
+
+def render_range(segments, settings, start_seconds, end_seconds, filename, music_file=None,
+                 music_gain_db=mixer.DEFAULT_MUSIC_GAIN_DB, fmt=None, checkpoint=None, loop_points=None,
+                 memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES):
+    """Render only [start_seconds, end_seconds) of a parsed script; returns a RangeReport
+
+    Segments already in checkpoint are reused (their lengths are exact) and
+    newly synthesized ones are committed to it. Offsets depend on the lengths
+    of all earlier speech, so they are estimates unless exact_offsets is True.
+    """
+    fmt = fmt or audio_format.render_format()
+    timeline = Timeline.from_segments(segments, settings.rate, fmt)
+    speech_clips = {}
+    if checkpoint is not None:
+        for index in np.flatnonzero(timeline.kinds == SPEECH):
+            path = checkpoint.lookup(settings, timeline.contents[index], fmt)
+            if path:
+                speech_clips[index] = ('audio', path)
+                timeline.set_length(index, _exact_length(speech_clips[index], fmt))
+
+    # Real lengths shift later segments, so repeat until every overlapping segment exists
+    synthesized = 0
+    while True:
+        needed = [index for index in timeline.overlapping(start_seconds, end_seconds)
+                  if timeline.kinds[index] == SPEECH and index not in speech_clips]
+        if not needed:
+            break
+        texts = [timeline.contents[index] for index in needed]
+        for index, text, samples in zip(needed, texts, speech.texts_to_speech_samples(texts, settings, fmt)):
+            speech_clips[index] = ('samples', samples)
+            timeline.set_length(index, len(samples))
+            if checkpoint is not None:
+                checkpoint.commit_samples(samples, settings, text, fmt, fmt=fmt)
+        synthesized += len(needed)
+
+    exact = timeline.offsets_exact(end_seconds)
+    print(f"✂️ Rendering {start_seconds:.1f}s-{end_seconds:.1f}s of {timeline.duration / 60:.1f} minutes: "
+          f"{synthesized} segment(s) synthesized" + ("" if exact else ", offsets estimated"))
+    renderer = BoundedRenderer(memory_budget_bytes, fmt)
+    report = renderer.render(timeline.audio_segments(speech_clips), music_file, filename, music_gain_db,
+                             loop_points, start_seconds, end_seconds)
+    return RangeReport(report.filename, start_seconds, report.duration, synthesized, exact)
+
+
+def parse_time(value):
+    """Seconds from '90', '12:00' or '1:02:30'"""
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render an excerpt of a meditation script")
+    parser.add_argument('script', help="meditation script text file")
+    parser.add_argument('--start', type=parse_time, required=True, help="start time (seconds or mm:ss)")
+    parser.add_argument('--end', type=parse_time, required=True, help="end time (seconds or mm:ss)")
+    parser.add_argument('--output', default="output/excerpt.wav")
+    parser.add_argument('--music', help="background music file")
+    parser.add_argument('--music-gain-db', type=float, default=mixer.DEFAULT_MUSIC_GAIN_DB)
+    parser.add_argument('--engine', default="gtts", choices=["gtts", "pyttsx3"])
+    parser.add_argument('--voice', default="English (US)")
+    parser.add_argument('--rate', type=int, default=speech.DEFAULT_RATE)
+    parser.add_argument('--volume', type=float, default=speech.DEFAULT_VOLUME)
+    args = parser.parse_args()
+
+    with open(args.script, encoding='utf-8') as f:
+        segments = parse_meditation_text(f.read())
+    settings = speech.VoiceSettings(args.engine, args.voice, args.rate, args.volume, None)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    report = render_range(segments, settings, args.start, args.end, args.output, args.music, args.music_gain_db)
+    print(f"📁 Excerpt: {report.filename} ({report.duration:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
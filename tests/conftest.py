@@ -0,0 +1,10 @@
+"""
+Shared pytest setup: make the application modules in src/ importable,
+the same way run.py does.
+"""
+
+import sys
+from pathlib import Path
+
+src_path = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(src_path))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Canonical Audio Format Tests
+Resampling accuracy and one-time conversion to the render format.
+"""
+
+import numpy as np
+
+import audio_format
+from audio_format import RenderFormat
+
+
+def sine(frequency, sample_rate, seconds, channels=1):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    tone = np.sin(2 * np.pi * frequency * t).astype(np.float32)
+    return np.repeat(tone[:, None], channels, axis=1)
+
+
+def test_resample_up_and_down_preserves_tone():
+    for src_rate, dst_rate, frequency in [(24000, 44100, 1000), (48000, 22050, 440), (22050, 48000, 3000)]:
+        resampled = audio_format.resample(sine(frequency, src_rate, 1.0), src_rate, dst_rate)
+        assert abs(len(resampled) - dst_rate) <= 1
+        expected = sine(frequency, dst_rate, len(resampled) / dst_rate)[:len(resampled)]
+        # Ignore the filter's edge transients
+        edge = dst_rate // 20
+        assert np.abs(resampled[edge:-edge] - expected[edge:-edge]).max() < 1e-3
+
+
+def test_resample_removes_content_above_new_nyquist():
+    # 15 kHz cannot be represented at 22.05 kHz and must not alias down
+    resampled = audio_format.resample(sine(15000, 44100, 1.0), 44100, 22050)
+    assert np.sqrt(np.mean(resampled[2000:-2000] ** 2)) < 1e-3
+
+
+def test_to_canonical_converts_rate_channels_and_type_once():
+    fmt = RenderFormat(44100, 2, 'int16')
+    canonical = audio_format.to_canonical(sine(440, 24000, 0.5), 24000, fmt)
+    assert canonical.dtype == np.int16
+    assert canonical.shape == (22050, 2)
+    assert np.array_equal(canonical[:, 0], canonical[:, 1])
+
+    mono = audio_format.to_canonical(sine(440, 44100, 0.5, channels=2), 44100, RenderFormat(44100, 1, 'float32'))
+    assert mono.shape == (22050, 1)
+
+
+def test_wav_round_trip_in_render_format(tmp_path):
+    fmt = RenderFormat(32000, 2, 'float32')
+    filename = str(tmp_path / "tone.wav")
+    audio_format.write_wav(filename, audio_format.to_canonical(sine(500, 16000, 0.25), 16000, fmt), fmt)
+    samples, sample_rate = audio_format.read_wav(filename)
+    assert sample_rate == 32000
+    assert samples.shape == (8000, 2)
+    assert np.array_equal(audio_format.load_audio(filename, fmt), samples)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Audio Probe Tests
+Builds minimal WAV, FLAC, Ogg and MP3 files and checks header-only probing.
+"""
+
+import struct
+import wave
+
+import pytest
+
+from audio_probe import probe_audio, probe_duration, ProbeError
+
+
+def test_probe_wav(tmp_path):
+    filename = tmp_path / "tone.wav"
+    with wave.open(str(filename), 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(48000)
+        wav_file.writeframes(b'\x00' * 4 * 72000)
+    info = probe_audio(str(filename))
+    assert (info.format, info.sample_rate, info.channels, info.frames) == ('wav', 48000, 2, 72000)
+    assert info.duration == 1.5
+
+
+def test_probe_flac_streaminfo(tmp_path):
+    sample_rate, channels, bits, total = 44100, 2, 16, 44100 * 600
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | total
+    streaminfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + packed.to_bytes(8, 'big') + b'\x00' * 16
+    filename = tmp_path / "long.flac"
+    filename.write_bytes(b'fLaC' + bytes([0x80, 0, 0, 34]) + streaminfo)
+    info = probe_audio(str(filename))
+    assert (info.format, info.sample_rate, info.channels, info.frames) == ('flac', 44100, 2, total)
+    assert info.duration == 600.0
+
+
+def ogg_page(packet, granule, sequence, header_type=0):
+    segments = [255] * (len(packet) // 255) + [len(packet) % 255]
+    return (b'OggS' + bytes([0, header_type]) + struct.pack('<qIII', granule, 1, sequence, 0)
+            + bytes([len(segments)]) + bytes(segments) + packet)
+
+
+def test_probe_ogg_vorbis_uses_last_granule(tmp_path):
+    identification = b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 2, 22050, 0, 0, 0, 0xB8, 1)
+    body = b''.join(ogg_page(b'\x00' * 400, 22050 * i, i) for i in range(1, 50))
+    filename = tmp_path / "rain.ogg"
+    filename.write_bytes(ogg_page(identification, 0, 0, 0x02) + body + ogg_page(b'\x00' * 10, 22050 * 90, 50, 0x04))
+    info = probe_audio(str(filename))
+    assert (info.format, info.sample_rate, info.channels) == ('ogg', 22050, 2)
+    assert info.duration == 90.0
+
+
+def test_probe_opus_removes_pre_skip(tmp_path):
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 1, 312, 44100, 0, 0)
+    filename = tmp_path / "voice.opus"
+    filename.write_bytes(ogg_page(head, 0, 0, 0x02) + ogg_page(b'\x00' * 20, 48000 * 5 + 312, 1, 0x04))
+    info = probe_audio(str(filename))
+    assert (info.format, info.channels) == ('opus', 1)
+    assert info.duration == 5.0
+
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, joint stereo, no padding: 417-byte frames
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x44])
+MP3_FRAME = 417
+
+
+def id3v2_tag(size):
+    return b'ID3\x04\x00\x00' + bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F]) + b'\x00' * size
+
+
+def cbr_frames(count):
+    """CBR frames with the padding bit set the way encoders do (417.96 bytes on average)"""
+    frames = []
+    remainder = 0
+    for _ in range(count):
+        remainder += 144 * 128000 % 44100
+        padding = remainder >= 44100
+        remainder -= 44100 if padding else 0
+        header = bytes([0xFF, 0xFB, 0x92 if padding else 0x90, 0x44])
+        frames.append(header + b'\x00' * (MP3_FRAME + padding - 4))
+    return b''.join(frames)
+
+
+def test_probe_cbr_mp3_from_payload_size(tmp_path):
+    filename = tmp_path / "cbr.mp3"
+    filename.write_bytes(id3v2_tag(300) + cbr_frames(200) + b'TAG' + b'\x00' * 125)
+    info = probe_audio(str(filename))
+    assert (info.format, info.sample_rate, info.channels) == ('mp3', 44100, 2)
+    assert abs(info.duration - 200 * 1152 / 44100) < 0.001
+
+
+def test_probe_mp3_xing_frames_and_lame_gapless_info(tmp_path):
+    frames, delay, padding = 5000, 576, 1200
+    xing = b'Info' + struct.pack('>II', 0x1, frames)
+    lame = b'LAME3.100' + b'\x00' * 12 + ((delay << 12) | padding).to_bytes(3, 'big')
+    first = MP3_HEADER + b'\x00' * 32 + xing + lame
+    first += b'\x00' * (MP3_FRAME - len(first))
+    filename = tmp_path / "vbr.mp3"
+    # Only a handful of real frames on disk: the tag alone determines the length
+    filename.write_bytes(first + (MP3_HEADER + b'\x00' * (MP3_FRAME - 4)) * 10)
+    info = probe_audio(str(filename))
+    assert info.frames == frames * 1152 - delay - padding
+    assert info.duration == info.frames / 44100.0
+
+
+def test_probe_rejects_unknown_data(tmp_path):
+    filename = tmp_path / "notes.txt"
+    filename.write_bytes(b'just some text, not audio' * 10)
+    with pytest.raises(ProbeError):
+        probe_audio(str(filename))
+    assert probe_duration(str(filename)) is None
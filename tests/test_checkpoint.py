@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Render Checkpoint Tests
+Atomic segment manifests and resuming an interrupted render.
+"""
+
+import os
+
+import numpy as np
+
+import checkpoint as checkpoint_module
+import fanout
+import speech
+from audio_format import RenderFormat
+from checkpoint import RenderCheckpoint, JOBS_DIRNAME, MANIFEST_FILENAME
+from fanout import FanOutRenderer, RenderVariant
+
+
+def test_manifest_survives_restart_and_rejects_torn_files(tmp_path):
+    fmt = RenderFormat(8000, 1, 'float32')
+    settings = speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+    checkpoint = RenderCheckpoint.for_job(tmp_path, "script", settings, fmt)
+    first = checkpoint.commit_samples(np.zeros((800, 1), np.float32), settings, "Breathe in", fmt, fmt=fmt)
+    second = checkpoint.commit_samples(np.zeros((400, 1), np.float32), settings, "Let go", fmt, fmt=fmt)
+
+    resumed = RenderCheckpoint.for_job(tmp_path, "script", settings, fmt)
+    assert resumed.completed(settings, "Breathe in", fmt) == first
+    assert resumed.completed(settings, "Breathe out", fmt) is None
+    # Different voice settings are a different job
+    assert len(RenderCheckpoint.for_job(tmp_path, "script", settings._replace(rate=140), fmt)) == 0
+
+    # A segment whose file no longer matches the manifest is redone
+    with open(second, 'r+b') as f:
+        f.truncate(100)
+    assert RenderCheckpoint.for_job(tmp_path, "script", settings, fmt).completed(settings, "Let go", fmt) is None
+    assert not [name for name in os.listdir(checkpoint.job_dir) if '.tmp' in name]
+
+    resumed.discard()
+    assert not resumed.job_dir.exists()
+
+
+def test_commits_append_to_a_journal_compacted_into_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint_module, 'COMPACT_EVERY', 4)
+    fmt = RenderFormat(8000, 1, 'float32')
+    settings = speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+    checkpoint = RenderCheckpoint.for_job(tmp_path, "script", settings, fmt)
+    for index in range(3):
+        checkpoint.commit_samples(np.zeros((80, 1), np.float32), settings, f"Phrase {index}", fmt, fmt=fmt)
+    # Nothing is rewritten per segment until the journal is compacted
+    assert not (checkpoint.job_dir / MANIFEST_FILENAME).exists()
+    assert len(checkpoint.journal_file.read_text().splitlines()) == 3
+    assert len(RenderCheckpoint.for_job(tmp_path, "script", settings, fmt)) == 3
+
+    for index in range(3, 6):
+        checkpoint.commit_samples(np.zeros((80, 1), np.float32), settings, f"Phrase {index}", fmt, fmt=fmt)
+    assert len(checkpoint.journal_file.read_text().splitlines()) == 2
+    # A line torn by a crash mid-append is ignored
+    with open(checkpoint.journal_file, 'a') as f:
+        f.write('{"bytes": 2')
+    resumed = RenderCheckpoint.for_job(tmp_path, "script", settings, fmt)
+    assert len(resumed) == 6 and resumed.completed(settings, "Phrase 5", fmt)
+
+
+def test_interrupted_fanout_resumes_without_resynthesizing(tmp_path, monkeypatch):
+    fetched = []
+
+    def fake_fetch(text, lang, tld, slow, mp3_filename):
+        fetched.append(text)
+        speech.create_silent_audio(mp3_filename, 0.2)
+
+    def crashing_mix(*args, **kwargs):
+        raise RuntimeError("killed")
+
+    monkeypatch.setattr(speech, 'fetch_gtts_mp3', fake_fetch)
+    real_mix = fanout.mixer.mix_voice_with_background
+    monkeypatch.setattr(fanout.mixer, 'mix_voice_with_background', crashing_mix)
+
+    music = str(tmp_path / "music.wav")
+    speech.create_silent_audio(music, 1.0)
+    variants = [RenderVariant(speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None), music)]
+    script = "Breathe in. [PAUSE:1] Breathe out. [PAUSE:1] Rest."
+    output_dir = tmp_path / "out"
+
+    assert FanOutRenderer(output_dir=str(output_dir)).render(script, variants) == [None]
+    assert sorted(fetched) == ["Breathe in.", "Breathe out.", "Rest."]
+    assert (output_dir / JOBS_DIRNAME).exists()
+
+    monkeypatch.setattr(fanout.mixer, 'mix_voice_with_background', real_mix)
+    results = FanOutRenderer(output_dir=str(output_dir)).render(script, variants)
+    assert os.path.exists(results[0])
+    assert len(fetched) == 3
+    assert not (output_dir / JOBS_DIRNAME).exists()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Bounded-Memory Rendering Tests
+Renders a multi-hour session in a child process and checks its peak RSS.
+"""
+
+import json
+import subprocess
+import sys
+import textwrap
+import wave
+from pathlib import Path
+
+import numpy as np
+
+import audio_format
+import chunked_render
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+
+
+def write_wav(filename, samples, sample_rate):
+    with wave.open(str(filename), 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(audio_format.float_to_pcm16(samples))
+
+
+def tone(frequency, sample_rate, seconds, channels=1):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    samples = (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+
+def test_chunked_render_matches_in_memory_mix(tmp_path):
+    fmt = RenderFormat(16000, 2, 'float32')
+    voice = tmp_path / "voice.wav"
+    music = tmp_path / "music.wav"
+    write_wav(voice, tone(300, 22050, 1.3), 22050)
+    write_wav(music, tone(110, 8000, 0.7, channels=2), 8000)
+    segments = [('audio', str(voice)), ('pause', 1), ('audio', str(voice))]
+
+    expected = np.clip(mixer_reference(segments, str(music), fmt), -1, 1)
+    output = tmp_path / "out.wav"
+    report = BoundedRenderer(2**34, fmt=fmt, chunk_seconds=0.25).render(segments, str(music), str(output))
+
+    rendered, sample_rate = audio_format.read_wav(str(output))
+    assert sample_rate == 16000
+    assert report.chunks > 10
+    assert rendered.shape == expected.shape
+    # Same math, chunk boundaries only add 16-bit rounding
+    assert np.abs(rendered - expected).max() < 2e-4
+
+
+def mixer_reference(segments, music_file, fmt):
+    import mixer
+    voice_track = mixer.build_voice_track(segments, fmt)
+    background = mixer.load_background_music(music_file, fmt)
+    return mixer.mix_voice_with_background(voice_track, background, fmt=fmt)
+
+
+def test_render_runs_without_a_budget_check_where_rss_is_unavailable(tmp_path, monkeypatch):
+    # As on Windows without psutil when GetProcessMemoryInfo fails: no /proc and no resource module
+    monkeypatch.setattr(chunked_render, 'current_rss', lambda: None)
+    fmt = RenderFormat(8000, 1, 'float32')
+    voice = tmp_path / "voice.wav"
+    write_wav(voice, tone(300, 8000, 1.0), 8000)
+    report = BoundedRenderer(1, fmt=fmt, chunk_seconds=0.25).render([('audio', str(voice))], None,
+                                                                     str(tmp_path / "out.wav"))
+    assert report.peak_rss is None
+    assert audio_format.read_wav(str(tmp_path / "out.wav"))[0].shape == (8000, 1)
+
+
+CHILD_SCRIPT = textwrap.dedent('''
+    import json, sys
+    sys.path.insert(0, sys.argv[1])
+    import audio_format
+    from audio_format import RenderFormat
+    from chunked_render import BoundedRenderer, current_rss, peak_rss
+
+    segments = json.loads(sys.argv[2])
+    fmt = RenderFormat(8000, 1, 'float32')
+    budget = current_rss() + 48 * 2**20
+    report = BoundedRenderer(budget, fmt=fmt).render(segments, sys.argv[3], sys.argv[4])
+    print(json.dumps({'budget': budget, 'peak': report.peak_rss, 'hwm': peak_rss(),
+                      'duration': report.duration}))
+''')
+
+
+def test_two_hour_render_stays_under_rss_budget(tmp_path):
+    voice = tmp_path / "voice.wav"
+    music = tmp_path / "music.wav"
+    write_wav(voice, tone(300, 22050, 2.0), 22050)
+    write_wav(music, tone(110, 16000, 300.0, channels=2), 16000)
+
+    # 100 x (2s of speech + 70s pause) = 2 hours
+    segments = []
+    for _ in range(100):
+        segments += [('audio', str(voice)), ('pause', 70)]
+
+    src_path = Path(__file__).parent.parent / "src"
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, str(src_path), json.dumps(segments),
+         str(music), str(tmp_path / "session.wav")],
+        capture_output=True, text=True, timeout=600
+    )
+    assert result.returncode == 0, result.stderr
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert stats['duration'] == 7200.0
+    # An in-memory render would need ~230 MB for the voice track alone
+    assert stats['peak'] < stats['budget']
+    assert stats['hwm'] < stats['budget']
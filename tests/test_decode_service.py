@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Decode Service Tests
+Streamed WAV parsing and batching of compressed items into few decoder runs.
+"""
+
+import shutil
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+import audio_format
+import decode_service
+from decode_service import decode_many, parse_wav_stream
+
+
+def float_wav_stream(samples, sample_rate):
+    """WAV bytes the way ffmpeg streams them to a pipe: float data, unknown sizes"""
+    channels = samples.shape[1]
+    fmt_chunk = struct.pack('<HHIIHH', 3, channels, sample_rate, sample_rate * channels * 4, channels * 4, 32)
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE' +
+            b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk +
+            b'LIST' + struct.pack('<I', 4) + b'INFO' +
+            b'data' + struct.pack('<I', 0xFFFFFFFF) + samples.astype('<f4').tobytes())
+
+
+def test_parse_wav_stream_with_placeholder_sizes():
+    samples = np.linspace(-1, 1, 600, dtype=np.float32).reshape(300, 2)
+    decoded, sample_rate = parse_wav_stream(float_wav_stream(samples, 24000))
+    assert sample_rate == 24000
+    assert np.array_equal(decoded, samples)
+
+
+def test_compressed_items_are_decoded_in_batches(monkeypatch):
+    batches = []
+
+    def fake_batch(ffmpeg, items):
+        batches.append(len(items))
+        if b'bad' in items:
+            return None, "Invalid data found when processing input"
+        return [(np.full((10, 1), len(item), dtype=np.float32), 22050) for item in items], ""
+
+    monkeypatch.setattr(decode_service, '_soundfile', lambda: None)
+    monkeypatch.setattr(decode_service, '_ffmpeg_batch', fake_batch)
+    monkeypatch.setattr(decode_service.shutil, 'which', lambda name: '/usr/bin/ffmpeg')
+    monkeypatch.setattr(decode_service.os, 'name', 'posix')
+    monkeypatch.setattr(decode_service, '_decode_with_pydub', lambda item: (np.zeros((5, 1), np.float32), 8000))
+
+    wav = float_wav_stream(np.zeros((4, 1), np.float32), 8000)
+    items = [b'\xff\xfb' + bytes(i) for i in range(20)] + [wav]
+    results = decode_many(items)
+    # The WAV never reaches ffmpeg; 20 MP3s need two processes, not twenty
+    assert batches == [16, 4]
+    assert results[-1][0].shape == (4, 1)
+    assert [int(r[0][0, 0]) for r in results[:20]] == [len(item) for item in items[:20]]
+
+    # A bad input fails its batch, so those items are retried one at a time
+    batches.clear()
+    results = decode_many([b'ok', b'bad'])
+    assert batches == [2] and all(r[1] == 8000 for r in results)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+def test_ffmpeg_batch_decodes_files_and_pipes(tmp_path):
+    t = np.arange(4410) / 44100.0
+    tone = (0.25 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)[:, None]
+    filename = str(tmp_path / "tone.wav")
+    with wave.open(filename, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(44100)
+        wav_file.writeframes(audio_format.float_to_pcm16(tone))
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    results, _ = decode_service._ffmpeg_batch(shutil.which('ffmpeg'), [filename, data, filename])
+    for samples, sample_rate in results:
+        assert sample_rate == 44100
+        assert np.abs(samples - tone).max() < 1e-4
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Draft Render Tests
+Drafts are small and fast, and share fetched speech with final renders.
+"""
+
+import io
+import os
+import shutil
+import wave
+
+import numpy as np
+
+import audio_format
+import draft
+import speech
+from decode_service import parse_wav_stream
+from speech import VoiceSettings
+
+
+RATE = 24000  # Google TTS speech rate
+
+
+def fake_gtts(requests):
+    """fetch_gtts_bytes stand-in: 0.05 s of tone per character, 0.4 s between sentences"""
+    def fetch(text, lang, tld, slow):
+        requests.append(text)
+        parts = [np.zeros(int(0.1 * RATE))]
+        for sentence in [s.strip() for s in text.split('.') if s.strip()]:
+            t = np.arange(int(0.05 * len(sentence) * RATE)) / RATE
+            parts += [0.3 * np.sin(2 * np.pi * 200 * t), np.zeros(int(0.4 * RATE))]
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(RATE)
+            wav_file.writeframes(audio_format.float_to_pcm16(np.concatenate(parts)[:, None]))
+        return buffer.getvalue()
+    return fetch
+
+
+def test_mulaw_preview_is_half_size_and_decodable(tmp_path):
+    fmt = draft.DRAFT_FORMAT
+    samples = (0.5 * np.sin(np.arange(16000) / 10.0)).astype(np.float32)[:, None]
+    audio_format.write_mulaw_wav(str(tmp_path / "a.wav"), samples, fmt)
+    audio_format.write_wav(str(tmp_path / "b.wav"), samples, fmt)
+    assert os.path.getsize(tmp_path / "a.wav") < 0.55 * os.path.getsize(tmp_path / "b.wav")
+
+    decoded, sample_rate = parse_wav_stream((tmp_path / "a.wav").read_bytes())
+    assert sample_rate == 16000 and decoded.shape == samples.shape
+    assert np.abs(decoded - samples).max() < 0.02
+
+
+def test_warm_draft_of_a_long_script_is_fast_and_warms_the_final_render(tmp_path, monkeypatch):
+    requests = []
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fake_gtts(requests))
+    monkeypatch.setattr(shutil, 'which', lambda name: None)  # mu-law preview, no ffmpeg
+    speech.set_speech_cache_dir(str(tmp_path / "speech_cache"))
+    try:
+        settings = VoiceSettings("gtts", "US English", 100, 0.6, None)
+        phrases = [f"Relax part {index} now" for index in range(100)]
+        script = " [PAUSE:11] ".join(phrases)
+
+        cold = draft.render_draft(script, settings, str(tmp_path / "out"))
+        assert len(requests) < len(phrases) / 3  # coalesced
+        assert cold.duration > 20 * 60
+        preview, sample_rate = parse_wav_stream(open(cold.filename, 'rb').read())
+        assert preview.shape[1] == 1 and sample_rate == 16000
+        assert os.path.getsize(cold.filename) < cold.duration * 16000 * 1.01
+
+        requests.clear()
+        warm = draft.render_draft(script, settings, str(tmp_path / "out"))
+        assert requests == []
+        assert warm.seconds < 10
+
+        # The final render gets the same phrases from the cache, time-stretched for its rate
+        final = speech.texts_to_speech_samples(phrases[:3], settings, audio_format.RenderFormat(16000, 1, 'float32'))
+        assert requests == []
+        assert len(final[0]) > 1.1 * 0.05 * len(phrases[0]) * 16000
+    finally:
+        speech.set_speech_cache_dir(None)
+
+
+def fake_pyttsx3(batches):
+    """_run_pyttsx3_many stand-in: 0.5 s of tone per phrase, one batch per call"""
+    def run(items, settings):
+        batches.append([text for text, _ in items])
+        t = np.arange(int(0.5 * RATE)) / RATE
+        for _, filename in items:
+            audio_format.write_wav(filename, (0.3 * np.sin(2 * np.pi * 200 * t))[:, None].astype(np.float32),
+                                   audio_format.RenderFormat(RATE, 1, 'float32'))
+        return [filename for _, filename in items]
+    return run
+
+
+def test_local_drafts_batch_the_engine_and_warm_the_final_render(tmp_path, monkeypatch):
+    batches = []
+    monkeypatch.setattr(speech, '_run_pyttsx3_many', fake_pyttsx3(batches))
+    speech.set_speech_cache_dir(str(tmp_path / "speech_cache"))
+    try:
+        settings = VoiceSettings("pyttsx3", "System Default", 100, 0.6, None)
+        phrases = ["Breathe in.", "Breathe out.", "Let go."]
+        samples = draft.draft_speech(phrases + ["Let go."], settings)
+        assert batches == [phrases]     # one engine process for the whole draft
+        assert all(samples[text].shape == (8000, 1) for text in phrases)
+
+        batches.clear()
+        draft.draft_speech(phrases, settings)
+        final = speech.texts_to_speech_samples(phrases, settings)
+        assert batches == [] and len(final) == 3
+
+        # Another voice is not served from this one's cache
+        draft.draft_speech(phrases[:1], settings._replace(voice_id="other"))
+        assert batches == [phrases[:1]]
+    finally:
+        speech.set_speech_cache_dir(None)
+
+
+def test_google_drafts_never_mix_in_local_speech(tmp_path, monkeypatch):
+    requests = []
+    batches = []
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fake_gtts(requests))
+    monkeypatch.setattr(speech, '_run_pyttsx3_many', fake_pyttsx3(batches))
+    speech.set_speech_cache_dir(str(tmp_path / "speech_cache"))
+    try:
+        settings = VoiceSettings("gtts", "US English", 100, 0.6, None)
+        speech.texts_to_speech_samples(["Breathe in."], settings)     # a final render fetched this one
+        requests.clear()
+        draft.draft_speech(["Breathe in.", "Breathe out.", "Let go."], settings)
+        assert sorted(requests) == ["Breathe out. Let go."] and batches == []
+    finally:
+        speech.set_speech_cache_dir(None)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Multi-Format Export Tests
+One mixed stream fanned out to concurrent encoders, with no second mix or decode.
+"""
+
+import shutil
+import stat
+import sys
+import wave
+
+import numpy as np
+
+import audio_format
+import mixer
+import sharded_render
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+from encoder_tee import EncoderTee
+from sharded_render import ShardedRenderer
+
+
+FMT = RenderFormat(8000, 2, 'float32')
+
+# Stands in for ffmpeg: copies the raw PCM it is fed to the output file, or fails for .opus;
+# 'chatty' outputs fill the stderr pipe before reading any input
+FAKE_FFMPEG = f"""#!{sys.executable}
+import shutil, sys
+if sys.argv[-1].endswith('.opus') and 'fail' in sys.argv[-1]:
+    sys.stderr.write('no libopus')
+    sys.exit(1)
+if 'chatty' in sys.argv[-1]:
+    sys.stderr.write('warning: ' * 100000)
+    sys.stderr.flush()
+with open(sys.argv[-1], 'wb') as output:
+    shutil.copyfileobj(sys.stdin.buffer, output)
+"""
+
+
+def fake_ffmpeg(tmp_path, monkeypatch):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(shutil, 'which', lambda name: str(ffmpeg) if name == 'ffmpeg' else None)
+
+
+def pcm_of(filename):
+    with wave.open(filename, 'rb') as wav_file:
+        return wav_file.readframes(wav_file.getnframes())
+
+
+def tone(seconds, frequency, rate=8000):
+    t = np.arange(int(seconds * rate)) / rate
+    return np.repeat((0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None], 2, axis=1)
+
+
+def test_every_renderer_tees_the_master_pcm(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch)
+    monkeypatch.setattr(sharded_render, 'MIN_SHARD_SECONDS', 1.0)
+    segments = [('samples', tone(1.5, 330)), ('pause', 1.0), ('samples', tone(2.0, 440)), ('pause', 2.0)] * 2
+
+    mixer.export_mix(mixer.build_voice_track(segments, FMT), str(tmp_path / "memory.wav"), FMT, ('mp3', 'opus'))
+    bounded = BoundedRenderer(256 * 2**20, FMT, chunk_seconds=1.0).render(
+        segments, None, str(tmp_path / "bounded.wav"), exports=('mp3', 'opus'))
+    sharded = ShardedRenderer(256 * 2**20, FMT, workers=2, chunk_seconds=1.0).render(
+        segments, None, str(tmp_path / "sharded.wav"), exports=('mp3',), start_seconds=0.5)
+
+    for stem in ("memory", "bounded"):
+        master = pcm_of(str(tmp_path / f"{stem}.wav"))
+        assert (tmp_path / f"{stem}.mp3").read_bytes() == master
+        assert (tmp_path / f"{stem}.opus").read_bytes() == master
+    assert bounded.exports == {'mp3': str(tmp_path / "bounded.mp3"), 'opus': str(tmp_path / "bounded.opus")}
+    assert sharded.exports == {'mp3': str(tmp_path / "sharded.mp3")}
+    assert (tmp_path / "sharded.mp3").read_bytes() == pcm_of(str(tmp_path / "sharded.wav"))
+
+
+def test_failed_or_missing_encoders_leave_the_master(tmp_path, monkeypatch, capsys):
+    fake_ffmpeg(tmp_path, monkeypatch)
+    pcm = audio_format.float_to_pcm16(tone(0.5, 440))
+    with EncoderTee(str(tmp_path / "fail.wav"), ('mp3', 'opus'), FMT) as tee:
+        tee.write(pcm)
+    assert tee.outputs == {'mp3': str(tmp_path / "fail.mp3")}
+    assert not (tmp_path / "fail.opus").exists()
+    assert "OPUS export failed (ffmpeg exit code 1): no libopus" in capsys.readouterr().out
+
+    monkeypatch.setattr(shutil, 'which', lambda name: None)
+    with EncoderTee(str(tmp_path / "plain.wav"), ('mp3',), FMT) as tee:
+        tee.write(pcm)
+    assert tee.outputs == {}
+
+
+def test_encoders_writing_to_stderr_do_not_stall_the_tee(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch)
+    pcm = audio_format.float_to_pcm16(tone(10.0, 440))  # more than a pipe holds, both ways
+    with EncoderTee(str(tmp_path / "chatty.wav"), ('mp3',), FMT) as tee:
+        for start in range(0, len(pcm), 32000):
+            tee.write(pcm[start:start + 32000])
+    assert (tmp_path / "chatty.mp3").read_bytes() == pcm
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Fan-out Rendering Tests
+Checks that variants share parsing, synthesis and music decode work.
+"""
+
+import json
+import math
+import os
+import struct
+import wave
+
+import audio_format
+import fanout
+import speech
+from fanout import FanOutRenderer, RenderVariant
+
+
+def write_tone(filename, seconds, frequency=220.0, sample_rate=22050):
+    """Write a short mono sine tone WAV"""
+    frames = int(seconds * sample_rate)
+    with wave.open(filename, 'w') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b''.join(
+            struct.pack('<h', int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate)))
+            for i in range(frames)
+        ))
+
+
+def test_variants_share_synthesis_and_decode(tmp_path, monkeypatch):
+    calls = {'fetch': 0, 'local': 0, 'music': 0}
+
+    def fake_fetch(text, lang, tld, slow, mp3_filename):
+        calls['fetch'] += 1
+        write_tone(mp3_filename, 0.3)
+
+    def fake_local(text, filename, settings):
+        calls['local'] += 1
+        write_tone(filename, 0.3, frequency=330.0)
+
+    real_load = fanout.mixer.load_background_music
+
+    def counting_load(music_file):
+        calls['music'] += 1
+        return real_load(music_file)
+
+    monkeypatch.setattr(speech, 'fetch_gtts_mp3', fake_fetch)
+    monkeypatch.setattr(speech, 'create_speech_pyttsx3', fake_local)
+    monkeypatch.setattr(fanout.mixer, 'load_background_music', counting_load)
+
+    rain = str(tmp_path / "rain.wav")
+    drone = str(tmp_path / "drone.wav")
+    write_tone(rain, 0.5, frequency=110.0)
+    write_tone(drone, 2.0, frequency=55.0)
+
+    soft = speech.VoiceSettings('gtts', 'English (US Female, Slow)', 120, 0.85, None)
+    loud = soft._replace(volume=1.0)
+    local = speech.VoiceSettings('pyttsx3', '', 140, 0.85, None)
+    variants = [
+        RenderVariant(soft, rain),
+        RenderVariant(soft, drone, -6),
+        RenderVariant(loud, rain),
+        RenderVariant(local, drone),
+        RenderVariant(local, drone),
+    ]
+
+    script = "Breathe in. [PAUSE:1] Breathe out. [PAUSE:1] Breathe in."
+    results = FanOutRenderer(output_dir=str(tmp_path / "out")).render(script, variants)
+
+    # Two distinct texts: fetched once for both gTTS volumes, synthesized once locally
+    assert calls == {'fetch': 2, 'local': 2, 'music': 2}
+    assert len(results) == 5
+    assert results[3] == results[4]
+    assert len(set(results)) == 4
+    for filename in results:
+        assert os.path.exists(filename)
+    # Work files are cleaned up, only the variant outputs remain
+    assert sorted(os.listdir(tmp_path / "out")) == sorted(os.path.basename(f) for f in set(results))
+
+
+def test_music_gain_moves_soundscape_variants(tmp_path):
+    scape = tmp_path / "scape.json"
+    scape.write_text(json.dumps({'layers': [{'generator': {'type': 'brown', 'seed': 1}, 'gain_db': -20}]}))
+    settings = speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+    variants = [RenderVariant(settings, str(scape), label="default"),
+                RenderVariant(settings, str(scape), fanout.mixer.DEFAULT_MUSIC_GAIN_DB - 6, label="quiet")]
+    results = FanOutRenderer(output_dir=str(tmp_path / "out")).render("[PAUSE:2]", variants)
+
+    default, quiet = (audio_format.load_audio(filename) for filename in results)
+    ratio = float(abs(quiet).max() / abs(default).max())
+    assert abs(ratio - 10 ** (-6 / 20.0)) < 0.01
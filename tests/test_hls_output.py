@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+HLS Output Tests
+Segment cutting, progressive publishing and playlist validation.
+"""
+
+import shutil
+import stat
+import sys
+
+import numpy as np
+import pytest
+
+import hls_output
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+from hls_output import HlsSegmenter, PlaylistError, validate_playlist
+
+# MPEG-2.5 layer III, 64 kbps, 8 kHz, stereo: 576 samples in 576 bytes
+FRAME = b'\xFF\xE3\x88\x00' + bytes(572)
+
+# Stands in for ffmpeg: one MP3 frame on stdout per 576 PCM frames read from stdin
+FAKE_FFMPEG = f"""#!{sys.executable}
+import sys
+frame = {FRAME!r}
+while True:
+    pcm = sys.stdin.buffer.read(576 * 4)
+    if not pcm:
+        break
+    sys.stdout.buffer.write(frame)
+"""
+
+
+def test_segments_are_published_as_they_complete(tmp_path):
+    segmenter = HlsSegmenter(str(tmp_path), segment_seconds=2.0)
+    stream = FRAME * 60                                 # 4.32 s
+    for start in range(0, len(stream), 1000):           # pieces that split frames
+        segmenter.feed(stream[start:start + 1000])
+
+    playlist = validate_playlist(str(tmp_path / hls_output.PLAYLIST_NAME))
+    assert not playlist.ended
+    assert [segment.duration for segment in playlist.segments] == [2.016, 2.016]  # 28 frames each
+
+    playlist = validate_playlist(segmenter.finish())
+    assert playlist.ended and playlist.target_duration == 2
+    assert [segment.duration for segment in playlist.segments] == [2.016, 2.016, 0.288]
+    assert (tmp_path / "segment_00001.mp3").read_bytes()[:3] == b'ID3'
+
+    with open(tmp_path / "segment_00002.mp3", 'ab') as f:
+        f.write(FRAME)
+    with pytest.raises(PlaylistError):
+        validate_playlist(str(tmp_path / hls_output.PLAYLIST_NAME))
+
+
+def test_render_streams_hls_alongside_the_master(tmp_path, monkeypatch):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(shutil, 'which', lambda name: str(ffmpeg) if name == 'ffmpeg' else None)
+    fmt = RenderFormat(8000, 2, 'float32')
+    voice = np.full((int(7.5 * 8000), 2), 0.1, dtype=np.float32)
+
+    report = BoundedRenderer(256 * 2**20, fmt, chunk_seconds=2.0).render(
+        [('samples', voice), ('pause', 8.0)], None, str(tmp_path / "session.wav"), exports=('hls',))
+    playlist = validate_playlist(report.exports['hls'])
+    assert report.exports['hls'] == str(tmp_path / "session_hls" / hls_output.PLAYLIST_NAME)
+    assert playlist.ended
+    assert all(segment.duration <= hls_output.SEGMENT_SECONDS + 576 / 8000 for segment in playlist.segments)
+    assert abs(sum(segment.duration for segment in playlist.segments) - 15.5) < 576 / 8000
+    assert hls_output.main([report.exports['hls']]) == 0
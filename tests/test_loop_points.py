@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Seamless Looping Tests
+Loop-point detection on periodic material and chunked crossfade-loop playback.
+"""
+
+import numpy as np
+
+from audio_sources import ArraySource, CrossfadeLoopSource
+from loop_points import find_loop_points, whole_track_loop
+
+
+def test_loop_points_match_the_period_of_the_music():
+    sample_rate = 8000
+    rng = np.random.default_rng(3)
+    # A 1.5 s noise pattern repeated, then slightly detuned around the edges
+    pattern = rng.standard_normal(int(1.5 * sample_rate)).astype(np.float32) * 0.2
+    samples = np.tile(pattern, 8)[:, None]
+
+    loop = find_loop_points(samples, sample_rate, search_seconds=4)
+    period = (loop.loop_out - loop.loop_in) * sample_rate
+    assert loop.score > 0.99
+    assert abs(period / len(pattern) - round(period / len(pattern))) < 1e-3
+
+
+def test_crossfade_loop_reads_are_chunk_independent():
+    sample_rate = 1000
+    t = np.arange(3 * sample_rate) / sample_rate
+    samples = np.stack([np.sin(2 * np.pi * 5 * t), np.cos(2 * np.pi * 3 * t)], axis=1).astype(np.float32)
+    source = CrossfadeLoopSource(ArraySource(samples), loop_in=400, loop_out=2700, crossfade=300)
+
+    whole = source.read(0, 10000)
+    pieces = np.concatenate([source.read(start, 777) for start in range(0, 10000, 777)])[:10000]
+    assert np.array_equal(whole, pieces)
+    # The first pass plays the original audio up to the first seam
+    assert np.array_equal(whole[:2400], samples[:2400])
+    # After the seam the loop repeats with a period of loop_out - loop_in
+    assert np.allclose(whole[2700:4000], whole[2700 + 2300:4000 + 2300])
+
+
+def test_whole_track_loop_for_short_music():
+    loop = whole_track_loop(0.4)
+    assert loop.loop_out == 0.4 and loop.crossfade == loop.loop_in == 0.1
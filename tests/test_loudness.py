@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Loudness Tests
+BS.1770 measurement, cached analyses, voice normalization and ducking.
+"""
+
+import numpy as np
+
+import audio_format
+import loudness
+import mixer
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+from loudness import LoudnessMeter, LoudnessTarget
+
+
+FMT = RenderFormat(16000, 1, 'float32')
+
+
+def sine(seconds, frequency=997, level_db=-20.0, rate=16000, phase=0.0):
+    t = np.arange(int(seconds * rate)) / rate
+    return (10 ** (level_db / 20) * np.sin(2 * np.pi * frequency * t + phase)).astype(np.float32)[:, None]
+
+
+def measure(samples, rate=16000, chunk=None):
+    meter = LoudnessMeter(rate, samples.shape[1])
+    for start in range(0, len(samples), chunk or len(samples)):
+        meter.add(samples[start:start + (chunk or len(samples))])
+    return loudness.report(meter.result())
+
+
+def test_meter_matches_bs1770_and_is_chunking_independent():
+    reference = measure(sine(5.0, rate=48000), rate=48000)
+    assert abs(reference.integrated_lufs - -23.0) < 0.1  # 997 Hz at -20 dBFS reads -23 LUFS (mono)
+    # The filters carry their state across chunks; only rounding depends on where chunks end
+    chunked, whole = measure(sine(5.0), chunk=1234), measure(sine(5.0))
+    assert abs(chunked.integrated_lufs - whole.integrated_lufs) < 1e-9 and chunked.true_peak_db == whole.true_peak_db
+
+    # Gating ignores the silent half; a 45 degree phased fs/4 tone peaks between samples
+    gated = measure(np.concatenate([sine(20.0), np.zeros((20 * 16000, 1), dtype=np.float32)]))
+    assert abs(gated.integrated_lufs - measure(sine(20.0)).integrated_lufs) < 0.1
+    between = sine(1.0, frequency=4000, level_db=0.0, phase=np.pi / 4)
+    assert np.abs(between).max() < 0.71
+    assert abs(measure(between).true_peak_db) < 0.2
+
+
+# BS.1770 Tables 1 and 2: the K-weighting stages at 48 kHz
+PUBLISHED_K_WEIGHTING = [([1.53512485958697, -2.69169618940638, 1.19839281085285],
+                          [1.0, -1.69065929318241, 0.73248077421585]),
+                         ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])]
+
+
+def published_gain_db(frequency):
+    z = np.exp(-2j * np.pi * frequency / 48000)
+    return sum(20 * np.log10(abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z))) for b, a in PUBLISHED_K_WEIGHTING)
+
+
+def test_k_weighting_is_the_published_filter():
+    for (b, a), (published_b, published_a) in zip(loudness.k_weighting_filters(48000), PUBLISHED_K_WEIGHTING):
+        assert np.allclose(b, published_b, atol=1e-8) and np.allclose(a, published_a, atol=1e-8)
+
+    # A full-scale 997 Hz sine reads -3.01 LUFS at 48 kHz, and within a few hundredths at other rates
+    assert abs(measure(sine(5.0, level_db=0.0, rate=48000), rate=48000).integrated_lufs - -3.01) < 0.01
+    assert abs(measure(sine(5.0, level_db=0.0), chunk=1000).integrated_lufs - -3.01) < 0.05
+
+    # 25 Hz does not fit the 100 ms sub-blocks: the filter runs across them, so the reading is the published gain
+    tone = measure(sine(10.0, frequency=25, level_db=0.0, rate=48000), rate=48000, chunk=4321)
+    assert abs(tone.integrated_lufs - (-3.01 - 0.691 + published_gain_db(25))) < 0.01
+    # At 16 kHz it is the redesigned filter's gain, a tenth of a dB from the 48 kHz curve
+    tone = measure(sine(10.0, frequency=25, level_db=0.0), chunk=4321)
+    gain_db = 10 * np.log10(loudness.k_weighting_power(np.array([25.0]), 16000)[0])
+    assert abs(tone.integrated_lufs - (-3.01 - 0.691 + gain_db)) < 0.01
+    assert abs(gain_db - published_gain_db(25)) < 0.1
+
+
+def test_voice_is_normalized_from_cached_analyses(tmp_path, monkeypatch):
+    analyzed = []
+    analyze_source = loudness.analyze_source
+    monkeypatch.setattr(loudness, 'analyze_source', lambda *args: analyzed.append(1) or analyze_source(*args))
+    quiet, loud = str(tmp_path / "quiet.wav"), str(tmp_path / "loud.wav")
+    audio_format.write_wav(quiet, sine(2.0, 300, -40.0), FMT)
+    audio_format.write_wav(loud, sine(2.0, 500, -30.0), FMT)
+    segments = [('audio', quiet), ('pause', 1), ('audio', loud), ('pause', 1), ('samples', sine(1.0, 400, -35.0))]
+    renderer = BoundedRenderer(512 * 2**20, FMT, analysis_cache_dir=str(tmp_path / "analysis"))
+
+    first = renderer.render(segments, None, str(tmp_path / "a.wav"), loudness=LoudnessTarget(-20.0))
+    assert abs(first.loudness.integrated_lufs - -20.0) < 0.5
+    assert len(analyzed) == 3
+
+    analyzed.clear()
+    renderer = BoundedRenderer(512 * 2**20, FMT, analysis_cache_dir=str(tmp_path / "analysis"))
+    second = renderer.render(segments, None, str(tmp_path / "b.wav"), loudness=LoudnessTarget(-16.0))
+    assert analyzed == []
+    assert abs(second.loudness.integrated_lufs - -16.0) < 0.5
+    assert second.loudness.true_peak_db <= -1.0 + 0.2
+
+
+def test_music_sits_below_the_voice_and_ducks_under_speech(tmp_path):
+    music = str(tmp_path / "music.wav")
+    audio_format.write_wav(music, sine(20.0, 150, -10.0), FMT)
+    segments = [('pause', 4), ('samples', sine(2.0, 600, -25.0)), ('pause', 4)]
+    target = LoudnessTarget(-20.0, duck_db=-6.0, attack=0.5, release=1.0)
+    session = BoundedRenderer(512 * 2**20, FMT, analysis_cache_dir=str(tmp_path / "analysis")).open_session(
+        segments, music, music_gain_db=-15.0, work_dir=str(tmp_path), loudness=target)
+
+    def music_level(start_seconds, seconds=0.25):
+        # The 150 Hz bed's level, separated from the 600 Hz voice by projection
+        chunk = session.read(int(start_seconds * 16000), int(seconds * 16000))[:, 0]
+        t = (np.arange(len(chunk)) + int(start_seconds * 16000)) / 16000
+        return 2 * np.hypot(chunk @ np.sin(2 * np.pi * 150 * t), chunk @ np.cos(2 * np.pi * 150 * t)) / len(chunk)
+
+    steady, ducked = music_level(1.0), music_level(5.0)
+    # Music 15 LU below the -20 LUFS voice: the amplitude a K-weighted 150 Hz tone needs to read -35 LUFS
+    weighting = loudness.k_weighting_power(np.array([150.0]), 16000)[0]
+    expected = np.sqrt(2 * 10 ** ((-35.0 + 0.691) / 10) / weighting)
+    assert abs(20 * np.log10(steady / expected)) < 0.3
+    assert abs(20 * np.log10(ducked / steady) - -6.0) < 0.3
+    # The dip starts ahead of the phrase and recovers after it
+    assert 0.55 < music_level(3.75) / steady < 0.95
+    assert music_level(3.0) / steady > 0.99
+    assert music_level(8.0) / steady > 0.99
+
+
+def test_in_memory_mix_normalizes_like_the_bounded_renderer(tmp_path):
+    music = str(tmp_path / "music.wav")
+    audio_format.write_wav(music, sine(3.0, 150, -10.0), FMT)
+    segments = [('samples', sine(2.0, 600, -35.0)), ('pause', 2), ('samples', sine(2.0, 500, -30.0))]
+    target = LoudnessTarget(-20.0)
+    bounded = BoundedRenderer(512 * 2**20, FMT, analysis_cache_dir=str(tmp_path / "analysis")).render(
+        segments, music, str(tmp_path / "bounded.wav"), loudness=target)
+
+    voice_track = mixer.build_voice_track(segments, FMT)
+    voice = mixer.mix_voice_with_background(voice_track, np.zeros((0, 1), np.float32), fmt=FMT, loudness=target)
+    assert abs(measure(voice).integrated_lufs - -20.0) < 0.1
+    mix = mixer.mix_voice_with_background(voice_track, mixer.load_background_music(music, FMT), fmt=FMT,
+                                          loudness=target)
+    # The in-memory mix gates the whole voice track, the bounded renderer each clip: close, not identical
+    assert mix.shape == (bounded.duration * 16000, 1)
+    assert abs(measure(mix).integrated_lufs - bounded.loudness.integrated_lufs) < 1.0
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Generator Render Tests
+The GUI's render path driven without a window: widgets and variables are
+replaced by stand-ins holding the values the user would have chosen.
+"""
+
+import io
+
+import numpy as np
+
+import audio_format
+import checkpoint
+import metrics
+import speech
+from audio_format import RenderFormat
+from meditation_generator import MeditationGenerator
+
+
+SETTINGS = speech.VoiceSettings("gtts", "British English (Slow)", 120, 0.85, None)
+
+
+class Var:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class Widget:
+    def config(self, **options):
+        pass
+
+    def update(self):
+        pass
+
+    start = stop = update
+
+
+def wav_bytes(seconds, sample_rate=22050):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buffer = io.BytesIO()
+    audio_format.write_wav(buffer, (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)[:, None],
+                           RenderFormat(sample_rate, 1, 'float32'))
+    return buffer.getvalue()
+
+
+def fail(title, message):
+    raise AssertionError(message)
+
+
+def generator(music_file, in_memory=True):
+    app = MeditationGenerator.__new__(MeditationGenerator)
+    app.root = app.status_label = app.progress = Widget()
+    app.background_music_file = Var(music_file)
+    app.in_memory_var = Var(in_memory)
+    app.coalesce_var = Var(False)
+    app.normalize_var = Var(False)
+    app.rate_var = Var(SETTINGS.rate)
+    app.volume_var = Var(SETTINGS.volume)
+    app.generated_audio_files = []
+    app.is_playing = True
+    app.current_voice_settings = lambda: SETTINGS
+    app.stop_meditation = lambda: None
+    return app
+
+
+def checkpoint_lookups():
+    return {result: metrics.CACHE_REQUESTS.value(cache='checkpoint', result=result) for result in ('hit', 'miss')}
+
+
+def test_in_memory_render_keeps_segments_off_the_output_volume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('meditation_generator.messagebox.showerror', fail)
+    monkeypatch.setattr('meditation_generator.SCRATCH_DIR', str(tmp_path / "scratch"))
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.3))
+    monkeypatch.setattr(MeditationGenerator, 'EXPORT_FORMATS', ())
+    audio_format.write_wav(str(tmp_path / "music.wav"), np.zeros((8000, 2), dtype=np.float32),
+                           RenderFormat(8000, 2, 'float32'))
+    app = generator(str(tmp_path / "music.wav"))
+
+    seen = []
+    create_final = app.create_final_meditation_file
+
+    def spy(audio_segments, estimated_duration):
+        seen.extend(path for path in (tmp_path / "output").rglob("*") if path.is_file())
+        seen.extend(path for path in (tmp_path / "scratch").rglob("*.wav"))
+        return create_final(audio_segments, estimated_duration)
+
+    app.create_final_meditation_file = spy
+    app._generate_meditation_direct("Breathe in. [PAUSE:1] Breathe out. [PAUSE:1] Breathe in.")
+
+    # Segments were checkpointed, but in the scratch directory, not under output/
+    assert seen and all(tmp_path / "scratch" in path.parents for path in seen)
+    finals = [path for path in (tmp_path / "output").rglob("*") if path.is_file() and ".render_cache" not in path.parts]
+    assert [path.name[:20] for path in finals] == ["complete_meditation_"]
+    assert not (tmp_path / "output" / checkpoint.JOBS_DIRNAME).exists()
+
+
+def test_checkpoint_lookups_are_counted_once_per_segment(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('meditation_generator.messagebox.showerror', fail)
+    monkeypatch.setattr('meditation_generator.SCRATCH_DIR', str(tmp_path / "scratch"))
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.3))
+    app = generator(None)
+    app.create_final_meditation_file = lambda audio_segments, estimated_duration: None  # keep the checkpoint
+
+    before = checkpoint_lookups()
+    app._generate_meditation_direct("One. [PAUSE:1] Two. [PAUSE:1] One. [PAUSE:1] Three.")
+    after = checkpoint_lookups()
+    assert (after['hit'] - before['hit'], after['miss'] - before['miss']) == (0, 3)
+
+    app._generate_meditation_direct("One. [PAUSE:1] Two. [PAUSE:1] One. [PAUSE:1] Three.")
+    again = checkpoint_lookups()
+    assert (again['hit'] - after['hit'], again['miss'] - after['miss']) == (3, 0)
+
+
+def test_in_memory_renders_can_opt_out_of_segment_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('meditation_generator.messagebox.showerror', fail)
+    monkeypatch.setattr('meditation_generator.SCRATCH_DIR', str(tmp_path / "scratch"))
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.3))
+    monkeypatch.setattr(MeditationGenerator, 'CHECKPOINT_IN_MEMORY_SEGMENTS', False)
+    app = generator(None)
+    segments = []
+
+    def final(audio_segments, estimated_duration):
+        segments.extend(kind for kind, _ in audio_segments)
+        return None     # keep the checkpoint directory to look into
+    app.create_final_meditation_file = final
+
+    app._generate_meditation_direct("One. [PAUSE:1] Two. [PAUSE:1] Three.")
+    assert segments == ['samples', 'pause', 'samples', 'pause', 'samples']
+    assert not list((tmp_path / "scratch").rglob("*.wav"))
+
+
+def test_render_cache_tells_apart_every_output_option(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('meditation_generator.messagebox.showerror', fail)
+    monkeypatch.setattr('meditation_generator.SCRATCH_DIR', str(tmp_path / "scratch"))
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.3))
+    monkeypatch.setattr(MeditationGenerator, 'EXPORT_FORMATS', ())
+    audio_format.write_wav(str(tmp_path / "music.wav"), np.zeros((8000, 2), dtype=np.float32),
+                           RenderFormat(8000, 2, 'float32'))
+    app = generator(str(tmp_path / "music.wav"))
+    renders = []
+    create_final = app.create_final_meditation_file
+    app.create_final_meditation_file = lambda *args: renders.append(1) or create_final(*args)
+
+    script = "Breathe in. [PAUSE:1] Breathe out."
+    app._generate_meditation_direct(script)
+    app._generate_meditation_direct(script)
+    assert len(renders) == 1
+    app.coalesce_var = Var(True)
+    app._generate_meditation_direct(script)
+    app.in_memory_var = Var(False)
+    monkeypatch.setattr(speech, 'text_to_speech_file',
+                        lambda text, filename, settings: audio_format.write_wav(filename, audio_format.silence(0.3)))
+    app._generate_meditation_direct(script)
+    assert len(renders) == 3
+
+
+def test_short_normalized_renders_stay_on_the_in_memory_mixer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('meditation_generator.messagebox.showerror', fail)
+    monkeypatch.setattr('meditation_generator.SCRATCH_DIR', str(tmp_path / "scratch"))
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.3))
+    monkeypatch.setattr(MeditationGenerator, 'EXPORT_FORMATS', ())
+    monkeypatch.setattr('meditation_generator.BoundedRenderer', None)  # a call would fail
+    audio_format.write_wav(str(tmp_path / "music.wav"), np.zeros((8000, 2), dtype=np.float32),
+                           RenderFormat(8000, 2, 'float32'))
+    app = generator(str(tmp_path / "music.wav"))
+    app.normalize_var = Var(True)
+    finals = []
+    create_final = app.create_final_meditation_file
+    app.create_final_meditation_file = lambda *args: finals.append(create_final(*args)) or finals[-1]
+
+    app._generate_meditation_direct("Breathe in. [PAUSE:1] Breathe out.")
+    assert len(finals) == 1 and finals[0].startswith("output/complete_meditation_")
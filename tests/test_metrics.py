@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Metrics Endpoint Tests
+Scrapes the local /metrics endpoint and validates the Prometheus text format.
+"""
+
+import math
+import re
+import urllib.request
+
+import numpy as np
+
+import metrics
+import mixer
+import speech
+from audio_format import RenderFormat
+
+
+SAMPLE_LINE = re.compile(
+    r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)'
+    r'(?:\{(?P<labels>[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*)\})?'
+    r' (?P<value>[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|Inf|NaN))$'
+)
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_exposition(text):
+    """Strict parse of the text format into {name: {type, samples}}"""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            current = line.split(' ')[2]
+            families.setdefault(current, {'samples': []})
+        elif line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert name == current, f"TYPE for {name} outside its family"
+            families[name]['type'] = kind
+        else:
+            match = SAMPLE_LINE.match(line)
+            assert match, f"Malformed sample line: {line!r}"
+            name = match.group('name')
+            assert name == current or name.startswith(current + '_'), f"{name} outside family {current}"
+            labels = dict(LABEL.findall(match.group('labels') or ''))
+            families[current]['samples'].append((name, labels, float(match.group('value'))))
+    return families
+
+
+def sample(families, family, name=None, **labels):
+    for sample_name, sample_labels, value in families[family]['samples']:
+        if sample_name == (name or family) and sample_labels == {k: str(v) for k, v in labels.items()}:
+            return value
+    return 0.0
+
+
+def scrape(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        return parse_exposition(response.read().decode('utf-8'))
+
+
+def test_scrape_reports_render_activity(monkeypatch):
+    server = metrics.serve(0, host='127.0.0.1')
+    try:
+        before = scrape(server)
+
+        # One gTTS failure that falls back to local TTS, which also fails -> silence
+        def offline(text, lang, tld, slow):
+            raise OSError("offline")
+        monkeypatch.setattr(speech, 'fetch_gtts_bytes', offline)
+        monkeypatch.setattr(speech, '_run_pyttsx3_many', lambda items, settings: [])
+        fmt = RenderFormat(8000, 1, 'float32')
+        settings = speech.VoiceSettings("gtts", "US English", 120, 0.85, None)
+        speech.text_to_speech_samples("one two", settings, fmt)
+
+        metrics.record_segment('gtts', 0.3)
+        metrics.record_segment('gtts', 7.0)
+        metrics.record_cache('test', True)
+        metrics.record_cache('test', True)
+        metrics.record_cache('test', False)
+        metrics.QUEUE_DEPTH.set(5, queue='test')
+        voice = np.zeros((8000 * 4, 1), np.float32)
+        mixer.mix_voice_with_background(voice, np.zeros((8000, 1), np.float32), fmt=fmt)
+
+        after = scrape(server)
+    finally:
+        server.shutdown()
+
+    def delta(family, name=None, **labels):
+        return sample(after, family, name, **labels) - sample(before, family, name, **labels)
+
+    assert after['meditation_synthesis_seconds']['type'] == 'histogram'
+    assert after['meditation_gtts_fallbacks_total']['type'] == 'counter'
+    assert delta('meditation_gtts_fallbacks_total') == 1
+    assert delta('meditation_silent_fallbacks_total') == 1
+    assert delta('meditation_segments_synthesized_total', engine='gtts') == 2
+    assert delta('meditation_synthesis_seconds', 'meditation_synthesis_seconds_count', engine='gtts') == 2
+    assert delta('meditation_synthesis_seconds', 'meditation_synthesis_seconds_bucket', engine='gtts', le='0.5') == 1
+    assert delta('meditation_synthesis_seconds', 'meditation_synthesis_seconds_bucket', engine='gtts', le='+Inf') == 2
+    assert sample(after, 'meditation_segments_per_second') > 0
+    assert math.isclose(sample(after, 'meditation_cache_hit_ratio', cache='test'), 2 / 3)
+    assert sample(after, 'meditation_queue_depth', queue='test') == 5
+    assert delta('meditation_audio_seconds_total', stage='mix') == 4.0
+    assert sample(after, 'meditation_stage_realtime_factor', stage='mix') > 1
+
+    # Histogram buckets are cumulative and end with +Inf == _count
+    buckets = [value for name, labels, value in after['meditation_synthesis_seconds']['samples']
+               if name.endswith('_bucket') and labels['engine'] == 'gtts']
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == sample(after, 'meditation_synthesis_seconds', 'meditation_synthesis_seconds_count', engine='gtts')
+
+
+def test_label_values_are_escaped():
+    gauge = metrics.Gauge('test_escaping', "Label escaping", ['path'])
+    gauge.set(1, path='C:\\music\\"rain"\n')
+    assert 'test_escaping{path="C:\\\\music\\\\\\"rain\\"\\n"} 1' in metrics.render_text()
+    parse_exposition(metrics.render_text())
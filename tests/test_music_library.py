@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Music Library Tests
+Indexing, incremental rescans and queries over a small music folder.
+"""
+
+import os
+import wave
+
+import numpy as np
+
+import audio_format
+from music_library import MusicLibrary, INDEX_FILENAME
+
+
+def write_track(filename, seconds, amplitude, sample_rate=8000, lead_silence=0.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    samples = (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    samples = np.concatenate([np.zeros(int(sample_rate * lead_silence), dtype=np.float32), samples])
+    with wave.open(str(filename), 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(audio_format.float_to_pcm16(samples[:, None]))
+
+
+def test_scan_index_and_query(tmp_path):
+    write_track(tmp_path / "short_loud.wav", 20, 0.5)
+    write_track(tmp_path / "long_quiet.wav", 120, 0.05, lead_silence=2.0)
+    os.makedirs(tmp_path / "nature")
+    write_track(tmp_path / "nature" / "medium.wav", 60, 0.2)
+    (tmp_path / "README.txt").write_text("not music")
+
+    library = MusicLibrary(tmp_path)
+    result = library.scan(max_workers=2)
+    assert (result.added, result.updated, result.removed, result.failed) == (3, 0, 0, 0)
+    assert (tmp_path / INDEX_FILENAME).exists()
+
+    long_quiet = library.get("long_quiet.wav")
+    assert long_quiet.duration == 122.0
+    assert (long_quiet.format, long_quiet.sample_rate, long_quiet.channels) == ('wav', 8000, 1)
+    # Silent lead-in is excluded from the loop region
+    assert 2.0 - 0.4 <= long_quiet.loop_start < long_quiet.loop_end <= 122.0
+    assert long_quiet.loop_score > 0.9
+
+    assert [t.path for t in library.find(min_duration=60)] == ["long_quiet.wav", os.path.join("nature", "medium.wav")]
+    # A sine at amplitude 0.2 has an RMS level of about -17 dB
+    assert library.closest_loudness(-17.0)[0].path == os.path.join("nature", "medium.wav")
+
+
+def test_rescan_only_analyzes_changed_files(tmp_path):
+    write_track(tmp_path / "a.wav", 5, 0.3)
+    write_track(tmp_path / "b.wav", 5, 0.3)
+    MusicLibrary(tmp_path).scan()
+
+    # A fresh instance reloads the persisted index: nothing to do
+    library = MusicLibrary(tmp_path)
+    assert library.scan() == (0, 0, 0, 2, 0)
+
+    write_track(tmp_path / "a.wav", 9, 0.3)
+    os.unlink(tmp_path / "b.wav")
+    write_track(tmp_path / "c.wav", 3, 0.3)
+    result = library.scan()
+    assert (result.added, result.updated, result.removed, result.unchanged) == (1, 1, 1, 0)
+    assert library.get("a.wav").duration == 9.0
+    assert MusicLibrary(tmp_path).get("b.wav") is None
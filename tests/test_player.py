@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Streaming Player Tests
+Buffer timing, seek/pause/resume and constant memory against the offline sink.
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+
+import audio_format
+from audio_format import RenderFormat
+from player import OfflineSink, Player
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+
+
+def tone(seconds, frequency=300):
+    t = np.arange(int(seconds * FMT.sample_rate)) / FMT.sample_rate
+    return (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None]
+
+
+def test_buffers_arrive_back_to_back_without_underruns(tmp_path):
+    music = str(tmp_path / "music.wav")
+    audio_format.write_wav(music, tone(0.4, 90), FMT)
+    segments = [('samples', tone(0.5)), ('pause', 0.5), ('samples', tone(0.5, 500))]
+    sink = OfflineSink(FMT, queue_seconds=0.2)
+    player = Player.for_session(segments, music, loop_points=None, sink=sink, fmt=FMT, buffer_seconds=0.05)
+
+    started = time.monotonic()
+    player.play()
+    player.wait(10)
+    elapsed = time.monotonic() - started
+    player.stop()
+
+    assert sink.underruns == 0
+    # Each buffer starts on the device exactly where the previous one ended
+    ends = np.cumsum([frames for _, frames in sink.writes]) / FMT.sample_rate
+    assert np.allclose([start for start, _ in sink.writes[1:]], ends[:-1], atol=0.02)
+    # Paced by the device, not produced all at once
+    assert elapsed > player.duration - sink.queue_seconds - 0.1
+    assert np.array_equal(sink.played(), player.source.read(0, player.source.frames))
+
+
+def test_seek_pause_and_resume():
+    segments = [('samples', tone(1.0)), ('pause', 1.0), ('samples', tone(1.0, 500))]
+    sink = OfflineSink(FMT, queue_seconds=0.1)
+    player = Player.for_session(segments, sink=sink, fmt=FMT, buffer_seconds=0.05)
+    player.play()
+    time.sleep(0.3)
+
+    player.pause()
+    time.sleep(0.05)
+    writes = len(sink.writes)
+    time.sleep(0.3)
+    assert len(sink.writes) == writes
+    position = player.position
+    player.resume()
+
+    player.seek(2.0)
+    player.wait(10)
+    player.stop()
+    assert sink.underruns == 0
+    assert 0.3 <= position < 1.0
+    # The session continues at 2.0 s with the second phrase
+    after_seek = next(index for index, chunk in enumerate(sink.audio)
+                      if np.array_equal(chunk, player.source.read(16000, len(chunk))))
+    assert sum(len(chunk) for chunk in sink.audio[after_seek:]) == 8000
+
+
+def test_memory_stays_constant_on_a_long_session(tmp_path):
+    clip = str(tmp_path / "clip.wav")
+    audio_format.write_wav(clip, tone(10.0), FMT)
+    segments = [('audio', clip), ('pause', 110)] * 30  # one hour
+    sink = OfflineSink(FMT, realtime=False, keep_audio=False)
+    player = Player.for_session(segments, sink=sink, fmt=FMT, buffer_seconds=0.5)
+
+    tracemalloc.start()
+    player.play()
+    player.wait(60)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    player.stop()
+
+    assert sum(frames for _, frames in sink.writes) == 3600 * FMT.sample_rate
+    assert peak < 2 * 2**20
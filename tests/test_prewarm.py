@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Cache Prewarming Tests
+Script libraries are fetched into the speech cache once per distinct request,
+and voice auditions are served from it without another fetch.
+"""
+
+import io
+import threading
+import time
+
+import numpy as np
+
+import audio_format
+import prewarm
+import speech
+from audio_format import RenderFormat
+from prewarm import AuditionClips, RateLimiter
+
+
+def wav_bytes(seconds, sample_rate=22050):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buffer = io.BytesIO()
+    audio_format.write_wav(buffer, (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)[:, None],
+                           RenderFormat(sample_rate, 1, 'float32'))
+    return buffer.getvalue()
+
+
+def test_scripts_are_fetched_once_per_request_in_parallel(tmp_path, monkeypatch):
+    requests = []
+    lock = threading.Lock()
+
+    def fetch(text, lang, tld, slow):
+        with lock:
+            requests.append((text, tld, slow))
+        return wav_bytes(0.2)
+
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fetch)
+    speech.set_speech_cache_dir(str(tmp_path), 'wav')
+    try:
+        scripts = ["Breathe in. [PAUSE:2] Breathe out. [PAUSE:2] Breathe in.",
+                   "Welcome, {name}. [PAUSE:1] Breathe out."]
+        voices = [speech.VoiceSettings("gtts", "British English (Slow)", rate, 0.85, None) for rate in (100, 120)]
+        voices.append(speech.VoiceSettings("pyttsx3", "Local", 120, 0.85, "local-id"))
+        report = prewarm.prewarm(scripts, voices, workers=3, requests_per_second=0)
+        assert sorted(requests) == sorted((text, 'co.uk', True) for text in ("Breathe in.", "Breathe out.", "Welcome,"))
+        assert (report.requests, report.cached, report.fetched, report.failed) == (3, 0, 3, 0)
+
+        # Both rates are slow British speech: a second voice at a fast rate adds one request per phrase
+        voices.append(speech.VoiceSettings("gtts", "British English", 160, 0.85, None))
+        report = prewarm.prewarm(scripts, voices, requests_per_second=0)
+        assert (report.requests, report.cached, report.fetched) == (6, 3, 3)
+        assert len(requests) == 6
+    finally:
+        speech.set_speech_cache_dir(None)
+
+
+def test_auditions_play_from_the_cache(tmp_path, monkeypatch):
+    fetches = []
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: fetches.append(tld) or wav_bytes(1.0))
+    local_renders = []
+
+    def render_local(texts, settings):
+        local_renders.append(settings)
+        return {text: (np.full((11025, 1), 0.1, np.float32), 22050) for text in texts}
+    monkeypatch.setattr(speech, 'fetch_pyttsx3_samples', render_local)
+    speech.set_speech_cache_dir(str(tmp_path), 'wav')
+    try:
+        fmt = RenderFormat(16000, 2, 'float32')
+        voices = [speech.VoiceSettings("gtts", label, 120, 0.85, None) for label in speech.GTTS_VOICES]
+        local = speech.VoiceSettings("pyttsx3", "Zira", 120, 0.85, "zira")
+        auditions = AuditionClips(fmt)
+        auditions.start(voices + [local], requests_per_second=0).join()
+        assert sorted(fetches) == ['ca', 'co.in', 'co.uk', 'co.za', 'com', 'com.au']
+
+        clip = auditions.get(voices[2])
+        assert clip.shape == (16000, 2)
+        assert auditions.get(local._replace(voice="⭐ Zira")).shape == (8000, 2)
+        assert len(fetches) == 6
+
+        # Local clips are rendered once per voice and follow the sliders at playback
+        assert [(settings.rate, settings.volume) for settings in local_renders] == \
+            [(speech.DEFAULT_RATE, speech.DEFAULT_VOLUME)]
+        faster = auditions.get(local._replace(rate=160, volume=0.4))
+        assert faster.shape == (6000, 2)
+        assert np.abs(faster).max() < np.abs(auditions.get(local)).max()
+        assert auditions.get(local._replace(voice_id="other")) is None
+    finally:
+        speech.set_speech_cache_dir(None)
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - start >= 4 / 50.0
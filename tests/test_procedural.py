@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Procedural Background Tests
+Determinism across chunking, noise spectra, binaural channels and soundscape use.
+"""
+
+import json
+
+import numpy as np
+
+import procedural
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+
+
+STEREO = RenderFormat(8000, 2, 'float32')
+
+
+def band_power_db(samples, low, high, rate=8000):
+    spectrum = np.abs(np.fft.rfft(samples)) ** 2
+    frequencies = np.fft.rfftfreq(len(samples), 1.0 / rate)
+    return 10 * np.log10(spectrum[(frequencies >= low) & (frequencies < high)].mean())
+
+
+def test_noise_is_deterministic_per_seed_and_independent_of_chunking():
+    for color in procedural.NOISE_SLOPES:
+        noise = procedural.NoiseSource(3600 * 8000, color, seed=5, fmt=STEREO)
+        whole = noise.read(10**6, 40000)
+        chunked = np.concatenate([noise.read(10**6 + start, 999) for start in range(0, 40000, 999)])[:40000]
+        assert np.array_equal(whole, chunked)
+        assert np.array_equal(whole, procedural.NoiseSource(3600 * 8000, color, 5, STEREO).read(10**6, 40000))
+        assert not np.array_equal(whole, procedural.NoiseSource(3600 * 8000, color, 6, STEREO).read(10**6, 40000))
+        assert abs(whole.std() - procedural.NOISE_RMS) < 0.05
+
+
+def test_noise_colors_have_their_spectral_slope():
+    slopes = {}
+    for color in procedural.NOISE_SLOPES:
+        left = procedural.NoiseSource(80000, color, seed=1, fmt=STEREO).read(0, 80000)[:, 0]
+        # dB lost per octave between 100-200 Hz and 1600-3200 Hz
+        slopes[color] = (band_power_db(left, 100, 200) - band_power_db(left, 1600, 3200)) / 4
+    assert abs(slopes['white']) < 1
+    assert 2 < slopes['pink'] < 4
+    assert 5 < slopes['brown'] < 7
+
+
+def test_binaural_pair_and_modulation():
+    source = procedural.open_generator({'type': 'binaural', 'frequency': 200, 'beat': 8,
+                                        'modulation_rate': 1, 'modulation_depth': 1}, 16000, STEREO)
+    samples = source.read(0, 16000)
+    peaks = [np.fft.rfftfreq(8000, 1 / 8000)[np.argmax(np.abs(np.fft.rfft(samples[:8000, channel])))]
+             for channel in (0, 1)]
+    # Modulation sidebands are at +-1 Hz; the carrier stays strongest
+    assert peaks == [196.0, 204.0]
+    assert np.abs(samples[:40]).max() > 0.45                 # starts at full level
+    assert np.abs(samples[3980:4020]).max() < 0.01           # silent mid-swing at depth 1
+
+
+def test_generated_soundscape_streams_without_audio_files(tmp_path):
+    definition = tmp_path / "scape.json"
+    definition.write_text(json.dumps({'layers': [
+        {'generator': {'type': 'sine', 'frequency': 100}, 'gain_db': 0, 'fade_in': 1},
+        {'generator': {'type': 'brown', 'seed': 2}, 'gain_db': -20, 'offset': 2},
+    ]}))
+    session = BoundedRenderer(256 * 2**20, STEREO).open_session([('pause', 5)], str(definition),
+                                                                work_dir=str(tmp_path))
+    samples = session.read(0, session.frames)
+    assert np.abs(samples[:40]).max() < 0.01
+    assert abs(np.abs(samples[8000:16000, 0]).max() - procedural.TONE_AMPLITUDE) < 0.01
+    # The noise layer (independent per channel) only comes in at its 2 s offset
+    assert np.array_equal(samples[:16000, 0], samples[:16000, 1])
+    assert not np.array_equal(samples[16000:, 0], samples[16000:, 1])
+    assert not list(tmp_path.glob("*.wav"))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Render Cache Tests
+Fingerprinting, lookup validation and retention of whole-render memoization.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import render_farm
+import speech
+from audio_format import RenderFormat
+from render_cache import RenderCache, RetentionPolicy, render_fingerprint
+from render_farm import RenderFarm
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+SETTINGS = speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+
+
+def _output(path, size=1000):
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_identical_render_is_served_from_cache(tmp_path):
+    cache = RenderCache(tmp_path / "cache")
+    fingerprint = render_fingerprint("Breathe.", SETTINGS, fmt=FMT)
+    assert cache.lookup(fingerprint) is None
+
+    output = _output(tmp_path / "render.wav")
+    assert cache.store(fingerprint, output).from_cache is False
+    result = cache.lookup(fingerprint)
+    assert result.from_cache and result.filename == os.path.abspath(output)
+
+    # Once the user's file is gone the cached copy is returned
+    os.unlink(output)
+    result = cache.lookup(fingerprint)
+    assert result.from_cache and os.path.exists(result.filename)
+
+
+def test_fingerprint_covers_every_input(tmp_path):
+    music = tmp_path / "music.mp3"
+    music.write_bytes(b"one")
+    base = render_fingerprint("Breathe.", SETTINGS, str(music), -12, FMT)
+    assert render_fingerprint("Breathe.", SETTINGS, str(music), -12, FMT) == base
+    assert render_fingerprint("Breathe.", SETTINGS._replace(rate=140), str(music), -12, FMT) != base
+    assert render_fingerprint("Breathe.", SETTINGS, str(music), -6, FMT) != base
+    assert render_fingerprint("Breathe.", SETTINGS, str(music), -12, FMT._replace(channels=2)) != base
+    assert render_fingerprint("Breathe.", SETTINGS, str(music), -12, FMT, coalesce=True) != base
+    music.write_bytes(b"edited")
+    assert render_fingerprint("Breathe.", SETTINGS, str(music), -12, FMT) != base
+
+
+def test_output_rewritten_in_place_is_not_served(tmp_path):
+    cache = RenderCache(tmp_path / "cache")
+    output = _output(tmp_path / "render.wav")
+    cache.store("abc", output)
+    with open(output, 'ab') as f:  # the artifact is a hard link, so it changes too
+        f.write(b"more")
+    assert cache.lookup("abc") is None
+    assert cache.entries() == []
+
+
+def test_retention_evicts_least_recently_used(tmp_path):
+    cache = RenderCache(tmp_path / "cache", RetentionPolicy(max_entries=2, max_bytes=2500))
+    for name in ("a", "b"):
+        cache.store(name, _output(tmp_path / f"{name}.wav"))
+    past = time.time() - 60
+    os.utime(tmp_path / "cache" / "a.json", (past, past))
+    cache.lookup("a")  # a is now the most recently used
+    cache.store("c", _output(tmp_path / "c.wav"))
+    assert sorted(entry[0] for entry in cache.entries()) == ["a", "c"]
+
+    cache.store("d", _output(tmp_path / "d.wav", size=2000))  # over max_bytes with anything else
+    assert [entry[0] for entry in cache.entries()] == ["d"]
+
+    expiring = RenderCache(tmp_path / "cache", RetentionPolicy(max_age_seconds=30))
+    os.utime(tmp_path / "cache" / "d.json", (past, past))
+    assert expiring.lookup("d") is None
+
+
+def test_resubmitted_farm_job_is_served_from_cache(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_synthesize(text, settings, fmt):
+        calls.append(text)
+        return np.full((int(0.2 * fmt.sample_rate), fmt.channels), 0.1, dtype=np.float32)
+
+    monkeypatch.setattr(render_farm, '_synthesize', fake_synthesize)
+    farm = RenderFarm(tmp_path / "jobs", output_dir=tmp_path / "out")
+    first = farm.submit("Breathe in.", SETTINGS, output="first.wav")
+    second = farm.submit("Breathe in.", SETTINGS, output="second.wav")
+    assert farm.work() == 2
+
+    assert calls == ["Breathe in."]
+    records = {job_id: json.loads((tmp_path / "jobs" / "done" / f"{job_id}.json").read_text())
+               for job_id in (first, second)}
+    # Whichever job was claimed first rendered; the other reused its output
+    assert sorted(record['from_cache'] for record in records.values()) == [False, True]
+    assert (tmp_path / "out" / "first.wav").read_bytes() == (tmp_path / "out" / "second.wav").read_bytes()
+
+
+def test_exports_are_cached_with_the_master(tmp_path):
+    cache = RenderCache(tmp_path / "cache")
+    output = _output(tmp_path / "render.wav")
+    mp3 = _output(tmp_path / "render.mp3", size=300)
+    hls_dir = tmp_path / "render_hls"
+    hls_dir.mkdir()
+    playlist = _output(hls_dir / "playlist.m3u8", size=50)
+    _output(hls_dir / "segment_00000.mp3", size=200)
+    stored = cache.store("abc", output, {'mp3': mp3, 'hls': playlist})
+    assert stored.exports == {'mp3': mp3, 'hls': playlist}
+    assert cache.lookup("abc").exports == {'mp3': os.path.abspath(mp3), 'hls': os.path.abspath(playlist)}
+    assert cache.entries()[0][2] == 1000 + 300 + 50 + 200
+
+    # The user's copies are gone: the cached ones are served, segments included
+    mp3_bytes = open(mp3, 'rb').read()
+    os.unlink(mp3)
+    shutil.rmtree(hls_dir)
+    exports = cache.lookup("abc").exports
+    assert open(exports['mp3'], 'rb').read() == mp3_bytes
+    assert sorted(os.listdir(os.path.dirname(exports['hls']))) == ["playlist.m3u8", "segment_00000.mp3"]
+
+    # An entry whose cached export went missing is not served without it
+    os.unlink(exports['mp3'])
+    assert cache.lookup("abc") is None
+    assert os.listdir(tmp_path / "cache") == []
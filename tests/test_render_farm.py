@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Render Farm Tests
+Job claiming across worker processes and in-flight dedup in the shared cache.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+import render_farm
+import speech
+from audio_format import RenderFormat
+from render_cache import RenderResult
+from render_farm import RenderFarm, SharedCache
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+
+
+def _slow_produce(log_file):
+    with open(log_file, 'a') as log:
+        log.write(f"{os.getpid()}\n")
+    time.sleep(0.5)
+    return np.full((800, 1), 0.25, dtype=np.float32)
+
+
+def _cache_worker(cache_dir, log_file, results):
+    cache = SharedCache(cache_dir, FMT)
+    results.put(cache.get_or_create(lambda: _slow_produce(log_file), 'segments', 'same phrase'))
+
+
+def test_concurrent_identical_requests_are_produced_once(tmp_path):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    log_file = str(tmp_path / "produced.log")
+    workers = [context.Process(target=_cache_worker, args=(str(tmp_path / "cache"), log_file, results))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    paths = {results.get(timeout=30) for _ in workers}
+    for worker in workers:
+        worker.join()
+
+    assert len(open(log_file).read().split()) == 1
+    assert len(paths) == 1 and os.path.exists(paths.pop())
+    # No temporary or lock files are left behind
+    leftovers = [name for _, _, names in os.walk(tmp_path / "cache") for name in names if not name.endswith('.wav')]
+    assert leftovers == []
+
+
+def test_stale_lock_from_a_dead_worker_is_broken(tmp_path, monkeypatch):
+    cache = SharedCache(tmp_path, FMT)
+    path = cache.path('segments', 'phrase')
+    path.parent.mkdir(parents=True)
+    open(f"{path}.lock", 'w').close()
+    monkeypatch.setattr(render_farm, 'LOCK_STALE_SECONDS', 0.0)
+    assert cache.get_or_create(lambda: np.zeros((10, 1), np.float32), 'segments', 'phrase') == str(path)
+
+
+def test_local_pool_renders_every_job_once(tmp_path, monkeypatch):
+    log_file = tmp_path / "synth.log"
+
+    def fake_synthesize(text, settings, fmt):
+        with open(log_file, 'a') as log:
+            log.write(text + "\n")
+        return np.full((int(0.2 * fmt.sample_rate), fmt.channels), 0.1, dtype=np.float32)
+
+    # Worker processes are forked, so they inherit the patched synthesizer
+    monkeypatch.setattr(render_farm, '_synthesize', fake_synthesize)
+    farm = RenderFarm(tmp_path / "jobs", output_dir=tmp_path / "out")
+    settings = speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+    scripts = [f"Breathe in. [PAUSE:1] Script {i}." for i in range(6)]
+    job_ids = [farm.submit(script, settings, output=f"job{i}.wav") for i, script in enumerate(scripts)]
+
+    assert farm.run_local(processes=3) == 6
+    assert farm.status() == {'pending': 0, 'running': 0, 'done': 6, 'failed': 0}
+    assert sorted(os.listdir(tmp_path / "out")) == [f"job{i}.wav" for i in range(6)]
+    synthesized = open(log_file).read().splitlines()
+    # The shared phrase was synthesized by one worker only
+    assert synthesized.count("Breathe in.") == 1
+    assert len(synthesized) == 7
+    assert len(job_ids) == len(set(job_ids))
+
+
+def test_lock_is_kept_alive_while_a_slow_entry_is_produced(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_farm, 'LOCK_STALE_SECONDS', 0.3)
+    monkeypatch.setattr(render_farm, 'HEARTBEAT_SECONDS', 0.05)
+    monkeypatch.setattr(render_farm, 'LOCK_POLL_SECONDS', 0.02)
+    produced = []
+
+    def produce():
+        produced.append(1)
+        time.sleep(1.0)
+        return np.zeros((10, 1), np.float32)
+
+    first = threading.Thread(target=SharedCache(tmp_path, FMT).get_or_create, args=(produce, 'segments', 'phrase'))
+    first.start()
+    time.sleep(0.1)
+    path = SharedCache(tmp_path, FMT).get_or_create(produce, 'segments', 'phrase')
+    first.join()
+    assert len(produced) == 1 and os.path.exists(path)
+    assert [name for name in os.listdir(os.path.dirname(path)) if not name.endswith('.wav')] == []
+
+
+def test_a_broken_lock_is_not_released_by_its_old_holder(tmp_path):
+    cache = SharedCache(tmp_path, FMT)
+    lock_path = str(tmp_path / "entry.lock")
+    old = cache._try_lock(lock_path)
+    os.unlink(lock_path)        # broken as stale and taken over
+    new = cache._try_lock(lock_path)
+    cache._release(lock_path, old)
+    assert open(lock_path).read() == new
+
+
+def test_long_jobs_are_not_requeued_while_their_worker_lives(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_farm, 'HEARTBEAT_SECONDS', 0.05)
+    renders = []
+
+    def slow_render(job, cache, output_dir, render_cache=None):
+        renders.append(job['id'])
+        time.sleep(1.0)
+        return RenderResult(str(tmp_path / "out.wav"), False, None)
+
+    monkeypatch.setattr(render_farm, 'render_job', slow_render)
+    farm = RenderFarm(tmp_path / "jobs", output_dir=tmp_path / "out")
+    farm.submit("Breathe in.", speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None))
+    worker = threading.Thread(target=farm.work)
+    worker.start()
+    requeued = 0
+    while worker.is_alive():
+        requeued += farm.requeue_stale(0.3)
+        time.sleep(0.05)
+    worker.join()
+    assert requeued == 0 and len(renders) == 1
+    assert farm.status() == {'pending': 0, 'running': 0, 'done': 1, 'failed': 0}
+
+    # A job requeued from under a worker that did finish it is not rendered again
+    monkeypatch.setattr(render_farm, 'HEARTBEAT_SECONDS', 60.0)
+    farm.submit("Breathe out.", speech.VoiceSettings('gtts', 'English (US)', 120, 0.85, None))
+    worker = threading.Thread(target=farm.work)
+    worker.start()
+    time.sleep(0.5)
+    assert farm.requeue_stale(0.3) == 1
+    worker.join()
+    assert len(renders) == 2
+    assert farm.status() == {'pending': 0, 'running': 0, 'done': 2, 'failed': 0}
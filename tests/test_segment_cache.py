@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Segment Cache Tests
+Compressed storage, the in-memory hot tier, and converting an older cache.
+"""
+
+import io
+import shutil
+import struct
+import zlib
+
+import numpy as np
+
+import audio_format
+import decode_service
+import segment_cache
+from segment_cache import SegmentCache
+
+
+class LosslessCodec:
+    """Stands in for soundfile's FLAC support: zlib-compressed 16-bit PCM"""
+
+    @staticmethod
+    def write(file, samples, sample_rate, format, subtype):
+        pcm = audio_format.float_to_pcm16(samples)
+        file.write(b'fLaC' + struct.pack('<IH', sample_rate, samples.shape[1]) + zlib.compress(pcm, 9))
+
+    @staticmethod
+    def read(source, dtype, always_2d):
+        data = source.read() if hasattr(source, 'read') else open(source, 'rb').read()
+        if data[:4] != b'fLaC':
+            raise RuntimeError("not FLAC")
+        sample_rate, channels = struct.unpack('<IH', data[4:10])
+        return audio_format.pcm_to_float(zlib.decompress(data[10:]), 2, channels), sample_rate
+
+
+def speech_like(seconds, rate=24000, seed=0):
+    t = np.arange(int(seconds * rate)) / rate
+    envelope = (np.sin(2 * np.pi * 3 * t) > 0.3).astype(np.float32)     # syllables and gaps
+    return (0.3 * envelope * np.sin(2 * np.pi * (180 + seed) * t)).astype(np.float32)[:, None]
+
+
+def test_clips_are_stored_compressed_and_kept_hot(tmp_path, monkeypatch):
+    monkeypatch.setattr(decode_service, '_soundfile', lambda: LosslessCodec)
+    cache = SegmentCache(str(tmp_path), 'flac', hot_bytes=2 * speech_like(1.0).nbytes)
+    clips = {index: speech_like(1.0, seed=index) for index in range(3)}
+    for index, clip in clips.items():
+        cache.put(('gtts', f"phrase {index}"), clip, 24000)
+
+    files = sorted(tmp_path.rglob("*.flac"))
+    assert len(files) == 3 and not list(tmp_path.rglob("*.wav"))
+    assert sum(f.stat().st_size for f in files) < 3 * clips[0].nbytes / 2 / 2  # under half of 16-bit PCM
+
+    # The two most recent clips are served from memory, the oldest was evicted and is decoded
+    for f in files:
+        f.unlink()
+    assert cache.get(('gtts', "phrase 2"))[0] is clips[2]
+    assert cache.get(('gtts', "phrase 0")) is None
+
+    cache.put(('gtts', "phrase 0"), clips[0], 24000)
+    fresh = SegmentCache(str(tmp_path), 'flac')
+    samples, sample_rate = fresh.get(('gtts', "phrase 0"))
+    assert sample_rate == 24000 and np.abs(samples - clips[0]).max() <= 1 / 32768
+
+
+def test_wav_cache_is_read_and_recompressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(decode_service, '_soundfile', lambda: None)
+    monkeypatch.setattr(shutil, 'which', lambda name: None)
+    old = SegmentCache(str(tmp_path), 'flac')          # no encoder: falls back to WAV
+    for index in range(4):
+        old.put(('gtts', f"phrase {index}"), speech_like(0.5, seed=index), 24000)
+    assert len(list(tmp_path.rglob("*.wav"))) == 4
+
+    monkeypatch.setattr(decode_service, '_soundfile', lambda: LosslessCodec)
+    assert segment_cache.recompress(str(tmp_path), 'flac') == 4
+    assert len(list(tmp_path.rglob("*.flac"))) == 4 and not list(tmp_path.rglob("*.wav"))
+    report = segment_cache.benchmark(str(tmp_path))
+    assert report.clips == 4 and abs(report.audio_seconds - 2.0) < 1e-6
+    assert report.pcm_bytes / report.stored_bytes > 2
+    samples, _ = SegmentCache(str(tmp_path)).get(('gtts', "phrase 3"))
+    assert np.abs(samples - speech_like(0.5, seed=3)).max() <= 1 / 32768
+    assert segment_cache.main([str(tmp_path)]) == 0
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Sharded Rendering Tests
+Shards mixed in parallel processes reproduce a sequential render exactly.
+"""
+
+import numpy as np
+import pytest
+
+import audio_format
+import sharded_render
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+from loudness import LoudnessTarget
+from sharded_render import ShardedRenderer, SharedArraySource, shard_boundaries
+
+
+FMT = RenderFormat(8000, 2, 'float32')
+
+
+def tone(seconds, frequency, level=0.3, rate=8000, channels=2):
+    t = np.arange(int(seconds * rate)) / rate
+    return np.repeat((level * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None], channels, axis=1)
+
+
+def test_shards_split_in_pauses_and_render_identically(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharded_render, 'MIN_SHARD_SECONDS', 2.0)
+    monkeypatch.setattr(sharded_render, 'SHARE_MIN_BYTES', 0)
+    voice, music = str(tmp_path / "voice.wav"), str(tmp_path / "music.wav")
+    audio_format.write_wav(voice, tone(1.7, 440), FMT)
+    audio_format.write_wav(music, tone(3.1, 110, 0.5), FMT)
+    segments = []
+    for index in range(6):
+        segments += [('audio', voice), ('pause', 0.8), ('samples', tone(1.3, 660 + 20 * index)), ('pause', 0.5)]
+    target = LoudnessTarget(-20.0)
+
+    sequential = BoundedRenderer(256 * 2**20, FMT, analysis_cache_dir=str(tmp_path / "analysis")).render(
+        segments, music, str(tmp_path / "sequential.wav"), music_gain_db=-12.0, loudness=target,
+        start_seconds=0.3, end_seconds=24.0)
+
+    renderer = ShardedRenderer(256 * 2**20, FMT, workers=3, analysis_cache_dir=str(tmp_path / "analysis"))
+    session = renderer.open_session(segments, music, work_dir=str(tmp_path))
+    assert any(isinstance(source, SharedArraySource) for _, source in session.clips)
+    edges = shard_boundaries(session, 0, session.frames, 6, 800)
+    assert len(edges) == 7
+    for edge in edges[1:-1]:
+        assert edge % 800 == 0
+        clip = np.searchsorted(session.ends, edge, side='right')
+        assert clip == len(session.starts) or session.starts[clip] >= edge  # in a pause
+    renderer._release_blocks()
+
+    sharded = renderer.render(segments, music, str(tmp_path / "sharded.wav"), music_gain_db=-12.0,
+                              loudness=target, start_seconds=0.3, end_seconds=24.0)
+    assert (tmp_path / "sharded.wav").read_bytes() == (tmp_path / "sequential.wav").read_bytes()
+    assert sharded.duration == sequential.duration
+    assert sharded.loudness.true_peak_db == sequential.loudness.true_peak_db
+    assert abs(sharded.loudness.integrated_lufs - sequential.loudness.integrated_lufs) < 1e-6
+    assert renderer._blocks == []
+
+
+def test_shards_hold_workers_to_their_share_of_the_budget(tmp_path, monkeypatch):
+    session = BoundedRenderer(256 * 2**20, FMT).open_session([('samples', tone(4.0, 440))], None)
+    filename = str(tmp_path / "shard.wav")
+    with open(filename, 'wb') as f:
+        f.truncate(sharded_render.WAV_HEADER_BYTES + session.frames * 2 * 2)
+    reads = []
+    read = session.read
+    session.read = lambda start, count: reads.append(count) or read(start, count)
+
+    # Every chunk leaves another megabyte behind: chunks halve down to the minimum, then the shard fails
+    rss = iter(range(0, 2**40, 2**20))
+    monkeypatch.setattr(sharded_render, 'current_rss', lambda: next(rss))
+    with pytest.raises(MemoryError):
+        sharded_render._render_shard(session, filename, 0, session.frames, (0, session.frames), 8000, 2000,
+                                     2**20, FMT, False)
+    assert reads == [8000, 8000, 4000, 2000]
+
+    # Within the budget chunks keep their size; the shard is written without POSIX-only calls
+    monkeypatch.setattr(sharded_render, 'current_rss', lambda: 2**30)
+    monkeypatch.delattr(sharded_render.os, 'pwrite', raising=False)
+    reads.clear()
+    chunks, _, _ = sharded_render._render_shard(session, filename, 4000, session.frames, (0, session.frames), 8000,
+                                                2000, 2**20, FMT, False)
+    assert (chunks, reads) == (4, [8000] * 3 + [4000])
+    with open(filename, 'rb') as f:
+        data = f.read()
+    assert data[sharded_render.WAV_HEADER_BYTES + 4000 * 4:] == audio_format.float_to_pcm16(read(4000, 28000))
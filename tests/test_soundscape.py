@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Soundscape Tests
+Layer placement, fades and looping, the decoded PCM cache and streaming cost.
+"""
+
+import json
+import shutil
+import tracemalloc
+
+import numpy as np
+
+import audio_format
+import soundscape
+from audio_format import RenderFormat
+from chunked_render import BoundedRenderer
+from soundscape import DecodedPcmCache, open_soundscape
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+
+
+def constant(filename, seconds, value=0.5, rate=8000):
+    audio_format.write_wav(str(filename), np.full((int(seconds * rate), 1), value, dtype=np.float32),
+                           RenderFormat(rate, 1, 'float32'))
+
+
+def write_soundscape(filename, layers):
+    filename.write_text(json.dumps({'layers': layers}))
+    return str(filename)
+
+
+def test_layers_are_placed_faded_and_looped(tmp_path):
+    constant(tmp_path / "bed.wav", 3.0)
+    constant(tmp_path / "bowl.wav", 1.0)
+    definition = write_soundscape(tmp_path / "scape.json", [
+        {'file': "bed.wav", 'gain_db': 0, 'fade_in': 1.0, 'fade_out': 2.0},
+        {'file': "bowl.wav", 'gain_db': -6.0206, 'offset': 4.0, 'loop': False},
+    ])
+    source = open_soundscape(definition, 10 * 8000, FMT, DecodedPcmCache(str(tmp_path / "pcm"), FMT))
+    full = source.read(0, source.frames)[:, 0]
+
+    bed, bowl = source.layers
+    assert abs(full[4000] - 0.25) < 0.01            # halfway through the fade in
+    assert abs(bed._envelope(9 * 8000 - bed.start, 1) - 0.5) < 0.01  # halfway through the fade out
+    assert abs(full[-1]) < 0.001
+    # The bed loops to the end; the bowl plays once at half gain from 4 s
+    alone = np.zeros((source.frames, 1), dtype=np.float32)
+    bed.add_into(alone, 0)
+    assert np.all(alone[3 * 8000:8 * 8000] > 0.4)
+    on_top = full - alone[:, 0]
+    assert np.abs(on_top[:4 * 8000]).max() < 1e-6 and np.abs(on_top[5 * 8000:]).max() < 1e-6
+    assert np.allclose(on_top[4 * 8000:5 * 8000], 0.25, atol=0.01)
+
+    chunks = np.concatenate([source.read(start, 777) for start in range(0, source.frames, 777)])
+    assert np.array_equal(chunks[:source.frames, 0], full)
+
+
+def test_compressed_layers_are_decoded_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, 'which', lambda name: None)
+    decodes = []
+    load_audio = audio_format.load_audio
+    monkeypatch.setattr(audio_format, 'load_audio', lambda *args: decodes.append(args) or load_audio(*args))
+    constant(tmp_path / "rain.wav", 2.0, rate=16000)  # not in the render format
+    definition = write_soundscape(tmp_path / "scape.json", [{'file': "rain.wav", 'gain_db': 0}])
+    cache = DecodedPcmCache(str(tmp_path / "pcm"), FMT)
+
+    first = open_soundscape(definition, 5 * 8000, FMT, cache).read(0, 5 * 8000)
+    second = open_soundscape(definition, 5 * 8000, FMT, cache).read(0, 5 * 8000)
+    assert len(decodes) == 1
+    assert np.array_equal(first, second)
+    assert len(list((tmp_path / "pcm").glob("*.loop.json"))) == 1
+
+
+def test_hour_long_soundscape_streams_in_constant_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(soundscape, 'DEFAULT_PCM_CACHE_DIR', str(tmp_path / "pcm"))
+    layers = []
+    for index in range(4):
+        constant(tmp_path / f"layer{index}.wav", 5.0 + index, 0.1)
+        layers.append({'file': f"layer{index}.wav", 'offset': 60.0 * index, 'fade_in': 10, 'fade_out': 10})
+    definition = write_soundscape(tmp_path / "scape.json", layers)
+    segments = [('pause', 3600)]
+
+    tracemalloc.start()
+    session = BoundedRenderer(256 * 2**20, FMT).open_session(segments, definition, work_dir=str(tmp_path))
+    for start in range(0, session.frames, 8000 * 10):
+        session.read(start, 8000 * 10)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert session.frames == 3600 * 8000
+    assert peak < 4 * 2**20
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+In-Memory Speech Tests
+Synthesized speech flows to the mixer as arrays without touching the disk.
+"""
+
+import io
+import os
+import wave
+
+import numpy as np
+
+import audio_format
+import mixer
+import speech
+from audio_format import RenderFormat
+from speech import VoiceSettings
+
+
+def wav_bytes(seconds, sample_rate=22050):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)[:, None]
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(audio_format.float_to_pcm16(samples))
+    return buffer.getvalue()
+
+
+def test_gtts_speech_is_decoded_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.5))
+    fmt = RenderFormat(16000, 2, 'float32')
+    settings = VoiceSettings("gtts", "US English", speech.DEFAULT_RATE, speech.DEFAULT_VOLUME, None)
+
+    samples = speech.text_to_speech_samples("Breathe in", settings, fmt)
+    assert samples.shape == (8000, 2) and samples.dtype == np.float32
+    assert os.listdir(tmp_path) == []
+
+    track = mixer.build_voice_track([('samples', samples), ('pause', 1), ('samples', samples)], fmt)
+    assert track.shape == (32000, 2)
+    assert np.array_equal(track[24000:], samples)
+
+
+def test_failed_engines_fall_back_to_silence(monkeypatch):
+    def fail(text, lang, tld, slow):
+        raise OSError("offline")
+
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fail)
+    monkeypatch.setattr(speech, '_run_pyttsx3_many', lambda items, settings: [])
+    fmt = RenderFormat(8000, 1, 'float32')
+    settings = VoiceSettings("gtts", "US English", 150, speech.DEFAULT_VOLUME, None)
+
+    samples = speech.text_to_speech_samples("one two three four", settings, fmt)
+    assert samples.shape == (16000, 1) and not samples.any()
+
+
+def test_both_engines_report_success_the_same_way(tmp_path, monkeypatch):
+    monkeypatch.setattr(speech, 'fetch_gtts_mp3', lambda text, lang, tld, slow, filename: None)
+    monkeypatch.setattr(speech, 'convert_gtts_mp3', lambda mp3, filename, settings: None)
+    gtts = VoiceSettings("gtts", "US English", 150, speech.DEFAULT_VOLUME, None)
+    local = gtts._replace(engine="pyttsx3")
+    filename = str(tmp_path / "segment.wav")
+
+    monkeypatch.setattr(speech, '_run_pyttsx3', lambda text, filename, settings: True)
+    assert speech.text_to_speech_file("Relax", filename, gtts) is True
+    assert speech.text_to_speech_file("Relax", filename, local) is True
+
+    # Silence standing in for speech is not a success, whichever engine fell back to it
+    monkeypatch.setattr(speech, '_run_pyttsx3', lambda text, filename, settings: False)
+    assert speech.text_to_speech_file("Relax", filename, local) is False
+    def offline(text, lang, tld, slow, filename):
+        raise OSError("offline")
+
+    monkeypatch.setattr(speech, 'fetch_gtts_mp3', offline)
+    assert speech.text_to_speech_file("Relax", filename, gtts) is False
+
+
+def test_script_speech_is_decoded_in_one_batch(monkeypatch):
+    batches = []
+    real_decode_many = speech.decode_service.decode_many
+
+    def counting_decode_many(items):
+        batches.append(len(items))
+        return real_decode_many(items)
+
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', lambda text, lang, tld, slow: wav_bytes(0.1 * len(text)))
+    monkeypatch.setattr(speech.decode_service, 'decode_many', counting_decode_many)
+    fmt = RenderFormat(8000, 1, 'float32')
+    settings = VoiceSettings("gtts", "US English", speech.DEFAULT_RATE, speech.DEFAULT_VOLUME, None)
+
+    texts = ["Relax", "Breathe in", "Relax", "Let go now"]
+    samples = speech.texts_to_speech_samples(texts, settings, fmt)
+    # Three distinct texts, one decode call
+    assert batches == [3]
+    assert [len(s) for s in samples] == [4000, 8000, 4000, 8000]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Speech Request Coalescing Tests
+Short phrases share Google TTS requests and are split back at silences.
+"""
+
+import io
+import wave
+
+import numpy as np
+
+import audio_format
+import speech
+import speech_batching
+from audio_format import RenderFormat
+from speech import VoiceSettings
+
+
+RATE = 16000
+
+
+def tone(seconds):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)[:, None]
+
+
+def gap(seconds):
+    return np.zeros((int(seconds * RATE), 1), dtype=np.float32)
+
+
+def fake_speech(sentences, sentence_gap=0.4):
+    """Speech-like audio: 0.05 s of tone per character, sentence_gap between sentences"""
+    parts = [gap(0.1)]
+    for sentence in sentences:
+        parts += [tone(0.05 * len(sentence)), gap(sentence_gap)]
+    return np.concatenate(parts)
+
+
+def wav_bytes(samples):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(RATE)
+        wav_file.writeframes(audio_format.float_to_pcm16(samples))
+    return buffer.getvalue()
+
+
+def test_adjacent_short_texts_are_grouped_within_the_request_limit():
+    texts = ["Relax your feet", "and your ankles", "Now your calves", "x" * 95, "Breathe"]
+    groups = speech_batching.coalesce_texts(texts)
+    assert groups == [texts[:3], [texts[3]], [texts[4]]]
+    assert all(len(speech_batching.request_text(group)) <= speech_batching.GTTS_MAX_CHARS for group in groups)
+    assert speech_batching.request_text(["Relax", "Let go!"]) == "Relax. Let go!"
+
+
+def test_split_cuts_at_the_longest_gaps():
+    texts = ["Relax your feet", "Soften, your knees", "Breathe"]
+    samples = np.concatenate([gap(0.1), tone(0.75), gap(0.4),
+                              tone(0.3), gap(0.16), tone(0.6), gap(0.4),  # a comma pause inside
+                              tone(0.35), gap(0.3)])
+    clips = speech_batching.split_on_silence(samples, RATE, texts)
+    assert len(clips) == 3
+    assert sum(len(clip) for clip in clips) == len(samples)
+    voiced = [int(np.count_nonzero(np.abs(clip[:, 0]) > 0)) / RATE for clip in clips]
+    assert np.allclose(voiced, [0.75, 0.9, 0.35], atol=0.01)
+
+
+def test_split_refuses_audio_that_does_not_match():
+    texts = ["Relax your feet", "Breathe"]
+    assert speech_batching.split_on_silence(tone(1.0), RATE, texts) is None
+    # Two clips, but the second is far too long for its text
+    samples = np.concatenate([tone(0.1), gap(0.4), tone(3.0)])
+    assert speech_batching.split_on_silence(samples, RATE, ["Relax your feet", "Go"]) is None
+
+
+def test_script_uses_fewer_requests_and_falls_back_when_split_fails(monkeypatch):
+    requests = []
+
+    def fake_fetch(text, lang, tld, slow):
+        requests.append(text)
+        sentences = [s.strip() for s in text.replace('!', '.').split('.') if s.strip()]
+        # Requests containing "mumble" come back without audible sentence gaps
+        return wav_bytes(fake_speech(sentences, 0.02 if "mumble" in text else 0.4))
+
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fake_fetch)
+    fmt = RenderFormat(RATE, 1, 'float32')
+    settings = VoiceSettings("gtts", "US English", speech.DEFAULT_RATE, speech.DEFAULT_VOLUME, None)
+    texts = ["Relax your feet", "Relax your ankles", "Relax your calves", "Relax your knees"]
+
+    samples = speech.texts_to_speech_samples(texts, settings, fmt, coalesce=True)
+    assert requests == ["Relax your feet. Relax your ankles. Relax your calves. Relax your knees."]
+    for text, clip in zip(texts, samples):
+        voiced = np.count_nonzero(np.abs(clip[:, 0]) > 1e-3) / RATE
+        assert abs(voiced - 0.05 * len(text)) < 0.02
+
+    requests.clear()
+    samples = speech.texts_to_speech_samples(["Breathe", "mumble", "Rest"], settings, fmt, coalesce=True)
+    assert requests == ["Breathe. mumble. Rest.", "Breathe", "mumble", "Rest"]
+    assert len(samples) == 3
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Template Tests
+Slot parsing, splicing, and static phrases synthesized once across renders.
+"""
+
+import numpy as np
+
+import speech
+import templates
+from audio_format import RenderFormat
+from speech import VoiceSettings
+from templates import TemplateRenderer, parse_template, splice
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+SETTINGS = VoiceSettings('gtts', 'English (US)', 120, 0.85, None)
+
+
+def padded(seconds, value=0.5, silence=0.3, rate=8000):
+    """A constant 'phrase' with the silence a TTS engine leaves around speech"""
+    quiet = np.zeros((int(silence * rate), 1), dtype=np.float32)
+    return np.concatenate([quiet, np.full((int(seconds * rate), 1), value, dtype=np.float32), quiet])
+
+
+def test_template_is_parsed_into_static_text_and_slots():
+    assert parse_template("Welcome, {name}. [PAUSE:3] Rest now, {name}.") == [
+        ('text', [('static', "Welcome,"), ('slot', "name")]),
+        ('pause', 3),
+        ('text', [('static', "Rest now,"), ('slot', "name")]),
+    ]
+
+
+def test_splice_trims_joins_and_crossfades_without_gaps():
+    joined = splice([padded(1.0), padded(0.5)], 8000)
+    margin, fade = int(8000 * templates.SPLICE_MARGIN_SECONDS), int(8000 * templates.SPLICE_CROSSFADE_SECONDS)
+    # Outer silence is kept, the silence at the join is cut to a margin on each side
+    assert len(joined) == (0.3 + 1.0 + 0.5 + 0.3) * 8000 + 2 * margin - fade
+    assert np.allclose(joined[2400:2400 + 8000], 0.5)
+    # Back to back speech crossfades to a constant: the fades sum to one
+    assert np.allclose(splice([np.full((800, 1), 0.5, np.float32)] * 3, 8000), 0.5)
+    assert len(splice([np.full((800, 1), 0.5, np.float32)] * 3, 8000)) == 2400 - 2 * fade
+
+    # A slot value shorter than the fade shortens the fades at its joins instead of breaking them
+    short = splice([padded(0.5), np.full((20, 1), 0.5, np.float32), padded(0.5)], 8000)
+    assert len(short) == 2 * (0.3 + 0.5) * 8000 + 2 * margin + 20 - 2 * 10
+    join = int((0.3 + 0.5) * 8000) + margin
+    assert np.all(short[join - 10:join + 10] > 0) and np.abs(short).max() <= 0.5 + 1e-6
+    assert np.allclose(splice([np.full((20, 1), 0.5, np.float32)] * 2, 8000), 0.5)
+
+
+def test_only_slot_values_are_synthesized_per_render(tmp_path, monkeypatch):
+    synthesized = []
+
+    def fake_tts(texts, settings, fmt=None, progress=None, coalesce=False):
+        synthesized.extend(texts)
+        return [padded(0.1 * len(text)) for text in texts]
+
+    monkeypatch.setattr(speech, 'texts_to_speech_samples', fake_tts)
+    template_text = "Welcome, {name}. Breathe in deeply. [PAUSE:2] Today, {name}, you choose {intention}."
+    template = TemplateRenderer(template_text, SETTINGS, FMT, cache_dir=str(tmp_path / "cache"))
+    assert template.slots == ['name', 'intention']
+
+    first = template.audio_segments({'name': "Ana", 'intention': "calm"})
+    assert sorted(synthesized) == sorted(["Welcome,", "Breathe in deeply.", "Today,", "you choose",
+                                          "Ana", "calm"])
+    assert [kind for kind, _ in first] == ['samples', 'pause', 'samples']
+
+    synthesized.clear()
+    report = template.render({'name': "Bo", 'intention': "rest"}, str(tmp_path / "bo.wav"))
+    assert synthesized == ["Bo", "rest"]
+    assert report.duration > 2.0
+
+    # A new renderer (another run) loads the static phrases from the clip store
+    synthesized.clear()
+    again = TemplateRenderer(template_text, SETTINGS, FMT, cache_dir=str(tmp_path / "cache"))
+    again.audio_segments({'name': "Ana", 'intention': "calm"})
+    assert synthesized == ["Ana", "calm"]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Timeline Tests
+Binary-search lookup and rendering of excerpts without synthesizing the rest.
+"""
+
+import io
+import wave
+
+import numpy as np
+
+import audio_format
+import speech
+import timeline
+from audio_format import RenderFormat
+from checkpoint import RenderCheckpoint
+from speech import VoiceSettings
+from timeline import Timeline
+
+
+FMT = RenderFormat(8000, 1, 'float32')
+SETTINGS = VoiceSettings("gtts", "US English", 60, speech.DEFAULT_VOLUME, None)
+
+
+def wav_bytes(seconds):
+    t = np.arange(int(seconds * 8000)) / 8000
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(audio_format.float_to_pcm16((0.3 * np.sin(2 * np.pi * 300 * t))[:, None]))
+    return buffer.getvalue()
+
+
+def read_frames(filename):
+    with wave.open(filename, 'rb') as wav_file:
+        return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+
+def test_lookup_and_real_lengths_shift_later_segments():
+    segments = [('text', "one two"), ('pause', 3), ('text', "three"), ('pause', 1)]
+    line = Timeline.from_segments(segments, rate=60, fmt=FMT)
+    assert list(line.starts) == [0, 16000, 40000, 48000]
+    assert line.duration == 7.0
+    assert [line.index_at(t) for t in (0, 1.99, 2.0, 5.5, 6.5, 7.0)] == [0, 0, 1, 2, 3, None]
+    assert list(line.overlapping(1.0, 5.0)) == [0, 1]
+    assert list(line.overlapping(5.0, 5.5)) == [2]
+    assert not line.offsets_exact(6.0)
+
+    line.set_length(0, 4000)
+    assert list(line.starts) == [0, 4000, 28000, 36000]
+    assert list(line.overlapping(1.0, 4.4)) == [1, 2]
+    assert line.offsets_exact(3.5) and not line.offsets_exact(5.0)
+
+
+def test_excerpt_synthesizes_only_overlapping_speech(tmp_path, monkeypatch):
+    requests = []
+
+    def fake_fetch(text, lang, tld, slow):
+        requests.append(text)
+        return wav_bytes(0.25 * len(text.split()))
+
+    monkeypatch.setattr(speech, 'fetch_gtts_bytes', fake_fetch)
+    music = tmp_path / "music.wav"
+    audio_format.write_wav(str(music), np.random.default_rng(1).uniform(-0.5, 0.5, (3 * 8000, 1)), FMT)
+    segments = []
+    for index in range(20):
+        segments += [('text', f"phrase number {index} please relax"), ('pause', 2)]
+
+    excerpt = timeline.render_range(segments, SETTINGS, 30.0, 36.0, str(tmp_path / "excerpt.wav"),
+                                    str(music), fmt=FMT)
+    assert excerpt.duration == 6.0
+    assert 0 < excerpt.synthesized == len(requests) <= 3
+    assert not excerpt.exact_offsets
+
+    # With every segment checkpointed, an excerpt is exactly that slice of the full render
+    checkpoint = RenderCheckpoint(tmp_path / "job")
+    full = timeline.render_range(segments, SETTINGS, 0.0, 10**6, str(tmp_path / "full.wav"), str(music),
+                                 fmt=FMT, checkpoint=checkpoint)
+    assert full.synthesized == 20 and full.exact_offsets
+    requests.clear()
+    excerpt = timeline.render_range(segments, SETTINGS, 30.0, 36.0, str(tmp_path / "excerpt.wav"),
+                                    str(music), fmt=FMT, checkpoint=checkpoint)
+    assert requests == [] and excerpt.exact_offsets
+    expected = read_frames(str(tmp_path / "full.wav"))[30 * 8000:36 * 8000]
+    assert np.abs(read_frames(str(tmp_path / "excerpt.wav")).astype(int) - expected).max() <= 1